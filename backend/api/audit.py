@@ -0,0 +1,35 @@
+"""Журнал аудита"""
+import json
+from core import esc, query_rows
+
+def handle_audit(params, staff, cur):
+    if staff.get('role') != 'admin':
+        return {'_status': 403, 'error': 'Только администратор может просматривать журнал'}
+    limit = min(int(params.get('limit', 100)), 500)
+    offset = int(params.get('offset', 0))
+    entity_filter = params.get('filter_entity', '')
+    action_filter = params.get('filter_action', '')
+    where = []
+    if entity_filter:
+        where.append("entity='%s'" % esc(entity_filter))
+    if action_filter:
+        where.append("action='%s'" % esc(action_filter))
+    where_sql = (' WHERE ' + ' AND '.join(where)) if where else ''
+    cur.execute("EXPLAIN (FORMAT JSON) SELECT 1 FROM audit_log%s" % where_sql)
+    plan = cur.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    total = int(plan[0]['Plan']['Plan Rows'])
+
+    cursor = params.get('cursor', '')
+    if cursor:
+        c_ts, c_id = cursor.rsplit('_', 1)
+        where.append("(created_at, id) < ('%s', %s)" % (esc(c_ts), int(c_id)))
+        offset = 0
+    page_sql = (' WHERE ' + ' AND '.join(where)) if where else ''
+    rows = query_rows(cur, "SELECT * FROM audit_log%s ORDER BY created_at DESC, id DESC LIMIT %s OFFSET %s" % (page_sql, limit + 1, offset))
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = '%s_%s' % (rows[-1]['created_at'], rows[-1]['id'])
+    return {'items': rows, 'total': total, 'total_estimated': True, 'next_cursor': next_cursor}
@@ -0,0 +1,193 @@
+"""Вход пайщиков в личный кабинет"""
+import json
+import os
+from datetime import datetime, timedelta
+import base64
+import secrets
+import urllib.parse
+import http_pool
+from core import esc, generate_token, hash_password
+
+def generate_sms_code():
+    return '%06d' % (secrets.randbelow(900000) + 100000)
+
+def send_smsaero(phone, text):
+    email = os.environ.get('SMSAERO_EMAIL', '')
+    api_key = os.environ.get('SMSAERO_API_KEY', '')
+    if not email or not api_key:
+        return False, 'SMS-сервис не настроен'
+    clean = ''.join(c for c in phone if c.isdigit())
+    if len(clean) == 11 and clean[0] == '8':
+        clean = '7' + clean[1:]
+    if not clean.startswith('7') or len(clean) != 11:
+        return False, 'Неверный формат номера телефона'
+    params = urllib.parse.urlencode({'number': clean, 'text': text, 'sign': 'SMS Aero', 'channel': 'DIRECT'})
+    url = 'https://gate.smsaero.ru/v2/sms/send?' + params
+    credentials = base64.b64encode(f'{email}:{api_key}'.encode()).decode()
+    try:
+        data = json.loads(http_pool.request(url, headers={'Authorization': f'Basic {credentials}', 'Accept': 'application/json'}).decode())
+        if data.get('success'):
+            return True, None
+        return False, data.get('message', 'Ошибка отправки SMS')
+    except Exception as e:
+        return False, str(e)
+
+def handle_auth(method, body, cur, conn):
+    action = body.get('action', '')
+
+    if action == 'send_sms':
+        phone = body.get('phone', '').strip()
+        if not phone:
+            return {'error': 'Укажите номер телефона'}
+        clean_phone = ''.join(c for c in phone if c.isdigit())
+        if len(clean_phone) == 11 and clean_phone[0] == '8':
+            clean_phone = '7' + clean_phone[1:]
+
+        cur.execute("SELECT m.id, m.phone FROM members m WHERE REPLACE(REPLACE(REPLACE(REPLACE(m.phone,' ',''),'-',''),'(',''),')','') LIKE '%%%s%%' AND m.status='active'" % clean_phone[-10:])
+        member = cur.fetchone()
+        if not member:
+            return {'error': 'Пайщик с таким номером не найден. Обратитесь в КПК.'}
+
+        member_id = member[0]
+        cur.execute("SELECT id, password_hash FROM users WHERE member_id=%s AND role='client'" % member_id)
+        user_row = cur.fetchone()
+
+        code = generate_sms_code()
+        expires = (datetime.now() + timedelta(minutes=5)).strftime('%Y-%m-%d %H:%M:%S')
+
+        if user_row:
+            user_id = user_row[0]
+            has_password = bool(user_row[1])
+            cur.execute("UPDATE users SET sms_code='%s', sms_code_expires='%s' WHERE id=%s" % (code, expires, user_id))
+        else:
+            cur.execute("SELECT CASE WHEN member_type='FL' THEN CONCAT(last_name,' ',first_name) ELSE company_name END FROM members WHERE id=%s" % member_id)
+            name_row = cur.fetchone()
+            uname = name_row[0] if name_row else 'Клиент'
+            cur.execute("INSERT INTO users (member_id, name, email, phone, role, sms_code, sms_code_expires) VALUES (%s,'%s','','%s','client','%s','%s') RETURNING id" % (member_id, esc(uname), esc(phone), code, expires))
+            user_id = cur.fetchone()[0]
+            has_password = False
+
+        conn.commit()
+        sms_ok, sms_err = send_smsaero(phone, f'Ваш код для входа в личный кабинет: {code}')
+        if not sms_ok:
+            return {'error': f'Не удалось отправить SMS: {sms_err}'}
+        return {'success': True, 'has_password': has_password, 'sms_sent': True}
+
+    elif action == 'verify_sms':
+        phone = body.get('phone', '').strip()
+        code = body.get('code', '').strip()
+        clean_phone = ''.join(c for c in phone if c.isdigit())
+
+        cur.execute("SELECT u.id, u.password_hash, u.name, u.member_id FROM users u JOIN members m ON m.id=u.member_id WHERE REPLACE(REPLACE(REPLACE(REPLACE(m.phone,' ',''),'-',''),'(',''),')','') LIKE '%%%s%%' AND u.role='client' AND u.sms_code='%s' AND u.sms_code_expires > NOW()" % (clean_phone[-10:], esc(code)))
+        row = cur.fetchone()
+        if not row:
+            return {'error': 'Неверный код или код истёк'}
+
+        user_id, pw_hash, name, member_id = row[0], row[1], row[2], row[3]
+        has_password = bool(pw_hash)
+
+        cur.execute("UPDATE users SET sms_code=NULL, sms_code_expires=NULL WHERE id=%s" % user_id)
+
+        if has_password:
+            token = generate_token()
+            expires = (datetime.now() + timedelta(days=30)).strftime('%Y-%m-%d %H:%M:%S')
+            cur.execute("INSERT INTO client_sessions (user_id, token, expires_at) VALUES (%s,'%s','%s')" % (user_id, token, expires))
+            cur.execute("UPDATE users SET last_login=NOW() WHERE id=%s" % user_id)
+            conn.commit()
+            return {'success': True, 'has_password': True, 'authenticated': True, 'token': token, 'user': {'name': name, 'member_id': member_id}}
+        else:
+            temp_token = generate_token()
+            expires = (datetime.now() + timedelta(minutes=15)).strftime('%Y-%m-%d %H:%M:%S')
+            cur.execute("INSERT INTO client_sessions (user_id, token, expires_at) VALUES (%s,'%s','%s')" % (user_id, temp_token, expires))
+            conn.commit()
+            return {'success': True, 'has_password': False, 'setup_token': temp_token}
+
+    elif action == 'set_password':
+        token = body.get('setup_token') or body.get('token', '')
+        password = body.get('password', '')
+        if not password or len(password) < 6:
+            return {'error': 'Пароль должен быть не менее 6 символов'}
+
+        cur.execute("SELECT cs.user_id FROM client_sessions cs WHERE cs.token='%s' AND cs.expires_at > NOW()" % esc(token))
+        row = cur.fetchone()
+        if not row:
+            return {'error': 'Сессия истекла, повторите авторизацию'}
+
+        user_id = row[0]
+        pw_hash = hash_password(password)
+        cur.execute("UPDATE users SET password_hash='%s' WHERE id=%s" % (pw_hash, user_id))
+
+        cur.execute("UPDATE client_sessions SET expires_at=NOW() WHERE token='%s'" % esc(token))
+
+        new_token = generate_token()
+        expires = (datetime.now() + timedelta(days=30)).strftime('%Y-%m-%d %H:%M:%S')
+        cur.execute("INSERT INTO client_sessions (user_id, token, expires_at) VALUES (%s,'%s','%s')" % (user_id, new_token, expires))
+        cur.execute("UPDATE users SET last_login=NOW() WHERE id=%s" % user_id)
+
+        cur.execute("SELECT name, member_id FROM users WHERE id=%s" % user_id)
+        ur = cur.fetchone()
+        conn.commit()
+        return {'success': True, 'token': new_token, 'user': {'name': ur[0], 'member_id': ur[1]}}
+
+    elif action == 'login_password':
+        phone = body.get('phone', '').strip()
+        login = body.get('login', '').strip()
+        password = body.get('password', '')
+        pw_hash = hash_password(password)
+
+        row = None
+        if login:
+            cur.execute("SELECT u.id, u.name, u.member_id FROM users u WHERE u.login='%s' AND u.role='client' AND u.password_hash='%s' AND u.status='active'" % (esc(login), pw_hash))
+            row = cur.fetchone()
+        if not row and phone:
+            clean_phone = ''.join(c for c in phone if c.isdigit())
+            cur.execute("SELECT u.id, u.name, u.member_id FROM users u JOIN members m ON m.id=u.member_id WHERE REPLACE(REPLACE(REPLACE(REPLACE(m.phone,' ',''),'-',''),'(',''),')','') LIKE '%%%s%%' AND u.role='client' AND u.password_hash='%s'" % (clean_phone[-10:], pw_hash))
+            row = cur.fetchone()
+        if not row:
+            return {'error': 'Неверный логин/телефон или пароль'}
+
+        user_id, name, member_id = row
+        token = generate_token()
+        expires = (datetime.now() + timedelta(days=30)).strftime('%Y-%m-%d %H:%M:%S')
+        cur.execute("INSERT INTO client_sessions (user_id, token, expires_at) VALUES (%s,'%s','%s')" % (user_id, token, expires))
+        cur.execute("UPDATE users SET last_login=NOW() WHERE id=%s" % user_id)
+        conn.commit()
+        return {'success': True, 'token': token, 'user': {'name': name, 'member_id': member_id}}
+
+    elif action == 'change_password':
+        token = body.get('token', '')
+        old_pw = body.get('old_password', '')
+        new_pw = body.get('new_password', '')
+        if not new_pw or len(new_pw) < 6:
+            return {'error': 'Новый пароль должен быть не менее 6 символов'}
+
+        cur.execute("SELECT cs.user_id FROM client_sessions cs WHERE cs.token='%s' AND cs.expires_at > NOW()" % esc(token))
+        row = cur.fetchone()
+        if not row:
+            return {'error': 'Сессия истекла'}
+        user_id = row[0]
+
+        cur.execute("SELECT password_hash FROM users WHERE id=%s" % user_id)
+        cur_hash = cur.fetchone()[0]
+        if cur_hash and cur_hash != hash_password(old_pw):
+            return {'error': 'Неверный текущий пароль'}
+
+        cur.execute("UPDATE users SET password_hash='%s' WHERE id=%s" % (hash_password(new_pw), user_id))
+        conn.commit()
+        return {'success': True}
+
+    elif action == 'logout':
+        token = body.get('token', '')
+        cur.execute("UPDATE client_sessions SET expires_at=NOW() WHERE token='%s'" % esc(token))
+        conn.commit()
+        return {'success': True}
+
+    elif action == 'check':
+        token = body.get('token', '')
+        cur.execute("SELECT u.id, u.name, u.member_id FROM users u JOIN client_sessions cs ON cs.user_id=u.id WHERE cs.token='%s' AND cs.expires_at > NOW()" % esc(token))
+        row = cur.fetchone()
+        if not row:
+            return {'error': 'Не авторизован'}
+        return {'success': True, 'user': {'name': row[1], 'member_id': row[2]}}
+
+    return {'error': 'Неизвестное действие'}
@@ -0,0 +1,243 @@
+"""Вебхуки ботов Telegram и MAX"""
+import json
+import os
+import urllib.parse
+from core import esc
+
+# Сколько ответов вебхук отправляет сам сразу после commit; остальное и неудачное дошлёт крон (action=drain_outbox)
+BOT_REPLY_INLINE_LIMIT = 5
+BOT_REPLY_TIMEOUT = 5
+
+def register_bot_update(cur, platform, update_key, body):
+    """Фиксирует входящее обновление бота; False — оно уже обработано (повторная доставка вебхука)"""
+    if not update_key:
+        return True
+    cur.execute("INSERT INTO bot_updates (platform, update_key, payload) VALUES ('%s', '%s', '%s'::jsonb) ON CONFLICT DO NOTHING RETURNING 1" % (
+        platform, esc(str(update_key)), esc(json.dumps(body, ensure_ascii=False))))
+    return cur.fetchone() is not None
+
+def queue_bot_reply(cur, platform, chat_id, text):
+    """Ставит ответ бота в notification_outbox; отправляет его send_bot_replies после commit вебхука"""
+    cur.execute("INSERT INTO notification_outbox (channel, recipient, payload, source) VALUES ('%s', '%s', '%s'::jsonb, 'bot_reply')" % (
+        platform, int(chat_id), esc(json.dumps({'text': text}, ensure_ascii=False))))
+
+def send_bot_message(platform, bot_token, chat_id, text):
+    import http_pool
+    if platform == 'telegram':
+        url = 'https://api.telegram.org/bot%s/sendMessage' % bot_token
+        data = {'chat_id': chat_id, 'text': text, 'parse_mode': 'HTML'}
+    else:
+        url = 'https://botapi.max.ru/messages?access_token=%s&chat_id=%s' % (urllib.parse.quote(bot_token), chat_id)
+        data = {'text': text, 'format': 'html'}
+    http_pool.request(url, data=json.dumps(data).encode('utf-8'), headers={'Content-Type': 'application/json'}, timeout=BOT_REPLY_TIMEOUT)
+
+def send_bot_replies(cur, conn, platform, bot_token):
+    """Отправляет свежие ответы бота из очереди, не дожидаясь крона. Строки берутся FOR UPDATE SKIP LOCKED,
+    поэтому параллельный drain_outbox их не продублирует; ошибка оставляет ответ в очереди на повтор кроном"""
+    if not bot_token:
+        return
+    cur.execute("""
+        SELECT id, recipient, payload FROM notification_outbox
+        WHERE source='bot_reply' AND channel='%s' AND status='pending' AND attempts=0
+        ORDER BY id LIMIT %d FOR UPDATE SKIP LOCKED
+    """ % (platform, BOT_REPLY_INLINE_LIMIT))
+    sent, failed = [], []
+    for msg_id, recipient, payload in cur.fetchall():
+        payload = payload if isinstance(payload, dict) else json.loads(payload)
+        try:
+            send_bot_message(platform, bot_token, recipient, payload.get('text', ''))
+            sent.append(msg_id)
+        except Exception as e:
+            failed.append((msg_id, str(e)[:500]))
+    if sent:
+        cur.execute("UPDATE notification_outbox SET status='sent', attempts=attempts+1, sent_at=NOW() WHERE id IN (%s)" % ','.join(str(i) for i in sent))
+    for msg_id, err in failed:
+        cur.execute("UPDATE notification_outbox SET attempts=attempts+1, last_error='%s' WHERE id=%d" % (esc(err), msg_id))
+    conn.commit()
+
+def get_telegram_bot_token(cur):
+    token = os.environ.get('TELEGRAM_BOT_TOKEN', '')
+    if not token:
+        cur.execute("SELECT settings FROM notification_channels WHERE channel='telegram'")
+        row = cur.fetchone()
+        if row:
+            ch = row[0] if isinstance(row[0], dict) else json.loads(row[0])
+            token = ch.get('bot_token', '')
+    return token
+
+def handle_telegram_bot(method, body, cur, conn):
+    """Webhook для Telegram-бота: приём подписок от пайщиков. Ответы идут через очередь и отправляются после commit"""
+    if not register_bot_update(cur, 'telegram', body.get('update_id'), body):
+        return {'ok': True, 'duplicate': True}
+    bot_token = get_telegram_bot_token(cur)
+    result = process_telegram_update(body, cur, conn, bot_token)
+    conn.commit()
+    send_bot_replies(cur, conn, 'telegram', bot_token)
+    return result
+
+def process_telegram_update(body, cur, conn, bot_token):
+    if not bot_token:
+        return {'ok': True}
+
+    msg = body.get('message') or body.get('edited_message') or {}
+    chat = msg.get('chat', {})
+    chat_id = chat.get('id')
+    text = (msg.get('text') or '').strip()
+    tg_username = chat.get('username', '')
+    tg_first_name = chat.get('first_name', '')
+
+    if not chat_id:
+        return {'ok': True}
+
+    def send_tg(txt):
+        queue_bot_reply(cur, 'telegram', chat_id, txt)
+
+    if text.startswith('/start'):
+        parts = text.split(maxsplit=1)
+        if len(parts) > 1:
+            link_code = parts[1].strip()
+            cur.execute("SELECT user_id FROM telegram_link_codes WHERE code='%s' AND expires_at > NOW()" % esc(link_code))
+            row = cur.fetchone()
+            if not row:
+                send_tg('Ссылка для привязки недействительна или истекла.\n\nПерейдите в личный кабинет и нажмите «Привязать Telegram» заново.')
+                return {'ok': True}
+            user_id = row[0]
+            cur.execute("DELETE FROM telegram_link_codes WHERE code='%s'" % esc(link_code))
+            cur.execute("SELECT id, active FROM telegram_subscribers WHERE user_id=%s AND chat_id=%s" % (user_id, chat_id))
+            existing = cur.fetchone()
+            if existing:
+                cur.execute("UPDATE telegram_subscribers SET active=true, username='%s', first_name='%s', subscribed_at=NOW() WHERE id=%s" % (esc(tg_username), esc(tg_first_name), existing[0]))
+            else:
+                cur.execute("INSERT INTO telegram_subscribers (user_id, chat_id, username, first_name) VALUES (%s, %s, '%s', '%s')" % (user_id, chat_id, esc(tg_username), esc(tg_first_name)))
+            conn.commit()
+            cur.execute("SELECT u.name FROM users u WHERE u.id=%s" % user_id)
+            urow = cur.fetchone()
+            name = urow[0] if urow else ''
+            welcome = 'Здравствуйте'
+            if name:
+                welcome = 'Здравствуйте, %s' % name
+            send_tg('%s! Telegram успешно привязан.\n\nТеперь вы будете получать уведомления о платежах и новости кооператива.' % welcome)
+        else:
+            send_tg('Для привязки Telegram перейдите в личный кабинет на сайте и нажмите кнопку «Привязать Telegram».\n\nЕсли у вас нет доступа к личному кабинету — обратитесь в КПК.')
+        return {'ok': True}
+
+    if text in ('/stop', '/unsubscribe'):
+        cur.execute("UPDATE telegram_subscribers SET active=false WHERE chat_id=%s AND active=true" % chat_id)
+        conn.commit()
+        send_tg('Вы отписались от уведомлений. Чтобы подписаться снова, перейдите в личный кабинет.')
+        return {'ok': True}
+
+    if text == '/status':
+        cur.execute("SELECT ts.id, u.name FROM telegram_subscribers ts JOIN users u ON u.id=ts.user_id WHERE ts.chat_id=%s AND ts.active=true" % chat_id)
+        row = cur.fetchone()
+        if row:
+            send_tg('Вы подписаны на уведомления.\nАккаунт: %s\n\nДля отписки отправьте /stop' % (row[1] or ''))
+        else:
+            send_tg('Вы не подписаны на уведомления.\n\nДля подписки перейдите в личный кабинет.')
+        return {'ok': True}
+
+    send_tg('Я бот для уведомлений КПК.\n\nКоманды:\n/status — проверить подписку\n/stop — отписаться от уведомлений')
+    return {'ok': True}
+
+def max_update_key(body):
+    """У MAX нет update_id: сообщения различаем по mid, прочие события — по типу, чату и времени"""
+    mid = ((body.get('message') or {}).get('body') or {}).get('mid')
+    if mid:
+        return mid
+    if body.get('timestamp'):
+        return '%s:%s:%s' % (body.get('update_type', ''), body.get('chat_id', ''), body['timestamp'])
+    return None
+
+def handle_max_bot(method, body, cur, conn):
+    """Webhook для MAX-бота: приём подписок от пайщиков. Ответы идут через очередь и отправляются после commit"""
+    if not register_bot_update(cur, 'max', max_update_key(body), body):
+        return {'ok': True, 'duplicate': True}
+    bot_token = os.environ.get('MAX_BOT_TOKEN', '')
+    result = process_max_update(body, cur, conn, bot_token)
+    conn.commit()
+    send_bot_replies(cur, conn, 'max', bot_token)
+    return result
+
+def process_max_update(body, cur, conn, bot_token):
+    if not bot_token:
+        return {'ok': True}
+
+    update_type = body.get('update_type', '')
+
+    if update_type == 'bot_started':
+        chat_id = body.get('chat_id')
+        user_data = body.get('user', {})
+        max_user_id = user_data.get('user_id')
+        username = user_data.get('username', '')
+        first_name = user_data.get('first_name', '')
+        payload = body.get('payload', '')
+
+        if not chat_id:
+            return {'ok': True}
+
+        def send_max(txt):
+            queue_bot_reply(cur, 'max', chat_id, txt)
+
+        if payload:
+            link_code = payload.strip()
+            cur.execute("SELECT user_id FROM max_link_codes WHERE code='%s' AND expires_at > NOW()" % esc(link_code))
+            row = cur.fetchone()
+            if not row:
+                send_max('Ссылка для привязки недействительна или истекла.\n\nПерейдите в личный кабинет и нажмите «Привязать MAX» заново.')
+                return {'ok': True}
+            user_id = row[0]
+            cur.execute("DELETE FROM max_link_codes WHERE code='%s'" % esc(link_code))
+            cur.execute("SELECT id, active FROM max_subscribers WHERE user_id=%s AND chat_id=%s" % (user_id, chat_id))
+            existing = cur.fetchone()
+            if existing:
+                cur.execute("UPDATE max_subscribers SET active=true, user_id_max=%s, username='%s', first_name='%s', subscribed_at=NOW() WHERE id=%s" % (max_user_id or 'NULL', esc(username), esc(first_name), existing[0]))
+            else:
+                cur.execute("INSERT INTO max_subscribers (user_id, chat_id, user_id_max, username, first_name) VALUES (%s, %s, %s, '%s', '%s')" % (user_id, chat_id, max_user_id or 'NULL', esc(username), esc(first_name)))
+            conn.commit()
+            cur.execute("SELECT u.name FROM users u WHERE u.id=%s" % user_id)
+            urow = cur.fetchone()
+            name = urow[0] if urow else ''
+            welcome = 'Здравствуйте'
+            if name:
+                welcome = 'Здравствуйте, %s' % name
+            send_max('%s! MAX успешно привязан.\n\nТеперь вы будете получать уведомления о платежах и новости кооператива.' % welcome)
+        else:
+            send_max('Для привязки MAX перейдите в личный кабинет на сайте и нажмите кнопку «Привязать MAX».\n\nЕсли у вас нет доступа к личному кабинету — обратитесь в КПК.')
+        return {'ok': True}
+
+    if update_type == 'message_created':
+        msg = body.get('message', {})
+        msg_body = msg.get('body', {})
+        text = (msg_body.get('text') or '').strip()
+        sender = msg.get('sender', {})
+        recipient = msg.get('recipient', {})
+        chat_id = recipient.get('chat_id')
+        max_user_id = sender.get('user_id')
+        username = sender.get('username', '')
+        first_name = sender.get('first_name', '')
+
+        if not chat_id:
+            return {'ok': True}
+
+        def send_max(txt):
+            queue_bot_reply(cur, 'max', chat_id, txt)
+
+        if text in ('/stop', '/unsubscribe'):
+            cur.execute("UPDATE max_subscribers SET active=false WHERE chat_id=%s AND active=true" % chat_id)
+            conn.commit()
+            send_max('Вы отписались от уведомлений. Чтобы подписаться снова, перейдите в личный кабинет.')
+            return {'ok': True}
+
+        if text == '/status':
+            cur.execute("SELECT ms.id, u.name FROM max_subscribers ms JOIN users u ON u.id=ms.user_id WHERE ms.chat_id=%s AND ms.active=true" % chat_id)
+            row = cur.fetchone()
+            if row:
+                send_max('Вы подписаны на уведомления.\nАккаунт: %s\n\nДля отписки отправьте /stop' % (row[1] or ''))
+            else:
+                send_max('Вы не подписаны на уведомления.\n\nДля подписки перейдите в личный кабинет.')
+            return {'ok': True}
+
+        send_max('Я бот для уведомлений КПК.\n\nКоманды:\n/status — проверить подписку\n/stop — отписаться от уведомлений')
+        return {'ok': True}
+
+    return {'ok': True}
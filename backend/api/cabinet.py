@@ -0,0 +1,264 @@
+"""Личный кабинет пайщика"""
+import json
+import os
+from datetime import datetime, timedelta
+import base64
+import secrets
+import urllib.parse
+import http_pool
+from core import esc, execute_prepared, query_one, query_rows, serialize
+from documents import generate_loan_certificate_pdf, generate_loan_closure_pdf, load_org_settings
+
+def handle_cabinet(method, params, body, headers, cur, conn=None):
+    token = params.get('token') or body.get('token', '')
+    if not token:
+        token = (headers or {}).get('X-Auth-Token') or (headers or {}).get('x-auth-token', '')
+
+    execute_prepared(cur, 'cabinet_session', token)
+    row = cur.fetchone()
+    if not row:
+        return {'_status': 401, 'error': 'Не авторизован'}
+    user_id = row[0]
+    member_id = row[1]
+
+    action = params.get('action') or body.get('action', 'overview')
+
+    if action == 'overview':
+        cur.execute("SELECT CASE WHEN member_type='FL' THEN CONCAT(last_name,' ',first_name,' ',middle_name) ELSE company_name END as name, member_no, phone, email FROM members WHERE id=%s" % member_id)
+        mr = cur.fetchone()
+        info = {'name': mr[0], 'member_no': mr[1], 'phone': mr[2], 'email': mr[3]} if mr else {}
+
+        loans = query_rows(cur, """
+            SELECT l.id, l.contract_no, l.amount, l.rate, l.term_months, l.schedule_type, l.start_date, l.end_date,
+                   l.monthly_payment, l.balance, l.status, l.org_id,
+                   o.name as org_name, o.short_name as org_short_name
+            FROM loans l LEFT JOIN organizations o ON o.id=l.org_id
+            WHERE l.member_id=%s ORDER BY l.created_at DESC
+        """ % member_id)
+
+        savings = query_rows(cur, """
+            SELECT s.id, s.contract_no, s.amount, s.rate, s.term_months, s.payout_type, s.start_date, s.end_date,
+                   s.accrued_interest, s.paid_interest, s.current_balance, s.status, s.org_id,
+                   o.name as org_name, o.short_name as org_short_name,
+                   s.accrual_total as total_daily_accrued, s.accrual_last_date as last_accrual_date
+            FROM savings s LEFT JOIN organizations o ON o.id=s.org_id
+            WHERE s.member_id=%s ORDER BY s.created_at DESC
+        """ % member_id)
+        for sv in savings:
+            sv['total_daily_accrued'] = float(sv['total_daily_accrued'])
+            if sv.get('last_accrual_date'):
+                sv['last_accrual_date'] = str(sv['last_accrual_date'])
+
+        shares = query_rows(cur, """
+            SELECT sa.id, sa.account_no, sa.balance, sa.total_in, sa.total_out, sa.status, sa.org_id,
+                   o.name as org_name, o.short_name as org_short_name
+            FROM share_accounts sa LEFT JOIN organizations o ON o.id=sa.org_id
+            WHERE sa.member_id=%s ORDER BY sa.created_at DESC
+        """ % member_id)
+
+        active_loan_ids = [l['id'] for l in loans if l.get('status') in ('active', 'overdue')]
+        if active_loan_ids:
+            ids_str = ','.join(str(i) for i in active_loan_ids)
+            next_rows = query_rows(cur, """
+                SELECT DISTINCT ON (loan_id) loan_id, payment_date
+                FROM loan_schedule
+                WHERE loan_id IN (%s) AND status IN ('pending', 'overdue')
+                ORDER BY loan_id, payment_no
+            """ % ids_str)
+            next_map = {nr['loan_id']: str(nr['payment_date']) for nr in next_rows}
+            for l in loans:
+                if l['id'] in next_map:
+                    l['next_payment_date'] = next_map[l['id']]
+
+        org_ids = set()
+        for item in loans + savings + shares:
+            if item.get('org_id'):
+                org_ids.add(item['org_id'])
+        orgs_map = {}
+        if org_ids:
+            org_rows = query_rows(cur, "SELECT id, name, short_name, inn, kpp, bank_name, bik, rs, ks FROM organizations WHERE id IN (%s)" % ','.join(str(i) for i in org_ids))
+            for o in org_rows:
+                orgs_map[o['id']] = o
+
+        return {'info': info, 'loans': loans, 'savings': savings, 'shares': shares, 'organizations': orgs_map}
+
+    elif action == 'loan_detail':
+        loan_id = params.get('id') or body.get('id')
+        loan = query_one(cur, "SELECT * FROM loans WHERE id=%s AND member_id=%s" % (loan_id, member_id))
+        if not loan:
+            return {'error': 'Договор не найден'}
+        loan['schedule'] = query_rows(cur, "SELECT * FROM loan_schedule WHERE loan_id=%s ORDER BY payment_no" % loan_id)
+        loan['payments'] = query_rows(cur, "SELECT * FROM loan_payments WHERE loan_id=%s ORDER BY payment_date" % loan_id)
+        return loan
+
+    elif action == 'loan_certificate':
+        loan_id = params.get('id') or body.get('id')
+        date_from = params.get('date_from') or body.get('date_from', '')
+        date_to = params.get('date_to') or body.get('date_to', '')
+        if not loan_id or not date_from or not date_to:
+            return {'error': 'Не указаны обязательные параметры'}
+        loan = query_one(cur, "SELECT * FROM loans WHERE id=%s AND member_id=%s" % (loan_id, member_id))
+        if not loan:
+            return {'error': 'Договор не найден'}
+        member = query_one(cur, "SELECT * FROM members WHERE id=%s" % member_id)
+        if not member:
+            return {'error': 'Пайщик не найден'}
+        org_id = loan.get('org_id')
+        if org_id:
+            org_row = query_one(cur, "SELECT * FROM organizations WHERE id=%s" % org_id)
+            org = org_row if org_row else load_org_settings(cur)
+        else:
+            org = load_org_settings(cur)
+        payments = query_rows(cur, "SELECT * FROM loan_payments WHERE loan_id=%s AND payment_date >= '%s' AND payment_date <= '%s' ORDER BY payment_date" % (loan_id, esc(date_from), esc(date_to)))
+        total_principal = sum(float(p.get('principal_part', 0)) for p in payments)
+        total_interest = sum(float(p.get('interest_part', 0)) for p in payments)
+        total_penalty = sum(float(p.get('penalty_part', 0)) for p in payments)
+        data = generate_loan_certificate_pdf(loan, member, org, date_from, date_to, total_principal, total_interest, total_penalty)
+        ct = 'application/pdf'
+        fn = 'certificate_%s_%s_%s.pdf' % (loan.get('contract_no', loan_id), date_from, date_to)
+        return {'file': base64.b64encode(data).decode('utf-8'), 'content_type': ct, 'filename': fn}
+
+    elif action == 'loan_closure':
+        loan_id = params.get('id') or body.get('id')
+        if not loan_id:
+            return {'error': 'Не указан ID займа'}
+        loan = query_one(cur, "SELECT * FROM loans WHERE id=%s AND member_id=%s" % (loan_id, member_id))
+        if not loan:
+            return {'error': 'Договор не найден'}
+        if loan.get('status') != 'closed':
+            return {'error': 'Займ не закрыт'}
+        member = query_one(cur, "SELECT * FROM members WHERE id=%s" % member_id)
+        if not member:
+            return {'error': 'Пайщик не найден'}
+        org_id = loan.get('org_id')
+        if org_id:
+            org_row = query_one(cur, "SELECT * FROM organizations WHERE id=%s" % org_id)
+            org = org_row if org_row else load_org_settings(cur)
+        else:
+            org = load_org_settings(cur)
+        cur.execute("SELECT MAX(payment_date) FROM loan_payments WHERE loan_id=%s" % loan_id)
+        cd_row = cur.fetchone()
+        closed_date = str(cd_row[0]) if cd_row and cd_row[0] else None
+        data = generate_loan_closure_pdf(loan, member, org, closed_date)
+        ct = 'application/pdf'
+        fn = 'closure_%s.pdf' % loan.get('contract_no', loan_id)
+        return {'file': base64.b64encode(data).decode('utf-8'), 'content_type': ct, 'filename': fn}
+
+    elif action == 'saving_detail':
+        saving_id = params.get('id') or body.get('id')
+        saving = query_one(cur, "SELECT * FROM savings WHERE id=%s AND member_id=%s" % (saving_id, member_id))
+        if not saving:
+            return {'error': 'Договор не найден'}
+        saving['schedule'] = query_rows(cur, "SELECT * FROM savings_schedule WHERE saving_id=%s ORDER BY period_no" % saving_id)
+        saving['total_daily_accrued'] = saving['accrual_total']
+        saving['last_accrual_date'] = saving['accrual_last_date']
+        saving['interest_payouts'] = query_rows(cur, "SELECT id, transaction_date, amount, description FROM savings_transactions WHERE saving_id=%s AND transaction_type='interest_payout' ORDER BY transaction_date DESC" % saving_id)
+        saving['transactions'] = query_rows(cur, "SELECT id, transaction_date, amount, transaction_type, description FROM savings_transactions WHERE saving_id=%s AND transaction_type IN ('deposit','withdrawal') ORDER BY transaction_date DESC" % saving_id)
+        return saving
+
+    elif action == 'telegram_link':
+        bot_token = os.environ.get('TELEGRAM_BOT_TOKEN', '')
+        if not bot_token:
+            cur.execute("SELECT settings FROM notification_channels WHERE channel='telegram'")
+            row = cur.fetchone()
+            if row:
+                ch = row[0] if isinstance(row[0], dict) else json.loads(row[0])
+                bot_token = ch.get('bot_token', '')
+        if not bot_token:
+            return {'error': 'Telegram-бот не настроен. Обратитесь в КПК.'}
+        try:
+            url = 'https://api.telegram.org/bot%s/getMe' % bot_token
+            resp = http_pool.request(url)
+            me = json.loads(resp.decode('utf-8'))
+            bot_username = me.get('result', {}).get('username', '')
+        except:
+            return {'error': 'Не удалось получить данные бота'}
+        code = secrets.token_hex(16)
+        expires = (datetime.now() + timedelta(minutes=15)).strftime('%Y-%m-%d %H:%M:%S')
+        cur.execute("DELETE FROM telegram_link_codes WHERE user_id=%s" % user_id)
+        cur.execute("INSERT INTO telegram_link_codes (user_id, code, expires_at) VALUES (%s, '%s', '%s')" % (user_id, code, expires))
+        conn.commit()
+        return {'bot_username': bot_username, 'link_code': code, 'link_url': 'https://t.me/%s?start=%s' % (bot_username, code)}
+
+    elif action == 'telegram_status':
+        cur.execute("SELECT ts.id, ts.chat_id, ts.username, ts.first_name, ts.subscribed_at FROM telegram_subscribers ts WHERE ts.user_id=%s AND ts.active=true" % user_id)
+        row = cur.fetchone()
+        if row:
+            return {'linked': True, 'chat_id': row[1], 'username': row[2] or '', 'first_name': row[3] or '', 'subscribed_at': serialize(row[4])}
+        return {'linked': False}
+
+    elif action == 'telegram_unlink':
+        cur.execute("UPDATE telegram_subscribers SET active=false WHERE user_id=%s AND active=true" % user_id)
+        conn.commit()
+        return {'success': True}
+
+    elif action == 'max_link':
+        bot_token = os.environ.get('MAX_BOT_TOKEN', '')
+        if not bot_token:
+            return {'error': 'MAX-бот не настроен. Обратитесь в КПК.'}
+        try:
+            url = 'https://botapi.max.ru/me?access_token=%s' % urllib.parse.quote(bot_token)
+            resp = http_pool.request(url)
+            me = json.loads(resp.decode('utf-8'))
+            bot_username = me.get('username', '')
+        except:
+            return {'error': 'Не удалось получить данные бота MAX'}
+        code = secrets.token_hex(16)
+        expires = (datetime.now() + timedelta(minutes=15)).strftime('%Y-%m-%d %H:%M:%S')
+        cur.execute("DELETE FROM max_link_codes WHERE user_id=%s" % user_id)
+        cur.execute("INSERT INTO max_link_codes (user_id, code, expires_at) VALUES (%s, '%s', '%s')" % (user_id, code, expires))
+        conn.commit()
+        return {'bot_username': bot_username, 'link_code': code, 'link_url': 'https://max.ru/%s?start=%s' % (bot_username, code)}
+
+    elif action == 'max_status':
+        cur.execute("SELECT ms.id, ms.chat_id, ms.username, ms.first_name, ms.subscribed_at FROM max_subscribers ms WHERE ms.user_id=%s AND ms.active=true" % user_id)
+        row = cur.fetchone()
+        if row:
+            return {'linked': True, 'chat_id': row[1], 'username': row[2] or '', 'first_name': row[3] or '', 'subscribed_at': serialize(row[4])}
+        return {'linked': False}
+
+    elif action == 'max_unlink':
+        cur.execute("UPDATE max_subscribers SET active=false WHERE user_id=%s AND active=true" % user_id)
+        conn.commit()
+        return {'success': True}
+
+    elif action == 'get_profile':
+        cur.execute("SELECT member_type, last_name, first_name, middle_name, birth_date, birth_place, inn, passport_series, passport_number, passport_dept_code, passport_issue_date, passport_issued_by, registration_address, phone, email, telegram, bank_bik, bank_account, marital_status, spouse_fio, spouse_phone, extra_phone, extra_contact_fio, company_name, director_fio, director_phone, contact_person_fio, contact_person_phone FROM members WHERE id=%s" % member_id)
+        row = cur.fetchone()
+        if not row:
+            return {'error': 'Пайщик не найден'}
+        cols = [d[0] for d in cur.description]
+        profile = {}
+        for i, c in enumerate(cols):
+            v = row[i]
+            if v is not None:
+                profile[c] = str(v)
+            else:
+                profile[c] = ''
+        return profile
+
+    elif action == 'update_profile':
+        if method != 'PUT':
+            return {'_status': 405, 'error': 'Метод не поддерживается'}
+        updates = []
+        allowed = ['last_name','first_name','middle_name','birth_place','inn','passport_series','passport_number',
+                    'passport_dept_code','passport_issued_by','registration_address','phone','email','telegram',
+                    'bank_bik','bank_account','marital_status','spouse_fio','spouse_phone','extra_phone',
+                    'extra_contact_fio','company_name','director_fio','director_phone','contact_person_fio',
+                    'contact_person_phone']
+        for f in allowed:
+            if f in body:
+                updates.append("%s = '%s'" % (f, esc(body[f])))
+        for f in ['birth_date','passport_issue_date']:
+            if f in body:
+                if body[f]:
+                    updates.append("%s = '%s'" % (f, body[f]))
+                else:
+                    updates.append("%s = NULL" % f)
+        if updates:
+            updates.append("updated_at = NOW()")
+            cur.execute("UPDATE members SET %s WHERE id = %s" % (', '.join(updates), member_id))
+            conn.commit()
+        return {'success': True}
+
+    return {'error': 'Неизвестное действие'}
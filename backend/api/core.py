@@ -0,0 +1,275 @@
+"""Общие части API: соединения с основной БД и репликой, подготовленные запросы, аудит, сессии сотрудников, утилиты"""
+import os
+import psycopg2
+import psycopg2.extensions
+from datetime import datetime, date
+from decimal import Decimal
+import calendar
+import hashlib
+import secrets
+import time
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """Курсор, который считает выполненные запросы в connection.statements — для бюджетов SQL на запрос"""
+    def execute(self, query, vars=None):
+        self.connection.statements += 1
+        return super().execute(query, vars)
+
+    def copy_expert(self, sql, file, size=8192):
+        self.connection.statements += 1
+        return super().copy_expert(sql, file, size)
+
+class ErpConnection(psycopg2.extensions.connection):
+    """Соединение с буфером журнала аудита: записи копятся за запрос и пишутся одним INSERT при commit.
+    Так же при commit пересчитываются member_stats пайщиков, чьи договоры менялись"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.audit_buffer = []
+        self.stats_dirty = {}
+        self.prepared = set()
+        self.statements = 0
+        self.cursor_factory = CountingCursor
+
+    def commit(self):
+        if self.stats_dirty:
+            flush_member_stats(self)
+        if self.audit_buffer:
+            flush_audit_log(self)
+        super().commit()
+
+    def rollback(self):
+        self.audit_buffer = []
+        self.stats_dirty = {}
+        super().rollback()
+
+def get_conn():
+    return psycopg2.connect(os.environ['DATABASE_URL'], connection_factory=ErpConnection)
+
+# Горячие запросы: готовятся на сервере один раз на соединение (PREPARE) и выполняются через EXECUTE с параметрами
+PREPARED = {
+    'staff_session': ('text', "SELECT cs.user_id, u.name, u.role, u.login, EXTRACT(EPOCH FROM NOW() - cs.last_write_at) FROM client_sessions cs JOIN users u ON u.id=cs.user_id WHERE cs.token=$1 AND cs.expires_at > NOW() AND u.role IN ('admin','manager')"),
+    'client_session': ('text', "SELECT cs.user_id, u.member_id, u.name, u.phone, u.role FROM client_sessions cs JOIN users u ON u.id=cs.user_id WHERE cs.token=$1 AND cs.expires_at > NOW()"),
+    'cabinet_session': ('text', "SELECT u.id, u.member_id FROM users u JOIN client_sessions cs ON cs.user_id=u.id WHERE cs.token=$1 AND cs.expires_at > NOW()"),
+    'session_write_age': ('text', "SELECT EXTRACT(EPOCH FROM NOW() - last_write_at) FROM client_sessions WHERE token=$1"),
+    'loan_schedule_rows': ('integer', "SELECT id, payment_no, payment_date, principal_amount, interest_amount, penalty_amount FROM loan_schedule WHERE loan_id=$1"),
+    'loan_payment_rows': ('integer', "SELECT id, payment_date, amount, manual_distribution, principal_part, interest_part, penalty_part FROM loan_payments WHERE loan_id=$1 ORDER BY payment_date, id"),
+    'loan_payment_rows_after': ('integer, date, integer', "SELECT id, payment_date, amount, manual_distribution, principal_part, interest_part, penalty_part FROM loan_payments WHERE loan_id=$1 AND (payment_date, id) > ($2, $3) ORDER BY payment_date, id"),
+    'loan_last_snapshot': ('integer', "SELECT payment_date, payment_id, principal_paid, row_states, schedule_hash FROM loan_balance_snapshots WHERE loan_id=$1 ORDER BY payment_date DESC, payment_id DESC LIMIT 1"),
+    'loan_first_open_row': ('integer', "SELECT id, principal_amount, interest_amount, penalty_amount, paid_amount, payment_date, payment_no FROM loan_schedule WHERE loan_id=$1 AND status IN ('pending','partial','overdue') ORDER BY payment_no, id LIMIT 1"),
+    'loan_overdue_total': ('integer', "SELECT COALESCE(SUM(principal_amount + interest_amount + penalty_amount - COALESCE(paid_amount, 0)), 0) FROM loan_schedule WHERE loan_id=$1 AND status IN ('overdue', 'partial')"),
+}
+
+def execute_prepared(cur, name, *args):
+    conn = cur.connection
+    if name not in conn.prepared:
+        arg_types, sql = PREPARED[name]
+        cur.execute("PREPARE %s (%s) AS %s" % (name, arg_types, sql))
+        conn.prepared.add(name)
+    cur.execute("EXECUTE %s (%s)" % (name, ', '.join(['%s'] * len(args))), args)
+
+READ_URL = os.environ.get('DATABASE_READ_URL', '')
+REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', '5'))
+REPLICA_LAG_TTL = 5.0
+READ_AFTER_WRITE_MARGIN = 1.0
+
+# Пары (entity, action) только на чтение, которые можно отдать реплике; None — любое действие
+READ_ROUTES = {('dashboard', None), ('export', None), ('audit', None), ('loans', 'reconciliation_report'), ('loans', 'simulate_repayment'), ('reports', None), ('cabinet', 'overview')}
+
+METRICS = {'db_primary': 0, 'db_replica': 0, 'fallback_write': 0, 'fallback_lag': 0, 'fallback_auth': 0, 'replica_error': 0,
+           'dadata_hits': 0, 'dadata_db_hits': 0, 'dadata_misses': 0, 'dadata_coalesced': 0, 'dadata_errors': 0, 'sql_budget_exceeded': 0, 'import_ms': {}}
+_replica_lag = {'checked_at': 0.0, 'lag': None}
+
+def get_read_conn():
+    conn = psycopg2.connect(READ_URL, connection_factory=ErpConnection)
+    conn.set_session(readonly=True, autocommit=True)
+    return conn
+
+def is_read_route(entity, method, params):
+    if not READ_URL or method != 'GET':
+        return False
+    action = params.get('action') or ('overview' if entity == 'cabinet' else '')
+    return (entity, None) in READ_ROUTES or (entity, action) in READ_ROUTES
+
+def replica_lag(read_cur):
+    """Отставание реплики в секундах, кэшируется на REPLICA_LAG_TTL; на ведущем сервере — 0"""
+    now = time.monotonic()
+    if now - _replica_lag['checked_at'] > REPLICA_LAG_TTL:
+        read_cur.execute("""
+            SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0
+                        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                        ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 0) END
+        """)
+        _replica_lag['lag'] = float(read_cur.fetchone()[0])
+        _replica_lag['checked_at'] = now
+    return _replica_lag['lag']
+
+def request_token(params, body, headers):
+    return (headers or {}).get('X-Auth-Token') or (headers or {}).get('x-auth-token') or params.get('staff_token') or params.get('token') or body.get('token', '')
+
+def session_write_age(cur, token):
+    """Сколько секунд назад сессия что-то записывала (по ведущему серверу); None — записей не было"""
+    if not token:
+        return None
+    execute_prepared(cur, 'session_write_age', token)
+    row = cur.fetchone()
+    return float(row[0]) if row and row[0] is not None else None
+
+def safe_float(v, field_name='значение'):
+    if v is None:
+        raise ValueError('Не указано: %s' % field_name)
+    return float(str(v).replace(',', '.'))
+
+def safe_int(v, field_name='значение'):
+    if v is None:
+        raise ValueError('Не указано: %s' % field_name)
+    return int(float(str(v).replace(',', '.')))
+
+def last_day_of_month(d):
+    return d.replace(day=calendar.monthrange(d.year, d.month)[1])
+
+def add_months(d, months):
+    month = d.month - 1 + months
+    year = d.year + month // 12
+    month = month % 12 + 1
+    day = min(d.day, calendar.monthrange(year, month)[1])
+    return date(year, month, day)
+
+def serialize(val):
+    if isinstance(val, Decimal):
+        return float(val)
+    if isinstance(val, (datetime, date)):
+        return val.isoformat()
+    return val
+
+def query_rows(cur, sql):
+    cur.execute(sql)
+    cols = [d[0] for d in cur.description]
+    return [{cols[i]: serialize(r[i]) for i in range(len(cols))} for r in cur.fetchall()]
+
+def query_one(cur, sql):
+    cur.execute(sql)
+    if cur.rowcount == 0:
+        return None
+    cols = [d[0] for d in cur.description]
+    row = cur.fetchone()
+    return {cols[i]: serialize(row[i]) for i in range(len(cols))}
+
+def query_json(cur, sql, params=None):
+    """Возвращает готовый JSON-текст, собранный в БД (json_agg / to_jsonb), без разбора в Python"""
+    cur.execute(sql, params)
+    row = cur.fetchone()
+    return row[0] if row else None
+
+def esc(val):
+    return str(val).replace("'", "''") if val else ''
+
+def audit_log(cur, staff, action, entity, entity_id=None, entity_label='', details='', ip=''):
+    uid = staff.get('user_id') if staff else None
+    uname = esc(staff.get('name', '')) if staff else ''
+    urole = esc(staff.get('role', '')) if staff else ''
+    cur.connection.audit_buffer.append("(%s, '%s', '%s', '%s', '%s', %s, '%s', '%s', '%s')" % (
+        uid or 'NULL', uname, urole, esc(action), esc(entity),
+        entity_id or 'NULL', esc(entity_label), esc(details), esc(ip)
+    ))
+
+def flush_audit_log(conn):
+    rows, conn.audit_buffer = conn.audit_buffer, []
+    cur = conn.cursor()
+    try:
+        cur.execute("INSERT INTO audit_log (user_id, user_name, user_role, action, entity, entity_id, entity_label, details, ip) VALUES %s" % ','.join(rows))
+    finally:
+        cur.close()
+
+# Счётчики пайщика: один запрос на любой набор пайщиков, %s — условие на m.id
+MEMBER_STATS_UPSERT = """
+    INSERT INTO member_stats (member_id, active_loans, overdue_loans, active_savings, share_balance, total_debt, updated_at)
+    SELECT m.id, l.active_loans, l.overdue_loans, s.active_savings, sa.share_balance, l.total_debt, NOW()
+    FROM members m
+    CROSS JOIN LATERAL (SELECT COUNT(*) AS active_loans, COUNT(*) FILTER (WHERE status = 'overdue') AS overdue_loans, COALESCE(SUM(balance), 0) AS total_debt
+                        FROM loans WHERE member_id = m.id AND status != 'closed') l
+    CROSS JOIN LATERAL (SELECT COUNT(*) AS active_savings FROM savings WHERE member_id = m.id AND status = 'active') s
+    CROSS JOIN LATERAL (SELECT COALESCE(SUM(balance), 0) AS share_balance FROM share_accounts WHERE member_id = m.id AND status = 'active') sa
+    WHERE %s
+    ON CONFLICT (member_id) DO UPDATE SET active_loans=EXCLUDED.active_loans, overdue_loans=EXCLUDED.overdue_loans, active_savings=EXCLUDED.active_savings,
+        share_balance=EXCLUDED.share_balance, total_debt=EXCLUDED.total_debt, updated_at=EXCLUDED.updated_at
+"""
+
+def mark_member_stats(cur, table, row_id):
+    """Помечает пайщика (members) или его договор (loans, savings, share_accounts) к пересчёту member_stats при commit"""
+    if row_id:
+        cur.connection.stats_dirty.setdefault(table, set()).add(int(row_id))
+
+def flush_member_stats(conn):
+    dirty, conn.stats_dirty = conn.stats_dirty, {}
+    sources = ['SELECT %s FROM %s WHERE id IN (%s)' % ('id' if table == 'members' else 'member_id', table, ','.join(str(i) for i in sorted(ids)))
+               for table, ids in sorted(dirty.items())]
+    cur = conn.cursor()
+    try:
+        cur.execute(MEMBER_STATS_UPSERT % ('m.id IN (%s)' % ' UNION '.join(sources)))
+    finally:
+        cur.close()
+
+def next_number(cur, scheme, scope_id=0, count=1):
+    """Выделяет count номеров из счётчика схемы нумерации (scope_id — организация или 0), возвращает последний выделенный"""
+    cur.execute("""
+        INSERT INTO number_counters (scheme, scope_id, last_value) VALUES ('%s', %s, %s)
+        ON CONFLICT (scheme, scope_id) DO UPDATE SET last_value = number_counters.last_value + EXCLUDED.last_value, updated_at = NOW()
+        RETURNING last_value
+    """ % (esc(scheme), int(scope_id or 0), int(count)))
+    return cur.fetchone()[0]
+
+def map_parallel(fn, items, chunk_size=20):
+    """Применяет fn к элементам в пуле процессов по числу ядер; без пула (одно ядро, нет /dev/shm) — последовательно"""
+    workers = min(os.cpu_count() or 1, (len(items) + chunk_size - 1) // chunk_size)
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        from concurrent.futures.process import BrokenProcessPool
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                return list(pool.map(fn, items, chunksize=chunk_size))
+        except (OSError, NotImplementedError, BrokenProcessPool):
+            pass
+    return [fn(item) for item in items]
+
+def fmt_date(d):
+    if not d:
+        return ''
+    if isinstance(d, str):
+        parts = d.split('-')
+        if len(parts) == 3:
+            return '%s.%s.%s' % (parts[2], parts[1], parts[0])
+        return d
+    return d.strftime('%d.%m.%Y')
+
+def fmt_money(n):
+    if n is None:
+        return '0.00'
+    return '{:,.2f}'.format(float(n)).replace(',', ' ')
+
+def hash_password(pw):
+    return hashlib.sha256(pw.encode()).hexdigest()
+
+def generate_token():
+    return secrets.token_hex(32)
+
+def get_session_user(headers, cur):
+    token = (headers or {}).get('X-Auth-Token') or (headers or {}).get('x-auth-token', '')
+    if not token:
+        return None
+    execute_prepared(cur, 'client_session', token)
+    row = cur.fetchone()
+    if not row:
+        return None
+    return {'user_id': row[0], 'member_id': row[1], 'name': row[2], 'phone': row[3], 'role': row[4]}
+
+def get_staff_session(params, headers, cur):
+    token = (headers or {}).get('X-Auth-Token') or (headers or {}).get('x-auth-token', '')
+    if not token:
+        token = params.get('staff_token', '')
+    if not token:
+        return None
+    execute_prepared(cur, 'staff_session', token)
+    row = cur.fetchone()
+    if not row:
+        return None
+    return {'user_id': row[0], 'name': row[1], 'role': row[2], 'login': row[3], 'write_age': float(row[4]) if row[4] is not None else None}
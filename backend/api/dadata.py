@@ -0,0 +1,110 @@
+"""Подсказки DaData с кешем в памяти процесса и в БД"""
+import json
+import os
+import time
+import threading
+from collections import OrderedDict
+import http_pool
+from core import METRICS, esc
+
+DADATA_BASE_URL = os.environ.get('DADATA_BASE_URL', 'https://suggestions.dadata.ru/suggestions/api/4_1/rs/suggest/')
+DADATA_URLS = {action: DADATA_BASE_URL + action for action in ('party', 'address', 'fms_unit', 'bank')}
+DADATA_TIMEOUT = 5
+DADATA_CACHE_TTL = int(os.environ.get('DADATA_CACHE_TTL', '86400'))
+DADATA_CACHE_SIZE = int(os.environ.get('DADATA_CACHE_SIZE', '2000'))
+DADATA_CACHE_TABLE = os.environ.get('DADATA_CACHE_TABLE', '') == 'true'
+
+# Кэш подсказок живёт между вызовами тёплого контейнера: ключ -> (истекает, ответ), порядок — LRU
+_dadata_cache = OrderedDict()
+_dadata_inflight = {}
+_dadata_lock = threading.Lock()
+
+def dadata_cache_key(action, query, count):
+    return '%s:%s:%s' % (action, ' '.join(query.lower().split()), count)
+
+def dadata_cache_get(key):
+    with _dadata_lock:
+        hit = _dadata_cache.get(key)
+        if hit and hit[0] > time.monotonic():
+            _dadata_cache.move_to_end(key)
+            return hit[1]
+        if hit:
+            del _dadata_cache[key]
+    return None
+
+def dadata_cache_put(key, result, ttl=DADATA_CACHE_TTL):
+    with _dadata_lock:
+        _dadata_cache[key] = (time.monotonic() + ttl, result)
+        _dadata_cache.move_to_end(key)
+        while len(_dadata_cache) > DADATA_CACHE_SIZE:
+            _dadata_cache.popitem(last=False)
+
+def fetch_dadata(url, query, count, token):
+    payload = json.dumps({'query': query, 'count': count}).encode('utf-8')
+    try:
+        return json.loads(http_pool.request(url, data=payload, headers={
+            'Content-Type': 'application/json',
+            'Accept': 'application/json',
+            'Authorization': 'Token %s' % token,
+        }, timeout=DADATA_TIMEOUT).decode('utf-8'))
+    except Exception as e:
+        return {'suggestions': [], '_error': str(e)}
+
+def handle_dadata(body, cur=None, conn=None):
+    """Проксирование запросов к DaData API с кэшем и склейкой одинаковых одновременных запросов"""
+    action = body.get('action', '')
+    query = body.get('query', '')
+    if not query:
+        return {'suggestions': []}
+    url = DADATA_URLS.get(action)
+    if not url:
+        return {'error': 'Неизвестный тип подсказки: %s' % action}
+    token = os.environ.get('DADATA_API_KEY', '')
+    if not token:
+        return {'error': 'DADATA_API_KEY не настроен'}
+    count = min(max(int(body.get('count') or 7), 1), 20)
+    key = dadata_cache_key(action, query, count)
+
+    cached = dadata_cache_get(key)
+    if cached is not None:
+        METRICS['dadata_hits'] += 1
+        return cached
+
+    with _dadata_lock:
+        waiter = _dadata_inflight.get(key)
+        leader = waiter is None
+        if leader:
+            waiter = _dadata_inflight[key] = {'event': threading.Event(), 'result': None}
+    if not leader:
+        METRICS['dadata_coalesced'] += 1
+        waiter['event'].wait(DADATA_TIMEOUT + 1)
+        return waiter['result'] or {'suggestions': [], '_error': 'timeout'}
+
+    result = None
+    try:
+        if DADATA_CACHE_TABLE and cur:
+            cur.execute("SELECT response FROM dadata_cache WHERE cache_key='%s' AND expires_at > NOW()" % esc(key))
+            row = cur.fetchone()
+            if row:
+                METRICS['dadata_db_hits'] += 1
+                result = row[0]
+                dadata_cache_put(key, result)
+                return result
+        METRICS['dadata_misses'] += 1
+        result = fetch_dadata(url, query, count, token)
+        if '_error' in result:
+            METRICS['dadata_errors'] += 1
+            return result
+        dadata_cache_put(key, result)
+        if DADATA_CACHE_TABLE and cur:
+            cur.execute("""
+                INSERT INTO dadata_cache (cache_key, response, expires_at) VALUES ('%s', '%s'::jsonb, NOW() + INTERVAL '%s seconds')
+                ON CONFLICT (cache_key) DO UPDATE SET response=EXCLUDED.response, expires_at=EXCLUDED.expires_at
+            """ % (esc(key), esc(json.dumps(result, ensure_ascii=False)), DADATA_CACHE_TTL))
+            conn.commit()
+        return result
+    finally:
+        with _dadata_lock:
+            _dadata_inflight.pop(key, None)
+        waiter['result'] = result
+        waiter['event'].set()
@@ -0,0 +1,101 @@
+"""Сводка для главной страницы"""
+
+
+def handle_dashboard(cur, params=None):
+    params = params or {}
+    org_id = params.get('org_id')
+    org_filter_loans = " AND l.org_id=%s" % org_id if org_id else ""
+    org_filter_savings = " AND s.org_id=%s" % org_id if org_id else ""
+    org_filter_shares = " AND sa.org_id=%s" % org_id if org_id else ""
+
+    stats = {}
+
+    if org_id:
+        cur.execute("SELECT COUNT(DISTINCT m.id) FROM members m JOIN loans l ON l.member_id=m.id WHERE m.status='active' AND l.org_id=%s UNION SELECT COUNT(DISTINCT m.id) FROM members m JOIN savings s ON s.member_id=m.id WHERE m.status='active' AND s.org_id=%s UNION SELECT COUNT(DISTINCT m.id) FROM members m JOIN share_accounts sa ON sa.member_id=m.id WHERE m.status='active' AND sa.org_id=%s" % (org_id, org_id, org_id))
+        rows = cur.fetchall()
+        member_ids = set()
+        cur.execute("SELECT DISTINCT m.id FROM members m LEFT JOIN loans l ON l.member_id=m.id AND l.org_id=%s LEFT JOIN savings s ON s.member_id=m.id AND s.org_id=%s LEFT JOIN share_accounts sa ON sa.member_id=m.id AND sa.org_id=%s WHERE m.status='active' AND (l.id IS NOT NULL OR s.id IS NOT NULL OR sa.id IS NOT NULL)" % (org_id, org_id, org_id))
+        stats['total_members'] = len(cur.fetchall())
+    else:
+        cur.execute("SELECT COUNT(*) FROM members WHERE status='active'")
+        stats['total_members'] = cur.fetchone()[0]
+
+    cur.execute("SELECT COUNT(*), COALESCE(SUM(l.balance),0) FROM loans l WHERE l.status='active'%s" % org_filter_loans)
+    r = cur.fetchone()
+    stats['active_loans'] = r[0]
+    stats['loan_portfolio'] = float(r[1])
+
+    cur.execute("SELECT COUNT(*) FROM loans l WHERE l.status='overdue'%s" % org_filter_loans)
+    stats['overdue_loans'] = cur.fetchone()[0]
+
+    cur.execute("SELECT COALESCE(SUM(s.current_balance),0) FROM savings s WHERE s.status='active'%s" % org_filter_savings)
+    stats['total_savings'] = float(cur.fetchone()[0])
+
+    cur.execute("SELECT COALESCE(SUM(sa.balance),0) FROM share_accounts sa WHERE sa.status='active'%s" % org_filter_shares)
+    stats['total_shares'] = float(cur.fetchone()[0])
+
+    cur.execute("SELECT id, name, short_name FROM organizations WHERE is_active=true ORDER BY name")
+    stats['organizations'] = [{'id': r[0], 'name': r[1], 'short_name': r[2]} for r in cur.fetchall()]
+
+    overdue_loans = []
+    cur.execute("""
+        SELECT l.id, l.contract_no, m.id as member_id,
+            COALESCE(m.last_name,'') || ' ' || COALESCE(m.first_name,'') || ' ' || COALESCE(m.middle_name,'') as member_name,
+            l.balance, l.rate, l.end_date, l.org_id,
+            COALESCE(o.short_name, o.name, '') as org_name,
+            od.overdue_amount, od.overdue_since, od.overdue_days, od.penalty_total
+        FROM loans l
+        JOIN members m ON m.id = l.member_id
+        LEFT JOIN organizations o ON o.id = l.org_id
+        CROSS JOIN LATERAL (
+            SELECT COALESCE(SUM(ls.payment_amount - COALESCE(ls.paid_amount,0)),0) AS overdue_amount,
+                   MIN(ls.payment_date) AS overdue_since,
+                   MAX(CASE WHEN ls.status='overdue' OR (ls.status='pending' AND ls.payment_date < CURRENT_DATE) THEN (CURRENT_DATE - ls.payment_date) ELSE 0 END) AS overdue_days,
+                   COALESCE(SUM(ls.penalty_amount),0) AS penalty_total
+            FROM loan_schedule ls
+            WHERE ls.loan_id=l.id AND ls.status IN ('overdue','pending') AND ls.payment_date < CURRENT_DATE
+        ) od
+        WHERE l.status = 'overdue'%s
+        ORDER BY l.end_date
+    """ % org_filter_loans)
+    for r in cur.fetchall():
+        overdue_loans.append({
+            'loan_id': r[0], 'contract_no': r[1], 'member_id': r[2], 'member_name': r[3].strip(),
+            'balance': float(r[4]), 'rate': float(r[5]), 'end_date': str(r[6]),
+            'org_id': r[7], 'org_name': r[8],
+            'overdue_amount': float(r[9]) if r[9] else 0,
+            'overdue_since': str(r[10]) if r[10] else None,
+            'overdue_days': int(r[11]) if r[11] else 0,
+            'penalty_total': float(r[12]) if r[12] else 0
+        })
+    stats['overdue_loan_list'] = overdue_loans
+
+    expiring_savings = []
+    cur.execute("""
+        SELECT s.id, s.contract_no, m.id as member_id,
+            COALESCE(m.last_name,'') || ' ' || COALESCE(m.first_name,'') || ' ' || COALESCE(m.middle_name,'') as member_name,
+            s.current_balance, s.accrued_interest, s.paid_interest, s.rate, s.end_date,
+            s.org_id, COALESCE(o.short_name, o.name, '') as org_name
+        FROM savings s
+        JOIN members m ON m.id = s.member_id
+        LEFT JOIN organizations o ON o.id = s.org_id
+        WHERE s.status = 'active'
+          AND s.end_date <= CURRENT_DATE + INTERVAL '30 days'
+          AND s.end_date >= CURRENT_DATE%s
+        ORDER BY s.end_date
+    """ % org_filter_savings)
+    total_refund = 0
+    for r in cur.fetchall():
+        refund = float(r[4]) + float(r[5]) - float(r[6])
+        total_refund += refund
+        expiring_savings.append({
+            'saving_id': r[0], 'contract_no': r[1], 'member_id': r[2], 'member_name': r[3].strip(),
+            'current_balance': float(r[4]), 'accrued_interest': float(r[5]),
+            'paid_interest': float(r[6]), 'rate': float(r[7]), 'end_date': str(r[8]),
+            'org_id': r[9], 'org_name': r[10],
+            'refund_amount': round(refund, 2)
+        })
+    stats['expiring_savings'] = expiring_savings
+    stats['expiring_savings_total'] = round(total_refund, 2)
+
+    return stats
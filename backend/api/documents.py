@@ -0,0 +1,1387 @@
+"""Выписки, справки и реестры в PDF и XLSX; reportlab и openpyxl импортируются внутри функций"""
+import os
+from datetime import datetime
+from decimal import Decimal
+import hashlib
+from io import BytesIO
+import urllib.parse
+from core import fmt_date, fmt_money
+
+_font_registered = False
+
+def register_cyrillic_font():
+    global _font_registered
+    if _font_registered:
+        return 'DejaVuSans', 'DejaVuSans-Bold'
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    paths = [
+        ('/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf', '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf'),
+        ('/usr/share/fonts/dejavu-sans-fonts/DejaVuSans.ttf', '/usr/share/fonts/dejavu-sans-fonts/DejaVuSans-Bold.ttf'),
+    ]
+    for reg_path, bold_path in paths:
+        if os.path.exists(reg_path):
+            pdfmetrics.registerFont(TTFont('DejaVuSans', reg_path))
+            pdfmetrics.registerFont(TTFont('DejaVuSans-Bold', bold_path if os.path.exists(bold_path) else reg_path))
+            _font_registered = True
+            return 'DejaVuSans', 'DejaVuSans-Bold'
+    import urllib.request
+    for name, fn in [('DejaVuSans', 'DejaVuSans.ttf'), ('DejaVuSans-Bold', 'DejaVuSans-Bold.ttf')]:
+        tmp = '/tmp/%s' % fn
+        if not os.path.exists(tmp):
+            urllib.request.urlretrieve('https://raw.githubusercontent.com/prawnpdf/prawn/master/data/fonts/%s' % fn, tmp)
+        pdfmetrics.registerFont(TTFont(name, tmp))
+    _font_registered = True
+    return 'DejaVuSans', 'DejaVuSans-Bold'
+
+_logo_cache = {}
+_DEFAULT_LOGO_URL = 'https://cdn.poehali.dev/projects/e404b5e6-12a9-4922-a20d-e3c26e46e7a6/bucket/39b830d8-2ba0-408a-8ced-fe6a9eaf99e4.jpg'
+
+def get_logo_path(logo_url=None):
+    import urllib.request
+    url = logo_url or _DEFAULT_LOGO_URL
+    if url in _logo_cache and os.path.exists(_logo_cache[url]):
+        return _logo_cache[url]
+    ext = url.rsplit('.', 1)[-1] if '.' in url.split('/')[-1] else 'jpg'
+    h = hashlib.md5(url.encode()).hexdigest()[:10]
+    p = '/tmp/logo_%s.%s' % (h, ext)
+    if not os.path.exists(p):
+        urllib.request.urlretrieve(url, p)
+    _logo_cache[url] = p
+    return p
+
+_img_cache = {}
+
+def get_image_path(url):
+    if not url:
+        return None
+    if url in _img_cache and os.path.exists(_img_cache[url]):
+        return _img_cache[url]
+    ext = url.rsplit('.', 1)[-1] if '.' in url.split('/')[-1] else 'png'
+    h = hashlib.md5(url.encode()).hexdigest()[:10]
+    p = '/tmp/img_%s.%s' % (h, ext)
+    if not os.path.exists(p):
+        try:
+            urllib.request.urlretrieve(url, p)
+        except Exception:
+            return None
+    _img_cache[url] = p
+    return p
+
+def build_pdf_signature_block(font_r, font_b, org):
+    from reportlab.lib.units import mm
+    from reportlab.platypus import Table, TableStyle, Paragraph, Spacer, Image
+    from reportlab.lib.styles import ParagraphStyle
+    from reportlab.lib import colors
+
+    if not org:
+        return []
+    sig_url = org.get('signature_url') or ''
+    stamp_url = org.get('stamp_url') or ''
+    director_fio = org.get('director_fio') or ''
+    director_position = org.get('director_position') or 'Директор'
+
+    if not sig_url and not stamp_url and not director_fio:
+        return []
+
+    elements = []
+    elements.append(Spacer(1, 12))
+
+    pos_style = ParagraphStyle('PS', fontName=font_r, fontSize=8, textColor=colors.HexColor('#666666'))
+    name_style = ParagraphStyle('NS', fontName=font_b, fontSize=9, textColor=colors.HexColor('#333333'))
+
+    sig_path = get_image_path(sig_url) if sig_url else None
+    stamp_path = get_image_path(stamp_url) if stamp_url else None
+
+    row_data = []
+    col_widths = []
+
+    if stamp_path:
+        stamp_img = Image(stamp_path, width=40*mm, height=40*mm)
+        row_data.append(stamp_img)
+        col_widths.append(45*mm)
+    else:
+        row_data.append('')
+        col_widths.append(5*mm)
+
+    if sig_path:
+        sig_img = Image(sig_path, width=30*mm, height=15*mm)
+        row_data.append(sig_img)
+        col_widths.append(35*mm)
+    else:
+        row_data.append('________________')
+        col_widths.append(35*mm)
+
+    fio_block = []
+    if director_position:
+        fio_block.append(Paragraph(director_position, pos_style))
+    if director_fio:
+        fio_block.append(Paragraph(director_fio, name_style))
+    from reportlab.platypus import KeepTogether
+    row_data.append(fio_block if fio_block else '')
+    col_widths.append(100*mm)
+
+    t = Table([row_data], colWidths=col_widths)
+    t.setStyle(TableStyle([
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('LEFTPADDING', (0, 0), (-1, -1), 0),
+        ('RIGHTPADDING', (0, 0), (-1, -1), 4),
+        ('TOPPADDING', (0, 0), (-1, -1), 0),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 0),
+    ]))
+    elements.append(t)
+    return elements
+
+def load_org_settings(cur):
+    cur.execute("SELECT key, value FROM organization_settings ORDER BY id")
+    rows = cur.fetchall()
+    return {r[0]: r[1] for r in rows}
+
+def build_pdf_header(font_r, font_b, org=None):
+    from reportlab.lib import colors
+    from reportlab.lib.units import mm
+    from reportlab.platypus import Table, TableStyle, Paragraph, Spacer, Image
+    from reportlab.lib.styles import ParagraphStyle
+    from reportlab.lib.enums import TA_LEFT
+
+    if org is None:
+        org = {}
+    org_name = org.get('name') or 'КПК «ЭКСПЕРТ ФИНАНС»'
+    org_phone = org.get('phone') or '8 (800) 700-89-09'
+    contacts = []
+    if org.get('website'):
+        contacts.append('Сайт: %s' % org['website'])
+    if org.get('email'):
+        contacts.append('Email: %s' % org['email'])
+    if org.get('telegram'):
+        contacts.append('Telegram: %s' % org['telegram'])
+    if org.get('max_messenger'):
+        contacts.append('Max: %s' % org['max_messenger'])
+    if not contacts:
+        contacts = ['Сайт: nfofinans.ru', 'Email: info@sll-expert.ru', 'Telegram: @nfofinans_161']
+    contacts_line = '    '.join(contacts)
+
+    logo_url = org.get('logo_url') or None
+    logo_path = get_logo_path(logo_url)
+    logo = Image(logo_path, width=24*mm, height=24*mm)
+
+    name_s = ParagraphStyle('HN', fontName=font_b, fontSize=12, leading=14, textColor=colors.HexColor('#1a3c5e'))
+    slogan_s = ParagraphStyle('HS', fontName=font_r, fontSize=7, leading=9, textColor=colors.HexColor('#888888'), spaceAfter=1)
+    phone_s = ParagraphStyle('HP', fontName=font_b, fontSize=9, leading=11, textColor=colors.HexColor('#333333'), spaceAfter=1)
+    contact_s = ParagraphStyle('HC', fontName=font_r, fontSize=6.5, leading=9, textColor=colors.HexColor('#555555'))
+
+    inner_data = [
+        [Paragraph(org_name, name_s)],
+        [Paragraph('Работаем с финансами, думаем о людях', slogan_s)],
+        [Paragraph('Тел: %s' % org_phone, phone_s)],
+        [Paragraph(contacts_line, contact_s)],
+    ]
+    inner = Table(inner_data, colWidths=[None])
+    inner.setStyle(TableStyle([
+        ('LEFTPADDING', (0, 0), (-1, -1), 0), ('RIGHTPADDING', (0, 0), (-1, -1), 0),
+        ('TOPPADDING', (0, 0), (-1, -1), 0), ('BOTTOMPADDING', (0, 0), (-1, -1), 1),
+    ]))
+
+    header = Table([[logo, inner]], colWidths=[28*mm, None])
+    header.setStyle(TableStyle([
+        ('VALIGN', (0, 0), (0, 0), 'TOP'), ('VALIGN', (1, 0), (1, 0), 'MIDDLE'),
+        ('LEFTPADDING', (0, 0), (-1, -1), 0), ('RIGHTPADDING', (0, 0), (-1, -1), 0),
+        ('TOPPADDING', (0, 0), (-1, -1), 0), ('BOTTOMPADDING', (0, 0), (-1, -1), 0),
+    ]))
+
+    line_data = [['']]
+    line = Table(line_data, colWidths=[186*mm])
+    line.setStyle(TableStyle([
+        ('LINEBELOW', (0, 0), (-1, -1), 0.8, colors.HexColor('#2e5d8a')),
+        ('TOPPADDING', (0, 0), (-1, -1), 0), ('BOTTOMPADDING', (0, 0), (-1, -1), 0),
+    ]))
+
+    return [header, Spacer(1, 3), line, Spacer(1, 8)]
+
+def build_xlsx_header(ws, org=None):
+    from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
+    from openpyxl.drawing.image import Image as XlImage
+
+    if org is None:
+        org = {}
+    org_name = org.get('name') or 'КПК «ЭКСПЕРТ ФИНАНС»'
+    org_phone = org.get('phone') or '8 (800) 700-89-09'
+    contacts = []
+    if org.get('website'):
+        contacts.append('Сайт: %s' % org['website'])
+    if org.get('email'):
+        contacts.append('Email: %s' % org['email'])
+    if org.get('telegram'):
+        contacts.append('Telegram: %s' % org['telegram'])
+    if org.get('max_messenger'):
+        contacts.append('Max: %s' % org['max_messenger'])
+    if not contacts:
+        contacts = ['Сайт: nfofinans.ru', 'Email: info@sll-expert.ru', 'Telegram: @nfofinans_161']
+    contacts_line = '    '.join(contacts)
+
+    logo_url = org.get('logo_url') or None
+    logo_path = get_logo_path(logo_url)
+    img = XlImage(logo_path)
+    img.width = 80
+    img.height = 80
+    ws.add_image(img, 'A1')
+    ws.row_dimensions[1].height = 20
+    ws.row_dimensions[2].height = 20
+    ws.row_dimensions[3].height = 15
+    ws.row_dimensions[4].height = 15
+    ws.row_dimensions[5].height = 12
+    ws.merge_cells('B1:F2')
+    ws['B1'] = org_name
+    ws['B1'].font = Font(bold=True, size=14, color='1a3c5e')
+    ws['B1'].alignment = Alignment(vertical='center')
+    ws['B3'] = 'Работаем с финансами, думаем о людях'
+    ws['B3'].font = Font(italic=True, size=8, color='888888')
+    ws['B4'] = 'Тел: %s' % org_phone
+    ws['B4'].font = Font(bold=True, size=9, color='333333')
+    ws['B5'] = contacts_line
+    ws['B5'].font = Font(size=7, color='555555')
+    line_border = Border(bottom=Side(style='medium', color='2e5d8a'))
+    for col in range(1, 8):
+        ws.cell(row=6, column=col).border = line_border
+    ws.row_dimensions[6].height = 5
+    return 8
+
+def generate_loan_xlsx(loan, schedule, payments, member_name, org=None):
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
+
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'Выписка по займу'
+
+    thin = Side(style='thin')
+    border = Border(left=thin, right=thin, top=thin, bottom=thin)
+    header_font = Font(bold=True, size=11)
+    title_font = Font(bold=True, size=14)
+    header_fill = PatternFill(start_color='E2EFDA', end_color='E2EFDA', fill_type='solid')
+
+    row = build_xlsx_header(ws, org)
+
+    ws.merge_cells('A%d:F%d' % (row, row))
+    ws['A%d' % row] = 'Выписка по договору займа %s' % loan.get('contract_no', '')
+    ws['A%d' % row].font = title_font
+    row += 2
+
+    ws['A%d' % row] = 'Пайщик:'
+    ws['B%d' % row] = member_name
+    ws['A%d' % row].font = Font(bold=True)
+    row += 1
+    ws['A%d' % row] = 'Сумма займа:'
+    ws['B%d' % row] = '%s руб.' % fmt_money(loan.get('amount'))
+    ws['A%d' % row].font = Font(bold=True)
+    row += 1
+    ws['A%d' % row] = 'Ставка:'
+    ws['B%d' % row] = '%s%% годовых' % loan.get('rate', '')
+    ws['A%d' % row].font = Font(bold=True)
+    row += 1
+    ws['A%d' % row] = 'Срок:'
+    ws['B%d' % row] = '%s мес.' % loan.get('term_months', '')
+    ws['A%d' % row].font = Font(bold=True)
+    row += 1
+    ws['A%d' % row] = 'Период:'
+    ws['B%d' % row] = '%s — %s' % (fmt_date(loan.get('start_date')), fmt_date(loan.get('end_date')))
+    ws['A%d' % row].font = Font(bold=True)
+    row += 1
+    ws['A%d' % row] = 'Остаток:'
+    ws['B%d' % row] = '%s руб.' % fmt_money(loan.get('balance'))
+    ws['A%d' % row].font = Font(bold=True)
+    row += 1
+    ws['A%d' % row] = 'Статус:'
+    status_map = {'active': 'Активен', 'closed': 'Закрыт', 'overdue': 'Просрочен'}
+    ws['B%d' % row] = status_map.get(loan.get('status', ''), loan.get('status', ''))
+    ws['A%d' % row].font = Font(bold=True)
+    row += 2
+
+    ws.column_dimensions['A'].width = 18
+    ws.column_dimensions['B'].width = 20
+    ws.column_dimensions['C'].width = 18
+    ws.column_dimensions['D'].width = 18
+    ws.column_dimensions['E'].width = 18
+    ws.column_dimensions['F'].width = 18
+    ws.column_dimensions['G'].width = 14
+
+    ws.merge_cells('A%d:G%d' % (row, row))
+    ws['A%d' % row] = 'ГРАФИК ПЛАТЕЖЕЙ'
+    ws['A%d' % row].font = Font(bold=True, size=12)
+    row += 1
+
+    sched_headers = ['№', 'Дата', 'Платёж', 'Осн. долг', 'Проценты', 'Остаток', 'Статус']
+    for ci, h in enumerate(sched_headers, 1):
+        c = ws.cell(row=row, column=ci, value=h)
+        c.font = header_font
+        c.fill = header_fill
+        c.border = border
+        c.alignment = Alignment(horizontal='center')
+    row += 1
+
+    status_labels = {'pending': 'Ожидается', 'paid': 'Оплачен', 'partial': 'Частично', 'overdue': 'Просрочен'}
+    for item in schedule:
+        ws.cell(row=row, column=1, value=item.get('payment_no')).border = border
+        ws.cell(row=row, column=2, value=fmt_date(item.get('payment_date'))).border = border
+        ws.cell(row=row, column=3, value=float(item.get('payment_amount', 0))).border = border
+        ws.cell(row=row, column=3).number_format = '#,##0.00'
+        ws.cell(row=row, column=4, value=float(item.get('principal_amount', 0))).border = border
+        ws.cell(row=row, column=4).number_format = '#,##0.00'
+        ws.cell(row=row, column=5, value=float(item.get('interest_amount', 0))).border = border
+        ws.cell(row=row, column=5).number_format = '#,##0.00'
+        ws.cell(row=row, column=6, value=float(item.get('balance_after', 0))).border = border
+        ws.cell(row=row, column=6).number_format = '#,##0.00'
+        ws.cell(row=row, column=7, value=status_labels.get(item.get('status', 'pending'), item.get('status', ''))).border = border
+        row += 1
+
+    total_payment = sum(float(i.get('payment_amount', 0)) for i in schedule)
+    total_principal = sum(float(i.get('principal_amount', 0)) for i in schedule)
+    total_interest = sum(float(i.get('interest_amount', 0)) for i in schedule)
+    ws.cell(row=row, column=1, value='ИТОГО').font = Font(bold=True)
+    ws.cell(row=row, column=1).border = border
+    ws.cell(row=row, column=2).border = border
+    ws.cell(row=row, column=3, value=total_payment).border = border
+    ws.cell(row=row, column=3).number_format = '#,##0.00'
+    ws.cell(row=row, column=3).font = Font(bold=True)
+    ws.cell(row=row, column=4, value=total_principal).border = border
+    ws.cell(row=row, column=4).number_format = '#,##0.00'
+    ws.cell(row=row, column=5, value=total_interest).border = border
+    ws.cell(row=row, column=5).number_format = '#,##0.00'
+    ws.cell(row=row, column=6).border = border
+    ws.cell(row=row, column=7).border = border
+    row += 2
+
+    if payments:
+        ws.merge_cells('A%d:F%d' % (row, row))
+        ws['A%d' % row] = 'ИСТОРИЯ ПЛАТЕЖЕЙ'
+        ws['A%d' % row].font = Font(bold=True, size=12)
+        row += 1
+
+        pay_headers = ['Дата', 'Сумма', 'Осн. долг', 'Проценты', 'Штрафы', 'Тип']
+        for ci, h in enumerate(pay_headers, 1):
+            c = ws.cell(row=row, column=ci, value=h)
+            c.font = header_font
+            c.fill = header_fill
+            c.border = border
+            c.alignment = Alignment(horizontal='center')
+        row += 1
+
+        for p in payments:
+            ws.cell(row=row, column=1, value=fmt_date(p.get('payment_date'))).border = border
+            ws.cell(row=row, column=2, value=float(p.get('amount', 0))).border = border
+            ws.cell(row=row, column=2).number_format = '#,##0.00'
+            ws.cell(row=row, column=3, value=float(p.get('principal_part', 0))).border = border
+            ws.cell(row=row, column=3).number_format = '#,##0.00'
+            ws.cell(row=row, column=4, value=float(p.get('interest_part', 0))).border = border
+            ws.cell(row=row, column=4).number_format = '#,##0.00'
+            ws.cell(row=row, column=5, value=float(p.get('penalty_part', 0))).border = border
+            ws.cell(row=row, column=5).number_format = '#,##0.00'
+            type_labels = {'regular': 'Обычный', 'early_full': 'Досрочное полное', 'early_partial': 'Досрочное частичное'}
+            ws.cell(row=row, column=6, value=type_labels.get(p.get('payment_type', ''), p.get('payment_type', ''))).border = border
+            row += 1
+
+    row += 1
+    ws['A%d' % row] = 'Дата формирования: %s' % datetime.now().strftime('%d.%m.%Y %H:%M')
+    ws['A%d' % row].font = Font(italic=True, color='666666')
+
+    buf = BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+def generate_loan_pdf(loan, schedule, payments, member_name, org=None):
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib import colors
+    from reportlab.lib.units import mm
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+
+    font_r, font_b = register_cyrillic_font()
+    buf = BytesIO()
+    doc = SimpleDocTemplate(buf, pagesize=A4, leftMargin=12*mm, rightMargin=12*mm, topMargin=15*mm, bottomMargin=15*mm)
+    styles = getSampleStyleSheet()
+    story = []
+
+    story.extend(build_pdf_header(font_r, font_b, org))
+
+    title_style = ParagraphStyle('T', fontName=font_b, fontSize=13, spaceAfter=4, textColor=colors.HexColor('#1a3c5e'))
+    sub_style = ParagraphStyle('S', fontName=font_b, fontSize=10, spaceAfter=4, spaceBefore=8, textColor=colors.HexColor('#2e5d8a'))
+    footer_style = ParagraphStyle('F', fontName=font_r, fontSize=7, textColor=colors.grey)
+
+    story.append(Paragraph('Выписка по договору займа %s' % loan.get('contract_no', ''), title_style))
+    story.append(Spacer(1, 4))
+
+    status_map = {'active': 'Активен', 'closed': 'Закрыт', 'overdue': 'Просрочен'}
+    info_data = [
+        ['Пайщик:', member_name, 'Сумма:', '%s руб.' % fmt_money(loan.get('amount'))],
+        ['Ставка:', '%s%% годовых' % loan.get('rate', ''), 'Срок:', '%s мес.' % loan.get('term_months', '')],
+        ['Период:', '%s — %s' % (fmt_date(loan.get('start_date')), fmt_date(loan.get('end_date'))), 'Остаток:', '%s руб.' % fmt_money(loan.get('balance'))],
+        ['Статус:', status_map.get(loan.get('status', ''), loan.get('status', '')), '', ''],
+    ]
+    info_table = Table(info_data, colWidths=[55, 150, 55, 150])
+    info_table.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (-1, -1), font_r), ('FONTSIZE', (0, 0), (-1, -1), 8),
+        ('FONTNAME', (0, 0), (0, -1), font_b), ('FONTNAME', (2, 0), (2, -1), font_b),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 2), ('TOPPADDING', (0, 0), (-1, -1), 1),
+    ]))
+    story.append(info_table)
+    story.append(Spacer(1, 6))
+
+    story.append(Paragraph('График платежей', sub_style))
+    sched_data = [['№', 'Дата', 'Платёж', 'Осн. долг', 'Проценты', 'Остаток', 'Статус']]
+    status_labels = {'pending': 'Ожидается', 'paid': 'Оплачен', 'partial': 'Частично', 'overdue': 'Просрочен'}
+    for item in schedule:
+        sched_data.append([
+            str(item.get('payment_no', '')), fmt_date(item.get('payment_date')),
+            fmt_money(item.get('payment_amount', 0)), fmt_money(item.get('principal_amount', 0)),
+            fmt_money(item.get('interest_amount', 0)), fmt_money(item.get('balance_after', 0)),
+            status_labels.get(item.get('status', 'pending'), item.get('status', '')),
+        ])
+    total_payment = sum(float(i.get('payment_amount', 0)) for i in schedule)
+    total_principal = sum(float(i.get('principal_amount', 0)) for i in schedule)
+    total_interest = sum(float(i.get('interest_amount', 0)) for i in schedule)
+    sched_data.append(['ИТОГО', '', fmt_money(total_payment), fmt_money(total_principal), fmt_money(total_interest), '', ''])
+
+    cw = [22, 58, 68, 68, 60, 68, 58]
+    st = Table(sched_data, colWidths=cw, repeatRows=1)
+    st.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (-1, -1), font_r), ('FONTSIZE', (0, 0), (-1, -1), 7),
+        ('FONTNAME', (0, 0), (-1, 0), font_b), ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#dce6f0')),
+        ('FONTNAME', (0, -1), (-1, -1), font_b), ('BACKGROUND', (0, -1), (-1, -1), colors.HexColor('#eef2f7')),
+        ('GRID', (0, 0), (-1, -1), 0.4, colors.HexColor('#b0b0b0')),
+        ('ALIGN', (0, 0), (0, -1), 'CENTER'), ('ALIGN', (2, 0), (5, -1), 'RIGHT'),
+        ('TOPPADDING', (0, 0), (-1, -1), 2), ('BOTTOMPADDING', (0, 0), (-1, -1), 2),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -2), [colors.white, colors.HexColor('#f8f9fb')]),
+    ]))
+    story.append(st)
+
+    if payments:
+        story.append(Spacer(1, 6))
+        story.append(Paragraph('История платежей', sub_style))
+        pay_data = [['Дата', 'Сумма', 'Осн. долг', 'Проценты', 'Штрафы', 'Тип']]
+        type_labels = {'regular': 'Обычный', 'early_full': 'Досрочное полное', 'early_partial': 'Досрочное частичное'}
+        for p in payments:
+            pay_data.append([
+                fmt_date(p.get('payment_date')), fmt_money(p.get('amount', 0)),
+                fmt_money(p.get('principal_part', 0)), fmt_money(p.get('interest_part', 0)),
+                fmt_money(p.get('penalty_part', 0)),
+                type_labels.get(p.get('payment_type', ''), p.get('payment_type', '')),
+            ])
+        pt = Table(pay_data, colWidths=[58, 68, 68, 60, 60, 100], repeatRows=1)
+        pt.setStyle(TableStyle([
+            ('FONTNAME', (0, 0), (-1, -1), font_r), ('FONTSIZE', (0, 0), (-1, -1), 7),
+            ('FONTNAME', (0, 0), (-1, 0), font_b), ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#dce6f0')),
+            ('GRID', (0, 0), (-1, -1), 0.4, colors.HexColor('#b0b0b0')),
+            ('ALIGN', (1, 0), (4, -1), 'RIGHT'),
+            ('TOPPADDING', (0, 0), (-1, -1), 2), ('BOTTOMPADDING', (0, 0), (-1, -1), 2),
+            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f8f9fb')]),
+        ]))
+        story.append(pt)
+
+    story.append(Spacer(1, 12))
+    story.append(Paragraph('Дата формирования: %s' % datetime.now().strftime('%d.%m.%Y %H:%M'), footer_style))
+
+    doc.build(story)
+    return buf.getvalue()
+
+def generate_savings_xlsx(saving, schedule, transactions, member_name, org=None):
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
+
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'Выписка по сбережению'
+
+    thin = Side(style='thin')
+    border = Border(left=thin, right=thin, top=thin, bottom=thin)
+    header_font = Font(bold=True, size=11)
+    header_fill = PatternFill(start_color='D6EAF8', end_color='D6EAF8', fill_type='solid')
+
+    row = build_xlsx_header(ws, org)
+
+    ws.merge_cells('A%d:F%d' % (row, row))
+    ws['A%d' % row] = 'Выписка по договору сбережений %s' % saving.get('contract_no', '')
+    ws['A%d' % row].font = Font(bold=True, size=14)
+    row += 2
+
+    ws['A%d' % row] = 'Пайщик:'
+    ws['B%d' % row] = member_name
+    ws['A%d' % row].font = Font(bold=True)
+    row += 1
+    ws['A%d' % row] = 'Сумма вклада:'
+    ws['B%d' % row] = '%s руб.' % fmt_money(saving.get('amount'))
+    ws['A%d' % row].font = Font(bold=True)
+    row += 1
+    ws['A%d' % row] = 'Ставка:'
+    ws['B%d' % row] = '%s%% годовых' % saving.get('rate', '')
+    ws['A%d' % row].font = Font(bold=True)
+    row += 1
+    ws['A%d' % row] = 'Срок:'
+    ws['B%d' % row] = '%s мес.' % saving.get('term_months', '')
+    ws['A%d' % row].font = Font(bold=True)
+    row += 1
+    ws['A%d' % row] = 'Период:'
+    ws['B%d' % row] = '%s — %s' % (fmt_date(saving.get('start_date')), fmt_date(saving.get('end_date')))
+    ws['A%d' % row].font = Font(bold=True)
+    row += 1
+    ws['A%d' % row] = 'Начислено %:'
+    ws['B%d' % row] = '%s руб.' % fmt_money(saving.get('accrued_interest'))
+    ws['A%d' % row].font = Font(bold=True)
+    row += 2
+
+    ws.column_dimensions['A'].width = 18
+    ws.column_dimensions['B'].width = 20
+    ws.column_dimensions['C'].width = 18
+    ws.column_dimensions['D'].width = 18
+    ws.column_dimensions['E'].width = 18
+
+    ws['A%d' % row] = 'ГРАФИК ДОХОДНОСТИ'
+    ws['A%d' % row].font = Font(bold=True, size=12)
+    row += 1
+
+    headers = ['№', 'Начало', 'Окончание', 'Проценты', 'Накоплено', 'Баланс']
+    for ci, h in enumerate(headers, 1):
+        c = ws.cell(row=row, column=ci, value=h)
+        c.font = header_font
+        c.fill = header_fill
+        c.border = border
+        c.alignment = Alignment(horizontal='center')
+    row += 1
+
+    for item in schedule:
+        ws.cell(row=row, column=1, value=item.get('period_no')).border = border
+        ws.cell(row=row, column=2, value=fmt_date(item.get('period_start'))).border = border
+        ws.cell(row=row, column=3, value=fmt_date(item.get('period_end'))).border = border
+        ws.cell(row=row, column=4, value=float(item.get('interest_amount', 0))).border = border
+        ws.cell(row=row, column=4).number_format = '#,##0.00'
+        ws.cell(row=row, column=5, value=float(item.get('cumulative_interest', 0))).border = border
+        ws.cell(row=row, column=5).number_format = '#,##0.00'
+        ws.cell(row=row, column=6, value=float(item.get('balance_after', 0))).border = border
+        ws.cell(row=row, column=6).number_format = '#,##0.00'
+        row += 1
+
+    if transactions:
+        row += 1
+        ws['A%d' % row] = 'ОПЕРАЦИИ'
+        ws['A%d' % row].font = Font(bold=True, size=12)
+        row += 1
+        t_headers = ['Дата', 'Сумма', 'Тип', 'Описание']
+        for ci, h in enumerate(t_headers, 1):
+            c = ws.cell(row=row, column=ci, value=h)
+            c.font = header_font
+            c.fill = header_fill
+            c.border = border
+        row += 1
+        type_labels = {'deposit': 'Пополнение', 'withdrawal': 'Снятие', 'interest_payout': 'Выплата %', 'early_close': 'Досрочное закрытие'}
+        for t in transactions:
+            ws.cell(row=row, column=1, value=fmt_date(t.get('transaction_date'))).border = border
+            ws.cell(row=row, column=2, value=float(t.get('amount', 0))).border = border
+            ws.cell(row=row, column=2).number_format = '#,##0.00'
+            ws.cell(row=row, column=3, value=type_labels.get(t.get('transaction_type', ''), t.get('transaction_type', ''))).border = border
+            ws.cell(row=row, column=4, value=t.get('description', '')).border = border
+            row += 1
+
+    row += 1
+    ws['A%d' % row] = 'Дата формирования: %s' % datetime.now().strftime('%d.%m.%Y %H:%M')
+    ws['A%d' % row].font = Font(italic=True, color='666666')
+
+    buf = BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+def generate_savings_pdf(saving, schedule, transactions, member_name, org=None):
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib import colors
+    from reportlab.lib.units import mm
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+
+    font_r, font_b = register_cyrillic_font()
+    buf = BytesIO()
+    doc = SimpleDocTemplate(buf, pagesize=A4, leftMargin=12*mm, rightMargin=12*mm, topMargin=15*mm, bottomMargin=15*mm)
+    styles = getSampleStyleSheet()
+    story = []
+
+    story.extend(build_pdf_header(font_r, font_b, org))
+
+    title_style = ParagraphStyle('T', fontName=font_b, fontSize=13, spaceAfter=4, textColor=colors.HexColor('#1a3c5e'))
+    sub_style = ParagraphStyle('S', fontName=font_b, fontSize=10, spaceAfter=4, spaceBefore=8, textColor=colors.HexColor('#2e5d8a'))
+    footer_style = ParagraphStyle('F', fontName=font_r, fontSize=7, textColor=colors.grey)
+
+    story.append(Paragraph('Выписка по договору сбережений %s' % saving.get('contract_no', ''), title_style))
+    story.append(Spacer(1, 4))
+
+    info = [
+        ['Пайщик:', member_name, 'Сумма:', '%s руб.' % fmt_money(saving.get('amount'))],
+        ['Ставка:', '%s%% годовых' % saving.get('rate', ''), 'Срок:', '%s мес.' % saving.get('term_months', '')],
+        ['Период:', '%s — %s' % (fmt_date(saving.get('start_date')), fmt_date(saving.get('end_date'))), 'Начислено:', '%s руб.' % fmt_money(saving.get('accrued_interest'))],
+    ]
+    it = Table(info, colWidths=[55, 150, 60, 150])
+    it.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (-1, -1), font_r), ('FONTSIZE', (0, 0), (-1, -1), 8),
+        ('FONTNAME', (0, 0), (0, -1), font_b), ('FONTNAME', (2, 0), (2, -1), font_b),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 2), ('TOPPADDING', (0, 0), (-1, -1), 1),
+    ]))
+    story.append(it)
+    story.append(Spacer(1, 6))
+
+    story.append(Paragraph('График доходности', sub_style))
+    sdata = [['№', 'Начало', 'Окончание', 'Проценты', 'Накоплено', 'Баланс']]
+    for item in schedule:
+        sdata.append([str(item.get('period_no', '')), fmt_date(item.get('period_start')), fmt_date(item.get('period_end')),
+                       fmt_money(item.get('interest_amount', 0)), fmt_money(item.get('cumulative_interest', 0)), fmt_money(item.get('balance_after', 0))])
+    st = Table(sdata, colWidths=[22, 68, 68, 75, 75, 85], repeatRows=1)
+    st.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (-1, -1), font_r), ('FONTSIZE', (0, 0), (-1, -1), 7),
+        ('FONTNAME', (0, 0), (-1, 0), font_b), ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#d6eaf8')),
+        ('GRID', (0, 0), (-1, -1), 0.4, colors.HexColor('#b0b0b0')),
+        ('ALIGN', (0, 0), (0, -1), 'CENTER'), ('ALIGN', (3, 0), (-1, -1), 'RIGHT'),
+        ('TOPPADDING', (0, 0), (-1, -1), 2), ('BOTTOMPADDING', (0, 0), (-1, -1), 2),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f0f6fc')]),
+    ]))
+    story.append(st)
+
+    if transactions:
+        story.append(Spacer(1, 6))
+        story.append(Paragraph('Операции', sub_style))
+        tdata = [['Дата', 'Сумма', 'Тип', 'Описание']]
+        type_labels = {'deposit': 'Пополнение', 'withdrawal': 'Снятие', 'interest_payout': 'Выплата %', 'early_close': 'Досрочное закрытие'}
+        for t in transactions:
+            tdata.append([fmt_date(t.get('transaction_date')), fmt_money(t.get('amount', 0)),
+                           type_labels.get(t.get('transaction_type', ''), t.get('transaction_type', '')), t.get('description', '')])
+        tt = Table(tdata, colWidths=[58, 68, 100, 170], repeatRows=1)
+        tt.setStyle(TableStyle([
+            ('FONTNAME', (0, 0), (-1, -1), font_r), ('FONTSIZE', (0, 0), (-1, -1), 7),
+            ('FONTNAME', (0, 0), (-1, 0), font_b), ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#d6eaf8')),
+            ('GRID', (0, 0), (-1, -1), 0.4, colors.HexColor('#b0b0b0')),
+            ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
+            ('TOPPADDING', (0, 0), (-1, -1), 2), ('BOTTOMPADDING', (0, 0), (-1, -1), 2),
+            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f0f6fc')]),
+        ]))
+        story.append(tt)
+
+    story.append(Spacer(1, 12))
+    story.append(Paragraph('Дата формирования: %s' % datetime.now().strftime('%d.%m.%Y %H:%M'), footer_style))
+    doc.build(story)
+    return buf.getvalue()
+
+def generate_saving_transactions_xlsx(saving, transactions, member_name, org=None):
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
+
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'Выписка по транзакциям'
+
+    thin = Side(style='thin')
+    border = Border(left=thin, right=thin, top=thin, bottom=thin)
+    header_font = Font(bold=True, size=11)
+    header_fill = PatternFill(start_color='E8DAEF', end_color='E8DAEF', fill_type='solid')
+
+    row = build_xlsx_header(ws, org)
+
+    ws.merge_cells('A%d:F%d' % (row, row))
+    ws['A%d' % row] = 'Выписка по транзакциям — договор %s' % saving.get('contract_no', '')
+    ws['A%d' % row].font = Font(bold=True, size=14)
+    row += 2
+
+    ws['A%d' % row] = 'Пайщик:'
+    ws['B%d' % row] = member_name
+    ws['A%d' % row].font = Font(bold=True)
+    row += 1
+    ws['A%d' % row] = 'Сумма вклада:'
+    ws['B%d' % row] = '%s руб.' % fmt_money(saving.get('amount'))
+    ws['A%d' % row].font = Font(bold=True)
+    row += 1
+    ws['A%d' % row] = 'Ставка:'
+    ws['B%d' % row] = '%s%% годовых' % saving.get('rate', '')
+    ws['A%d' % row].font = Font(bold=True)
+    row += 1
+    ws['A%d' % row] = 'Срок:'
+    ws['B%d' % row] = '%s мес.' % saving.get('term_months', '')
+    ws['A%d' % row].font = Font(bold=True)
+    row += 1
+    ws['A%d' % row] = 'Период:'
+    ws['B%d' % row] = '%s — %s' % (fmt_date(saving.get('start_date')), fmt_date(saving.get('end_date')))
+    ws['A%d' % row].font = Font(bold=True)
+    row += 1
+    ws['A%d' % row] = 'Текущий баланс:'
+    ws['B%d' % row] = '%s руб.' % fmt_money(saving.get('current_balance'))
+    ws['A%d' % row].font = Font(bold=True)
+    row += 1
+    status_map = {'active': 'Активен', 'closed': 'Закрыт', 'early_closed': 'Досрочно закрыт'}
+    ws['A%d' % row] = 'Статус:'
+    ws['B%d' % row] = status_map.get(saving.get('status', ''), saving.get('status', ''))
+    ws['A%d' % row].font = Font(bold=True)
+    row += 2
+
+    ws.column_dimensions['A'].width = 8
+    ws.column_dimensions['B'].width = 16
+    ws.column_dimensions['C'].width = 18
+    ws.column_dimensions['D'].width = 22
+    ws.column_dimensions['E'].width = 40
+
+    ws['A%d' % row] = 'ТРАНЗАКЦИИ'
+    ws['A%d' % row].font = Font(bold=True, size=12)
+    row += 1
+
+    type_labels = {'opening': 'Открытие', 'deposit': 'Пополнение', 'withdrawal': 'Частичное изъятие', 'interest_payout': 'Выплата процентов', 'interest_accrual': 'Начисление процентов', 'term_change': 'Изменение срока', 'rate_change': 'Изменение ставки', 'early_close': 'Досрочное закрытие', 'closing': 'Закрытие'}
+    headers = ['№', 'Дата', 'Сумма', 'Тип операции', 'Описание']
+    for ci, h in enumerate(headers, 1):
+        c = ws.cell(row=row, column=ci, value=h)
+        c.font = header_font
+        c.fill = header_fill
+        c.border = border
+        c.alignment = Alignment(horizontal='center')
+    row += 1
+
+    running_balance = Decimal('0')
+    for idx, t in enumerate(transactions, 1):
+        tt = t.get('transaction_type', '')
+        amt = float(t.get('amount', 0))
+        ws.cell(row=row, column=1, value=idx).border = border
+        ws.cell(row=row, column=2, value=fmt_date(t.get('transaction_date'))).border = border
+        ws.cell(row=row, column=3, value=amt).border = border
+        ws.cell(row=row, column=3).number_format = '#,##0.00'
+        ws.cell(row=row, column=4, value=type_labels.get(tt, tt)).border = border
+        ws.cell(row=row, column=5, value=t.get('description', '')).border = border
+        row += 1
+
+    row += 1
+    ws['A%d' % row] = 'Всего транзакций: %d' % len(transactions)
+    ws['A%d' % row].font = Font(bold=True)
+    row += 1
+    ws['A%d' % row] = 'Дата формирования: %s' % datetime.now().strftime('%d.%m.%Y %H:%M')
+    ws['A%d' % row].font = Font(italic=True, color='666666')
+
+    buf = BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+def generate_saving_transactions_pdf(saving, transactions, member_name, org=None):
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib import colors
+    from reportlab.lib.units import mm
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+
+    font_r, font_b = register_cyrillic_font()
+    buf = BytesIO()
+    doc = SimpleDocTemplate(buf, pagesize=A4, leftMargin=12*mm, rightMargin=12*mm, topMargin=15*mm, bottomMargin=15*mm)
+    story = []
+
+    story.extend(build_pdf_header(font_r, font_b, org))
+
+    title_style = ParagraphStyle('T', fontName=font_b, fontSize=13, spaceAfter=4, textColor=colors.HexColor('#1a3c5e'))
+    sub_style = ParagraphStyle('S', fontName=font_b, fontSize=10, spaceAfter=4, spaceBefore=8, textColor=colors.HexColor('#2e5d8a'))
+    footer_style = ParagraphStyle('F', fontName=font_r, fontSize=7, textColor=colors.grey)
+    desc_style = ParagraphStyle('D', fontName=font_r, fontSize=6.5, leading=8)
+
+    story.append(Paragraph('Выписка по транзакциям — договор %s' % saving.get('contract_no', ''), title_style))
+    story.append(Spacer(1, 4))
+
+    status_map = {'active': 'Активен', 'closed': 'Закрыт', 'early_closed': 'Досрочно закрыт'}
+    info = [
+        ['Пайщик:', member_name, 'Сумма:', '%s руб.' % fmt_money(saving.get('amount'))],
+        ['Ставка:', '%s%% годовых' % saving.get('rate', ''), 'Срок:', '%s мес.' % saving.get('term_months', '')],
+        ['Период:', '%s — %s' % (fmt_date(saving.get('start_date')), fmt_date(saving.get('end_date'))), 'Баланс:', '%s руб.' % fmt_money(saving.get('current_balance'))],
+        ['Статус:', status_map.get(saving.get('status', ''), saving.get('status', '')), '', ''],
+    ]
+    it = Table(info, colWidths=[55, 150, 55, 150])
+    it.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (-1, -1), font_r), ('FONTSIZE', (0, 0), (-1, -1), 8),
+        ('FONTNAME', (0, 0), (0, -1), font_b), ('FONTNAME', (2, 0), (2, -1), font_b),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 2), ('TOPPADDING', (0, 0), (-1, -1), 1),
+    ]))
+    story.append(it)
+    story.append(Spacer(1, 6))
+
+    story.append(Paragraph('Транзакции', sub_style))
+    type_labels = {'opening': 'Открытие', 'deposit': 'Пополнение', 'withdrawal': 'Частичное изъятие', 'interest_payout': 'Выплата %', 'interest_accrual': 'Начисление %', 'term_change': 'Изм. срока', 'rate_change': 'Изм. ставки', 'early_close': 'Досрочное закр.', 'closing': 'Закрытие'}
+    tdata = [['№', 'Дата', 'Сумма', 'Тип', 'Описание']]
+    for idx, t in enumerate(transactions, 1):
+        tt = t.get('transaction_type', '')
+        desc_text = t.get('description', '') or ''
+        tdata.append([str(idx), fmt_date(t.get('transaction_date')), fmt_money(t.get('amount', 0)),
+                       type_labels.get(tt, tt), Paragraph(desc_text, desc_style)])
+    tt_table = Table(tdata, colWidths=[22, 58, 68, 75, 170], repeatRows=1)
+    tt_table.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (-1, -1), font_r), ('FONTSIZE', (0, 0), (-1, -1), 7),
+        ('FONTNAME', (0, 0), (-1, 0), font_b), ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#e8daef')),
+        ('GRID', (0, 0), (-1, -1), 0.4, colors.HexColor('#b0b0b0')),
+        ('ALIGN', (0, 0), (0, -1), 'CENTER'), ('ALIGN', (2, 0), (2, -1), 'RIGHT'),
+        ('TOPPADDING', (0, 0), (-1, -1), 2), ('BOTTOMPADDING', (0, 0), (-1, -1), 2),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f8f0fc')]),
+    ]))
+    story.append(tt_table)
+
+    story.append(Spacer(1, 8))
+    story.append(Paragraph('Всего транзакций: %d' % len(transactions), ParagraphStyle('C', fontName=font_b, fontSize=8)))
+    story.append(Spacer(1, 12))
+    story.append(Paragraph('Дата формирования: %s' % datetime.now().strftime('%d.%m.%Y %H:%M'), footer_style))
+    doc.build(story)
+    return buf.getvalue()
+
+def generate_shares_xlsx(account, transactions, member_name, org=None):
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
+
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'Выписка по паевому счёту'
+
+    thin = Side(style='thin')
+    border = Border(left=thin, right=thin, top=thin, bottom=thin)
+    header_font = Font(bold=True, size=11)
+    header_fill = PatternFill(start_color='FCE4D6', end_color='FCE4D6', fill_type='solid')
+
+    row = build_xlsx_header(ws, org)
+
+    ws.merge_cells('A%d:D%d' % (row, row))
+    ws['A%d' % row] = 'Выписка по паевому счёту %s' % account.get('account_no', '')
+    ws['A%d' % row].font = Font(bold=True, size=14)
+    row += 2
+
+    ws['A%d' % row] = 'Пайщик:'
+    ws['B%d' % row] = member_name
+    ws['A%d' % row].font = Font(bold=True)
+    row += 1
+    ws['A%d' % row] = 'Баланс:'
+    ws['B%d' % row] = '%s руб.' % fmt_money(account.get('balance'))
+    ws['A%d' % row].font = Font(bold=True)
+    row += 1
+    ws['A%d' % row] = 'Внесено:'
+    ws['B%d' % row] = '%s руб.' % fmt_money(account.get('total_in'))
+    ws['A%d' % row].font = Font(bold=True)
+    row += 1
+    ws['A%d' % row] = 'Выплачено:'
+    ws['B%d' % row] = '%s руб.' % fmt_money(account.get('total_out'))
+    ws['A%d' % row].font = Font(bold=True)
+    row += 2
+
+    ws.column_dimensions['A'].width = 18
+    ws.column_dimensions['B'].width = 20
+    ws.column_dimensions['C'].width = 18
+    ws.column_dimensions['D'].width = 30
+
+    ws['A%d' % row] = 'ОПЕРАЦИИ'
+    ws['A%d' % row].font = Font(bold=True, size=12)
+    row += 1
+
+    headers = ['Дата', 'Сумма', 'Тип', 'Описание']
+    for ci, h in enumerate(headers, 1):
+        c = ws.cell(row=row, column=ci, value=h)
+        c.font = header_font
+        c.fill = header_fill
+        c.border = border
+    row += 1
+
+    type_labels = {'in': 'Внесение', 'out': 'Выплата'}
+    for t in transactions:
+        ws.cell(row=row, column=1, value=fmt_date(t.get('transaction_date'))).border = border
+        ws.cell(row=row, column=2, value=float(t.get('amount', 0))).border = border
+        ws.cell(row=row, column=2).number_format = '#,##0.00'
+        ws.cell(row=row, column=3, value=type_labels.get(t.get('transaction_type', ''), t.get('transaction_type', ''))).border = border
+        ws.cell(row=row, column=4, value=t.get('description', '')).border = border
+        row += 1
+
+    row += 1
+    ws['A%d' % row] = 'Дата формирования: %s' % datetime.now().strftime('%d.%m.%Y %H:%M')
+    ws['A%d' % row].font = Font(italic=True, color='666666')
+
+    buf = BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+def generate_shares_pdf(account, transactions, member_name, org=None):
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib import colors
+    from reportlab.lib.units import mm
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+
+    font_r, font_b = register_cyrillic_font()
+    buf = BytesIO()
+    doc = SimpleDocTemplate(buf, pagesize=A4, leftMargin=12*mm, rightMargin=12*mm, topMargin=15*mm, bottomMargin=15*mm)
+    styles = getSampleStyleSheet()
+    story = []
+
+    story.extend(build_pdf_header(font_r, font_b, org))
+
+    title_style = ParagraphStyle('T', fontName=font_b, fontSize=13, spaceAfter=4, textColor=colors.HexColor('#1a3c5e'))
+    sub_style = ParagraphStyle('S', fontName=font_b, fontSize=10, spaceAfter=4, spaceBefore=8, textColor=colors.HexColor('#2e5d8a'))
+    footer_style = ParagraphStyle('F', fontName=font_r, fontSize=7, textColor=colors.grey)
+
+    story.append(Paragraph('Выписка по паевому счёту %s' % account.get('account_no', ''), title_style))
+    story.append(Spacer(1, 4))
+
+    info = [['Пайщик:', member_name], ['Баланс:', '%s руб.' % fmt_money(account.get('balance'))],
+            ['Внесено:', '%s руб.' % fmt_money(account.get('total_in'))], ['Выплачено:', '%s руб.' % fmt_money(account.get('total_out'))]]
+    it = Table(info, colWidths=[70, 200])
+    it.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (-1, -1), font_r), ('FONTSIZE', (0, 0), (-1, -1), 8),
+        ('FONTNAME', (0, 0), (0, -1), font_b),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 2), ('TOPPADDING', (0, 0), (-1, -1), 1),
+    ]))
+    story.append(it)
+    story.append(Spacer(1, 6))
+
+    story.append(Paragraph('Операции', sub_style))
+    tdata = [['Дата', 'Сумма', 'Тип', 'Описание']]
+    type_labels = {'in': 'Внесение', 'out': 'Выплата'}
+    for t in transactions:
+        tdata.append([fmt_date(t.get('transaction_date')), fmt_money(t.get('amount', 0)),
+                       type_labels.get(t.get('transaction_type', ''), t.get('transaction_type', '')), t.get('description', '')])
+    tt = Table(tdata, colWidths=[58, 68, 85, 200], repeatRows=1)
+    tt.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (-1, -1), font_r), ('FONTSIZE', (0, 0), (-1, -1), 7),
+        ('FONTNAME', (0, 0), (-1, 0), font_b), ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#fce4d6')),
+        ('GRID', (0, 0), (-1, -1), 0.4, colors.HexColor('#b0b0b0')),
+        ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
+        ('TOPPADDING', (0, 0), (-1, -1), 2), ('BOTTOMPADDING', (0, 0), (-1, -1), 2),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#fef5ef')]),
+    ]))
+    story.append(tt)
+
+    story.append(Spacer(1, 12))
+    story.append(Paragraph('Дата формирования: %s' % datetime.now().strftime('%d.%m.%Y %H:%M'), footer_style))
+    doc.build(story)
+    return buf.getvalue()
+
+def generate_loan_certificate_pdf(loan, member, org, date_from, date_to, total_principal, total_interest, total_penalty):
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib import colors
+    from reportlab.lib.units import mm
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+    from reportlab.lib.styles import ParagraphStyle
+    from reportlab.lib.enums import TA_CENTER, TA_JUSTIFY
+
+    font_r, font_b = register_cyrillic_font()
+    buf = BytesIO()
+    doc = SimpleDocTemplate(buf, pagesize=A4, leftMargin=20*mm, rightMargin=15*mm, topMargin=15*mm, bottomMargin=15*mm)
+    story = []
+
+    story.extend(build_pdf_header(font_r, font_b, org))
+
+    title_style = ParagraphStyle('T', fontName=font_b, fontSize=13, spaceAfter=12, spaceBefore=8, alignment=TA_CENTER, textColor=colors.HexColor('#1a3c5e'))
+    body_style = ParagraphStyle('B', fontName=font_r, fontSize=10, leading=16, spaceAfter=6, alignment=TA_JUSTIFY)
+    body_bold = ParagraphStyle('BB', fontName=font_b, fontSize=10, leading=16, spaceAfter=6, alignment=TA_JUSTIFY)
+    footer_style = ParagraphStyle('F', fontName=font_r, fontSize=7, textColor=colors.grey)
+    small_style = ParagraphStyle('SM', fontName=font_r, fontSize=9, leading=12, textColor=colors.HexColor('#333333'))
+    line_style = ParagraphStyle('LN', fontName=font_r, fontSize=10, leading=16, spaceAfter=2)
+
+    story.append(Paragraph('СПРАВКА', title_style))
+
+    org_name = org.get('name') or org.get('short_name') or ''
+    org_inn = org.get('inn') or ''
+    member_name = ''
+    if member.get('member_type') == 'FL':
+        parts = [member.get('last_name', ''), member.get('first_name', ''), member.get('middle_name', '')]
+        member_name = ' '.join(p for p in parts if p)
+    else:
+        member_name = member.get('company_name') or ''
+
+    passport_series = member.get('passport_series') or '____'
+    passport_number = member.get('passport_number') or '______'
+    passport_issued_by = member.get('passport_issued_by') or '_________________________'
+    passport_issue_date = fmt_date(member.get('passport_issue_date')) if member.get('passport_issue_date') else '____________'
+    passport_dept_code = member.get('passport_dept_code') or '___-___'
+
+    contract_no = loan.get('contract_no') or ''
+    contract_date = fmt_date(loan.get('start_date')) if loan.get('start_date') else ''
+    period_from = fmt_date(date_from)
+    period_to = fmt_date(date_to)
+    balance = float(loan.get('balance', 0))
+
+    text = '%s ИНН %s сообщает сведения об уплате основного долга и процентов клиентом <b>%s</b> (Паспорт гражданина Российской Федерации %s %s выдан %s %s, код подразделения %s) по договору займа № <b>%s</b> от <b>%s</b> за период с <b>%s</b> по <b>%s</b>:' % (
+        org_name, org_inn, member_name,
+        passport_series, passport_number, passport_issue_date, passport_issued_by, passport_dept_code,
+        contract_no, contract_date, period_from, period_to
+    )
+    story.append(Paragraph(text, body_style))
+    story.append(Spacer(1, 8))
+
+    story.append(Paragraph('Сумма оплаченного основного долга составила — <b>%s руб.</b>' % fmt_money(total_principal), line_style))
+    story.append(Spacer(1, 2))
+    story.append(Paragraph('Сумма оплаченных процентов составила — <b>%s руб.</b>' % fmt_money(total_interest), line_style))
+    story.append(Spacer(1, 2))
+    story.append(Paragraph('Сумма иных платежей (штрафы/пени) — <b>%s руб.</b>' % fmt_money(total_penalty), line_style))
+
+    story.append(Spacer(1, 4))
+    line_data = [['']]
+    line_t = Table(line_data, colWidths=[170*mm])
+    line_t.setStyle(TableStyle([
+        ('LINEBELOW', (0, 0), (-1, -1), 0.5, colors.HexColor('#999999')),
+        ('TOPPADDING', (0, 0), (-1, -1), 0), ('BOTTOMPADDING', (0, 0), (-1, -1), 0),
+    ]))
+    story.append(line_t)
+    story.append(Spacer(1, 8))
+
+    story.append(Paragraph('Остаток задолженности на дату формирования данной справки составляет — <b>%s руб.</b>' % fmt_money(balance), body_style))
+
+    story.append(Spacer(1, 20))
+
+    req_title = ParagraphStyle('RT', fontName=font_b, fontSize=9, leading=12, spaceBefore=8, spaceAfter=4, textColor=colors.HexColor('#2e5d8a'))
+    story.append(Paragraph('Реквизиты организации', req_title))
+
+    req_items = []
+    if org_name:
+        req_items.append(['Наименование:', org_name])
+    if org_inn:
+        req_items.append(['ИНН:', org_inn])
+    if org.get('kpp'):
+        req_items.append(['КПП:', org['kpp']])
+    if org.get('ogrn'):
+        req_items.append(['ОГРН:', org['ogrn']])
+    if org.get('rs'):
+        req_items.append(['Расчётный счёт:', org['rs']])
+    if org.get('bank_name'):
+        req_items.append(['Банк:', org['bank_name']])
+    if org.get('bik'):
+        req_items.append(['БИК:', org['bik']])
+    if org.get('ks'):
+        req_items.append(['Корр. счёт:', org['ks']])
+
+    if req_items:
+        rt = Table(req_items, colWidths=[55*mm, 115*mm])
+        rt.setStyle(TableStyle([
+            ('FONTNAME', (0, 0), (0, -1), font_b), ('FONTNAME', (1, 0), (1, -1), font_r),
+            ('FONTSIZE', (0, 0), (-1, -1), 8), ('TEXTCOLOR', (0, 0), (-1, -1), colors.HexColor('#333333')),
+            ('TOPPADDING', (0, 0), (-1, -1), 1), ('BOTTOMPADDING', (0, 0), (-1, -1), 1),
+            ('LEFTPADDING', (0, 0), (-1, -1), 0),
+        ]))
+        story.append(rt)
+
+    story.extend(build_pdf_signature_block(font_r, font_b, org))
+
+    story.append(Spacer(1, 16))
+    story.append(Paragraph('Дата формирования: %s' % datetime.now().strftime('%d.%m.%Y %H:%M'), footer_style))
+    doc.build(story)
+    return buf.getvalue()
+
+def generate_loan_closure_pdf(loan, member, org, closed_date):
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib import colors
+    from reportlab.lib.units import mm
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+    from reportlab.lib.styles import ParagraphStyle
+    from reportlab.lib.enums import TA_CENTER, TA_JUSTIFY
+
+    font_r, font_b = register_cyrillic_font()
+    buf = BytesIO()
+    doc = SimpleDocTemplate(buf, pagesize=A4, leftMargin=20*mm, rightMargin=15*mm, topMargin=15*mm, bottomMargin=15*mm)
+    story = []
+
+    story.extend(build_pdf_header(font_r, font_b, org))
+
+    title_style = ParagraphStyle('T', fontName=font_b, fontSize=13, spaceAfter=12, spaceBefore=8, alignment=TA_CENTER, textColor=colors.HexColor('#1a3c5e'))
+    body_style = ParagraphStyle('B', fontName=font_r, fontSize=10, leading=16, spaceAfter=6, alignment=TA_JUSTIFY)
+    footer_style = ParagraphStyle('F', fontName=font_r, fontSize=7, textColor=colors.grey)
+    req_title = ParagraphStyle('RT', fontName=font_b, fontSize=9, leading=12, spaceBefore=8, spaceAfter=4, textColor=colors.HexColor('#2e5d8a'))
+
+    story.append(Paragraph('СПРАВКА', title_style))
+
+    org_name = org.get('name') or org.get('short_name') or ''
+    member_name = ''
+    if member.get('member_type') == 'FL':
+        parts = [member.get('last_name', ''), member.get('first_name', ''), member.get('middle_name', '')]
+        member_name = ' '.join(p for p in parts if p)
+    else:
+        member_name = member.get('company_name') or ''
+
+    passport_series = member.get('passport_series') or '____'
+    passport_number = member.get('passport_number') or '______'
+    passport_issued_by = member.get('passport_issued_by') or '_________________________'
+    passport_issue_date = fmt_date(member.get('passport_issue_date')) if member.get('passport_issue_date') else '____________'
+    passport_dept_code = member.get('passport_dept_code') or '___-___'
+
+    contract_no = loan.get('contract_no') or ''
+    contract_date = fmt_date(loan.get('start_date')) if loan.get('start_date') else ''
+    current_date = fmt_date(datetime.now().strftime('%Y-%m-%d'))
+    closed_date_fmt = fmt_date(closed_date) if closed_date else current_date
+
+    text = '%s сообщает, что задолженность клиента <b>%s</b> (Паспорт гражданина Российской Федерации %s %s выдан %s %s, код подразделения %s) по договору займа № <b>%s</b> от <b>%s</b> по состоянию на <b>%s</b> полностью погашена, договор закрыт <b>%s</b>.' % (
+        org_name, member_name,
+        passport_series, passport_number, passport_issue_date, passport_issued_by, passport_dept_code,
+        contract_no, contract_date, current_date, closed_date_fmt
+    )
+    story.append(Paragraph(text, body_style))
+
+    story.append(Spacer(1, 20))
+
+    story.append(Paragraph('Реквизиты организации', req_title))
+
+    org_inn = org.get('inn') or ''
+    req_items = []
+    if org_name:
+        req_items.append([org_name, ''])
+    if org_inn:
+        req_items.append(['ИНН:', org_inn])
+    if org.get('kpp'):
+        req_items.append(['КПП:', org['kpp']])
+    if org.get('ogrn'):
+        req_items.append(['ОГРН:', org['ogrn']])
+    if org.get('rs'):
+        req_items.append(['Расчётный счёт:', org['rs']])
+    if org.get('bank_name'):
+        req_items.append(['Банк:', org['bank_name']])
+    if org.get('bik'):
+        req_items.append(['БИК:', org['bik']])
+    if org.get('ks'):
+        req_items.append(['Корр. счёт:', org['ks']])
+
+    if req_items:
+        rt = Table(req_items, colWidths=[55*mm, 115*mm])
+        rt.setStyle(TableStyle([
+            ('FONTNAME', (0, 0), (0, -1), font_b), ('FONTNAME', (1, 0), (1, -1), font_r),
+            ('FONTSIZE', (0, 0), (-1, -1), 8), ('TEXTCOLOR', (0, 0), (-1, -1), colors.HexColor('#333333')),
+            ('TOPPADDING', (0, 0), (-1, -1), 1), ('BOTTOMPADDING', (0, 0), (-1, -1), 1),
+            ('LEFTPADDING', (0, 0), (-1, -1), 0),
+        ]))
+        story.append(rt)
+
+    story.extend(build_pdf_signature_block(font_r, font_b, org))
+
+    story.append(Spacer(1, 16))
+    story.append(Paragraph('Дата формирования: %s' % datetime.now().strftime('%d.%m.%Y %H:%M'), footer_style))
+    doc.build(story)
+    return buf.getvalue()
+
+def generate_members_xlsx(members):
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'Пайщики'
+    header_font = Font(bold=True, size=10)
+    header_fill = PatternFill(start_color='D9E1F2', end_color='D9E1F2', fill_type='solid')
+    header_align = Alignment(horizontal='center', vertical='center', wrap_text=True)
+    thin_border = Border(
+        left=Side(style='thin'), right=Side(style='thin'),
+        top=Side(style='thin'), bottom=Side(style='thin')
+    )
+    cols = [
+        ('Номер', 'member_no', 14),
+        ('Тип', 'member_type_label', 6),
+        ('Фамилия', 'last_name', 18),
+        ('Имя', 'first_name', 15),
+        ('Отчество', 'middle_name', 18),
+        ('Наименование компании', 'company_name', 30),
+        ('ИНН', 'inn', 14),
+        ('Телефон', 'phone', 18),
+        ('Email', 'email', 22),
+        ('Telegram', 'telegram', 16),
+        ('Дата рождения', 'birth_date', 14),
+        ('Место рождения', 'birth_place', 22),
+        ('Серия паспорта', 'passport_series', 10),
+        ('Номер паспорта', 'passport_number', 10),
+        ('Код подразделения', 'passport_dept_code', 12),
+        ('Дата выдачи паспорта', 'passport_issue_date', 14),
+        ('Кем выдан', 'passport_issued_by', 30),
+        ('Адрес регистрации', 'registration_address', 35),
+        ('Семейное положение', 'marital_status', 16),
+        ('ФИО супруга(и)', 'spouse_fio', 22),
+        ('Телефон супруга(и)', 'spouse_phone', 16),
+        ('Доп. телефон', 'extra_phone', 16),
+        ('Доп. контакт ФИО', 'extra_contact_fio', 22),
+        ('Руководитель ФИО', 'director_fio', 22),
+        ('Телефон руководителя', 'director_phone', 16),
+        ('Контактное лицо ФИО', 'contact_person_fio', 22),
+        ('Телефон контактного лица', 'contact_person_phone', 16),
+        ('БИК банка', 'bank_bik', 12),
+        ('Расчётный счёт', 'bank_account', 22),
+        ('Статус', 'status_label', 12),
+        ('Активные займы', 'active_loans', 10),
+        ('Активные вклады', 'active_savings', 10),
+        ('Дата регистрации', 'created_at', 16),
+    ]
+    for ci, (title, _, width) in enumerate(cols, 1):
+        cell = ws.cell(row=1, column=ci, value=title)
+        cell.font = header_font
+        cell.fill = header_fill
+        cell.alignment = header_align
+        cell.border = thin_border
+        ws.column_dimensions[chr(64 + ci) if ci <= 26 else ('A' + chr(64 + ci - 26))].width = width
+    status_map = {'active': 'Активен', 'inactive': 'Неактивен', 'deleted': 'Удалён'}
+    type_map = {'FL': 'ФЛ', 'UL': 'ЮЛ'}
+    for ri, m in enumerate(members, 2):
+        m['member_type_label'] = type_map.get(m.get('member_type', ''), m.get('member_type', ''))
+        m['status_label'] = status_map.get(m.get('status', ''), m.get('status', ''))
+        if m.get('created_at'):
+            raw = str(m['created_at'])
+            if 'T' in raw:
+                raw = raw.split('T')[0]
+            parts = raw.split('-')
+            if len(parts) == 3:
+                m['created_at'] = '%s.%s.%s' % (parts[2], parts[1], parts[0])
+        for df in ('birth_date', 'passport_issue_date'):
+            if m.get(df):
+                raw = str(m[df])
+                parts = raw.split('-')
+                if len(parts) == 3:
+                    m[df] = '%s.%s.%s' % (parts[2], parts[1], parts[0])
+        for ci, (_, key, _) in enumerate(cols, 1):
+            val = m.get(key, '')
+            if val is None:
+                val = ''
+            cell = ws.cell(row=ri, column=ci, value=val)
+            cell.border = thin_border
+            cell.alignment = Alignment(vertical='center')
+    ws.auto_filter.ref = 'A1:%s%s' % (chr(64 + len(cols)) if len(cols) <= 26 else ('A' + chr(64 + len(cols) - 26)), len(members) + 1)
+    ws.freeze_panes = 'A2'
+    from io import BytesIO
+    buf = BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+def generate_loans_list_xlsx(loans):
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
+    from openpyxl.utils import get_column_letter
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'Займы'
+    header_font = Font(bold=True, size=10)
+    header_fill = PatternFill(start_color='D9E1F2', end_color='D9E1F2', fill_type='solid')
+    header_align = Alignment(horizontal='center', vertical='center', wrap_text=True)
+    thin_border = Border(
+        left=Side(style='thin'), right=Side(style='thin'),
+        top=Side(style='thin'), bottom=Side(style='thin')
+    )
+    cols = [
+        ('№ договора', 'contract_no', 16),
+        ('Пайщик', 'member_name', 30),
+        ('Организация', 'org_short_name', 20),
+        ('Сумма займа', 'amount', 16),
+        ('Ставка, %', 'rate', 10),
+        ('Срок, мес.', 'term_months', 10),
+        ('Тип графика', 'schedule_type_label', 16),
+        ('Дата выдачи', 'start_date', 14),
+        ('Дата окончания', 'end_date', 14),
+        ('Ежемес. платёж', 'monthly_payment', 16),
+        ('Остаток долга', 'balance', 16),
+        ('Статус', 'status_label', 14),
+    ]
+    for ci, (title, _, width) in enumerate(cols, 1):
+        cell = ws.cell(row=1, column=ci, value=title)
+        cell.font = header_font
+        cell.fill = header_fill
+        cell.alignment = header_align
+        cell.border = thin_border
+        ws.column_dimensions[get_column_letter(ci)].width = width
+    status_map = {'active': 'Активен', 'overdue': 'Просрочен', 'closed': 'Закрыт', 'pending': 'Ожидает'}
+    schedule_map = {'annuity': 'Аннуитет', 'end_of_term': 'В конце срока'}
+    num_fmt = '#,##0.00'
+    for ri, row in enumerate(loans, 2):
+        row['status_label'] = status_map.get(row.get('status', ''), row.get('status', ''))
+        row['schedule_type_label'] = schedule_map.get(row.get('schedule_type', ''), row.get('schedule_type', ''))
+        if not row.get('org_short_name'):
+            row['org_short_name'] = row.get('org_name', '')
+        for df in ('start_date', 'end_date'):
+            if row.get(df):
+                raw = str(row[df])
+                parts = raw.split('-')
+                if len(parts) == 3:
+                    row[df] = '%s.%s.%s' % (parts[2], parts[1], parts[0])
+        for ci, (_, key, _) in enumerate(cols, 1):
+            val = row.get(key, '')
+            if val is None:
+                val = ''
+            cell = ws.cell(row=ri, column=ci, value=val)
+            cell.border = thin_border
+            cell.alignment = Alignment(vertical='center')
+            if key in ('amount', 'monthly_payment', 'balance') and val != '':
+                try:
+                    cell.value = float(val)
+                    cell.number_format = num_fmt
+                except (ValueError, TypeError):
+                    pass
+            if key == 'rate' and val != '':
+                try:
+                    cell.value = float(val)
+                except (ValueError, TypeError):
+                    pass
+    last_col = get_column_letter(len(cols))
+    ws.auto_filter.ref = 'A1:%s%s' % (last_col, len(loans) + 1)
+    ws.freeze_panes = 'A2'
+    from io import BytesIO
+    buf = BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+def generate_savings_list_xlsx(savings):
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
+    from openpyxl.utils import get_column_letter
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'Сбережения'
+    header_font = Font(bold=True, size=10)
+    header_fill = PatternFill(start_color='D9E1F2', end_color='D9E1F2', fill_type='solid')
+    header_align = Alignment(horizontal='center', vertical='center', wrap_text=True)
+    thin_border = Border(
+        left=Side(style='thin'), right=Side(style='thin'),
+        top=Side(style='thin'), bottom=Side(style='thin')
+    )
+    cols = [
+        ('№ договора', 'contract_no', 16),
+        ('Пайщик', 'member_name', 30),
+        ('Организация', 'org_short_name', 20),
+        ('Сумма вклада', 'amount', 16),
+        ('Ставка, %', 'rate', 10),
+        ('Срок, мес.', 'term_months', 10),
+        ('Тип выплаты', 'payout_type_label', 16),
+        ('Несниж. остаток, %', 'min_balance_pct', 14),
+        ('Дата начала', 'start_date', 14),
+        ('Дата окончания', 'end_date', 14),
+        ('Начислено %', 'accrued_interest', 16),
+        ('Выплачено %', 'paid_interest', 16),
+        ('Текущий баланс', 'current_balance', 16),
+        ('Статус', 'status_label', 14),
+    ]
+    for ci, (title, _, width) in enumerate(cols, 1):
+        cell = ws.cell(row=1, column=ci, value=title)
+        cell.font = header_font
+        cell.fill = header_fill
+        cell.alignment = header_align
+        cell.border = thin_border
+        ws.column_dimensions[get_column_letter(ci)].width = width
+    status_map = {'active': 'Активен', 'closed': 'Закрыт', 'early_closed': 'Досрочно закрыт'}
+    payout_map = {'monthly': 'Ежемесячно', 'end_of_term': 'В конце срока'}
+    num_fmt = '#,##0.00'
+    for ri, row in enumerate(savings, 2):
+        row['status_label'] = status_map.get(row.get('status', ''), row.get('status', ''))
+        row['payout_type_label'] = payout_map.get(row.get('payout_type', ''), row.get('payout_type', ''))
+        if not row.get('org_short_name'):
+            row['org_short_name'] = row.get('org_name', '')
+        for df in ('start_date', 'end_date'):
+            if row.get(df):
+                raw = str(row[df])
+                parts = raw.split('-')
+                if len(parts) == 3:
+                    row[df] = '%s.%s.%s' % (parts[2], parts[1], parts[0])
+        for ci, (_, key, _) in enumerate(cols, 1):
+            val = row.get(key, '')
+            if val is None:
+                val = ''
+            cell = ws.cell(row=ri, column=ci, value=val)
+            cell.border = thin_border
+            cell.alignment = Alignment(vertical='center')
+            if key in ('amount', 'accrued_interest', 'paid_interest', 'current_balance') and val != '':
+                try:
+                    cell.value = float(val)
+                    cell.number_format = num_fmt
+                except (ValueError, TypeError):
+                    pass
+            if key in ('rate', 'min_balance_pct') and val != '':
+                try:
+                    cell.value = float(val)
+                except (ValueError, TypeError):
+                    pass
+    last_col = get_column_letter(len(cols))
+    ws.auto_filter.ref = 'A1:%s%s' % (last_col, len(savings) + 1)
+    ws.freeze_panes = 'A2'
+    from io import BytesIO
+    buf = BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
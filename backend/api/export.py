@@ -0,0 +1,204 @@
+"""Выгрузка выписок, справок и реестров"""
+from datetime import datetime
+import base64
+from core import esc, query_one, query_rows
+from documents import generate_loan_certificate_pdf, generate_loan_closure_pdf, generate_loan_pdf, generate_loan_xlsx, generate_loans_list_xlsx, generate_members_xlsx, generate_saving_transactions_pdf, generate_saving_transactions_xlsx, generate_savings_list_xlsx, generate_savings_pdf, generate_savings_xlsx, generate_shares_pdf, generate_shares_xlsx, load_org_settings
+
+def handle_export(params, cur):
+    export_type = params.get('type', 'loan')
+    format_ = params.get('format', 'xlsx')
+    item_id = params.get('id')
+
+    if export_type == 'members':
+        rows = query_rows(cur, """
+            SELECT m.*, COALESCE(ms.active_loans, 0) as active_loans, COALESCE(ms.active_savings, 0) as active_savings
+            FROM members m LEFT JOIN member_stats ms ON ms.member_id = m.id
+            WHERE m.status != 'deleted' ORDER BY m.created_at DESC
+        """)
+        data = generate_members_xlsx(rows)
+        ct = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        fn = 'members_%s.xlsx' % datetime.now().strftime('%Y%m%d')
+        return {'file': base64.b64encode(data).decode('utf-8'), 'content_type': ct, 'filename': fn}
+
+    if export_type == 'loans_list':
+        rows = query_rows(cur, """
+            SELECT l.id, l.contract_no, l.amount, l.rate, l.term_months, l.schedule_type,
+                   l.start_date, l.end_date, l.monthly_payment, l.balance, l.status,
+                   CASE WHEN m.member_type='FL' THEN CONCAT(m.last_name,' ',m.first_name,' ',m.middle_name)
+                        ELSE m.company_name END as member_name,
+                   o.name as org_name, o.short_name as org_short_name
+            FROM loans l JOIN members m ON m.id=l.member_id
+            LEFT JOIN organizations o ON o.id=l.org_id
+            ORDER BY l.created_at DESC
+        """)
+        data = generate_loans_list_xlsx(rows)
+        ct = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        fn = 'loans_%s.xlsx' % datetime.now().strftime('%Y%m%d')
+        return {'file': base64.b64encode(data).decode('utf-8'), 'content_type': ct, 'filename': fn}
+
+    if export_type == 'savings_list':
+        rows = query_rows(cur, """
+            SELECT s.id, s.contract_no, s.amount, s.rate, s.term_months, s.payout_type,
+                   s.start_date, s.end_date, s.accrued_interest, s.paid_interest, s.current_balance,
+                   s.status, s.min_balance_pct,
+                   CASE WHEN m.member_type='FL' THEN CONCAT(m.last_name,' ',m.first_name,' ',m.middle_name)
+                        ELSE m.company_name END as member_name,
+                   o.name as org_name, o.short_name as org_short_name
+            FROM savings s JOIN members m ON m.id=s.member_id
+            LEFT JOIN organizations o ON o.id=s.org_id
+            ORDER BY s.created_at DESC
+        """)
+        data = generate_savings_list_xlsx(rows)
+        ct = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        fn = 'savings_%s.xlsx' % datetime.now().strftime('%Y%m%d')
+        return {'file': base64.b64encode(data).decode('utf-8'), 'content_type': ct, 'filename': fn}
+
+    if not item_id:
+        return None
+
+    default_org = load_org_settings(cur)
+
+    if export_type == 'loan':
+        loan = query_one(cur, "SELECT * FROM loans WHERE id = %s" % item_id)
+        if not loan:
+            return None
+        org_id = loan.get('org_id')
+        if org_id:
+            org_row = query_one(cur, "SELECT * FROM organizations WHERE id=%s" % org_id)
+            org = org_row if org_row else default_org
+        else:
+            org = default_org
+        cur.execute("SELECT CASE WHEN m.member_type='FL' THEN CONCAT(m.last_name,' ',m.first_name,' ',m.middle_name) ELSE m.company_name END FROM members m WHERE m.id=%s" % loan['member_id'])
+        nr = cur.fetchone()
+        member_name = nr[0] if nr else ''
+        schedule = query_rows(cur, "SELECT * FROM loan_schedule WHERE loan_id=%s ORDER BY payment_no" % item_id)
+        payments = query_rows(cur, "SELECT * FROM loan_payments WHERE loan_id=%s ORDER BY payment_date" % item_id)
+        if format_ == 'pdf':
+            data = generate_loan_pdf(loan, schedule, payments, member_name, org)
+            ct = 'application/pdf'
+            fn = 'loan_%s.pdf' % loan.get('contract_no', item_id)
+        else:
+            data = generate_loan_xlsx(loan, schedule, payments, member_name, org)
+            ct = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            fn = 'loan_%s.xlsx' % loan.get('contract_no', item_id)
+
+    elif export_type == 'saving':
+        saving = query_one(cur, "SELECT * FROM savings WHERE id = %s" % item_id)
+        if not saving:
+            return None
+        org_id = saving.get('org_id')
+        if org_id:
+            org_row = query_one(cur, "SELECT * FROM organizations WHERE id=%s" % org_id)
+            org = org_row if org_row else default_org
+        else:
+            org = default_org
+        cur.execute("SELECT CASE WHEN m.member_type='FL' THEN CONCAT(m.last_name,' ',m.first_name,' ',m.middle_name) ELSE m.company_name END FROM members m WHERE m.id=%s" % saving['member_id'])
+        nr = cur.fetchone()
+        member_name = nr[0] if nr else ''
+        schedule = query_rows(cur, "SELECT * FROM savings_schedule WHERE saving_id=%s ORDER BY period_no" % item_id)
+        transactions = query_rows(cur, "SELECT * FROM savings_transactions WHERE saving_id=%s ORDER BY transaction_date" % item_id)
+        if format_ == 'pdf':
+            data = generate_savings_pdf(saving, schedule, transactions, member_name, org)
+            ct = 'application/pdf'
+            fn = 'saving_%s.pdf' % saving.get('contract_no', item_id)
+        else:
+            data = generate_savings_xlsx(saving, schedule, transactions, member_name, org)
+            ct = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            fn = 'saving_%s.xlsx' % saving.get('contract_no', item_id)
+
+    elif export_type == 'saving_transactions':
+        saving = query_one(cur, "SELECT * FROM savings WHERE id = %s" % item_id)
+        if not saving:
+            return None
+        org_id = saving.get('org_id')
+        if org_id:
+            org_row = query_one(cur, "SELECT * FROM organizations WHERE id=%s" % org_id)
+            org = org_row if org_row else default_org
+        else:
+            org = default_org
+        cur.execute("SELECT CASE WHEN m.member_type='FL' THEN CONCAT(m.last_name,' ',m.first_name,' ',m.middle_name) ELSE m.company_name END FROM members m WHERE m.id=%s" % saving['member_id'])
+        nr = cur.fetchone()
+        member_name = nr[0] if nr else ''
+        transactions = query_rows(cur, "SELECT * FROM savings_transactions WHERE saving_id=%s ORDER BY transaction_date, id" % item_id)
+        if format_ == 'pdf':
+            data = generate_saving_transactions_pdf(saving, transactions, member_name, org)
+            ct = 'application/pdf'
+            fn = 'transactions_%s.pdf' % saving.get('contract_no', item_id)
+        else:
+            data = generate_saving_transactions_xlsx(saving, transactions, member_name, org)
+            ct = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            fn = 'transactions_%s.xlsx' % saving.get('contract_no', item_id)
+
+    elif export_type == 'loan_certificate':
+        date_from = params.get('date_from', '')
+        date_to = params.get('date_to', '')
+        if not date_from or not date_to:
+            return {'error': 'Не указан период'}
+        loan = query_one(cur, "SELECT * FROM loans WHERE id = %s" % item_id)
+        if not loan:
+            return None
+        org_id = loan.get('org_id')
+        if org_id:
+            org_row = query_one(cur, "SELECT * FROM organizations WHERE id=%s" % org_id)
+            org = org_row if org_row else default_org
+        else:
+            org = default_org
+        member = query_one(cur, "SELECT * FROM members WHERE id=%s" % loan['member_id'])
+        if not member:
+            return None
+        payments = query_rows(cur, "SELECT * FROM loan_payments WHERE loan_id=%s AND payment_date >= '%s' AND payment_date <= '%s' ORDER BY payment_date" % (item_id, esc(date_from), esc(date_to)))
+        total_principal = sum(float(p.get('principal_part', 0)) for p in payments)
+        total_interest = sum(float(p.get('interest_part', 0)) for p in payments)
+        total_penalty = sum(float(p.get('penalty_part', 0)) for p in payments)
+        data = generate_loan_certificate_pdf(loan, member, org, date_from, date_to, total_principal, total_interest, total_penalty)
+        ct = 'application/pdf'
+        fn = 'certificate_%s_%s_%s.pdf' % (loan.get('contract_no', item_id), date_from, date_to)
+
+    elif export_type == 'loan_closure':
+        loan = query_one(cur, "SELECT * FROM loans WHERE id = %s" % item_id)
+        if not loan:
+            return None
+        if loan.get('status') != 'closed':
+            return {'error': 'Займ не закрыт'}
+        org_id = loan.get('org_id')
+        if org_id:
+            org_row = query_one(cur, "SELECT * FROM organizations WHERE id=%s" % org_id)
+            org = org_row if org_row else default_org
+        else:
+            org = default_org
+        member = query_one(cur, "SELECT * FROM members WHERE id=%s" % loan['member_id'])
+        if not member:
+            return None
+        cur.execute("SELECT MAX(payment_date) FROM loan_payments WHERE loan_id=%s" % item_id)
+        cd_row = cur.fetchone()
+        closed_date = str(cd_row[0]) if cd_row and cd_row[0] else None
+        data = generate_loan_closure_pdf(loan, member, org, closed_date)
+        ct = 'application/pdf'
+        fn = 'closure_%s.pdf' % loan.get('contract_no', item_id)
+
+    elif export_type == 'share':
+        account = query_one(cur, "SELECT * FROM share_accounts WHERE id = %s" % item_id)
+        if not account:
+            return None
+        org_id = account.get('org_id')
+        if org_id:
+            org_row = query_one(cur, "SELECT * FROM organizations WHERE id=%s" % org_id)
+            org = org_row if org_row else default_org
+        else:
+            org = default_org
+        cur.execute("SELECT CASE WHEN m.member_type='FL' THEN CONCAT(m.last_name,' ',m.first_name,' ',m.middle_name) ELSE m.company_name END FROM members m WHERE m.id=%s" % account['member_id'])
+        nr = cur.fetchone()
+        member_name = nr[0] if nr else ''
+        transactions = query_rows(cur, "SELECT * FROM share_transactions WHERE account_id=%s ORDER BY transaction_date DESC" % item_id)
+        if format_ == 'pdf':
+            data = generate_shares_pdf(account, transactions, member_name, org)
+            ct = 'application/pdf'
+            fn = 'share_%s.pdf' % account.get('account_no', item_id)
+        else:
+            data = generate_shares_xlsx(account, transactions, member_name, org)
+            ct = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            fn = 'share_%s.xlsx' % account.get('account_no', item_id)
+    else:
+        return None
+
+    return {'file': base64.b64encode(data).decode('utf-8'), 'content_type': ct, 'filename': fn}
@@ -0,0 +1,23 @@
+"""Пакетные задания и их прогресс"""
+import json
+from core import esc, query_one, query_rows
+
+def start_batch_job(cur, conn, kind, total, staff=None):
+    """Регистрирует пакетное задание и сразу фиксирует его, чтобы прогресс был виден из других запросов"""
+    cur.execute("INSERT INTO batch_jobs (kind, status, total, started_by) VALUES ('%s', 'running', %s, %s) RETURNING id" % (
+        esc(kind), total, (staff.get('user_id') if staff else None) or 'NULL'))
+    job_id = cur.fetchone()[0]
+    conn.commit()
+    return job_id
+
+def update_batch_job(cur, job_id, processed, failed, status='running', result=None):
+    cur.execute("UPDATE batch_jobs SET processed=%s, failed=%s, status='%s', result=%s, updated_at=NOW()%s WHERE id=%s" % (
+        processed, failed, status, ("'%s'::jsonb" % esc(json.dumps(result, ensure_ascii=False))) if result is not None else 'result',
+        ', finished_at=NOW()' if status != 'running' else '', job_id))
+
+def handle_jobs(params, cur):
+    job_id = params.get('id')
+    if job_id:
+        return query_one(cur, "SELECT * FROM batch_jobs WHERE id=%s" % int(job_id))
+    where = "WHERE kind='%s'" % esc(params['kind']) if params.get('kind') else ''
+    return query_rows(cur, "SELECT id, kind, status, total, processed, failed, started_by, started_at, updated_at, finished_at FROM batch_jobs %s ORDER BY started_at DESC LIMIT 20" % where)
@@ -0,0 +1,1013 @@
+"""Займы: выдача, графики, платежи, реструктуризация и сверка"""
+import json
+from datetime import date
+from decimal import Decimal
+from core import add_months, audit_log, esc, execute_prepared, map_parallel, mark_member_stats, query_json, query_one, query_rows, safe_float, safe_int
+from schedules import calc_annuity_schedule, calc_end_of_term_schedule, drop_loan_snapshots, load_loan_inputs, recalc_loan_schedule_statuses, reconcile_loan, refresh_loan_overdue_status
+from jobs import start_batch_job, update_batch_job
+
+SIMULATION_MAX_SCENARIOS = 200
+REPAYMENT_STRATEGIES = ('reduce_term', 'reduce_payment')
+
+def simulation_params(params):
+    """Разбирает сетку сценариев: amounts, dates, strategies через запятую; возвращает (amounts, dates, strategies) или строку с ошибкой"""
+    try:
+        amounts = [Decimal(a.strip()) for a in (params.get('amounts') or '').split(',') if a.strip()]
+        dates = [date.fromisoformat(d.strip()) for d in (params.get('dates') or date.today().isoformat()).split(',') if d.strip()]
+    except (ValueError, ArithmeticError):
+        return 'Некорректные суммы или даты сценариев'
+    strategies = [s.strip() for s in (params.get('strategies') or ','.join(REPAYMENT_STRATEGIES)).split(',') if s.strip()]
+    if not amounts or not dates or any(not a.is_finite() or a <= 0 for a in amounts):
+        return 'Укажите положительные суммы досрочного погашения'
+    for s in strategies:
+        if s not in REPAYMENT_STRATEGIES:
+            return 'Неизвестная стратегия: %s' % s
+    if len(amounts) * len(dates) * len(strategies) > SIMULATION_MAX_SCENARIOS:
+        return 'Не более %d сценариев за запрос' % SIMULATION_MAX_SCENARIOS
+    return amounts, dates, strategies
+
+def annuity_term_candidates(balances, rate, max_term, limit):
+    """Для каждого остатка — наименьший срок 1..max_term, при котором аннуитет не выше limit (0 — такого нет).
+    Все остатки и сроки считаются одной матрицей NumPy в float; результат затем сверяется точным расчётом"""
+    import numpy as np
+
+    t = np.arange(1, max_term + 1, dtype=np.float64)
+    p = np.asarray(balances, dtype=np.float64)[:, None]
+    i = rate / 1200.0
+    if i > 0:
+        g = (1 + i) ** t
+        pay = p * i * g / (g - 1)
+    else:
+        pay = p / t
+    ok = np.round(pay, 2) <= limit
+    return [int(c) for c in np.where(ok.any(axis=1), ok.argmax(axis=1) + 1, 0)]
+
+def reduce_term_by_search(fn, balance, rate, remaining, start, limit):
+    """Подбор срока как в early_repayment: первый срок с платежом не выше limit, иначе на период короче"""
+    best_term = remaining
+    for t in range(1, remaining + 1):
+        _, m = fn(balance, rate, t, start)
+        if m <= limit:
+            best_term = t
+            break
+    return best_term
+
+def simulate_repayment(cur, params):
+    """Сценарии досрочного погашения (сумма × дата × стратегия) по правилам early_repayment — только чтение, без записи в БД.
+    Займ и открытые строки графика читаются один раз; для reduce_term срок аннуитета подбирается сразу
+    по всем суммам через NumPy, графики и итоги — точным calc_annuity_schedule / calc_end_of_term_schedule"""
+    parsed = simulation_params(params)
+    if isinstance(parsed, str):
+        return {'error': parsed}
+    amounts, dates, strategies = parsed
+    lid = int(params['id'])
+    with_schedules = params.get('schedules') != '0'
+
+    cur.execute("SELECT balance, rate, schedule_type, monthly_payment, status FROM loans WHERE id=%s" % lid)
+    lr = cur.fetchone()
+    if not lr:
+        return None
+    if lr[4] == 'closed':
+        return {'error': 'Займ уже закрыт'}
+    cb, r, st = Decimal(str(lr[0])), float(lr[1]), lr[2]
+    old_monthly = float(lr[3]) if lr[3] else 0
+    cur.execute("SELECT COUNT(*), COALESCE(SUM(interest_amount), 0) FROM loan_schedule WHERE loan_id=%s AND status IN ('pending','partial','overdue')" % lid)
+    remaining_periods, remaining_interest = cur.fetchone()
+    remaining_interest = float(remaining_interest)
+
+    fn = calc_annuity_schedule if st == 'annuity' else calc_end_of_term_schedule
+    limit = old_monthly * 1.1
+    # Срок reduce_term для каждой суммы; у аннуитета он не зависит от даты, у графика «в конце срока» — ищется перебором
+    terms = {}
+    partial = sorted({a for a in amounts if a < cb})
+    if 'reduce_term' in strategies and old_monthly > 0 and remaining_periods > 0 and partial:
+        if st == 'annuity':
+            candidates = annuity_term_candidates([float(cb - a) for a in partial], r, remaining_periods, limit)
+            for a, c in zip(partial, candidates):
+                nb = float(cb - a)
+                if c:
+                    while c > 1 and fn(nb, r, c - 1, dates[0])[1] <= limit:
+                        c -= 1
+                    while c and fn(nb, r, c, dates[0])[1] > limit:
+                        c = c + 1 if c < remaining_periods else 0
+                best_term = c or remaining_periods
+                if best_term >= remaining_periods:
+                    best_term = max(remaining_periods - 1, 1)
+                terms[a] = max(best_term, 1)
+
+    scenarios = []
+    for a in amounts:
+        nb = cb - a
+        for d in dates:
+            for strategy in strategies:
+                item = {'amount': float(a), 'payment_date': d.isoformat(), 'strategy': strategy}
+                if nb <= 0:
+                    item.update({'closes_loan': True, 'new_balance': 0, 'new_term': 0, 'new_monthly': 0, 'end_date': d.isoformat(),
+                                 'total_interest': 0, 'total_payments': float(cb), 'interest_saved': round(remaining_interest, 2)})
+                    if with_schedules:
+                        item['schedule'] = []
+                    scenarios.append(item)
+                    continue
+                if strategy == 'reduce_payment' or old_monthly <= 0:
+                    nt = max(remaining_periods, 1)
+                elif a in terms:
+                    nt = terms[a]
+                else:
+                    best_term = reduce_term_by_search(fn, float(nb), r, remaining_periods, d, limit)
+                    if best_term >= remaining_periods:
+                        best_term = max(remaining_periods - 1, 1)
+                    nt = max(best_term, 1)
+                ns, nm = fn(float(nb), r, nt, d)
+                total_interest = sum(Decimal(str(x['interest_amount'])) for x in ns)
+                total_paid = sum(Decimal(str(x['payment_amount'])) for x in ns)
+                item.update({'closes_loan': False, 'new_balance': float(nb), 'new_term': len(ns), 'new_monthly': nm, 'end_date': ns[-1]['payment_date'],
+                             'total_interest': float(total_interest), 'total_payments': float(total_paid + a),
+                             'interest_saved': round(remaining_interest - float(total_interest), 2)})
+                if with_schedules:
+                    item['schedule'] = ns
+                scenarios.append(item)
+
+    return {'loan_id': lid, 'balance': float(cb), 'rate': r, 'schedule_type': st, 'monthly_payment': old_monthly,
+            'remaining_periods': remaining_periods, 'remaining_interest': remaining_interest, 'scenarios': scenarios}
+
+def handle_loans(method, params, body, cur, conn, staff=None, ip=''):
+    if method == 'GET':
+        action = params.get('action', 'list')
+        if action == 'detail':
+            raw = query_json(cur, """
+                SELECT (to_jsonb(l)
+                    || jsonb_build_object(
+                        'member_name', COALESCE((SELECT CASE WHEN m.member_type='FL' THEN CONCAT(m.last_name,' ',m.first_name,' ',m.middle_name) ELSE m.company_name END FROM members m WHERE m.id=l.member_id), ''),
+                        'schedule', COALESCE((SELECT jsonb_agg(to_jsonb(ls) ORDER BY ls.payment_no) FROM loan_schedule ls WHERE ls.loan_id=l.id), '[]'::jsonb),
+                        'payments', COALESCE((SELECT jsonb_agg(to_jsonb(lp) ORDER BY lp.payment_date) FROM loan_payments lp WHERE lp.loan_id=l.id), '[]'::jsonb))
+                    || CASE WHEN l.org_id IS NOT NULL THEN jsonb_build_object('org_name', COALESCE(o.name, ''), 'org_short_name', COALESCE(o.short_name, '')) ELSE '{}'::jsonb END
+                )::text
+                FROM loans l LEFT JOIN organizations o ON o.id = l.org_id
+                WHERE l.id = %s
+            """ % int(params['id']))
+            return {'_raw_json': raw} if raw else None
+        elif action == 'check_status':
+            loan_number = params.get('loan_number')
+            if not loan_number:
+                return {'error': 'Не указан номер договора'}
+            cur.execute("SELECT id FROM loans WHERE contract_no = '%s'" % esc(loan_number))
+            lr = cur.fetchone()
+            if not lr:
+                return {'error': 'Договор не найден'}
+            lid = lr[0]
+            
+            cur.execute("SELECT payment_no, payment_date, principal_amount, interest_amount, penalty_amount, COALESCE(paid_amount,0) as paid_amount, status, paid_date FROM loan_schedule WHERE loan_id=%s ORDER BY payment_no" % lid)
+            schedule = [{'payment_no': r[0], 'payment_date': str(r[1]), 'principal': float(r[2]), 'interest': float(r[3]), 'penalty': float(r[4]), 'paid_amount': float(r[5]), 'status': r[6], 'paid_date': str(r[7]) if r[7] else None} for r in cur.fetchall()]
+            
+            cur.execute("SELECT payment_date, amount, principal_part, interest_part, penalty_part FROM loan_payments WHERE loan_id=%s ORDER BY payment_date" % lid)
+            payments = [{'payment_date': str(r[0]), 'amount': float(r[1]), 'principal': float(r[2]), 'interest': float(r[3]), 'penalty': float(r[4])} for r in cur.fetchall()]
+            
+            total_paid_from_schedule = sum(s['paid_amount'] for s in schedule)
+            total_paid_from_payments = sum(p['amount'] for p in payments)
+            
+            last_paid = [s for s in schedule if s['status'] == 'paid']
+            last_paid_period = last_paid[-1]['payment_date'] if last_paid else None
+            
+            return {
+                'loan_id': lid,
+                'loan_number': loan_number,
+                'schedule': schedule,
+                'payments': payments,
+                'total_paid_from_schedule': total_paid_from_schedule,
+                'total_paid_from_payments': total_paid_from_payments,
+                'last_paid_period': last_paid_period,
+                'stats': {
+                    'paid': len([s for s in schedule if s['status'] == 'paid']),
+                    'partial': len([s for s in schedule if s['status'] == 'partial']),
+                    'pending': len([s for s in schedule if s['status'] == 'pending']),
+                    'overdue': len([s for s in schedule if s['status'] == 'overdue'])
+                }
+            }
+        elif action == 'reconciliation_report':
+            lid = params.get('id')
+            if not lid:
+                return {'error': 'Не указан id договора'}
+            loan = query_one(cur, "SELECT * FROM loans WHERE id=%s" % lid)
+            if not loan:
+                return {'error': 'Договор не найден'}
+            cur.execute("SELECT CASE WHEN m.member_type='FL' THEN CONCAT(m.last_name,' ',m.first_name,' ',m.middle_name) ELSE m.company_name END FROM members m WHERE m.id=%s" % loan['member_id'])
+            nr = cur.fetchone()
+            loan['member_name'] = nr[0] if nr else ''
+
+            # Отчёт читает данные напрямую из БД без собственных расчётов.
+            # Каждый период получает платёж через payment_id (проставляется при внесении платежа и recalc).
+            cur.execute("""
+                SELECT ls.id, ls.payment_no, ls.payment_date, ls.payment_amount,
+                       ls.principal_amount, ls.interest_amount,
+                       COALESCE(ls.penalty_amount,0) as penalty_amount,
+                       COALESCE(ls.paid_amount,0) as paid_amount,
+                       ls.status, ls.paid_date, ls.payment_id,
+                       lp.amount as pay_amount,
+                       lp.principal_part, lp.interest_part,
+                       COALESCE(lp.penalty_part,0) as penalty_part,
+                       lp.payment_type, lp.payment_date as pay_fact_date
+                FROM loan_schedule ls
+                LEFT JOIN loan_payments lp ON lp.id = ls.payment_id
+                WHERE ls.loan_id=%s
+                ORDER BY ls.payment_no, ls.id
+            """ % lid)
+            schedule_rows = cur.fetchall()
+
+            cur.execute("SELECT COALESCE(SUM(amount),0) FROM loan_payments WHERE loan_id=%s" % lid)
+            total_paid_row = cur.fetchone()
+
+            schedule_list = []
+            for r in schedule_rows:
+                (sch_id, pno, pdate, pamt, princ, inter, penal, paid, status, paid_date,
+                 pay_id, pay_amt, pay_pp, pay_ip, pay_pnp, pay_type, pay_fact_date) = r
+                plan_total = float(Decimal(str(princ)) + Decimal(str(inter)) + Decimal(str(penal)))
+                payments = []
+                if pay_id and paid > 0:
+                    payments.append({
+                        'payment_id': pay_id,
+                        'fact_date': str(pay_fact_date) if pay_fact_date else str(paid_date),
+                        'amount': float(paid),
+                        'fact_amount': float(pay_amt) if pay_amt else float(paid),
+                        'principal': float(pay_pp) if pay_pp else 0.0,
+                        'interest': float(pay_ip) if pay_ip else 0.0,
+                        'penalty': float(pay_pnp) if pay_pnp else 0.0,
+                        'payment_type': pay_type or 'regular',
+                    })
+                schedule_list.append({
+                    'id': sch_id,
+                    'payment_no': pno,
+                    'plan_date': str(pdate),
+                    'plan_amount': float(pamt),
+                    'plan_principal': float(princ),
+                    'plan_interest': float(inter),
+                    'plan_penalty': float(penal),
+                    'plan_total': round(plan_total, 2),
+                    'paid_amount': float(paid),
+                    'status': status,
+                    'paid_date': str(paid_date) if paid_date else None,
+                    'payments': payments,
+                })
+
+            total_plan = sum(s['plan_total'] for s in schedule_list)
+            total_paid = float(total_paid_row[0]) if total_paid_row else 0.0
+            total_overdue = sum(s['plan_total'] - s['paid_amount'] for s in schedule_list if s['status'] in ('overdue', 'partial') and s['plan_date'] < date.today().isoformat())
+
+            return {
+                'loan': {
+                    'id': loan['id'],
+                    'contract_no': loan['contract_no'],
+                    'member_name': loan['member_name'],
+                    'amount': float(loan['amount']),
+                    'rate': float(loan['rate']),
+                    'term_months': loan['term_months'],
+                    'start_date': str(loan['start_date']),
+                    'end_date': str(loan['end_date']),
+                    'status': loan['status'],
+                    'balance': float(loan['balance']),
+                },
+                'schedule': schedule_list,
+                'summary': {
+                    'total_plan': round(total_plan, 2),
+                    'total_paid': round(total_paid, 2),
+                    'total_diff': round(total_plan - total_paid, 2),
+                    'total_overdue': round(total_overdue, 2),
+                    'periods_total': len(schedule_list),
+                    'periods_paid': len([s for s in schedule_list if s['status'] == 'paid']),
+                    'periods_partial': len([s for s in schedule_list if s['status'] == 'partial']),
+                    'periods_overdue': len([s for s in schedule_list if s['status'] == 'overdue']),
+                    'periods_pending': len([s for s in schedule_list if s['status'] == 'pending']),
+                }
+            }
+        elif action == 'simulate_repayment':
+            return simulate_repayment(cur, params)
+        elif action == 'schedule':
+            a, r, t = safe_float(params['amount'], 'сумма'), safe_float(params['rate'], 'ставка'), safe_int(params['term'], 'срок')
+            st = params.get('schedule_type', 'annuity')
+            sd = date.fromisoformat(params.get('start_date', date.today().isoformat()))
+            fn = calc_annuity_schedule if st == 'annuity' else calc_end_of_term_schedule
+            schedule, monthly = fn(a, r, t, sd)
+            return {'schedule': schedule, 'monthly_payment': monthly}
+        else:
+            return query_rows(cur, """
+                SELECT l.id, l.contract_no, l.amount, l.rate, l.term_months, l.schedule_type,
+                       l.start_date, l.end_date, l.monthly_payment, l.balance, l.status,
+                       l.org_id,
+                       CASE WHEN m.member_type='FL' THEN CONCAT(m.last_name,' ',m.first_name,' ',m.middle_name)
+                            ELSE m.company_name END as member_name, m.id as member_id,
+                       o.name as org_name, o.short_name as org_short_name
+                FROM loans l JOIN members m ON m.id=l.member_id
+                LEFT JOIN organizations o ON o.id=l.org_id
+                ORDER BY l.created_at DESC
+            """)
+
+    elif method == 'POST':
+        action = body.get('action', 'create')
+        mark_member_stats(cur, 'loans', body.get('loan_id'))
+        if action == 'create':
+            cn = body['contract_no']
+            mid = int(body['member_id'])
+            a, r, t = safe_float(body['amount'], 'сумма'), safe_float(body['rate'], 'ставка'), safe_int(body['term_months'], 'срок')
+            st = body.get('schedule_type', 'annuity')
+            sd = date.fromisoformat(body.get('start_date', date.today().isoformat()))
+            ed = add_months(sd, t)
+            fn = calc_annuity_schedule if st == 'annuity' else calc_end_of_term_schedule
+            schedule, monthly = fn(a, r, t, sd)
+            org_id = body.get('org_id')
+
+            cur.execute("""
+                INSERT INTO loans (contract_no, member_id, amount, rate, term_months, schedule_type,
+                    start_date, end_date, monthly_payment, balance, status, org_id)
+                VALUES ('%s', %s, %s, %s, %s, '%s', '%s', '%s', %s, %s, 'active', %s) RETURNING id
+            """ % (esc(cn), mid, a, r, t, st, sd.isoformat(), ed.isoformat(), monthly, a, org_id if org_id else 'NULL'))
+            lid = cur.fetchone()[0]
+            mark_member_stats(cur, 'members', mid)
+            for item in schedule:
+                cur.execute("""
+                    INSERT INTO loan_schedule (loan_id, payment_no, payment_date, payment_amount,
+                        principal_amount, interest_amount, balance_after)
+                    VALUES (%s, %s, '%s', %s, %s, %s, %s)
+                """ % (lid, item['payment_no'], item['payment_date'], item['payment_amount'],
+                       item['principal_amount'], item['interest_amount'], item['balance_after']))
+            audit_log(cur, staff, 'create', 'loan', lid, cn, 'Сумма: %s, ставка: %s%%, срок: %s мес.' % (a, r, t), ip)
+            conn.commit()
+            return {'id': lid, 'schedule': schedule, 'monthly_payment': monthly}
+
+        elif action == 'payment':
+            lid = int(body['loan_id'])
+            pd = body['payment_date']
+            amt = Decimal(str(safe_float(body['amount'], 'сумма')))
+            overpay_strategy = body.get('overpay_strategy', '')
+
+            cur.execute("SELECT balance, rate, schedule_type, term_months, monthly_payment, start_date FROM loans WHERE id = %s" % lid)
+            loan_row = cur.fetchone()
+            loan_bal = Decimal(str(loan_row[0]))
+            l_rate, l_stype = float(loan_row[1]), loan_row[2]
+            old_monthly = Decimal(str(loan_row[4]))
+            loan_start = loan_row[5]
+
+            execute_prepared(cur, 'loan_first_open_row', lid)
+            first_row = cur.fetchone()
+            
+            execute_prepared(cur, 'loan_overdue_total', lid)
+            total_overdue = Decimal(str(cur.fetchone()[0]))
+            
+            if first_row:
+                f_sid = first_row[0]
+                f_sp = Decimal(str(first_row[1]))
+                f_si = Decimal(str(first_row[2]))
+                f_spn = Decimal(str(first_row[3]))
+                f_spa = Decimal(str(first_row[4]))
+                f_pay_date = first_row[5]
+                f_pay_no = first_row[6]
+                first_payment_owed = f_sp + f_si + f_spn - f_spa
+                current_owed = max(total_overdue, first_payment_owed)
+            else:
+                current_owed = loan_bal
+                f_pay_date = date.fromisoformat(pd)
+                f_pay_no = 0
+
+            overpay_amount = amt - current_owed if amt > current_owed else Decimal('0')
+            overpay_threshold = old_monthly * Decimal('0.5')
+            is_significant_overpay = overpay_amount > overpay_threshold and amt < loan_bal and total_overdue == 0
+
+            if is_significant_overpay and not overpay_strategy:
+                need_i = f_si - min(f_spa, f_si)
+                need_pn = f_spn - (min(f_spa - f_si, f_spn) if f_spa > f_si else Decimal('0'))
+                total_principal = amt - need_i - need_pn
+                if total_principal < 0:
+                    total_principal = Decimal('0')
+                new_bal_est = loan_bal - total_principal
+                if new_bal_est < 0:
+                    new_bal_est = Decimal('0')
+                cur.execute("SELECT COUNT(*) FROM loan_schedule WHERE loan_id=%s AND status IN ('pending','partial','overdue')" % lid)
+                remaining_periods = cur.fetchone()[0]
+                remaining_after = remaining_periods - 1
+                f_pay_date_parsed = date.fromisoformat(str(f_pay_date)) if isinstance(f_pay_date, str) else f_pay_date
+                options = {}
+                if remaining_after >= 1 and float(new_bal_est) > 0:
+                    fn = calc_annuity_schedule if l_stype == 'annuity' else calc_end_of_term_schedule
+                    sched_rp, monthly_rp = fn(float(new_bal_est), l_rate, remaining_after, f_pay_date_parsed)
+                    options['reduce_payment'] = {'new_monthly': monthly_rp, 'new_term': remaining_after, 'description': 'Уменьшить ежемесячный платёж, срок останется прежним'}
+                    best_term = remaining_after
+                    for t in range(1, remaining_after + 1):
+                        _, m = fn(float(new_bal_est), l_rate, t, f_pay_date_parsed)
+                        if m <= float(old_monthly) * 1.1:
+                            best_term = t
+                            break
+                    if best_term >= remaining_after:
+                        best_term = max(remaining_after - 1, 1)
+                    sched_rt, monthly_rt = fn(float(new_bal_est), l_rate, max(best_term, 1), f_pay_date_parsed)
+                    options['reduce_term'] = {'new_monthly': monthly_rt, 'new_term': best_term, 'description': 'Сократить срок, платёж останется примерно прежним'}
+                return {
+                    'needs_choice': True,
+                    'overpay_amount': float(overpay_amount),
+                    'current_payment': float(current_owed),
+                    'total_amount': float(amt),
+                    'options': options,
+                }
+
+            pp = i_p = pnp = Decimal('0')
+            remaining_amt = amt
+
+            if first_row:
+                cur.execute("""
+                    SELECT id, principal_amount, interest_amount, penalty_amount, paid_amount, payment_date
+                    FROM loan_schedule WHERE loan_id=%s AND status IN ('pending','partial','overdue')
+                    ORDER BY payment_no, id
+                """ % lid)
+                unpaid_rows = cur.fetchall()
+
+                covered_one_future = False
+                row_updates = []
+                for row in unpaid_rows:
+                    if remaining_amt <= Decimal('0.005'):
+                        break
+                    sid = row[0]
+                    sp = Decimal(str(row[1]))
+                    si = Decimal(str(row[2]))
+                    spn = Decimal(str(row[3]))
+                    spa = Decimal(str(row[4]))
+                    sch_date = str(row[5])
+
+                    is_future = sch_date > pd
+                    if is_future and covered_one_future:
+                        break
+                    need_total_for_row = sp + si + spn - spa
+                    if is_future and remaining_amt < need_total_for_row:
+                        break
+
+                    already_i = min(spa, si)
+                    already_pn = min(spa - si, spn) if spa > si else Decimal('0')
+                    already_pp = spa - already_i - already_pn if spa > already_i + already_pn else Decimal('0')
+                    
+                    need_i = si - already_i
+                    need_pn = spn - already_pn
+                    need_pp = sp - already_pp
+                    need_total = need_i + need_pn + need_pp
+
+                    if need_total <= Decimal('0.005'):
+                        if is_future:
+                            covered_one_future = True
+                        continue
+
+                    take_total = min(remaining_amt, need_total)
+                    item_i = min(take_total, need_i)
+                    after_i = take_total - item_i
+                    item_pn = min(after_i, need_pn)
+                    item_pp = after_i - item_pn
+                    remaining_amt -= take_total
+                    
+                    i_p += item_i
+                    pnp += item_pn
+                    pp += item_pp
+                    
+                    total_item = sp + si + spn
+                    new_paid = spa + item_i + item_pn + item_pp
+                    ns = 'paid' if new_paid >= total_item else 'partial'
+                    row_updates.append("(%s, %s, '%s')" % (sid, float(new_paid), ns))
+
+                    if is_future:
+                        covered_one_future = True
+
+                if row_updates:
+                    cur.execute("""
+                        UPDATE loan_schedule ls SET paid_amount=v.paid_amount, paid_date='%s', status=v.status
+                        FROM (VALUES %s) AS v(id, paid_amount, status) WHERE ls.id=v.id
+                    """ % (pd, ','.join(row_updates)))
+
+                if remaining_amt > Decimal('0.005'):
+                    pp += remaining_amt
+                    remaining_amt = Decimal('0')
+            else:
+                pp = min(amt, loan_bal)
+
+            cur.execute("""
+                INSERT INTO loan_payments (loan_id, payment_date, amount, principal_part, interest_part, penalty_part, payment_type)
+                VALUES (%s, '%s', %s, %s, %s, %s, 'regular') RETURNING id
+            """ % (lid, pd, float(amt), float(pp), float(i_p), float(pnp)))
+            new_pay_id = cur.fetchone()[0]
+            drop_loan_snapshots(cur, lid, (pd, new_pay_id))
+            # Проставляем payment_id во все периоды, закрытые этим платежом
+            cur.execute("UPDATE loan_schedule SET payment_id=%s WHERE loan_id=%s AND paid_date='%s' AND payment_id IS NULL AND status IN ('paid','partial')" % (new_pay_id, lid, pd))
+
+            nb = loan_bal - pp
+            if nb < 0: nb = Decimal('0')
+            cur.execute("UPDATE loans SET balance=%s, updated_at=NOW() WHERE id=%s" % (float(nb), lid))
+            if nb == 0:
+                cur.execute("UPDATE loans SET status='closed', updated_at=NOW() WHERE id=%s" % lid)
+
+            recalc_schedule = None
+            auto_recalculated = False
+
+            # Пересчёт нужен если была любая переплата (pp > плановый ОД периода)
+            actual_overpay = pp - (f_sp - f_spa if first_row else Decimal('0')) if first_row else Decimal('0')
+            if actual_overpay < 0:
+                actual_overpay = Decimal('0')
+            should_recalc = nb > 0 and (overpay_amount > 0 or actual_overpay > Decimal('0.005'))
+
+            if should_recalc:
+                cur.execute("SELECT COUNT(*) FROM loan_schedule WHERE loan_id=%s AND status IN ('pending','partial','overdue')" % lid)
+                remaining_periods = cur.fetchone()[0]
+                if remaining_periods > 0:
+                    # Берём дату последнего оплаченного периода как базу для пересчёта
+                    cur.execute("""
+                        SELECT payment_date FROM loan_schedule
+                        WHERE loan_id=%s AND status='paid'
+                        ORDER BY payment_no DESC LIMIT 1
+                    """ % lid)
+                    last_paid_row = cur.fetchone()
+                    if last_paid_row:
+                        last_paid_date = last_paid_row[0] if isinstance(last_paid_row[0], date) else date.fromisoformat(str(last_paid_row[0]))
+                    else:
+                        last_paid_date = date.fromisoformat(pd)
+                    cur.execute("DELETE FROM loan_schedule WHERE loan_id=%s AND status IN ('pending','partial','overdue')" % lid)
+                    fn = calc_annuity_schedule if l_stype == 'annuity' else calc_end_of_term_schedule
+
+                    if is_significant_overpay and overpay_strategy == 'reduce_term':
+                        best_term = remaining_periods
+                        for t in range(1, remaining_periods + 1):
+                            _, m = fn(float(nb), l_rate, t, last_paid_date)
+                            if m <= float(old_monthly) * 1.1:
+                                best_term = t
+                                break
+                        if best_term >= remaining_periods:
+                            best_term = max(remaining_periods - 1, 1)
+                        new_sched, new_monthly = fn(float(nb), l_rate, max(best_term, 1), last_paid_date)
+                    else:
+                        new_sched, new_monthly = fn(float(nb), l_rate, remaining_periods, last_paid_date)
+                        if not is_significant_overpay:
+                            auto_recalculated = True
+
+                    cur.execute("SELECT MAX(payment_no) FROM loan_schedule WHERE loan_id=%s" % lid)
+                    max_no_row = cur.fetchone()
+                    max_no = max_no_row[0] if max_no_row and max_no_row[0] else 0
+                    cur.execute("INSERT INTO loan_schedule (loan_id,payment_no,payment_date,payment_amount,principal_amount,interest_amount,balance_after) VALUES %s" % ','.join(
+                        "(%s,%s,'%s',%s,%s,%s,%s)" % (lid, max_no + item['payment_no'], item['payment_date'], item['payment_amount'], item['principal_amount'], item['interest_amount'], item['balance_after'])
+                        for item in new_sched))
+                    ne = date.fromisoformat(new_sched[-1]['payment_date'])
+                    new_term = max_no + len(new_sched)
+                    cur.execute("UPDATE loans SET monthly_payment=%s, end_date='%s', term_months=%s, updated_at=NOW() WHERE id=%s" % (new_monthly, ne.isoformat(), new_term, lid))
+                    recalc_schedule = new_sched
+
+            if nb > 0:
+                refresh_loan_overdue_status(cur, lid)
+
+            pay_detail = 'Сумма: %s, ОД: %s, %%: %s' % (float(amt), float(pp), float(i_p))
+            if recalc_schedule:
+                pay_detail += ', график пересчитан (%s)' % (overpay_strategy if overpay_strategy else 'авто')
+            audit_log(cur, staff, 'payment', 'loan', lid, '', pay_detail, ip)
+            conn.commit()
+            result = {'success': True, 'new_balance': float(nb), 'principal_part': float(pp), 'interest_part': float(i_p), 'penalty_part': float(pnp)}
+            if recalc_schedule:
+                result['schedule_recalculated'] = True
+                result['new_monthly'] = new_monthly
+            if auto_recalculated:
+                result['auto_recalculated'] = True
+            return result
+
+        elif action == 'early_repayment':
+            lid = int(body['loan_id'])
+            amt = safe_float(body['amount'], 'сумма')
+            rt = body.get('repayment_type', 'reduce_term')
+            pd = body.get('payment_date', date.today().isoformat())
+
+            cur.execute("SELECT amount, rate, balance, term_months, start_date, schedule_type, monthly_payment FROM loans WHERE id=%s" % lid)
+            lr = cur.fetchone()
+            cb, r, st = float(lr[2]), float(lr[1]), lr[5]
+            old_monthly = float(lr[6]) if lr[6] else 0
+            nb = cb - amt
+
+            if nb <= 0:
+                cur.execute("UPDATE loans SET balance=0, status='closed', updated_at=NOW() WHERE id=%s" % lid)
+                cur.execute("UPDATE loan_schedule SET status='paid' WHERE loan_id=%s AND status IN ('pending','partial','overdue')" % lid)
+                cur.execute("INSERT INTO loan_payments (loan_id, payment_date, amount, principal_part, payment_type) VALUES (%s,'%s',%s,%s,'early_full') RETURNING id" % (lid, pd, amt, cb))
+                drop_loan_snapshots(cur, lid, (pd, cur.fetchone()[0]))
+                audit_log(cur, staff, 'early_repayment', 'loan', lid, '', 'Полное досрочное погашение: %s' % amt, ip)
+                conn.commit()
+                return {'success': True, 'new_balance': 0, 'status': 'closed'}
+
+            cur.execute("SELECT COUNT(*) FROM loan_schedule WHERE loan_id=%s AND status IN ('pending','partial','overdue')" % lid)
+            remaining_periods = cur.fetchone()[0]
+            cur.execute("DELETE FROM loan_schedule WHERE loan_id=%s AND status IN ('pending','partial','overdue')" % lid)
+            cur.execute("SELECT COUNT(*) FROM loan_schedule WHERE loan_id=%s AND status='paid'" % lid)
+            paid_count = cur.fetchone()[0]
+
+            fn = calc_annuity_schedule if st == 'annuity' else calc_end_of_term_schedule
+
+            if rt == 'reduce_payment':
+                nt = max(remaining_periods, 1)
+            else:
+                if old_monthly > 0:
+                    best_term = remaining_periods
+                    for t in range(1, remaining_periods + 1):
+                        _, m = fn(nb, r, t, date.fromisoformat(pd))
+                        if m <= old_monthly * 1.1:
+                            best_term = t
+                            break
+                    if best_term >= remaining_periods:
+                        best_term = max(remaining_periods - 1, 1)
+                    nt = max(best_term, 1)
+                else:
+                    nt = max(remaining_periods, 1)
+
+            ns, nm = fn(nb, r, nt, date.fromisoformat(pd))
+            for item in ns:
+                cur.execute("INSERT INTO loan_schedule (loan_id,payment_no,payment_date,payment_amount,principal_amount,interest_amount,balance_after) VALUES (%s,%s,'%s',%s,%s,%s,%s)" % (lid, paid_count + item['payment_no'], item['payment_date'], item['payment_amount'], item['principal_amount'], item['interest_amount'], item['balance_after']))
+
+            ne = date.fromisoformat(ns[-1]['payment_date'])
+            total_term = paid_count + len(ns)
+            cur.execute("UPDATE loans SET balance=%s, monthly_payment=%s, end_date='%s', term_months=%s, updated_at=NOW() WHERE id=%s" % (nb, nm, ne.isoformat(), total_term, lid))
+            cur.execute("INSERT INTO loan_payments (loan_id,payment_date,amount,principal_part,payment_type) VALUES (%s,'%s',%s,%s,'early_partial') RETURNING id" % (lid, pd, amt, amt))
+            drop_loan_snapshots(cur, lid, (pd, cur.fetchone()[0]))
+            refresh_loan_overdue_status(cur, lid)
+            audit_log(cur, staff, 'early_repayment', 'loan', lid, '', 'Частичное: %s, тип: %s' % (amt, rt), ip)
+            conn.commit()
+            return {'success': True, 'new_balance': nb, 'new_schedule': ns, 'new_monthly': nm}
+
+        elif action == 'update_payment':
+            pid = int(body['payment_id'])
+            cur.execute("SELECT loan_id, amount, principal_part, interest_part, penalty_part, payment_date FROM loan_payments WHERE id=%s" % pid)
+            old = cur.fetchone()
+            if not old:
+                return {'error': 'Платёж не найден'}
+            lid = old[0]
+            mark_member_stats(cur, 'loans', lid)
+            old_principal = Decimal(str(old[2]))
+            new_date = body.get('payment_date', str(old[5]))
+            new_amount = Decimal(str(body.get('amount', float(old[1]))))
+            new_pp = Decimal(str(body.get('principal_part', float(old[2]))))
+            new_ip = Decimal(str(body.get('interest_part', float(old[3]))))
+            new_pnp = Decimal(str(body.get('penalty_part', float(old[4]))))
+            manual = bool(body.get('manual_distribution', False))
+            cur.execute("UPDATE loan_payments SET payment_date='%s', amount=%s, principal_part=%s, interest_part=%s, penalty_part=%s, manual_distribution=%s WHERE id=%s" % (
+                new_date, float(new_amount), float(new_pp), float(new_ip), float(new_pnp), manual, pid))
+            recalc_loan_schedule_statuses(cur, lid, since=(min(old[5], date.fromisoformat(str(new_date))), pid))
+            audit_log(cur, staff, 'update_payment', 'loan', lid, '', 'Платёж #%s: сумма %s, ОД %s, %%: %s, штраф: %s%s' % (pid, float(new_amount), float(new_pp), float(new_ip), float(new_pnp), ' (ручное)' if manual else ''), ip)
+            conn.commit()
+            return {'success': True}
+
+        elif action == 'delete_payment':
+            pid = int(body['payment_id'])
+            cur.execute("SELECT loan_id, principal_part, payment_date FROM loan_payments WHERE id=%s" % pid)
+            old = cur.fetchone()
+            if not old:
+                return {'error': 'Платёж не найден'}
+            lid, old_pp = old[0], Decimal(str(old[1]))
+            mark_member_stats(cur, 'loans', lid)
+            cur.execute("DELETE FROM loan_payments WHERE id=%s" % pid)
+            if old_pp > 0:
+                cur.execute("UPDATE loans SET balance=balance+%s, updated_at=NOW() WHERE id=%s" % (float(old_pp), lid))
+            recalc_loan_schedule_statuses(cur, lid, since=(old[2], pid))
+            audit_log(cur, staff, 'delete_payment', 'loan', lid, '', 'Удалён платёж #%s (ОД: %s)' % (pid, float(old_pp)), ip)
+            conn.commit()
+            return {'success': True}
+
+        elif action == 'delete_contract':
+            lid = int(body['loan_id'])
+            cur.execute("SELECT contract_no, member_id FROM loans WHERE id=%s" % lid)
+            lr = cur.fetchone()
+            if not lr:
+                return {'error': 'Договор не найден'}
+            mark_member_stats(cur, 'members', lr[1])
+            drop_loan_snapshots(cur, lid)
+            cur.execute("DELETE FROM loan_payments WHERE loan_id=%s" % lid)
+            cur.execute("DELETE FROM loan_schedule WHERE loan_id=%s" % lid)
+            cur.execute("DELETE FROM loans WHERE id=%s" % lid)
+            audit_log(cur, staff, 'delete_contract', 'loan', lid, lr[0], '', ip)
+            conn.commit()
+            return {'success': True}
+
+        elif action == 'delete_all_payments':
+            lid = int(body['loan_id'])
+            cur.execute("SELECT amount, rate, term_months, start_date, schedule_type FROM loans WHERE id=%s" % lid)
+            lr = cur.fetchone()
+            if not lr:
+                return {'error': 'Договор не найден'}
+            orig_amount = float(lr[0])
+            r = float(lr[1])
+            orig_term = int(lr[2])
+            sd = date.fromisoformat(str(lr[3]))
+            st = lr[4]
+            drop_loan_snapshots(cur, lid)
+            cur.execute("DELETE FROM loan_payments WHERE loan_id=%s" % lid)
+            cur.execute("DELETE FROM loan_schedule WHERE loan_id=%s" % lid)
+            fn = calc_annuity_schedule if st == 'annuity' else calc_end_of_term_schedule
+            ns, m = fn(orig_amount, r, orig_term, sd)
+            for item in ns:
+                cur.execute("INSERT INTO loan_schedule (loan_id,payment_no,payment_date,payment_amount,principal_amount,interest_amount,balance_after) VALUES (%s,%s,'%s',%s,%s,%s,%s)" % (lid, item['payment_no'], item['payment_date'], item['payment_amount'], item['principal_amount'], item['interest_amount'], item['balance_after']))
+            ne = date.fromisoformat(ns[-1]['payment_date'])
+            cur.execute("UPDATE loans SET balance=%s, monthly_payment=%s, term_months=%s, end_date='%s', status='active', updated_at=NOW() WHERE id=%s" % (orig_amount, m, orig_term, ne.isoformat(), lid))
+            audit_log(cur, staff, 'delete_all_payments', 'loan', lid, '', '', ip)
+            conn.commit()
+            return {'success': True}
+
+        elif action == 'fix_schedule':
+            lid = int(body['loan_id'])
+            cur.execute("SELECT amount, balance, rate, term_months, start_date, schedule_type FROM loans WHERE id=%s" % lid)
+            lr = cur.fetchone()
+            if not lr:
+                return {'error': 'Договор не найден'}
+            orig_amount, bal = float(lr[0]), Decimal(str(lr[1]))
+            r, orig_term = float(lr[2]), int(lr[3])
+            sd, st = date.fromisoformat(str(lr[4])), lr[5]
+
+            cur.execute("""
+                SELECT payment_no, COUNT(*) as cnt FROM loan_schedule 
+                WHERE loan_id=%s GROUP BY payment_no HAVING COUNT(*) > 1
+            """ % lid)
+            dups = cur.fetchall()
+            removed = 0
+            for dup in dups:
+                pno = dup[0]
+                cur.execute("""
+                    SELECT id FROM loan_schedule 
+                    WHERE loan_id=%s AND payment_no=%s 
+                    ORDER BY id
+                """ % (lid, pno))
+                ids = [row[0] for row in cur.fetchall()]
+                cur.execute("""
+                    SELECT id FROM loan_schedule 
+                    WHERE loan_id=%s AND payment_no=%s AND status='paid'
+                    ORDER BY id DESC LIMIT 1
+                """ % (lid, pno))
+                paid_row = cur.fetchone()
+                keep_id = paid_row[0] if paid_row else ids[-1]
+                for sid in ids:
+                    if sid != keep_id:
+                        cur.execute("DELETE FROM loan_schedule WHERE id=%s" % sid)
+                        removed += 1
+
+            recalc_loan_schedule_statuses(cur, lid)
+
+            cur.execute("SELECT COALESCE(SUM(principal_part),0) FROM loan_payments WHERE loan_id=%s" % lid)
+            total_paid_principal = Decimal(str(cur.fetchone()[0]))
+            real_balance = Decimal(str(orig_amount)) - total_paid_principal
+            if real_balance < 0:
+                real_balance = Decimal('0')
+            cur.execute("UPDATE loans SET balance=%s, updated_at=NOW() WHERE id=%s" % (float(real_balance), lid))
+
+            if real_balance == 0:
+                cur.execute("UPDATE loans SET status='closed', updated_at=NOW() WHERE id=%s" % lid)
+            else:
+                # Пересоздаём pending-строки графика от правильного баланса
+                # Берём последний оплаченный период как точку отсчёта
+                cur.execute("""
+                    SELECT payment_date, payment_no FROM loan_schedule
+                    WHERE loan_id=%s AND status='paid'
+                    ORDER BY payment_no DESC LIMIT 1
+                """ % lid)
+                last_paid = cur.fetchone()
+
+                cur.execute("SELECT COUNT(*) FROM loan_schedule WHERE loan_id=%s AND status IN ('pending','partial','overdue')" % lid)
+                pending_count = cur.fetchone()[0]
+
+                if last_paid and pending_count > 0 and real_balance > 0:
+                    last_paid_date = last_paid[0] if isinstance(last_paid[0], date) else date.fromisoformat(str(last_paid[0]))
+                    last_paid_no = last_paid[1]
+
+                    cur.execute("UPDATE loan_schedule SET status='deleted_fix' WHERE loan_id=%s AND status IN ('pending','partial','overdue')" % lid)
+
+                    fn = calc_annuity_schedule if st == 'annuity' else calc_end_of_term_schedule
+                    new_sched, new_monthly = fn(float(real_balance), r, pending_count, last_paid_date)
+
+                    for item in new_sched:
+                        cur.execute("INSERT INTO loan_schedule (loan_id,payment_no,payment_date,payment_amount,principal_amount,interest_amount,balance_after) VALUES (%s,%s,'%s',%s,%s,%s,%s)" % (
+                            lid, last_paid_no + item['payment_no'], item['payment_date'],
+                            item['payment_amount'], item['principal_amount'],
+                            item['interest_amount'], item['balance_after']))
+
+                    ne = date.fromisoformat(new_sched[-1]['payment_date'])
+                    new_term = last_paid_no + len(new_sched)
+                    cur.execute("UPDATE loans SET monthly_payment=%s, end_date='%s', term_months=%s, updated_at=NOW() WHERE id=%s" % (
+                        new_monthly, ne.isoformat(), new_term, lid))
+                    removed += pending_count
+
+                refresh_loan_overdue_status(cur, lid)
+
+            audit_log(cur, staff, 'fix_schedule', 'loan', lid, '', 'Удалено дублей: %s, пересчитан баланс: %s' % (removed, float(real_balance)), ip)
+            conn.commit()
+            return {'success': True, 'removed_duplicates': removed, 'new_balance': float(real_balance)}
+
+        elif action == 'recalc_statuses':
+            lid = int(body['loan_id'])
+            recalc_loan_schedule_statuses(cur, lid)
+            audit_log(cur, staff, 'recalc_statuses', 'loan', lid, '', 'Пересчёт статусов платежей', ip)
+            conn.commit()
+            return {'success': True}
+
+        elif action == 'reconcile_all':
+            """Сверка всего портфеля: повторное распределение платежей по графикам, при apply — исправление расхождений"""
+            apply = bool(body.get('apply'))
+            cur.execute("SELECT id FROM loans ORDER BY id")
+            ids = [r[0] for r in cur.fetchall()]
+            chunk_size = int(body.get('chunk_size', 200))
+            today = date.today()
+            job_id = start_batch_job(cur, conn, 'loans_reconcile', len(ids), staff)
+            processed = 0
+            discrepancies = []
+            errors = []
+            repaired = 0
+            try:
+                for pos in range(0, len(ids), chunk_size):
+                    inputs = load_loan_inputs(cur, ids[pos:pos + chunk_size], today)
+                    results = map_parallel(reconcile_loan, list(inputs.values()))
+                    row_fixes, part_fixes, loan_fixes = [], [], []
+                    for res in results:
+                        processed += 1
+                        item = inputs[res['id']]
+                        if 'error' in res:
+                            errors.append({'contract_no': item['contract_no'], 'error': res['error']})
+                            continue
+                        if not res['issues']:
+                            continue
+                        discrepancies.append({'loan_id': res['id'], 'contract_no': item['contract_no'], 'issues': res['issues']})
+                        if apply:
+                            row_fixes.extend(res['row_fixes'])
+                            part_fixes.extend(res['part_fixes'])
+                            if res['loan_fix']:
+                                loan_fixes.append((res['id'],) + res['loan_fix'])
+                            audit_log(cur, staff, 'reconcile', 'loan', res['id'], item['contract_no'], 'Сверка портфеля: исправлено расхождений %s' % len(res['issues']), ip)
+                            repaired += 1
+                    if row_fixes:
+                        cur.execute("""
+                            UPDATE loan_schedule ls SET paid_amount=v.paid_amount, paid_date=v.paid_date, status=v.status, payment_id=v.payment_id,
+                                overdue_days=COALESCE(v.overdue_days, ls.overdue_days)
+                            FROM (VALUES %s) AS v(id, paid_amount, paid_date, status, payment_id, overdue_days) WHERE ls.id=v.id
+                        """ % ','.join("(%s, %s, %s::date, '%s', %s::integer, %s::integer)" % (
+                            sid, paid, ("'%s'" % pdate) if pdate else 'NULL', st, pid or 'NULL', 'NULL' if od is None else od)
+                            for sid, paid, pdate, st, pid, od in row_fixes))
+                    if part_fixes:
+                        cur.execute("""
+                            UPDATE loan_payments lp SET principal_part=v.pp, interest_part=v.ip, penalty_part=v.pnp
+                            FROM (VALUES %s) AS v(id, pp, ip, pnp) WHERE lp.id=v.id
+                        """ % ','.join("(%s, %s, %s, %s)" % f for f in part_fixes))
+                    if loan_fixes:
+                        for f in loan_fixes:
+                            mark_member_stats(cur, 'loans', f[0])
+                        cur.execute("""
+                            UPDATE loans l SET balance=v.balance, status=v.status, updated_at=NOW()
+                            FROM (VALUES %s) AS v(id, balance, status) WHERE l.id=v.id
+                        """ % ','.join("(%s, %s, '%s')" % f for f in loan_fixes))
+                    update_batch_job(cur, job_id, processed, len(errors))
+                    conn.commit()
+            except Exception as e:
+                conn.rollback()
+                update_batch_job(cur, job_id, processed, len(errors), 'failed', {'error': str(e)})
+                conn.commit()
+                raise
+            summary = {'success': True, 'job_id': job_id, 'applied': apply, 'total': len(ids),
+                       'with_discrepancies': len(discrepancies), 'repaired': repaired, 'errors': errors}
+            update_batch_job(cur, job_id, processed, len(errors), 'done', dict(summary, discrepancies=discrepancies[:500]))
+            conn.commit()
+            summary['discrepancies'] = discrepancies
+            return summary
+
+        elif action == 'rebuild_schedule':
+            """Пересоздаёт график с оригинальной даты начала, сохраняя платежи"""
+            lid = int(body['loan_id'])
+            cur.execute("SELECT amount, rate, term_months, start_date, schedule_type FROM loans WHERE id=%s" % lid)
+            lr = cur.fetchone()
+            if not lr:
+                return {'error': 'Договор не найден'}
+            orig_amount = float(lr[0])
+            r = safe_float(body['rate'], 'ставка') if body.get('rate') else float(lr[1])
+            orig_term = safe_int(body['term_months'], 'срок') if body.get('term_months') else int(lr[2])
+            sd, st = date.fromisoformat(str(lr[3])), lr[4]
+            cur.execute("DELETE FROM loan_schedule WHERE loan_id=%s" % lid)
+            fn = calc_annuity_schedule if st == 'annuity' else calc_end_of_term_schedule
+            ns, m = fn(orig_amount, r, orig_term, sd)
+            for item in ns:
+                cur.execute("INSERT INTO loan_schedule (loan_id,payment_no,payment_date,payment_amount,principal_amount,interest_amount,balance_after) VALUES (%s,%s,'%s',%s,%s,%s,%s)" % (lid, item['payment_no'], item['payment_date'], item['payment_amount'], item['principal_amount'], item['interest_amount'], item['balance_after']))
+            ne = date.fromisoformat(ns[-1]['payment_date'])
+            cur.execute("UPDATE loans SET rate=%s, term_months=%s, monthly_payment=%s, end_date='%s', updated_at=NOW() WHERE id=%s" % (r, orig_term, m, ne.isoformat(), lid))
+            recalc_loan_schedule_statuses(cur, lid)
+            audit_log(cur, staff, 'rebuild_schedule', 'loan', lid, '', 'Пересоздан график с %s, %s периодов' % (sd.isoformat(), orig_term), ip)
+            conn.commit()
+            return {'success': True, 'periods': len(ns), 'monthly_payment': m, 'end_date': ne.isoformat()}
+
+        elif action == 'modify':
+            """Изменение условий займа: ставка, срок, сумма (доп. транш) с привязкой к дате"""
+            lid = int(body['loan_id'])
+            cur.execute("SELECT balance, rate, term_months, start_date, schedule_type, amount FROM loans WHERE id=%s" % lid)
+            lr = cur.fetchone()
+            bal = float(lr[0])
+            old_rate = float(lr[1])
+            old_term = int(lr[2])
+            st = lr[4]
+            old_amount = float(lr[5])
+
+            r = safe_float(body['new_rate'], 'ставка') if body.get('new_rate') else old_rate
+            t = safe_int(body['new_term'], 'срок') if body.get('new_term') else None
+            effective = date.fromisoformat(body['effective_date']) if body.get('effective_date') else date.today()
+
+            new_amount = safe_float(body['new_amount'], 'сумма') if body.get('new_amount') else None
+            extra = 0
+            if new_amount is not None:
+                if new_amount <= old_amount:
+                    return {'statusCode': 400, 'headers': cors, 'body': json.dumps({'error': 'Новая сумма должна быть больше текущей (%s)' % old_amount})}
+                extra = new_amount - old_amount
+                bal = bal + extra
+
+            cur.execute("DELETE FROM loan_schedule WHERE loan_id=%s AND status IN ('pending','partial','overdue') AND payment_date >= '%s'" % (lid, effective.isoformat()))
+            cur.execute("SELECT MAX(payment_no) FROM loan_schedule WHERE loan_id=%s" % lid)
+            max_no_row = cur.fetchone()
+            max_no = max_no_row[0] if max_no_row and max_no_row[0] else 0
+
+            remaining_term = t if t else None
+            if remaining_term is None:
+                cur.execute("SELECT COUNT(*) FROM loan_schedule WHERE loan_id=%s AND status IN ('pending','partial','overdue') AND payment_date < '%s'" % (lid, effective.isoformat()))
+                kept_pending = cur.fetchone()[0]
+                cur.execute("SELECT COUNT(*) FROM loan_schedule WHERE loan_id=%s AND status='paid'" % lid)
+                paid_count = cur.fetchone()[0]
+                remaining_term = max(old_term - paid_count - kept_pending, 1)
+
+            fn = calc_annuity_schedule if st == 'annuity' else calc_end_of_term_schedule
+            ns, m = fn(bal, r, remaining_term, effective)
+            for item in ns:
+                cur.execute("INSERT INTO loan_schedule (loan_id,payment_no,payment_date,payment_amount,principal_amount,interest_amount,balance_after) VALUES (%s,%s,'%s',%s,%s,%s,%s)" % (lid, max_no + item['payment_no'], item['payment_date'], item['payment_amount'], item['principal_amount'], item['interest_amount'], item['balance_after']))
+
+            ne = date.fromisoformat(ns[-1]['payment_date'])
+            total_term = max_no + len(ns)
+
+            upd_parts = ["rate=%s" % r, "term_months=%s" % total_term, "monthly_payment=%s" % m, "end_date='%s'" % ne.isoformat(), "balance=%s" % bal, "updated_at=NOW()"]
+            if new_amount is not None:
+                upd_parts.append("amount=%s" % new_amount)
+            cur.execute("UPDATE loans SET %s WHERE id=%s" % (', '.join(upd_parts), lid))
+
+            recalc_loan_schedule_statuses(cur, lid)
+
+            changes = []
+            if new_amount is not None:
+                changes.append('сумма: %s→%s (транш +%s)' % (old_amount, new_amount, extra))
+            if r != old_rate:
+                changes.append('ставка: %s%%→%s%%' % (old_rate, r))
+            if t and t != old_term:
+                changes.append('срок: %s→%s мес.' % (old_term, t))
+            changes.append('дата изменений: %s' % effective.isoformat())
+            audit_log(cur, staff, 'modify', 'loan', lid, '', 'Изменение условий: %s' % ', '.join(changes), ip)
+            conn.commit()
+            return {'success': True, 'new_schedule': ns, 'monthly_payment': m, 'new_balance': bal}
+
+        elif action == 'update_loan':
+            """Редактирование всех параметров договора займа с полным пересчётом графика"""
+            lid = int(body['loan_id'])
+            cur.execute("SELECT id, contract_no, member_id, amount, rate, term_months, schedule_type, start_date, balance, status, org_id FROM loans WHERE id=%s" % lid)
+            lr = cur.fetchone()
+            if not lr:
+                return {'error': 'Договор не найден'}
+            old_cn = lr[1]
+            old_mid = int(lr[2])
+            mark_member_stats(cur, 'members', old_mid)
+            old_amount = float(lr[3])
+            old_rate = float(lr[4])
+            old_term = int(lr[5])
+            old_st = lr[6]
+            old_sd = date.fromisoformat(str(lr[7]))
+            old_balance = float(lr[8])
+            old_org = lr[10]
+
+            cn = body.get('contract_no', old_cn).strip()
+            if cn != old_cn:
+                cur.execute("SELECT id FROM loans WHERE contract_no='%s' AND id!=%s" % (esc(cn), lid))
+                if cur.fetchone():
+                    return {'error': 'Договор с номером %s уже существует' % cn}
+            new_mid = int(body['member_id']) if 'member_id' in body else old_mid
+            new_amount = safe_float(body['amount'], 'сумма') if 'amount' in body else old_amount
+            new_rate = safe_float(body['rate'], 'ставка') if 'rate' in body else old_rate
+            new_term = safe_int(body['term_months'], 'срок') if 'term_months' in body else old_term
+            new_st = body.get('schedule_type', old_st)
+            new_sd = date.fromisoformat(body['start_date']) if 'start_date' in body else old_sd
+            new_org = body.get('org_id', old_org)
+            new_ed = add_months(new_sd, new_term)
+
+            cur.execute("DELETE FROM loan_schedule WHERE loan_id=%s" % lid)
+
+            fn = calc_annuity_schedule if new_st == 'annuity' else calc_end_of_term_schedule
+            ns, m = fn(new_amount, new_rate, new_term, new_sd)
+            for item in ns:
+                cur.execute("INSERT INTO loan_schedule (loan_id,payment_no,payment_date,payment_amount,principal_amount,interest_amount,balance_after) VALUES (%s,%s,'%s',%s,%s,%s,%s)" % (lid, item['payment_no'], item['payment_date'], item['payment_amount'], item['principal_amount'], item['interest_amount'], item['balance_after']))
+
+            cur.execute("UPDATE loans SET contract_no='%s', member_id=%s, amount=%s, rate=%s, term_months=%s, schedule_type='%s', start_date='%s', end_date='%s', monthly_payment=%s, balance=%s, org_id=%s, updated_at=NOW() WHERE id=%s" % (esc(cn), new_mid, new_amount, new_rate, new_term, new_st, new_sd.isoformat(), new_ed.isoformat(), m, new_amount, new_org if new_org else 'NULL', lid))
+
+            recalc_loan_schedule_statuses(cur, lid)
+
+            changes = []
+            if cn != old_cn:
+                changes.append('номер: %s→%s' % (old_cn, cn))
+            if new_amount != old_amount:
+                changes.append('сумма: %s→%s' % (old_amount, new_amount))
+            if new_rate != old_rate:
+                changes.append('ставка: %s%%→%s%%' % (old_rate, new_rate))
+            if new_term != old_term:
+                changes.append('срок: %s→%s мес.' % (old_term, new_term))
+            if new_st != old_st:
+                changes.append('тип: %s→%s' % (old_st, new_st))
+            if new_sd != old_sd:
+                changes.append('дата: %s→%s' % (old_sd.isoformat(), new_sd.isoformat()))
+            audit_log(cur, staff, 'update_loan', 'loan', lid, cn, 'Изменение договора: %s' % ', '.join(changes) if changes else 'Пересчёт графика', ip)
+
+            cur.execute("SELECT balance FROM loans WHERE id=%s" % lid)
+            final_balance = float(cur.fetchone()[0])
+
+            conn.commit()
+            return {'success': True, 'schedule': ns, 'monthly_payment': m, 'new_end_date': new_ed.isoformat(), 'new_balance': final_balance}
@@ -0,0 +1,342 @@
+"""Пайщики: карточки, поиск и импорт из CSV/XLSX"""
+from datetime import datetime, date
+import base64
+import re
+from io import BytesIO
+from core import MEMBER_STATS_UPSERT, audit_log, esc, next_number, query_one, query_rows
+
+MEMBER_IMPORT_COLUMNS = [
+    ('last_name', 'Фамилия', 100), ('first_name', 'Имя', 100), ('middle_name', 'Отчество', 100),
+    ('company_name', 'Наименование компании', 300), ('inn', 'ИНН', 12), ('phone', 'Телефон', 20),
+    ('email', 'Email', 200), ('telegram', 'Telegram', 100), ('birth_date', 'Дата рождения', None),
+    ('birth_place', 'Место рождения', 300), ('passport_series', 'Серия паспорта', 4),
+    ('passport_number', 'Номер паспорта', 6), ('passport_dept_code', 'Код подразделения', 10),
+    ('passport_issue_date', 'Дата выдачи паспорта', None), ('passport_issued_by', 'Кем выдан', 500),
+    ('registration_address', 'Адрес регистрации', 500), ('marital_status', 'Семейное положение', 50),
+    ('spouse_fio', 'ФИО супруга(и)', 200), ('spouse_phone', 'Телефон супруга(и)', 20),
+    ('extra_phone', 'Доп. телефон', 20), ('extra_contact_fio', 'Доп. контакт ФИО', 200),
+    ('director_fio', 'Руководитель ФИО', 200), ('director_phone', 'Телефон руководителя', 20),
+    ('contact_person_fio', 'Контактное лицо ФИО', 200), ('contact_person_phone', 'Телефон контактного лица', 20),
+    ('bank_bik', 'БИК банка', 9), ('bank_account', 'Расчётный счёт', 20),
+]
+
+def parse_import_date(v):
+    if isinstance(v, datetime):
+        return v.date()
+    if isinstance(v, date):
+        return v
+    v = str(v).strip()
+    if not v:
+        return None
+    if '.' in v:
+        return datetime.strptime(v[:10], '%d.%m.%Y').date()
+    return date.fromisoformat(v[:10])
+
+IMPORT_SNIFF_BYTES = 64 * 1024
+
+def read_import_rows(data, fmt):
+    """Построчно читает CSV/XLSX файл импорта, не загружая весь лист в память"""
+    if fmt == 'xlsx':
+        from openpyxl import load_workbook
+        wb = load_workbook(BytesIO(data), read_only=True, data_only=True)
+        for row in wb.active.iter_rows(values_only=True):
+            yield ['' if v is None else v for v in row]
+        wb.close()
+        return
+    import codecs
+    import csv
+    from io import TextIOWrapper
+    # Кодировка и разделитель — по началу файла; весь файл в строку не декодируется, csv читает из потока
+    head = data[:IMPORT_SNIFF_BYTES]
+    try:
+        encoding, sample = 'utf-8-sig', codecs.getincrementaldecoder('utf-8-sig')().decode(head, final=len(head) == len(data))
+    except UnicodeDecodeError:
+        encoding, sample = 'cp1251', head.decode('cp1251', errors='replace')
+    first_line = sample.split('\n', 1)[0]
+    delimiter = ';' if first_line.count(';') >= first_line.count(',') else ','
+    stream = TextIOWrapper(BytesIO(data), encoding=encoding, newline='')
+    try:
+        yield from csv.reader(stream, delimiter=delimiter)
+    except UnicodeDecodeError:
+        raise ValueError('Файл не в кодировке %s' % ('UTF-8' if encoding == 'utf-8-sig' else 'Windows-1251'))
+
+def copy_escape(v):
+    return str(v).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+def import_members(body, cur, conn, staff, ip):
+    from io import StringIO
+    if not body.get('file'):
+        return {'error': 'Не передан файл'}
+    data = base64.b64decode(body['file'])
+    fmt = body.get('format') or ('xlsx' if str(body.get('filename', '')).lower().endswith('.xlsx') else 'csv')
+
+    by_header = {}
+    for field, label, _ in MEMBER_IMPORT_COLUMNS:
+        by_header[field] = field
+        by_header[label.lower()] = field
+    by_header.update({'member_type': 'member_type', 'тип': 'member_type'})
+
+    rows = read_import_rows(data, fmt)
+    header = next(rows, None)
+    if not header:
+        return {'error': 'Файл пуст'}
+    positions = {}
+    for i, h in enumerate(header):
+        field = by_header.get(str(h).strip().lower()) or by_header.get(str(h).strip())
+        if field and field not in positions:
+            positions[field] = i
+    if 'inn' not in positions:
+        return {'error': 'В файле нет колонки ИНН (inn)'}
+
+    copy_cols = ['row_no', 'member_type'] + [c[0] for c in MEMBER_IMPORT_COLUMNS]
+    buf = StringIO()
+    errors = []
+    seen_inn = {}
+    valid = 0
+    total = 0
+    for row_no, row in enumerate(rows, 2):
+        if not any(str(v).strip() for v in row):
+            continue
+        total += 1
+        row_errors = []
+        get = lambda f: row[positions[f]] if f in positions and positions[f] < len(row) else ''
+        mt = str(get('member_type')).strip().upper() or 'FL'
+        mt = {'ФЛ': 'FL', 'ЮЛ': 'UL'}.get(mt, mt)
+        if mt not in ('FL', 'UL'):
+            row_errors.append('Неизвестный тип пайщика: %s' % mt)
+        values = {}
+        for field, label, max_len in MEMBER_IMPORT_COLUMNS:
+            v = get(field)
+            if max_len is None:
+                try:
+                    values[field] = parse_import_date(v)
+                except ValueError:
+                    row_errors.append('%s: некорректная дата' % label)
+                    values[field] = None
+                continue
+            v = str(v).strip()
+            if field in ('inn', 'bank_bik', 'bank_account', 'passport_series', 'passport_number') and v.endswith('.0'):
+                v = v[:-2]
+            if len(v) > max_len:
+                row_errors.append('%s: длиннее %s символов' % (label, max_len))
+            values[field] = v
+        inn = values['inn']
+        if not inn.isdigit() or len(inn) not in (10, 12):
+            row_errors.append('ИНН: должен содержать 10 или 12 цифр')
+        elif inn in seen_inn:
+            row_errors.append('ИНН %s уже встречается в строке %s' % (inn, seen_inn[inn]))
+        if mt == 'FL' and not (values['last_name'] and values['first_name']):
+            row_errors.append('Для ФЛ обязательны фамилия и имя')
+        if mt == 'UL' and not values['company_name']:
+            row_errors.append('Для ЮЛ обязательно наименование компании')
+        if row_errors:
+            errors.append({'row': row_no, 'errors': row_errors})
+            continue
+        seen_inn[inn] = row_no
+        line = [str(row_no), mt]
+        for field, _, max_len in MEMBER_IMPORT_COLUMNS:
+            v = values[field]
+            line.append('\\N' if v is None else copy_escape(v.isoformat() if max_len is None else v))
+        buf.write('\t'.join(line) + '\n')
+        valid += 1
+
+    col_defs = ', '.join('%s %s' % (c[0], 'DATE' if c[2] is None else 'TEXT') for c in MEMBER_IMPORT_COLUMNS)
+    cur.execute("CREATE TEMP TABLE members_import (row_no INTEGER PRIMARY KEY, member_type VARCHAR(2), %s) ON COMMIT DROP" % col_defs)
+    buf.seek(0)
+    cur.copy_expert("COPY members_import (%s) FROM STDIN" % ', '.join(copy_cols), buf)
+
+    cur.execute("""
+        DELETE FROM members_import i USING members m
+        WHERE m.inn = i.inn AND m.status != 'deleted'
+        RETURNING i.row_no, i.inn, m.member_no
+    """)
+    for row_no, inn, member_no in cur.fetchall():
+        errors.append({'row': row_no, 'errors': ['Пайщик с ИНН %s уже существует (%s)' % (inn, member_no)]})
+        valid -= 1
+    errors.sort(key=lambda e: e['row'])
+
+    if body.get('dry_run') or valid <= 0:
+        conn.rollback()
+        return {'success': True, 'dry_run': bool(body.get('dry_run')), 'total': total, 'imported': 0, 'valid': max(valid, 0), 'error_count': len(errors), 'errors': errors[:1000]}
+
+    first_no = next_number(cur, 'member', count=valid) - valid + 1
+    field_cols = ', '.join(c[0] for c in MEMBER_IMPORT_COLUMNS)
+    cur.execute("""
+        INSERT INTO members (member_no, member_type, %s)
+        SELECT 'П-' || lpad(n::text, GREATEST(6, length(n::text)), '0'), member_type, %s
+        FROM (SELECT i.*, %s - 1 + ROW_NUMBER() OVER (ORDER BY row_no) AS n FROM members_import i) t
+    """ % (field_cols, field_cols, first_no))
+    imported = cur.rowcount
+    audit_log(cur, staff, 'import', 'member', None, '', 'Импорт пайщиков: загружено %s из %s, ошибок %s' % (imported, total, len(errors)), ip)
+    conn.commit()
+    return {'success': True, 'total': total, 'imported': imported, 'error_count': len(errors), 'errors': errors[:1000]}
+
+MEMBER_LIST_SELECT = """
+    SELECT m.id, m.member_no, m.member_type,
+           CASE WHEN m.member_type = 'FL' THEN CONCAT(m.last_name, ' ', m.first_name, ' ', m.middle_name)
+                ELSE m.company_name END as name,
+           m.inn, m.phone, m.email, m.status, m.created_at,
+           COALESCE(ms.active_loans, 0) as active_loans, COALESCE(ms.active_savings, 0) as active_savings,
+           COALESCE(ms.overdue_loans, 0) as overdue_loans, COALESCE(ms.share_balance, 0) as share_balance,
+           COALESCE(ms.total_debt, 0) as total_debt
+    FROM members m LEFT JOIN member_stats ms ON ms.member_id = m.id
+"""
+
+# Выражения триграммных индексов из V0051 — менять только вместе с миграцией
+MEMBER_SEARCH_NAME = "lower(COALESCE(m.last_name, '') || ' ' || COALESCE(m.first_name, '') || ' ' || COALESCE(m.middle_name, '') || ' ' || COALESCE(m.company_name, ''))"
+MEMBER_SEARCH_IDS = ("(regexp_replace(COALESCE(m.member_no, ''), '\\D', '', 'g') || ' ' || COALESCE(m.inn, '') || ' ' || "
+                     "regexp_replace(COALESCE(m.phone, ''), '\\D', '', 'g') || ' ' || "
+                     "regexp_replace(COALESCE(m.passport_series, '') || COALESCE(m.passport_number, ''), '\\D', '', 'g'))")
+MEMBER_SEARCH_MAX_LIMIT = 50
+MEMBER_SEARCH_MIN_SUBSTRING = 3
+
+def search_members(cur, params):
+    """Поиск пайщика: подстрока в ФИО/наименовании, подстрока цифр номера, ИНН, телефона, паспорта; при недоборе — нечёткое совпадение слова.
+    Сначала точный номер или ИНН, затем совпадение реквизитов, начало слова в имени; внутри — по похожести, нечёткие — в конце.
+    Запрос короче MEMBER_SEARCH_MIN_SUBSTRING ищется только по началу слов имени и упорядочивается по алфавиту"""
+    q = ' '.join((params.get('q') or '').lower().split())
+    limit = min(max(int(params.get('limit') or 10), 1), MEMBER_SEARCH_MAX_LIMIT)
+    if not q:
+        return query_rows(cur, MEMBER_LIST_SELECT + " WHERE m.status != 'deleted' ORDER BY m.created_at DESC LIMIT %d" % limit)
+    lit = esc(q)
+    like = esc(q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_'))
+    digits = re.sub(r'\D', '', q)
+    short = len(q) < MEMBER_SEARCH_MIN_SUBSTRING
+    if short:
+        # Короче триграммы подстрока находит большую часть пайщиков полным проходом таблицы,
+        # а похожесть приходится считать для каждой найденной строки: только начало слова, внутри — по алфавиту
+        conds = ["%s LIKE '%s%%'" % (MEMBER_SEARCH_NAME, like), "%s LIKE '%% %s%%'" % (MEMBER_SEARCH_NAME, like)]
+        within = MEMBER_SEARCH_NAME
+    else:
+        conds = ["%s LIKE '%%%s%%'" % (MEMBER_SEARCH_NAME, like)]
+        within = "word_similarity('%s', %s) DESC" % (lit, MEMBER_SEARCH_NAME)
+    ids_rank = ''
+    if len(digits) >= MEMBER_SEARCH_MIN_SUBSTRING:
+        conds.append("%s LIKE '%%%s%%'" % (MEMBER_SEARCH_IDS, digits))
+        ids_rank = "WHEN %s LIKE '%%%s%%' THEN 2" % (MEMBER_SEARCH_IDS, digits)
+    rows = query_rows(cur, MEMBER_LIST_SELECT + """
+        WHERE m.status != 'deleted' AND (%s)
+        ORDER BY CASE WHEN lower(m.member_no) = '%s' OR m.inn = '%s' THEN 3 %s
+                      WHEN %s LIKE '%s%%' OR %s LIKE '%% %s%%' THEN 1 ELSE 0 END DESC,
+                 %s, m.id
+        LIMIT %d
+    """ % (' OR '.join(conds), lit, lit, ids_rank, MEMBER_SEARCH_NAME, like, MEMBER_SEARCH_NAME, like, within, limit))
+    if short or len(rows) >= limit:
+        return rows
+    # Нечёткое совпадение (опечатки) — отдельным запросом и только на недобор. В одном OR с подстрокой планировщик
+    # не учитывал, что %> считает похожесть для каждой строки, и на частых словах уходил в полный проход таблицы
+    return rows + query_rows(cur, MEMBER_LIST_SELECT + """
+        WHERE m.status != 'deleted' AND %s %%> '%s' AND NOT (%s)
+        ORDER BY word_similarity('%s', %s) DESC, m.id
+        LIMIT %d
+    """ % (MEMBER_SEARCH_NAME, lit, ' OR '.join(conds), lit, MEMBER_SEARCH_NAME, limit - len(rows)))
+
+def rebuild_member_stats(cur, conn, staff, ip=''):
+    """Полный пересчёт member_stats по всем пайщикам — после ручных правок в БД или при расхождении счётчиков"""
+    if staff.get('role') != 'admin':
+        return {'_status': 403, 'error': 'Только администратор может пересчитывать счётчики пайщиков'}
+    cur.execute(MEMBER_STATS_UPSERT % 'TRUE')
+    rebuilt = cur.rowcount
+    audit_log(cur, staff, 'rebuild_stats', 'member', None, '', 'Пересчёт счётчиков пайщиков: %s' % rebuilt, ip)
+    conn.commit()
+    return {'success': True, 'rebuilt': rebuilt}
+
+def handle_members(method, params, body, cur, conn, staff=None, ip=''):
+    if method == 'GET':
+        member_id = params.get('id')
+        if member_id:
+            return query_one(cur, "SELECT * FROM members WHERE id = %s" % member_id)
+        if params.get('action') == 'search':
+            return search_members(cur, params)
+        return query_rows(cur, MEMBER_LIST_SELECT + " WHERE m.status != 'deleted' ORDER BY m.created_at DESC")
+
+    elif method == 'POST':
+        if body.get('action') == 'import':
+            return import_members(body, cur, conn, staff, ip)
+        if body.get('action') == 'rebuild_stats':
+            return rebuild_member_stats(cur, conn, staff, ip)
+        mt = body.get('member_type', 'FL')
+        member_no = 'П-%06d' % next_number(cur, 'member')
+
+        if mt == 'FL':
+            cur.execute("""
+                INSERT INTO members (member_no, member_type, last_name, first_name, middle_name,
+                    birth_date, birth_place, inn, passport_series, passport_number,
+                    passport_dept_code, passport_issue_date, passport_issued_by,
+                    registration_address, phone, email, telegram, bank_bik, bank_account,
+                    marital_status, spouse_fio, spouse_phone, extra_phone, extra_contact_fio)
+                VALUES ('%s', 'FL', '%s', '%s', '%s', %s, '%s', '%s', '%s', '%s', '%s', %s, '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s')
+                RETURNING id, member_no
+            """ % (
+                member_no, esc(body.get('last_name')), esc(body.get('first_name')), esc(body.get('middle_name')),
+                ("'%s'" % body['birth_date']) if body.get('birth_date') else 'NULL',
+                esc(body.get('birth_place')), esc(body.get('inn')),
+                esc(body.get('passport_series')), esc(body.get('passport_number')),
+                esc(body.get('passport_dept_code')),
+                ("'%s'" % body['passport_issue_date']) if body.get('passport_issue_date') else 'NULL',
+                esc(body.get('passport_issued_by')), esc(body.get('registration_address')),
+                esc(body.get('phone')), esc(body.get('email')), esc(body.get('telegram')),
+                esc(body.get('bank_bik')), esc(body.get('bank_account')),
+                esc(body.get('marital_status')), esc(body.get('spouse_fio')),
+                esc(body.get('spouse_phone')), esc(body.get('extra_phone')), esc(body.get('extra_contact_fio')),
+            ))
+        else:
+            cur.execute("""
+                INSERT INTO members (member_no, member_type, inn, company_name, director_fio,
+                    director_phone, contact_person_fio, contact_person_phone, bank_bik, bank_account)
+                VALUES ('%s', 'UL', '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s')
+                RETURNING id, member_no
+            """ % (
+                member_no, esc(body.get('inn')), esc(body.get('company_name')),
+                esc(body.get('director_fio')), esc(body.get('director_phone')),
+                esc(body.get('contact_person_fio')), esc(body.get('contact_person_phone')),
+                esc(body.get('bank_bik')), esc(body.get('bank_account')),
+            ))
+        result = cur.fetchone()
+        label = body.get('last_name', body.get('company_name', ''))
+        audit_log(cur, staff, 'create', 'member', result[0], '%s %s' % (result[1], label), '', ip)
+        conn.commit()
+        return {'id': result[0], 'member_no': result[1]}
+
+    elif method == 'PUT':
+        member_id = body.get('id')
+        updates = []
+        for f in ['last_name','first_name','middle_name','birth_place','inn','passport_series','passport_number',
+                   'passport_dept_code','passport_issued_by','registration_address','phone','email','telegram',
+                   'bank_bik','bank_account','marital_status','spouse_fio','spouse_phone','extra_phone',
+                   'extra_contact_fio','company_name','director_fio','director_phone','contact_person_fio',
+                   'contact_person_phone','status']:
+            if f in body:
+                updates.append("%s = '%s'" % (f, esc(body[f])))
+        for f in ['birth_date','passport_issue_date']:
+            if f in body and body[f]:
+                updates.append("%s = '%s'" % (f, body[f]))
+        if updates:
+            updates.append("updated_at = NOW()")
+            cur.execute("UPDATE members SET %s WHERE id = %s" % (', '.join(updates), member_id))
+            changed = [f for f in body if f not in ('id', 'entity')]
+            audit_log(cur, staff, 'update', 'member', member_id, '', ', '.join(changed), ip)
+            conn.commit()
+        return {'success': True}
+
+    elif method == 'DELETE':
+        member_id = params.get('id')
+        cur.execute("SELECT member_no, CASE WHEN member_type='FL' THEN CONCAT(last_name,' ',first_name,' ',middle_name) ELSE company_name END as name FROM members WHERE id=%s" % member_id)
+        mem = cur.fetchone()
+        if not mem:
+            return {'error': 'Пайщик не найден'}
+        member_no, member_name = mem[0], mem[1]
+        cur.execute("SELECT COUNT(*) FROM loans WHERE member_id=%s AND status='active'" % member_id)
+        if cur.fetchone()[0] > 0:
+            return {'error': 'Нельзя удалить пайщика с активными займами'}
+        cur.execute("SELECT COUNT(*) FROM savings WHERE member_id=%s AND status='active'" % member_id)
+        if cur.fetchone()[0] > 0:
+            return {'error': 'Нельзя удалить пайщика с активными сбережениями'}
+        cur.execute("SELECT COUNT(*) FROM share_accounts WHERE member_id=%s AND status='active'" % member_id)
+        if cur.fetchone()[0] > 0:
+            return {'error': 'Нельзя удалить пайщика с активными паевыми счетами'}
+        cur.execute("DELETE FROM users WHERE member_id=%s" % member_id)
+        cur.execute("DELETE FROM members WHERE id=%s" % member_id)
+        audit_log(cur, staff, 'delete', 'member', member_id, member_no, member_name, ip)
+        conn.commit()
+        return {'success': True}
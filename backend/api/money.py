@@ -0,0 +1,79 @@
+"""Денежное ядро для горячих циклов начислений и распределения платежей: суммы в целых копейках,
+ставки в тысячных долях процента, округление half-up на целых числах — результат совпадает с Decimal.quantize.
+Файл одинаковый в backend/api и backend/cron-accrue."""
+from decimal import Decimal, ROUND_HALF_UP
+
+RATE_SCALE = 1000  # NUMERIC(6,3): 18.125% → 18125
+DECIMAL_PREC = 28  # точность контекста Decimal по умолчанию
+
+
+class FractionalAmount(ValueError):
+    """Сумма с долями копейки или ставка точнее 0.001% — такие входы считаются через Decimal"""
+
+
+def to_units(value, scale):
+    d = value if isinstance(value, Decimal) else Decimal(str(value))
+    n = d * scale
+    i = int(n)
+    if i != n:
+        raise FractionalAmount(value)
+    return i
+
+
+def to_kop(value):
+    return to_units(value, 100)
+
+
+def to_rate(value):
+    return to_units(value, RATE_SCALE)
+
+
+def kop_decimal(kop):
+    return Decimal(kop).scaleb(-2)
+
+
+def div_half_up(num, den):
+    """num / den, округлённое до целого half-up (половина — от нуля), den > 0"""
+    if num >= 0:
+        return (2 * num + den) // (2 * den)
+    return -((2 * -num + den) // (2 * den))
+
+
+def interest_kop(balance_kop, rate, days, year_days):
+    """balance × rate% × days / year_days в копейках; rate — из to_rate"""
+    return div_half_up(balance_kop * rate * days, 100 * RATE_SCALE * year_days)
+
+
+def period_interest(balance, rate, days, year_days):
+    """Проценты в Decimal для одиночных расчётов: через копейки, а с долями копейки — исходной формулой Decimal"""
+    try:
+        return kop_decimal(interest_kop(to_kop(balance), to_rate(rate), days, year_days))
+    except FractionalAmount:
+        return (Decimal(str(balance)) * Decimal(str(rate)) / Decimal('100') * Decimal(days) / Decimal(year_days)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def factor(value):
+    """Decimal-множитель → (коэффициент, порядок) для mul_kop"""
+    sign, digits, exp = Decimal(value).as_tuple()
+    coef = int(''.join(map(str, digits)))
+    return (-coef if sign else coef), exp
+
+
+def mul_kop(kop, fac):
+    """kop × множитель с округлением до копейки half-up. Произведение, как и в Decimal,
+    сначала округляется до 28 значащих цифр half-even — иначе на множителях вида rate/1200 расходится с Decimal"""
+    coef, exp = fac
+    p = kop * coef
+    exp -= 2
+    a = -p if p < 0 else p
+    if a >= 10 ** DECIMAL_PREC:
+        drop = len(str(a)) - DECIMAL_PREC
+        den = 10 ** drop
+        q, r = divmod(a, den)
+        if 2 * r > den or (2 * r == den and q & 1):
+            q += 1
+        p = -q if p < 0 else q
+        exp += drop
+    if exp >= -2:
+        return p * 10 ** (exp + 2)
+    return div_half_up(p, 10 ** (-exp - 2))
@@ -0,0 +1,460 @@
+"""Рассылки в Telegram, MAX и по e-mail"""
+import json
+import os
+from datetime import datetime, date
+from decimal import Decimal
+import urllib.parse
+import http_pool
+from core import esc
+
+# Сколько секунд запрос рассылки сам отправляет её после commit; остаток и повторы дошлёт крон (action=drain_outbox)
+BROADCAST_INLINE_SECONDS = 10
+
+def queue_broadcast(cur, notif_id, channel, payload, recipients_sql):
+    """Ставит рассылку notification_history в notification_outbox одной вставкой; recipients_sql отдаёт (адрес, user_id).
+    Отправляет drain_broadcast после commit, недоотправленное — крон; итоговые счётчики проставляет outbox"""
+    cur.execute("""INSERT INTO notification_outbox (channel, recipient, user_id, payload, source, source_id)
+        SELECT '%s', r.recipient, r.user_id, '%s'::jsonb, 'notification', %d FROM (%s) AS r(recipient, user_id)""" % (
+        channel, esc(json.dumps(payload, ensure_ascii=False)), notif_id, recipients_sql))
+    queued = cur.rowcount
+    if not queued:
+        cur.execute("UPDATE notification_history SET status='sent', sent_count=0, failed_count=0, sent_at=NOW() WHERE id=%d" % notif_id)
+    return queued
+
+def drain_broadcast(cur, conn, source, source_id):
+    """Отправляет только что поставленную рассылку, не дожидаясь крона, но не дольше BROADCAST_INLINE_SECONDS.
+    Вызывается после commit: строки берутся FOR UPDATE SKIP LOCKED, параллельный drain_outbox их не продублирует"""
+    import outbox
+    from bots import get_telegram_bot_token
+    return outbox.drain(cur, conn, get_telegram_bot_token(cur), os.environ.get('MAX_BOT_TOKEN', ''),
+                        seconds=BROADCAST_INLINE_SECONDS, source=source, source_id=source_id)['sent']
+
+def handle_notifications(method, params, body, staff, cur, conn):
+    """Управление уведомлениями: Telegram, Email, общая история"""
+    if not staff:
+        return {'error': 'Требуется авторизация', '_status': 401}
+    
+    action = body.get('action') or params.get('action', '')
+
+    if action == 'channels':
+        cur.execute("SELECT id, channel, enabled, settings, updated_at FROM notification_channels ORDER BY id")
+        cols = [d[0] for d in cur.description]
+        rows = [dict(zip(cols, r)) for r in cur.fetchall()]
+        for r in rows:
+            for k, v in r.items():
+                if isinstance(v, (datetime, date)):
+                    r[k] = v.isoformat()
+        return rows
+
+    if action == 'save_channel':
+        channel = body.get('channel', '')
+        enabled = body.get('enabled')
+        settings = body.get('settings', {})
+        if channel not in ('push', 'telegram', 'email', 'max'):
+            return {'error': 'Неизвестный канал'}
+        parts = []
+        if enabled is not None:
+            parts.append("enabled=%s" % ('true' if enabled else 'false'))
+        if settings:
+            import json as jn
+            parts.append("settings='%s'::jsonb" % jn.dumps(settings, ensure_ascii=False).replace("'", "''"))
+        if parts:
+            parts.append("updated_at=NOW()")
+            cur.execute("UPDATE notification_channels SET %s WHERE channel='%s'" % (', '.join(parts), channel))
+            conn.commit()
+        return {'success': True}
+
+    if action == 'telegram_subscribers':
+        cur.execute("""SELECT ts.id, ts.user_id, u.name, ts.chat_id, ts.username, ts.first_name, ts.subscribed_at, ts.active
+            FROM telegram_subscribers ts LEFT JOIN users u ON u.id=ts.user_id
+            WHERE ts.active=true ORDER BY ts.subscribed_at DESC""")
+        cols = [d[0] for d in cur.description]
+        rows = [dict(zip(cols, r)) for r in cur.fetchall()]
+        for r in rows:
+            for k, v in r.items():
+                if isinstance(v, (datetime, date)):
+                    r[k] = v.isoformat()
+        return rows
+
+    if action == 'send_telegram':
+        title = body.get('title', '').strip()
+        msg_body = body.get('body', '').strip()
+        target = body.get('target', 'all')
+        target_user_ids = body.get('target_user_ids', [])
+        if not msg_body:
+            return {'error': 'Введите текст сообщения'}
+
+        cur.execute("SELECT settings FROM notification_channels WHERE channel='telegram'")
+        row = cur.fetchone()
+        if not row:
+            return {'error': 'Канал Telegram не настроен'}
+        ch_settings = row[0] if isinstance(row[0], dict) else json.loads(row[0])
+        bot_token = ch_settings.get('bot_token', '')
+        if not bot_token:
+            return {'error': 'Не указан токен бота Telegram'}
+
+        text = title + '\n\n' + msg_body if title else msg_body
+
+        if target == 'all':
+            recipients_sql = "SELECT chat_id::text, user_id FROM telegram_subscribers WHERE active=true"
+        elif target == 'selected' and target_user_ids:
+            ids_str = ','.join(str(int(i)) for i in target_user_ids)
+            recipients_sql = "SELECT chat_id::text, user_id FROM telegram_subscribers WHERE user_id IN (%s) AND active=true" % ids_str
+        else:
+            return {'error': 'Неверный тип рассылки'}
+
+        cur.execute("""INSERT INTO notification_history (channel, title, body, target, target_user_ids, created_by, status)
+            VALUES ('telegram', '%s', '%s', '%s', %s, %d, 'sending') RETURNING id""" % (
+            title.replace("'", "''"), msg_body.replace("'", "''"), target.replace("'", "''"),
+            "ARRAY[%s]::integer[]" % ','.join(str(int(i)) for i in target_user_ids) if target_user_ids else 'NULL',
+            staff['user_id']))
+        notif_id = cur.fetchone()[0]
+        queued = queue_broadcast(cur, notif_id, 'telegram', {'text': text}, recipients_sql)
+        conn.commit()
+        sent = drain_broadcast(cur, conn, 'notification', notif_id) if queued else 0
+        return {'success': True, 'notification_id': notif_id, 'queued': queued, 'sent': sent}
+
+    if action == 'send_email':
+        title = body.get('title', '').strip()
+        msg_body = body.get('body', '').strip()
+        target = body.get('target', 'all')
+        target_user_ids = body.get('target_user_ids', [])
+        if not title or not msg_body:
+            return {'error': 'Заполните заголовок и текст'}
+
+        cur.execute("SELECT settings FROM notification_channels WHERE channel='email'")
+        row = cur.fetchone()
+        if not row:
+            return {'error': 'Канал Email не настроен'}
+        ch_settings = row[0] if isinstance(row[0], dict) else json.loads(row[0])
+        if not ch_settings.get('smtp_host') or not ch_settings.get('smtp_user') or not ch_settings.get('from_email'):
+            return {'error': 'SMTP не настроен. Заполните настройки Email'}
+
+        if target == 'all':
+            recipients_sql = "SELECT email, id FROM users WHERE email IS NOT NULL AND email != '' AND status='active'"
+        elif target == 'selected' and target_user_ids:
+            ids_str = ','.join(str(int(i)) for i in target_user_ids)
+            recipients_sql = "SELECT email, id FROM users WHERE id IN (%s) AND email IS NOT NULL AND email != ''" % ids_str
+        else:
+            return {'error': 'Неверный тип рассылки'}
+
+        cur.execute("""INSERT INTO notification_history (channel, title, body, target, target_user_ids, created_by, status)
+            VALUES ('email', '%s', '%s', '%s', %s, %d, 'sending') RETURNING id""" % (
+            title.replace("'", "''"), msg_body.replace("'", "''"), target.replace("'", "''"),
+            "ARRAY[%s]::integer[]" % ','.join(str(int(i)) for i in target_user_ids) if target_user_ids else 'NULL',
+            staff['user_id']))
+        notif_id = cur.fetchone()[0]
+        queued = queue_broadcast(cur, notif_id, 'email', {'subject': title, 'text': msg_body}, recipients_sql)
+        conn.commit()
+        sent = drain_broadcast(cur, conn, 'notification', notif_id) if queued else 0
+        return {'success': True, 'notification_id': notif_id, 'queued': queued, 'sent': sent}
+
+    if action == 'history':
+        channel = params.get('channel', '')
+        limit = int(params.get('limit', 50))
+        offset = int(params.get('offset', 0))
+        where = "WHERE nh.channel='%s'" % channel.replace("'", "''") if channel else ""
+        cur.execute("""SELECT nh.*, u.name as created_by_name
+            FROM notification_history nh LEFT JOIN users u ON u.id=nh.created_by
+            %s ORDER BY nh.created_at DESC LIMIT %d OFFSET %d""" % (where, limit, offset))
+        cols = [d[0] for d in cur.description]
+        rows = [dict(zip(cols, r)) for r in cur.fetchall()]
+        for r in rows:
+            for k, v in r.items():
+                if isinstance(v, (datetime, date)):
+                    r[k] = v.isoformat()
+                elif isinstance(v, Decimal):
+                    r[k] = float(v)
+        count_sql = "SELECT COUNT(*) FROM notification_history" + (" WHERE channel='%s'" % channel.replace("'", "''") if channel else "")
+        cur.execute(count_sql)
+        total = cur.fetchone()[0]
+        return {'items': rows, 'total': total}
+
+    if action == 'history_log':
+        notif_id = int(params.get('id', body.get('id', 0)))
+        if not notif_id:
+            return {'error': 'Не указан ID уведомления'}
+        cur.execute("""SELECT nhl.*, u.name as user_name
+            FROM notification_history_log nhl LEFT JOIN users u ON u.id=nhl.user_id
+            WHERE nhl.notification_id=%d ORDER BY nhl.created_at DESC""" % notif_id)
+        cols = [d[0] for d in cur.description]
+        rows = [dict(zip(cols, r)) for r in cur.fetchall()]
+        for r in rows:
+            for k, v in r.items():
+                if isinstance(v, (datetime, date)):
+                    r[k] = v.isoformat()
+        return rows
+
+    if action == 'stats':
+        cur.execute("SELECT COUNT(*) FROM telegram_subscribers WHERE active=true")
+        tg_subs = cur.fetchone()[0]
+        cur.execute("SELECT COUNT(*) FROM max_subscribers WHERE active=true")
+        max_subs = cur.fetchone()[0]
+        cur.execute("SELECT COUNT(*) FROM users WHERE email IS NOT NULL AND email != '' AND status='active'")
+        email_users = cur.fetchone()[0]
+        cur.execute("SELECT channel, COUNT(*) as cnt FROM notification_history GROUP BY channel")
+        channel_counts = {}
+        for r in cur.fetchall():
+            channel_counts[r[0]] = r[1]
+        return {
+            'telegram_subscribers': tg_subs,
+            'max_subscribers': max_subs,
+            'email_users': email_users,
+            'telegram_messages': channel_counts.get('telegram', 0),
+            'max_messages': channel_counts.get('max', 0),
+            'email_messages': channel_counts.get('email', 0)
+        }
+
+    if action == 'test_telegram':
+        chat_id = body.get('chat_id', '')
+        cur.execute("SELECT settings FROM notification_channels WHERE channel='telegram'")
+        row = cur.fetchone()
+        if not row:
+            return {'error': 'Канал не настроен'}
+        ch_settings = row[0] if isinstance(row[0], dict) else json.loads(row[0])
+        bot_token = ch_settings.get('bot_token', '')
+        if not bot_token:
+            return {'error': 'Не указан токен бота'}
+        if not chat_id:
+            return {'error': 'Не указан chat_id'}
+        try:
+            url = 'https://api.telegram.org/bot%s/sendMessage' % bot_token
+            data = json.dumps({'chat_id': int(chat_id), 'text': 'Тестовое уведомление из системы'}).encode('utf-8')
+            http_pool.request(url, data=data, headers={'Content-Type': 'application/json'})
+            return {'success': True}
+        except Exception as e:
+            return {'error': 'Ошибка отправки: %s' % str(e)}
+
+    if action == 'test_email':
+        to_email = body.get('to_email', '').strip()
+        if not to_email:
+            return {'error': 'Укажите email для теста'}
+        cur.execute("SELECT settings FROM notification_channels WHERE channel='email'")
+        row = cur.fetchone()
+        if not row:
+            return {'error': 'Канал не настроен'}
+        ch_settings = row[0] if isinstance(row[0], dict) else json.loads(row[0])
+        smtp_host = ch_settings.get('smtp_host', '')
+        smtp_port = int(ch_settings.get('smtp_port', 587))
+        smtp_user = ch_settings.get('smtp_user', '')
+        smtp_pass = ch_settings.get('smtp_pass', '')
+        from_email = ch_settings.get('from_email', '')
+        from_name = ch_settings.get('from_name', '')
+        if not smtp_host or not smtp_user or not from_email:
+            return {'error': 'SMTP не настроен'}
+        try:
+            import smtplib
+            from email.mime.text import MIMEText
+            msg = MIMEText('Тестовое уведомление из системы', 'plain', 'utf-8')
+            msg['Subject'] = 'Тестовое уведомление'
+            msg['From'] = '%s <%s>' % (from_name, from_email) if from_name else from_email
+            msg['To'] = to_email
+            with smtplib.SMTP(smtp_host, smtp_port, timeout=15) as server:
+                server.starttls()
+                server.login(smtp_user, smtp_pass)
+                server.sendmail(from_email, [to_email], msg.as_string())
+            return {'success': True}
+        except Exception as e:
+            return {'error': 'Ошибка: %s' % str(e)}
+
+    if action == 'max_subscribers':
+        cur.execute("""SELECT ms.id, ms.user_id, u.name, ms.chat_id, ms.username, ms.first_name, ms.subscribed_at, ms.active
+            FROM max_subscribers ms LEFT JOIN users u ON u.id=ms.user_id
+            WHERE ms.active=true ORDER BY ms.subscribed_at DESC""")
+        cols = [d[0] for d in cur.description]
+        rows = [dict(zip(cols, r)) for r in cur.fetchall()]
+        for r in rows:
+            for k, v in r.items():
+                if isinstance(v, (datetime, date)):
+                    r[k] = v.isoformat()
+        return rows
+
+    if action == 'send_max':
+        title = body.get('title', '').strip()
+        msg_body = body.get('body', '').strip()
+        target = body.get('target', 'all')
+        target_user_ids = body.get('target_user_ids', [])
+        if not msg_body:
+            return {'error': 'Введите текст сообщения'}
+        bot_token = os.environ.get('MAX_BOT_TOKEN', '')
+        if not bot_token:
+            return {'error': 'Токен MAX-бота не настроен'}
+        text = title + '\n\n' + msg_body if title else msg_body
+        if target == 'all':
+            recipients_sql = "SELECT chat_id::text, user_id FROM max_subscribers WHERE active=true"
+        elif target == 'selected' and target_user_ids:
+            ids_str = ','.join(str(int(i)) for i in target_user_ids)
+            recipients_sql = "SELECT chat_id::text, user_id FROM max_subscribers WHERE user_id IN (%s) AND active=true" % ids_str
+        else:
+            return {'error': 'Неверный тип рассылки'}
+
+        cur.execute("""INSERT INTO notification_history (channel, title, body, target, target_user_ids, created_by, status)
+            VALUES ('max', '%s', '%s', '%s', %s, %d, 'sending') RETURNING id""" % (
+            title.replace("'", "''"), msg_body.replace("'", "''"), target.replace("'", "''"),
+            "ARRAY[%s]::integer[]" % ','.join(str(int(i)) for i in target_user_ids) if target_user_ids else 'NULL',
+            staff['user_id']))
+        notif_id = cur.fetchone()[0]
+        queued = queue_broadcast(cur, notif_id, 'max', {'text': text}, recipients_sql)
+        conn.commit()
+        sent = drain_broadcast(cur, conn, 'notification', notif_id) if queued else 0
+        return {'success': True, 'notification_id': notif_id, 'queued': queued, 'sent': sent}
+
+    if action == 'test_max':
+        chat_id = body.get('chat_id', '')
+        bot_token = os.environ.get('MAX_BOT_TOKEN', '')
+        if not bot_token:
+            return {'error': 'Токен MAX-бота не настроен'}
+        if not chat_id:
+            return {'error': 'Не указан chat_id'}
+        try:
+            url = 'https://botapi.max.ru/messages?access_token=%s&chat_id=%s' % (urllib.parse.quote(bot_token), int(chat_id))
+            data = json.dumps({'text': 'Тестовое уведомление из системы'}).encode('utf-8')
+            http_pool.request(url, data=data, headers={'Content-Type': 'application/json'})
+            return {'success': True}
+        except Exception as e:
+            return {'error': 'Ошибка отправки: %s' % str(e)}
+
+    if action == 'set_max_webhook':
+        bot_token = os.environ.get('MAX_BOT_TOKEN', '')
+        if not bot_token:
+            return {'error': 'Токен MAX-бота не найден'}
+        api_base = os.environ.get('API_URL', 'https://functions.poehali.dev/f35e253c-613f-4ad6-8deb-2c20b4c5d450')
+        webhook_url = body.get('webhook_url', '') or '%s?entity=max_bot' % api_base
+        try:
+            url = 'https://botapi.max.ru/subscriptions?access_token=%s' % urllib.parse.quote(bot_token)
+            data = json.dumps({'url': webhook_url, 'update_types': ['bot_started', 'message_created']}).encode('utf-8')
+            resp = http_pool.request(url, data=data, headers={'Content-Type': 'application/json'})
+            result = json.loads(resp.decode('utf-8'))
+            return {'success': True, 'max_result': result, 'webhook_url': webhook_url}
+        except Exception as e:
+            return {'error': 'Ошибка: %s' % str(e)}
+
+    if action == 'delete_max_webhook':
+        bot_token = os.environ.get('MAX_BOT_TOKEN', '')
+        if not bot_token:
+            return {'error': 'Токен MAX-бота не найден'}
+        try:
+            url = 'https://botapi.max.ru/subscriptions?access_token=%s' % urllib.parse.quote(bot_token)
+            resp = http_pool.request(url, method='DELETE')
+            result = json.loads(resp.decode('utf-8'))
+            return {'success': True, 'max_result': result}
+        except Exception as e:
+            return {'error': 'Ошибка: %s' % str(e)}
+
+    if action == 'max_webhook_info':
+        bot_token = os.environ.get('MAX_BOT_TOKEN', '')
+        if not bot_token:
+            return {'url': '', 'error': 'Токен MAX-бота не найден'}
+        try:
+            url = 'https://botapi.max.ru/subscriptions?access_token=%s' % urllib.parse.quote(bot_token)
+            resp = http_pool.request(url)
+            result = json.loads(resp.decode('utf-8'))
+            subs = result.get('subscriptions', [])
+            if subs:
+                s = subs[0]
+                return {'url': s.get('url', ''), 'update_types': s.get('update_types', [])}
+            return {'url': ''}
+        except Exception as e:
+            return {'error': 'Ошибка: %s' % str(e)}
+
+    if action == 'get_telegram_settings':
+        cur.execute("SELECT key, value FROM telegram_settings")
+        rows = cur.fetchall()
+        return {r[0]: r[1] for r in rows}
+
+    if action == 'save_telegram_settings':
+        settings = body.get('settings', {})
+        allowed = {'enabled', 'reminder_days', 'overdue_notify', 'savings_enabled', 'savings_reminder_days',
+                   'tpl_payment_today', 'tpl_payment_tomorrow', 'tpl_payment_days', 'tpl_overdue',
+                   'tpl_savings_today', 'tpl_savings_tomorrow', 'tpl_savings_days'}
+        for k, v in settings.items():
+            if k not in allowed:
+                continue
+            val = str(v).replace("'", "''")
+            cur.execute("SELECT id FROM telegram_settings WHERE key='%s'" % k)
+            if cur.fetchone():
+                cur.execute("UPDATE telegram_settings SET value='%s', updated_at=NOW() WHERE key='%s'" % (val, k))
+            else:
+                cur.execute("INSERT INTO telegram_settings (key, value) VALUES ('%s', '%s')" % (k, val))
+        conn.commit()
+        return {'success': True}
+
+    if action == 'get_max_settings':
+        cur.execute("SELECT key, value FROM max_settings")
+        rows = cur.fetchall()
+        return {r[0]: r[1] for r in rows}
+
+    if action == 'save_max_settings':
+        settings = body.get('settings', {})
+        allowed = {'enabled', 'reminder_days', 'overdue_notify', 'savings_enabled', 'savings_reminder_days',
+                   'tpl_payment_today', 'tpl_payment_tomorrow', 'tpl_payment_days', 'tpl_overdue',
+                   'tpl_savings_today', 'tpl_savings_tomorrow', 'tpl_savings_days'}
+        for k, v in settings.items():
+            if k not in allowed:
+                continue
+            val = str(v).replace("'", "''")
+            cur.execute("SELECT id FROM max_settings WHERE key='%s'" % k)
+            if cur.fetchone():
+                cur.execute("UPDATE max_settings SET value='%s', updated_at=NOW() WHERE key='%s'" % (val, k))
+            else:
+                cur.execute("INSERT INTO max_settings (key, value) VALUES ('%s', '%s')" % (k, val))
+        conn.commit()
+        return {'success': True}
+
+    if action == 'set_webhook':
+        bot_token = os.environ.get('TELEGRAM_BOT_TOKEN', '')
+        if not bot_token:
+            cur.execute("SELECT settings FROM notification_channels WHERE channel='telegram'")
+            row = cur.fetchone()
+            if row:
+                ch = row[0] if isinstance(row[0], dict) else json.loads(row[0])
+                bot_token = ch.get('bot_token', '')
+        if not bot_token:
+            return {'error': 'Токен бота не найден'}
+        webhook_url = body.get('webhook_url', '') or '%s?entity=telegram_bot' % os.environ.get('API_URL', 'https://functions.poehali.dev/f35e253c-613f-4ad6-8deb-2c20b4c5d450')
+        try:
+            url = 'https://api.telegram.org/bot%s/setWebhook' % bot_token
+            data = json.dumps({'url': webhook_url}).encode('utf-8')
+            resp = http_pool.request(url, data=data, headers={'Content-Type': 'application/json'})
+            result = json.loads(resp.decode('utf-8'))
+            return {'success': True, 'telegram_result': result, 'webhook_url': webhook_url}
+        except Exception as e:
+            return {'error': 'Ошибка: %s' % str(e)}
+
+    if action == 'delete_webhook':
+        bot_token = os.environ.get('TELEGRAM_BOT_TOKEN', '')
+        if not bot_token:
+            cur.execute("SELECT settings FROM notification_channels WHERE channel='telegram'")
+            row = cur.fetchone()
+            if row:
+                ch = row[0] if isinstance(row[0], dict) else json.loads(row[0])
+                bot_token = ch.get('bot_token', '')
+        if not bot_token:
+            return {'error': 'Токен бота не найден'}
+        try:
+            url = 'https://api.telegram.org/bot%s/deleteWebhook' % bot_token
+            resp = http_pool.request(url, data=b'{}', headers={'Content-Type': 'application/json'})
+            result = json.loads(resp.decode('utf-8'))
+            return {'success': True, 'telegram_result': result}
+        except Exception as e:
+            return {'error': 'Ошибка: %s' % str(e)}
+
+    if action == 'webhook_info':
+        bot_token = os.environ.get('TELEGRAM_BOT_TOKEN', '')
+        if not bot_token:
+            cur.execute("SELECT settings FROM notification_channels WHERE channel='telegram'")
+            row = cur.fetchone()
+            if row:
+                ch = row[0] if isinstance(row[0], dict) else json.loads(row[0])
+                bot_token = ch.get('bot_token', '')
+        if not bot_token:
+            return {'error': 'Токен бота не найден'}
+        try:
+            url = 'https://api.telegram.org/bot%s/getWebhookInfo' % bot_token
+            resp = http_pool.request(url)
+            result = json.loads(resp.decode('utf-8'))
+            return result.get('result', {})
+        except Exception as e:
+            return {'error': 'Ошибка: %s' % str(e)}
+
+    return {'error': 'Неизвестное действие: %s' % action}
@@ -0,0 +1,150 @@
+"""Организации и настройки организации"""
+import os
+import base64
+from core import audit_log, esc, query_one, query_rows
+
+def handle_org_settings(method, body, staff, cur, conn):
+    if staff['role'] != 'admin':
+        return {'_status': 403, 'error': 'Только администратор может управлять настройками'}
+    if method == 'GET':
+        cur.execute("SELECT key, value FROM organization_settings ORDER BY id")
+        rows = cur.fetchall()
+        return {r[0]: r[1] for r in rows}
+    elif method == 'POST':
+        data = body.get('settings', {})
+        allowed = ('name', 'inn', 'ogrn', 'director_fio', 'bank_name', 'bik', 'rs', 'phone', 'website', 'email', 'telegram', 'max_messenger')
+        for k, v in data.items():
+            if k in allowed:
+                cur.execute("INSERT INTO organization_settings (key, value, updated_at) VALUES ('%s', '%s', NOW()) ON CONFLICT (key) DO UPDATE SET value='%s', updated_at=NOW()" % (esc(k), esc(v), esc(v)))
+        audit_log(cur, staff, 'update', 'org_settings', None, '', ', '.join(data.keys()), '')
+        conn.commit()
+        return {'success': True}
+    return {'error': 'Неизвестный метод'}
+
+def handle_organizations(method, params, body, staff, cur, conn, ip=''):
+    if method == 'GET':
+        org_id = params.get('id')
+        if org_id:
+            return query_one(cur, "SELECT * FROM organizations WHERE id=%s AND is_active=true" % org_id)
+        return query_rows(cur, "SELECT * FROM organizations WHERE is_active=true ORDER BY name")
+
+    elif method == 'POST':
+        action = body.get('action', 'create')
+
+        if action == 'create':
+            if staff.get('role') != 'admin':
+                return {'_status': 403, 'error': 'Только администратор может создавать организации'}
+            cur.execute("""
+                INSERT INTO organizations (name, short_name, inn, ogrn, kpp, director_fio, director_position,
+                    legal_address, actual_address, bank_name, bik, rs, ks, phone, email, website, telegram, max_messenger, logo_url)
+                VALUES ('%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s')
+                RETURNING id
+            """ % (
+                esc(body.get('name', '')), esc(body.get('short_name', '')), esc(body.get('inn', '')),
+                esc(body.get('ogrn', '')), esc(body.get('kpp', '')), esc(body.get('director_fio', '')),
+                esc(body.get('director_position', '')), esc(body.get('legal_address', '')),
+                esc(body.get('actual_address', '')), esc(body.get('bank_name', '')),
+                esc(body.get('bik', '')), esc(body.get('rs', '')), esc(body.get('ks', '')),
+                esc(body.get('phone', '')), esc(body.get('email', '')), esc(body.get('website', '')),
+                esc(body.get('telegram', '')), esc(body.get('max_messenger', '')), esc(body.get('logo_url', ''))
+            ))
+            org_id = cur.fetchone()[0]
+            audit_log(cur, staff, 'create', 'organization', org_id, esc(body.get('name', '')), '', ip)
+            conn.commit()
+            return {'id': org_id}
+
+        elif action == 'update':
+            if staff.get('role') != 'admin':
+                return {'_status': 403, 'error': 'Только администратор может редактировать организации'}
+            org_id = body.get('id')
+            if not org_id:
+                return {'error': 'Не указан id организации'}
+            fields = []
+            allowed = ('name', 'short_name', 'inn', 'ogrn', 'kpp', 'director_fio', 'director_position',
+                        'legal_address', 'actual_address', 'bank_name', 'bik', 'rs', 'ks',
+                        'phone', 'email', 'website', 'telegram', 'max_messenger', 'logo_url',
+                        'signature_url', 'stamp_url')
+            for k in allowed:
+                if k in body:
+                    fields.append("%s='%s'" % (k, esc(body[k])))
+            if fields:
+                fields.append("updated_at=NOW()")
+                cur.execute("UPDATE organizations SET %s WHERE id=%s" % (', '.join(fields), org_id))
+            audit_log(cur, staff, 'update', 'organization', org_id, esc(body.get('name', '')), '', ip)
+            conn.commit()
+            return {'success': True}
+
+        elif action == 'upload_logo':
+            if staff.get('role') != 'admin':
+                return {'_status': 403, 'error': 'Только администратор может загружать логотип'}
+            org_id = body.get('id')
+            if not org_id:
+                return {'error': 'Не указан id организации'}
+            logo_b64 = body.get('logo')
+            if not logo_b64:
+                return {'error': 'Не передан логотип'}
+            allowed_types = {'image/png': 'png', 'image/jpeg': 'jpg', 'image/webp': 'webp', 'image/svg+xml': 'svg'}
+            ct = body.get('content_type', 'image/png')
+            if ct not in allowed_types:
+                return {'_status': 400, 'error': 'Недопустимый формат. Допустимы: PNG, JPEG, WebP, SVG'}
+            import boto3
+            logo_data = base64.b64decode(logo_b64)
+            if len(logo_data) > 2 * 1024 * 1024:
+                return {'_status': 400, 'error': 'Файл слишком большой. Максимум 2 МБ'}
+            ext = allowed_types[ct]
+            s3 = boto3.client('s3',
+                endpoint_url='https://bucket.poehali.dev',
+                aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+                aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'])
+            s3_key = 'org_logos/%s.%s' % (org_id, ext)
+            s3.put_object(Bucket='files', Key=s3_key, Body=logo_data, ContentType=ct)
+            cdn_url = 'https://cdn.poehali.dev/projects/%s/bucket/%s' % (os.environ['AWS_ACCESS_KEY_ID'], s3_key)
+            cur.execute("UPDATE organizations SET logo_url='%s', updated_at=NOW() WHERE id=%s" % (esc(cdn_url), org_id))
+            audit_log(cur, staff, 'upload_logo', 'organization', org_id, '', '', ip)
+            conn.commit()
+            return {'success': True, 'logo_url': cdn_url}
+
+        elif action == 'upload_image':
+            if staff.get('role') != 'admin':
+                return {'_status': 403, 'error': 'Недостаточно прав'}
+            org_id = body.get('id')
+            image_type = body.get('image_type')
+            if not org_id or image_type not in ('signature', 'stamp'):
+                return {'error': 'Не указан id или тип изображения'}
+            img_b64 = body.get('image')
+            if not img_b64:
+                return {'error': 'Не передано изображение'}
+            allowed_types = {'image/png': 'png', 'image/jpeg': 'jpg', 'image/webp': 'webp'}
+            ct = body.get('content_type', 'image/png')
+            if ct not in allowed_types:
+                return {'_status': 400, 'error': 'Допустимы: PNG, JPEG, WebP'}
+            import boto3
+            img_data = base64.b64decode(img_b64)
+            if len(img_data) > 2 * 1024 * 1024:
+                return {'_status': 400, 'error': 'Файл слишком большой. Максимум 2 МБ'}
+            ext = allowed_types[ct]
+            s3 = boto3.client('s3',
+                endpoint_url='https://bucket.poehali.dev',
+                aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+                aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'])
+            s3_key = 'org_%s/%s.%s' % (image_type, org_id, ext)
+            s3.put_object(Bucket='files', Key=s3_key, Body=img_data, ContentType=ct)
+            cdn_url = 'https://cdn.poehali.dev/projects/%s/bucket/%s' % (os.environ['AWS_ACCESS_KEY_ID'], s3_key)
+            col = 'signature_url' if image_type == 'signature' else 'stamp_url'
+            cur.execute("UPDATE organizations SET %s='%s', updated_at=NOW() WHERE id=%s" % (col, esc(cdn_url), org_id))
+            audit_log(cur, staff, 'upload_%s' % image_type, 'organization', org_id, '', '', ip)
+            conn.commit()
+            return {'success': True, 'url': cdn_url}
+
+        elif action == 'delete':
+            if staff.get('role') != 'admin':
+                return {'_status': 403, 'error': 'Только администратор может удалять организации'}
+            org_id = body.get('id')
+            if not org_id:
+                return {'error': 'Не указан id организации'}
+            cur.execute("UPDATE organizations SET is_active=false, updated_at=NOW() WHERE id=%s" % org_id)
+            audit_log(cur, staff, 'delete', 'organization', org_id, '', '', ip)
+            conn.commit()
+            return {'success': True}
+
+    return {'error': 'Неизвестный метод'}
@@ -0,0 +1,208 @@
+"""Отправка очереди notification_outbox: рассылки Telegram, MAX, e-mail и Web Push, напоминания крона.
+Очередь разбирают крон (action=drain_outbox) и api сразу после commit рассылки, ограниченно по времени.
+Файл одинаковый в backend/api и backend/cron-accrue."""
+import json
+import os
+import time
+import urllib.parse
+
+import http_pool
+
+OUTBOX_BATCH = 100
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_BACKOFF_SECONDS = 30
+OUTBOX_DRAIN_SECONDS = 25
+# Сообщений в секунду на канал: Telegram ограничивает бота ~30/с, SMTP и push-сервисы режут массовые всплески
+OUTBOX_RATE = {'telegram': 25, 'max': 20, 'email': 5, 'push': 50}
+# Ответы, после которых повтор бесполезен: чат/подписка удалены или бот заблокирован
+OUTBOX_PERMANENT_CODES = (400, 403, 404, 410)
+
+
+def send_tg_message(bot_token, chat_id, text):
+    url = 'https://api.telegram.org/bot%s/sendMessage' % bot_token
+    data = json.dumps({'chat_id': chat_id, 'text': text, 'parse_mode': 'HTML'}).encode('utf-8')
+    http_pool.request(url, data=data, headers={'Content-Type': 'application/json'})
+
+
+def send_max_message(bot_token, chat_id, text):
+    url = 'https://botapi.max.ru/messages?access_token=%s&chat_id=%s' % (urllib.parse.quote(bot_token), chat_id)
+    data = json.dumps({'text': text, 'format': 'html'}).encode('utf-8')
+    http_pool.request(url, data=data, headers={'Content-Type': 'application/json'})
+
+
+def make_email_sender(cur):
+    """Отправитель писем с одним SMTP-соединением на весь проход очереди; возвращает (send, close)"""
+    import smtplib
+    from email.mime.text import MIMEText
+    from email.mime.multipart import MIMEMultipart
+
+    cur.execute("SELECT settings FROM notification_channels WHERE channel='email'")
+    row = cur.fetchone()
+    ch = (row[0] if isinstance(row[0], dict) else json.loads(row[0])) if row else {}
+    state = {'server': None}
+
+    def send(recipient, payload):
+        if not ch.get('smtp_host') or not ch.get('smtp_user') or not ch.get('from_email'):
+            raise ValueError('SMTP not configured')
+        from_email, from_name = ch['from_email'], ch.get('from_name', '')
+        text = payload.get('text', '')
+        msg = MIMEMultipart('alternative')
+        msg['Subject'] = payload.get('subject', '')
+        msg['From'] = '%s <%s>' % (from_name, from_email) if from_name else from_email
+        msg['To'] = recipient
+        msg.attach(MIMEText(text, 'plain', 'utf-8'))
+        msg.attach(MIMEText('<html><body><p>%s</p></body></html>' % text.replace('\n', '<br>'), 'html', 'utf-8'))
+        if state['server'] is None:
+            server = smtplib.SMTP(ch['smtp_host'], int(ch.get('smtp_port', 587)), timeout=15)
+            server.starttls()
+            server.login(ch['smtp_user'], ch.get('smtp_pass', ''))
+            state['server'] = server
+        try:
+            state['server'].sendmail(from_email, [recipient], msg.as_string())
+        except smtplib.SMTPServerDisconnected:
+            state['server'] = None
+            raise
+
+    def close():
+        if state['server'] is not None:
+            try:
+                state['server'].quit()
+            except Exception:
+                pass
+            state['server'] = None
+
+    return send, close
+
+
+def make_outbox_senders(cur, tg_token, max_token):
+    """Функции отправки по каналам: send(recipient, payload). Ненастроенный канал бросает ValueError при отправке"""
+    vapid_private = os.environ.get('VAPID_PRIVATE_KEY', '')
+    vapid_email = os.environ.get('VAPID_EMAIL', 'mailto:admin@example.com')
+
+    def send_telegram(recipient, payload):
+        if not tg_token:
+            raise ValueError('telegram bot token not configured')
+        send_tg_message(tg_token, recipient, payload['text'])
+
+    def send_max(recipient, payload):
+        if not max_token:
+            raise ValueError('max bot token not configured')
+        send_max_message(max_token, recipient, payload['text'])
+
+    def send_push(subscription_info, payload):
+        if not vapid_private:
+            raise ValueError('VAPID keys not configured')
+        from pywebpush import webpush
+        webpush(subscription_info=subscription_info, data=json.dumps(payload),
+                vapid_private_key=vapid_private, vapid_claims={'sub': vapid_email})
+
+    send_email, close_email = make_email_sender(cur)
+    return {'telegram': send_telegram, 'max': send_max, 'push': send_push, 'email': send_email}, close_email
+
+
+def outbox_error_code(e):
+    """HTTP-код ошибки отправки: HTTPError из http_pool или WebPushException с response"""
+    code = getattr(e, 'code', None)
+    if code is None:
+        code = getattr(getattr(e, 'response', None), 'status_code', None)
+    return code if isinstance(code, int) else None
+
+
+def finalize_outbox_sources(cur, ids):
+    """Пишет итоговые строки журналов рассылок и закрывает рассылки без ожидающих сообщений"""
+    id_list = ','.join(str(i) for i in ids)
+    cur.execute("""
+        INSERT INTO push_message_log (message_id, subscription_id, user_id, status, error_text)
+        SELECT source_id, recipient::integer, user_id, status, last_error FROM notification_outbox
+        WHERE id IN (%s) AND source='push_message' AND status IN ('sent', 'failed')
+    """ % id_list)
+    cur.execute("""
+        INSERT INTO notification_history_log (notification_id, user_id, channel, status, error_text)
+        SELECT source_id, user_id, channel, status, last_error FROM notification_outbox
+        WHERE id IN (%s) AND source='notification' AND status IN ('sent', 'failed')
+    """ % id_list)
+    for table, source in (('push_messages', 'push_message'), ('notification_history', 'notification')):
+        cur.execute("""
+            UPDATE %s m SET sent_count=s.sent, failed_count=s.failed,
+                status=CASE WHEN s.pending=0 THEN 'sent' ELSE m.status END,
+                sent_at=CASE WHEN s.pending=0 THEN NOW() ELSE m.sent_at END
+            FROM (
+                SELECT source_id, COUNT(*) FILTER (WHERE status='sent') AS sent,
+                       COUNT(*) FILTER (WHERE status='failed') AS failed,
+                       COUNT(*) FILTER (WHERE status='pending') AS pending
+                FROM notification_outbox
+                WHERE source='%s' AND source_id IN (SELECT source_id FROM notification_outbox WHERE id IN (%s) AND source='%s')
+                GROUP BY source_id
+            ) s WHERE m.id=s.source_id
+        """ % (table, source, id_list, source))
+
+
+def drain(cur, conn, tg_token, max_token, seconds=OUTBOX_DRAIN_SECONDS, source=None, source_id=None):
+    """Отправляет сообщения из notification_outbox пачками, пока есть готовые к отправке или не выйдет seconds.
+    source/source_id ограничивают проход одной рассылкой. Ошибки повторяются с экспоненциальной паузой,
+    скорость ограничена по каждому каналу. Строки берутся FOR UPDATE SKIP LOCKED, каждая пачка — отдельный commit"""
+    senders, close_email = make_outbox_senders(cur, tg_token, max_token)
+    only = " AND o.source='%s' AND o.source_id=%d" % (source, source_id) if source else ''
+    deadline = time.monotonic() + seconds
+    last_sent = {}
+    totals = {'sent': 0, 'failed': 0}
+    errors = []
+    try:
+        while time.monotonic() < deadline:
+            cur.execute("""
+                SELECT o.id, o.channel, o.recipient, o.payload, ps.endpoint, ps.p256dh, ps.auth, ps.user_agent
+                FROM notification_outbox o
+                LEFT JOIN push_subscriptions ps ON o.channel='push' AND ps.id::text=o.recipient
+                WHERE o.status='pending' AND o.next_attempt_at <= NOW()%s
+                ORDER BY o.next_attempt_at, o.id LIMIT %d
+                FOR UPDATE OF o SKIP LOCKED
+            """ % (only, OUTBOX_BATCH))
+            rows = cur.fetchall()
+            if not rows:
+                break
+            sent, failed, expired = [], [], []
+            for msg_id, channel, recipient, payload, endpoint, p256dh, auth_key, user_agent in rows:
+                if time.monotonic() >= deadline:
+                    break
+                payload = payload if isinstance(payload, dict) else json.loads(payload)
+                if channel == 'push':
+                    if not endpoint or user_agent in ('unsubscribed', 'expired', 'reset'):
+                        failed.append((msg_id, 'subscription inactive', True))
+                        continue
+                    recipient = {'endpoint': endpoint, 'keys': {'p256dh': p256dh, 'auth': auth_key}}
+                wait = last_sent.get(channel, 0) + 1.0 / OUTBOX_RATE.get(channel, 10) - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                last_sent[channel] = time.monotonic()
+                try:
+                    if channel not in senders:
+                        raise ValueError('unknown channel %s' % channel)
+                    senders[channel](recipient, payload)
+                    sent.append(msg_id)
+                except Exception as e:
+                    code = outbox_error_code(e)
+                    failed.append((msg_id, str(e)[:500], code in OUTBOX_PERMANENT_CODES))
+                    if channel == 'push' and code in (404, 410):
+                        expired.append(msg_id)
+            if sent:
+                cur.execute("UPDATE notification_outbox SET status='sent', attempts=attempts+1, sent_at=NOW() WHERE id IN (%s)" % ','.join(str(i) for i in sent))
+            if failed:
+                cur.execute("""
+                    UPDATE notification_outbox o SET attempts=o.attempts+1, last_error=v.err,
+                        status=CASE WHEN v.permanent OR o.attempts+1 >= %d THEN 'failed' ELSE 'pending' END,
+                        next_attempt_at=NOW() + make_interval(secs => %d * power(2, o.attempts))
+                    FROM (VALUES %s) AS v(id, err, permanent) WHERE o.id=v.id
+                """ % (OUTBOX_MAX_ATTEMPTS, OUTBOX_BACKOFF_SECONDS,
+                       ','.join("(%d, '%s', %s)" % (mid, err.replace("'", "''"), 'true' if perm else 'false') for mid, err, perm in failed)))
+            if expired:
+                cur.execute("UPDATE push_subscriptions SET user_agent='expired' WHERE id::text IN (SELECT recipient FROM notification_outbox WHERE id IN (%s))" % ','.join(str(i) for i in expired))
+            done = sent + [mid for mid, _, _ in failed]
+            if done:
+                finalize_outbox_sources(cur, done)
+            conn.commit()
+            totals['sent'] += len(sent)
+            totals['failed'] += len(failed)
+            errors.extend(err for _, err, _ in failed)
+    finally:
+        close_email()
+    return dict(totals, errors=errors)
@@ -0,0 +1,224 @@
+"""Web Push: подписки, VAPID и рассылка"""
+import json
+import os
+from datetime import datetime, date
+from decimal import Decimal
+from core import esc
+from notifications import drain_broadcast
+
+def handle_push(method, params, body, staff, cur, conn, src_ip=''):
+    """Управление Web Push уведомлениями"""
+    action = body.get('action') or params.get('action', '')
+
+    if action == 'vapid_key':
+        vk = os.environ.get('VAPID_PUBLIC_KEY', '')
+        return {'vapid_public_key': vk}
+
+    if action == 'subscribe':
+        token = body.get('token') or params.get('token', '')
+        if not token:
+            return {'error': 'Требуется токен'}
+        cur.execute("SELECT u.id FROM users u JOIN client_sessions cs ON cs.user_id=u.id WHERE cs.token='%s' AND cs.expires_at>NOW()" % token.replace("'", "''"))
+        row = cur.fetchone()
+        if not row:
+            return {'error': 'Недействительная сессия'}
+        user_id = row[0]
+        sub = body.get('subscription', {})
+        endpoint = sub.get('endpoint', '')
+        keys = sub.get('keys', {})
+        p256dh = keys.get('p256dh', '')
+        auth_key = keys.get('auth', '')
+        if not endpoint or not p256dh or not auth_key:
+            return {'error': 'Неверные данные подписки'}
+        ua = body.get('user_agent', '')
+        cur.execute("""INSERT INTO push_subscriptions (user_id, endpoint, p256dh, auth, user_agent)
+            VALUES (%d, '%s', '%s', '%s', '%s')
+            ON CONFLICT (user_id, endpoint) DO UPDATE SET p256dh='%s', auth='%s', user_agent='%s', created_at=NOW()""" % (
+            user_id,
+            endpoint.replace("'", "''"), p256dh.replace("'", "''"), auth_key.replace("'", "''"), ua.replace("'", "''"),
+            p256dh.replace("'", "''"), auth_key.replace("'", "''"), ua.replace("'", "''")))
+        conn.commit()
+        return {'success': True}
+
+    if action == 'unsubscribe':
+        token = body.get('token') or params.get('token', '')
+        if not token:
+            return {'error': 'Требуется токен'}
+        cur.execute("SELECT u.id FROM users u JOIN client_sessions cs ON cs.user_id=u.id WHERE cs.token='%s' AND cs.expires_at>NOW()" % token.replace("'", "''"))
+        row = cur.fetchone()
+        if not row:
+            return {'error': 'Недействительная сессия'}
+        user_id = row[0]
+        endpoint = body.get('endpoint', '')
+        if endpoint:
+            cur.execute("UPDATE push_subscriptions SET user_agent='unsubscribed' WHERE user_id=%d AND endpoint='%s'" % (user_id, endpoint.replace("'", "''")))
+        else:
+            cur.execute("UPDATE push_subscriptions SET user_agent='unsubscribed' WHERE user_id=%d" % user_id)
+        conn.commit()
+        return {'success': True}
+
+    if action == 'check_subscription':
+        token = body.get('token') or params.get('token', '')
+        if not token:
+            return {'subscribed': False}
+        cur.execute("SELECT u.id FROM users u JOIN client_sessions cs ON cs.user_id=u.id WHERE cs.token='%s' AND cs.expires_at>NOW()" % token.replace("'", "''"))
+        row = cur.fetchone()
+        if not row:
+            return {'subscribed': False}
+        cur.execute("SELECT COUNT(*) FROM push_subscriptions WHERE user_id=%d AND user_agent!='unsubscribed'" % row[0])
+        cnt = cur.fetchone()[0]
+        return {'subscribed': cnt > 0}
+
+    if action == 'my_messages':
+        token = body.get('token') or params.get('token', '')
+        if not token:
+            return {'error': 'Требуется токен'}
+        cur.execute("SELECT u.id FROM users u JOIN client_sessions cs ON cs.user_id=u.id WHERE cs.token='%s' AND cs.expires_at>NOW()" % token.replace("'", "''"))
+        row = cur.fetchone()
+        if not row:
+            return {'error': 'Недействительная сессия', '_status': 401}
+        user_id = row[0]
+        cur.execute("""
+            SELECT pm.id, pm.title, pm.body, pm.url, pm.sent_at, pml.status as delivery_status
+            FROM push_message_log pml
+            JOIN push_messages pm ON pm.id = pml.message_id
+            WHERE pml.user_id = %d AND pm.status = 'sent'
+            ORDER BY pm.sent_at DESC
+            LIMIT 50
+        """ % user_id)
+        cols = [d[0] for d in cur.description]
+        rows = [dict(zip(cols, r)) for r in cur.fetchall()]
+        for r in rows:
+            for k, v in r.items():
+                if isinstance(v, (datetime, date)):
+                    r[k] = v.isoformat()
+        return rows
+
+    if not staff:
+        return {'error': 'Требуется авторизация', '_status': 401}
+
+    if action == 'stats':
+        cur.execute("SELECT COUNT(*) FROM push_subscriptions WHERE user_agent NOT IN ('unsubscribed','expired','reset')")
+        total_subs = cur.fetchone()[0]
+        cur.execute("SELECT COUNT(DISTINCT user_id) FROM push_subscriptions WHERE user_agent NOT IN ('unsubscribed','expired','reset')")
+        unique_users = cur.fetchone()[0]
+        cur.execute("SELECT COUNT(*) FROM push_messages")
+        total_messages = cur.fetchone()[0]
+        return {'total_subscriptions': total_subs, 'unique_users': unique_users, 'total_messages': total_messages}
+
+    if action == 'subscribers':
+        cur.execute("""SELECT ps.user_id, u.name, u.phone, u.email, COUNT(ps.id) as devices, MAX(ps.created_at) as last_sub
+            FROM push_subscriptions ps
+            JOIN users u ON u.id=ps.user_id
+            WHERE ps.user_agent NOT IN ('unsubscribed','expired','reset')
+            GROUP BY ps.user_id, u.name, u.phone, u.email
+            ORDER BY last_sub DESC""")
+        cols = [d[0] for d in cur.description]
+        rows = [dict(zip(cols, r)) for r in cur.fetchall()]
+        for r in rows:
+            for k, v in r.items():
+                if isinstance(v, datetime):
+                    r[k] = v.isoformat()
+        return rows
+
+    if action == 'messages':
+        limit = int(params.get('limit', 50))
+        offset = int(params.get('offset', 0))
+        cur.execute("""SELECT pm.*, u.name as created_by_name
+            FROM push_messages pm LEFT JOIN users u ON u.id=pm.created_by
+            ORDER BY pm.created_at DESC LIMIT %d OFFSET %d""" % (limit, offset))
+        cols = [d[0] for d in cur.description]
+        rows = [dict(zip(cols, r)) for r in cur.fetchall()]
+        for r in rows:
+            for k, v in r.items():
+                if isinstance(v, (datetime, date)):
+                    r[k] = v.isoformat()
+                elif isinstance(v, Decimal):
+                    r[k] = float(v)
+        cur.execute("SELECT COUNT(*) FROM push_messages")
+        total = cur.fetchone()[0]
+        return {'items': rows, 'total': total}
+
+    if action == 'send':
+        title = body.get('title', '').strip()
+        msg_body = body.get('body', '').strip()
+        url = body.get('url', '').strip()
+        target = body.get('target', 'all')
+        target_user_ids = body.get('target_user_ids', [])
+        if not title or not msg_body:
+            return {'error': 'Укажите заголовок и текст сообщения'}
+
+        active = "user_agent NOT IN ('unsubscribed','expired','reset')"
+        if target == 'all':
+            sub_where = active
+        elif target == 'selected' and target_user_ids:
+            sub_where = "user_id IN (%s) AND %s" % (','.join(str(int(i)) for i in target_user_ids), active)
+        else:
+            return {'error': 'Неверный тип рассылки'}
+
+        if not os.environ.get('VAPID_PRIVATE_KEY', '') or not os.environ.get('VAPID_PUBLIC_KEY', ''):
+            return {'error': 'VAPID ключи не настроены'}
+
+        cur.execute("""INSERT INTO push_messages (title, body, url, target, target_user_ids, created_by, status)
+            VALUES ('%s', '%s', '%s', '%s', %s, %d, 'sending') RETURNING id""" % (
+            title.replace("'", "''"), msg_body.replace("'", "''"), url.replace("'", "''"),
+            target.replace("'", "''"),
+            "ARRAY[%s]::integer[]" % ','.join(str(int(i)) for i in target_user_ids) if target_user_ids else 'NULL',
+            staff['user_id']))
+        message_id = cur.fetchone()[0]
+
+        # Одна вставка в очередь на всю аудиторию; после commit рассылка отправляется сразу, остаток дошлёт крон (action=drain_outbox)
+        payload = json.dumps({'title': title, 'body': msg_body, 'url': url, 'message_id': message_id}, ensure_ascii=False)
+        cur.execute("""INSERT INTO notification_outbox (channel, recipient, user_id, payload, source, source_id)
+            SELECT 'push', id::text, user_id, '%s'::jsonb, 'push_message', %d FROM push_subscriptions WHERE %s""" % (
+            esc(payload), message_id, sub_where))
+        queued = cur.rowcount
+        if not queued:
+            cur.execute("UPDATE push_messages SET status='sent', sent_count=0, failed_count=0, sent_at=NOW() WHERE id=%d" % message_id)
+        conn.commit()
+        sent = drain_broadcast(cur, conn, 'push_message', message_id) if queued else 0
+        return {'success': True, 'message_id': message_id, 'queued': queued, 'sent': sent}
+
+    if action == 'message_log':
+        message_id = int(params.get('id') or body.get('id', 0))
+        if not message_id:
+            return {'error': 'Укажите id сообщения'}
+        cur.execute("""SELECT pml.*, u.name as user_name
+            FROM push_message_log pml LEFT JOIN users u ON u.id=pml.user_id
+            WHERE pml.message_id=%d ORDER BY pml.created_at DESC""" % message_id)
+        cols = [d[0] for d in cur.description]
+        rows = [dict(zip(cols, r)) for r in cur.fetchall()]
+        for r in rows:
+            for k, v in r.items():
+                if isinstance(v, datetime):
+                    r[k] = v.isoformat()
+        return rows
+
+    if action == 'get_settings':
+        cur.execute("SELECT key, value FROM push_settings")
+        rows = cur.fetchall()
+        return {r[0]: r[1] for r in rows}
+
+    if action == 'save_settings':
+        settings = body.get('settings', {})
+        allowed = {'enabled', 'reminder_days', 'overdue_notify', 'remind_time', 'savings_enabled', 'savings_reminder_days', 'savings_remind_time',
+                   'tpl_payment_today_title', 'tpl_payment_today_body',
+                   'tpl_payment_tomorrow_title', 'tpl_payment_tomorrow_body',
+                   'tpl_payment_days_title', 'tpl_payment_days_body',
+                   'tpl_overdue_title', 'tpl_overdue_body',
+                   'tpl_savings_today_title', 'tpl_savings_today_body',
+                   'tpl_savings_tomorrow_title', 'tpl_savings_tomorrow_body',
+                   'tpl_savings_days_title', 'tpl_savings_days_body'}
+        for k, v in settings.items():
+            if k not in allowed:
+                continue
+            val = str(v).replace("'", "''")
+            cur.execute("SELECT id FROM push_settings WHERE key='%s'" % k)
+            if cur.fetchone():
+                cur.execute("UPDATE push_settings SET value='%s', updated_at=NOW() WHERE key='%s'" % (val, k))
+            else:
+                cur.execute("INSERT INTO push_settings (key, value) VALUES ('%s', '%s')" % (k, val))
+        conn.commit()
+        return {'success': True}
+
+    return {'error': 'Неизвестное действие: %s' % action}
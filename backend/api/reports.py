@@ -0,0 +1,212 @@
+"""Отчёты: прогноз денежного потока и старение просрочки"""
+from datetime import date, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+import time
+from io import BytesIO
+from core import esc
+
+FORECAST_MAX_MONTHS = 60
+
+def handle_reports(method, params, cur):
+    action = params.get('action', '')
+    if method != 'GET':
+        return {'error': 'Метод не поддерживается'}
+    if action == 'forecast':
+        return cash_flow_forecast(cur, params)
+    if action == 'aging':
+        return arrears_aging(cur, params)
+    if action == 'aging_history':
+        return arrears_aging_history(cur, params)
+    return {'error': 'Неизвестное действие: %s' % action}
+
+def forecast_params(params):
+    """Разбирает параметры прогноза; возвращает (months, group, org_id, default_rate, prepay_rate) или строку с ошибкой"""
+    try:
+        months = int(params.get('months', 12))
+        default_rate = float(params.get('default_rate', 0)) / 100
+        prepay_rate = float(params.get('prepay_rate', 0)) / 100
+        org_id = int(params['org_id']) if params.get('org_id') else None
+    except (TypeError, ValueError):
+        return 'Некорректные параметры прогноза'
+    group = params.get('group', 'month')
+    if not 1 <= months <= FORECAST_MAX_MONTHS:
+        return 'Горизонт прогноза — от 1 до %d месяцев' % FORECAST_MAX_MONTHS
+    if group not in ('month', 'week'):
+        return 'Группировка: month или week'
+    if not (0 <= default_rate < 1 and 0 <= prepay_rate < 1):
+        return 'Ставки сценария — от 0 до 100%'
+    return months, group, org_id, default_rate, prepay_rate
+
+def fetch_float_array(cur, sql, ncols):
+    """Результат запроса из ncols столбцов float8 без NULL как массив NumPy (строк × ncols).
+    Строки идут через COPY в двоичном формате и разбираются одним np.frombuffer, без кортежей Python на каждую строку"""
+    import numpy as np
+
+    buf = BytesIO()
+    cur.copy_expert("COPY (%s) TO STDOUT WITH (FORMAT binary)" % sql, buf)
+    data = buf.getbuffer()
+    # Заголовок COPY — 19 байт, в конце — int16 -1; строка: int16 число полей, затем по каждому полю int32 длина и float8
+    row = np.dtype([('fields', '>i2')] + [('f%d' % i, [('len', '>i4'), ('value', '>f8')]) for i in range(ncols)])
+    rows = np.frombuffer(data, dtype=row, offset=19, count=(len(data) - 21) // row.itemsize)
+    return np.column_stack([rows['f%d' % i]['value'] for i in range(ncols)]).astype(np.float64).reshape(-1, ncols)
+
+def cash_flow_forecast(cur, params):
+    """Прогноз денежного потока по всему портфелю: поступления по графикам займов (ОД, проценты, досрочные погашения)
+    и выплаты по сбережениям (проценты, возврат вкладов) по неделям или месяцам на N месяцев вперёд.
+    Строки выгружаются тремя запросами COPY в двоичном формате (fetch_float_array) и сворачиваются в NumPy через bincount.
+    Сценарий: default_rate — годовая доля дефолтов (% от ожидаемых поступлений),
+    prepay_rate — годовая доля досрочных погашений (CPR): досрочно гасится остаток ОД, проценты по нему не поступают."""
+    import numpy as np
+
+    parsed = forecast_params(params)
+    if isinstance(parsed, str):
+        return {'error': parsed}
+    months, group, org_id, default_rate, prepay_rate = parsed
+    started = time.monotonic()
+    today = date.today()
+    month0 = today.year * 12 + today.month - 1
+    horizon = date((month0 + months) // 12, (month0 + months) % 12 + 1, 1)
+    span = (horizon - today).days
+    org_loans = " AND l.org_id=%d" % org_id if org_id else ""
+    org_savings = " AND s.org_id=%d" % org_id if org_id else ""
+
+    rows = fetch_float_array(cur, """
+        SELECT ls.loan_id::float8, (ls.payment_date - DATE '%s')::float8, ls.payment_no::float8, ls.principal_amount::float8,
+            ls.interest_amount::float8, COALESCE(ls.paid_amount, 0)::float8, ls.balance_after::float8, COALESCE(l.org_id, 0)::float8
+        FROM loan_schedule ls JOIN loans l ON l.id = ls.loan_id
+        WHERE l.status IN ('active', 'overdue') AND ls.status IN ('pending', 'partial', 'overdue')
+          AND ls.payment_date < DATE '%s'%s
+    """ % (today, horizon, org_loans), 8)
+    rows = rows[np.lexsort((rows[:, 2], rows[:, 1], rows[:, 0]))]
+    principal, interest, paid = rows[:, 3], rows[:, 4], rows[:, 5]
+    # Погашение внутри строки графика идёт сначала в проценты, затем в ОД
+    loans = np.column_stack([rows[:, 0], rows[:, 1], np.maximum(principal - np.maximum(paid - interest, 0), 0),
+                             np.maximum(interest - paid, 0), rows[:, 6] + principal, rows[:, 7]])
+    # Проценты по ежемесячным вкладам выплачиваются в конце периода, по вкладам «в конце срока» — вместе с вкладом
+    payouts = fetch_float_array(cur, """
+        SELECT (CASE WHEN s.payout_type = 'monthly' THEN ss.period_end ELSE s.end_date END - DATE '%s')::float8,
+            ss.interest_amount::float8, COALESCE(s.org_id, 0)::float8
+        FROM savings_schedule ss JOIN savings s ON s.id = ss.saving_id
+        WHERE s.status = 'active' AND ss.status = 'pending'
+          AND CASE WHEN s.payout_type = 'monthly' THEN ss.period_end ELSE s.end_date END < DATE '%s'%s
+    """ % (today, horizon, org_savings), 3)
+    maturities = fetch_float_array(cur, """
+        SELECT (s.end_date - DATE '%s')::float8, s.current_balance::float8, COALESCE(s.org_id, 0)::float8
+        FROM savings s WHERE s.status = 'active' AND s.end_date < DATE '%s'%s
+    """ % (today, horizon, org_savings), 3)
+
+    if group == 'month':
+        n_buckets = months
+        starts = [date((month0 + i) // 12, (month0 + i) % 12 + 1, 1) for i in range(months)]
+        base = np.datetime64(today, 'D')
+
+        def bucket(days):
+            stamp = base + np.maximum(days, 0).astype('timedelta64[D]')
+            return stamp.astype('datetime64[M]').astype(np.int64) - (month0 - 1970 * 12)
+    else:
+        week0 = today - timedelta(days=today.weekday())
+        n_buckets = (span - 1 + today.weekday()) // 7 + 1
+        starts = [week0 + timedelta(weeks=i) for i in range(n_buckets)]
+
+        def bucket(days):
+            return (np.maximum(days, 0).astype(np.int64) + today.weekday()) // 7
+
+    orgs = np.unique(np.concatenate([loans[:, 5], payouts[:, 2], maturities[:, 2]])).astype(np.int64)
+    n_orgs = max(len(orgs), 1)
+
+    def aggregate(days, org_col, weights):
+        cell = bucket(days) * n_orgs + np.searchsorted(orgs, org_col.astype(np.int64))
+        return np.bincount(cell, weights=weights, minlength=n_buckets * n_orgs).reshape(n_buckets, n_orgs)
+
+    # Доля займов, доживших до даты строки без дефолта и без досрочного погашения
+    years = np.maximum(loans[:, 1], 0) / 365.0
+    alive = (1 - default_rate) ** years
+    unprepaid = (1 - prepay_rate) ** years
+    first = np.ones(len(loans), dtype=bool)
+    first[1:] = loans[1:, 0] != loans[:-1, 0]
+    prev_unprepaid = np.where(first, 1.0, np.concatenate([[1.0], unprepaid[:-1]]))
+    flows = {
+        'principal': aggregate(loans[:, 1], loans[:, 5], loans[:, 2] * unprepaid * alive),
+        'interest': aggregate(loans[:, 1], loans[:, 5], loans[:, 3] * unprepaid * alive),
+        'prepayments': aggregate(loans[:, 1], loans[:, 5], loans[:, 4] * (prev_unprepaid - unprepaid) * alive),
+        'interest_payouts': aggregate(payouts[:, 0], payouts[:, 2], payouts[:, 1]),
+        'maturities': aggregate(maturities[:, 0], maturities[:, 2], maturities[:, 1]),
+    }
+    flows['inflow'] = flows['principal'] + flows['interest'] + flows['prepayments']
+    flows['outflow'] = flows['interest_payouts'] + flows['maturities']
+    flows['net'] = flows['inflow'] - flows['outflow']
+
+    def rows(col):
+        table = {k: (v.sum(axis=1) if col is None else v[:, col]).round(2) for k, v in flows.items()}
+        cumulative = np.cumsum(table['net']).round(2)
+        return [dict({k: float(table[k][i]) for k in table}, period=starts[i].isoformat(), cumulative_net=float(cumulative[i]))
+                for i in range(n_buckets)]
+
+    result = {
+        'group': group, 'months': months, 'start': today.isoformat(), 'end': horizon.isoformat(),
+        'scenario': {'default_rate': default_rate * 100, 'prepay_rate': prepay_rate * 100},
+        'buckets': rows(None),
+        'totals': {k: round(float(v.sum()), 2) for k, v in flows.items()},
+        'rows': {'loan_schedule': len(loans), 'savings_schedule': len(payouts), 'savings': len(maturities)},
+    }
+    if params.get('by_org') in ('1', 'true') and not org_id:
+        cur.execute("SELECT id, name FROM organizations")
+        names = dict(cur.fetchall())
+        result['by_org'] = [{'org_id': int(o) or None, 'name': names.get(int(o)), 'buckets': rows(i)} for i, o in enumerate(orgs)]
+    result['elapsed_ms'] = round((time.monotonic() - started) * 1000, 1)
+    return result
+
+AGING_BUCKETS = ('current', '1_30', '31_60', '61_90', '90_plus')
+
+def aging_summary(rows):
+    """Сводит строки снимка (bucket, loans_count, balance, overdue_amount) в корзины и PAR30/PAR90 — долю портфеля с просрочкой свыше 30/90 дней"""
+    buckets = {b: {'loans': 0, 'balance': Decimal('0'), 'overdue': Decimal('0')} for b in AGING_BUCKETS}
+    for bucket, loans_count, balance, overdue in rows:
+        b = buckets.setdefault(bucket, {'loans': 0, 'balance': Decimal('0'), 'overdue': Decimal('0')})
+        b['loans'] += loans_count
+        b['balance'] += balance
+        b['overdue'] += overdue
+    total = sum(b['balance'] for b in buckets.values())
+    par30 = buckets['31_60']['balance'] + buckets['61_90']['balance'] + buckets['90_plus']['balance']
+    par90 = buckets['90_plus']['balance']
+    return {
+        'buckets': [{'bucket': k, 'loans': v['loans'], 'balance': float(v['balance']), 'overdue': float(v['overdue'])} for k, v in buckets.items()],
+        'loans': sum(b['loans'] for b in buckets.values()),
+        'total_balance': float(total),
+        'total_overdue': float(sum(b['overdue'] for b in buckets.values())),
+        'par30': float((par30 / total * 100).quantize(Decimal('0.01'), ROUND_HALF_UP)) if total else 0.0,
+        'par90': float((par90 / total * 100).quantize(Decimal('0.01'), ROUND_HALF_UP)) if total else 0.0,
+    }
+
+def arrears_aging(cur, params):
+    """Снимок просрочки на дату (по умолчанию — последний) по портфелю и организациям. Снимки пишет ночной cron-accrue"""
+    on_date = params.get('date') or date.today().isoformat()
+    org_filter = " AND org_id=%d" % int(params['org_id']) if params.get('org_id') else ""
+    cur.execute("SELECT MAX(snapshot_date) FROM arrears_aging_snapshots WHERE snapshot_date <= '%s'%s" % (esc(on_date), org_filter))
+    snap_date = cur.fetchone()[0]
+    if not snap_date:
+        return dict(aging_summary([]), date=None, by_org=[])
+    cur.execute("SELECT org_id, bucket, loans_count, balance, overdue_amount FROM arrears_aging_snapshots WHERE snapshot_date='%s'%s ORDER BY org_id" % (snap_date, org_filter))
+    rows = cur.fetchall()
+    cur.execute("SELECT id, name FROM organizations")
+    names = dict(cur.fetchall())
+    by_org = {}
+    for org_id, *rest in rows:
+        by_org.setdefault(org_id, []).append(rest)
+    result = aging_summary([r[1:] for r in rows])
+    result['date'] = snap_date.isoformat()
+    result['by_org'] = [dict(aging_summary(org_rows), org_id=org_id or None, name=names.get(org_id)) for org_id, org_rows in by_org.items()]
+    return result
+
+def arrears_aging_history(cur, params):
+    """Динамика просрочки по сохранённым снимкам за период (по умолчанию — 90 дней) без пересчёта графиков"""
+    date_to = params.get('date_to') or date.today().isoformat()
+    date_from = params.get('date_from') or (date.fromisoformat(date_to) - timedelta(days=90)).isoformat()
+    org_filter = " AND org_id=%d" % int(params['org_id']) if params.get('org_id') else ""
+    cur.execute("""SELECT snapshot_date, bucket, SUM(loans_count), SUM(balance), SUM(overdue_amount) FROM arrears_aging_snapshots
+        WHERE snapshot_date BETWEEN '%s' AND '%s'%s GROUP BY snapshot_date, bucket ORDER BY snapshot_date""" % (esc(date_from), esc(date_to), org_filter))
+    by_date = {}
+    for snap_date, *rest in cur.fetchall():
+        by_date.setdefault(snap_date, []).append(rest)
+    return {'date_from': date_from, 'date_to': date_to,
+            'items': [dict(aging_summary(rows), date=d.isoformat()) for d, rows in by_date.items()]}
@@ -0,0 +1,780 @@
+"""Сбережения: договоры, операции, начисление процентов и пакетные пересчёты"""
+from datetime import date, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from money import to_kop, to_rate, kop_decimal, interest_kop, period_interest
+from core import add_months, audit_log, esc, fmt_date, fmt_money, map_parallel, mark_member_stats, next_number, query_json, query_rows, safe_float, safe_int
+from schedules import calc_savings_schedule, compute_savings_recalc, get_accrued_interest_end_of_prev_month, insert_daily_accruals, load_savings_inputs, recalc_savings_schedule, refresh_accrual_totals, schedule_interest_total, write_savings_schedule
+from jobs import start_batch_job, update_batch_job
+
+def handle_savings(method, params, body, cur, conn, staff=None, ip=''):
+    if method == 'GET':
+        action = params.get('action', 'list')
+        if action == 'detail':
+            sid = int(params['id'])
+            today = date.today()
+            cur.execute("UPDATE savings_schedule SET status='accrued' WHERE saving_id=%s AND status='pending' AND period_end <= '%s'" % (sid, today.isoformat()))
+            if cur.rowcount > 0:
+                conn.commit()
+            raw = query_json(cur, """
+                SELECT (to_jsonb(s)
+                    || jsonb_build_object(
+                        'member_name', COALESCE((SELECT CASE WHEN m.member_type='FL' THEN CONCAT(m.last_name,' ',m.first_name,' ',m.middle_name) ELSE m.company_name END FROM members m WHERE m.id=s.member_id), ''),
+                        'schedule', COALESCE((SELECT jsonb_agg(to_jsonb(ss) ORDER BY ss.period_no) FROM savings_schedule ss WHERE ss.saving_id=s.id), '[]'::jsonb),
+                        'transactions', COALESCE((SELECT jsonb_agg(to_jsonb(st) ORDER BY st.transaction_date) FROM savings_transactions st WHERE st.saving_id=s.id), '[]'::jsonb),
+                        'daily_accruals', COALESCE((SELECT jsonb_agg(jsonb_build_object('id', d.id, 'accrual_date', d.accrual_date, 'balance', d.balance, 'rate', d.rate, 'daily_amount', d.daily_amount, 'created_at', d.created_at) ORDER BY d.accrual_date) FROM savings_daily_accruals d WHERE d.saving_id=s.id), '[]'::jsonb),
+                        'rate_changes', COALESCE((SELECT jsonb_agg(jsonb_build_object('id', rc.id, 'effective_date', rc.effective_date, 'old_rate', rc.old_rate, 'new_rate', rc.new_rate, 'reason', rc.reason, 'created_at', rc.created_at) ORDER BY rc.effective_date) FROM savings_rate_changes rc WHERE rc.saving_id=s.id), '[]'::jsonb),
+                        'total_daily_accrued', s.accrual_total,
+                        'max_payout', GREATEST(s.accrual_total - cm.month_total - COALESCE(s.paid_interest, 0), 0),
+                        'accrual_first_date', s.accrual_first_date,
+                        'accrual_last_date', s.accrual_last_date,
+                        'accrual_days_count', s.accrual_days)
+                    || CASE WHEN s.org_id IS NOT NULL THEN jsonb_build_object('org_name', COALESCE(o.name, ''), 'org_short_name', COALESCE(o.short_name, '')) ELSE '{}'::jsonb END
+                )::text
+                FROM savings s
+                LEFT JOIN organizations o ON o.id = s.org_id
+                CROSS JOIN LATERAL (
+                    SELECT COALESCE(SUM(daily_amount), 0) AS month_total
+                    FROM savings_daily_accruals WHERE saving_id = s.id AND accrual_date >= %s
+                ) cm
+                WHERE s.id = %s
+            """, (today.replace(day=1), sid))
+            return {'_raw_json': raw} if raw else None
+        elif action == 'schedule':
+            a, r, t = safe_float(params['amount'], 'сумма'), safe_float(params['rate'], 'ставка'), safe_int(params['term'], 'срок')
+            pt = params.get('payout_type', 'monthly')
+            sd = date.fromisoformat(params.get('start_date', date.today().isoformat()))
+            return {'schedule': calc_savings_schedule(a, r, t, sd, pt)}
+        else:
+            return query_rows(cur, """
+                SELECT s.id, s.contract_no, s.amount, s.rate, s.term_months, s.payout_type,
+                       s.start_date, s.end_date, s.accrued_interest, s.paid_interest, s.current_balance, s.status,
+                       s.min_balance_pct, s.org_id,
+                       CASE WHEN m.member_type='FL' THEN CONCAT(m.last_name,' ',m.first_name,' ',m.middle_name)
+                            ELSE m.company_name END as member_name, m.id as member_id,
+                       o.name as org_name, o.short_name as org_short_name
+                FROM savings s JOIN members m ON m.id=s.member_id
+                LEFT JOIN organizations o ON o.id=s.org_id
+                ORDER BY s.created_at DESC
+            """)
+
+    elif method == 'POST':
+        action = body.get('action', 'create')
+        if action == 'create':
+            cn = body.get('contract_no', '').strip()
+            mid = int(body['member_id'])
+            a, r, t = safe_float(body['amount'], 'сумма'), safe_float(body['rate'], 'ставка'), safe_int(body['term_months'], 'срок')
+            pt = body.get('payout_type', 'monthly')
+            sd = date.fromisoformat(body.get('start_date', date.today().isoformat()))
+            mbp = safe_float(body.get('min_balance_pct', 0), 'мин. остаток %')
+            org_id = body.get('org_id')
+            if not cn:
+                cn = '%s-%s' % (next_number(cur, 'saving_contract'), sd.strftime('%d%m%Y'))
+            else:
+                cur.execute("SELECT id FROM savings WHERE contract_no='%s'" % esc(cn))
+                if cur.fetchone():
+                    return {'error': 'Договор с номером %s уже существует' % cn}
+            schedule = calc_savings_schedule(a, r, t, sd, pt)
+            ed = add_months(sd, t)
+            cur.execute("INSERT INTO savings (contract_no,member_id,amount,rate,term_months,payout_type,start_date,end_date,current_balance,status,min_balance_pct,org_id) VALUES ('%s',%s,%s,%s,%s,'%s','%s','%s',%s,'active',%s,%s) RETURNING id" % (esc(cn), mid, a, r, t, pt, sd.isoformat(), ed.isoformat(), a, mbp, org_id if org_id else 'NULL'))
+            sid = cur.fetchone()[0]
+            mark_member_stats(cur, 'members', mid)
+            for item in schedule:
+                cur.execute("INSERT INTO savings_schedule (saving_id,period_no,period_start,period_end,interest_amount,cumulative_interest,balance_after) VALUES (%s,%s,'%s','%s',%s,%s,%s)" % (sid, item['period_no'], item['period_start'], item['period_end'], item['interest_amount'], item['cumulative_interest'], item['balance_after']))
+            cur.execute("INSERT INTO savings_transactions (saving_id,transaction_date,amount,transaction_type,description) VALUES (%s,'%s',%s,'opening','Открытие договора. Сумма: %s руб., ставка: %s%%, срок: %s мес.')" % (sid, sd.isoformat(), a, fmt_money(a), r, t))
+            audit_log(cur, staff, 'create', 'saving', sid, cn, 'Сумма: %s, ставка: %s%%, срок: %s мес., несниж.остаток: %s%%' % (a, r, t, mbp), ip)
+            conn.commit()
+            return {'id': sid, 'contract_no': cn, 'schedule': schedule}
+
+        elif action == 'transaction':
+            sid = int(body['saving_id'])
+            a = safe_float(body['amount'], 'сумма')
+            tt = body['transaction_type']
+            td = body.get('transaction_date', date.today().isoformat())
+            ic = body.get('is_cash', False)
+            d = body.get('description', '')
+            cur.execute("INSERT INTO savings_transactions (saving_id,transaction_date,amount,transaction_type,is_cash,description) VALUES (%s,'%s',%s,'%s',%s,'%s')" % (sid, td, a, tt, ic, esc(d)))
+            if tt == 'deposit':
+                cur.execute("UPDATE savings SET current_balance=current_balance+%s, amount=amount+%s, updated_at=NOW() WHERE id=%s" % (a, a, sid))
+                cur.execute("SELECT amount, rate, term_months, start_date, payout_type FROM savings WHERE id=%s" % sid)
+                sv = cur.fetchone()
+                recalc_savings_schedule(cur, sid, float(sv[0]), float(sv[1]), int(sv[2]), date.fromisoformat(str(sv[3])), sv[4])
+            elif tt == 'withdrawal':
+                cur.execute("UPDATE savings SET current_balance=current_balance-%s, updated_at=NOW() WHERE id=%s" % (a, sid))
+            elif tt == 'interest_payout':
+                cur.execute("UPDATE savings SET paid_interest=paid_interest+%s, updated_at=NOW() WHERE id=%s" % (a, sid))
+            tt_labels = {'deposit': 'Пополнение', 'withdrawal': 'Снятие', 'interest_payout': 'Выплата %'}
+            audit_log(cur, staff, 'transaction', 'saving', sid, '', '%s: %s' % (tt_labels.get(tt, tt), a), ip)
+            conn.commit()
+            return {'success': True}
+
+        elif action == 'interest_payout':
+            sid = int(body['saving_id'])
+            cur.execute("SELECT payout_type, accrued_interest, paid_interest, current_balance, rate, amount FROM savings WHERE id=%s" % sid)
+            sv = cur.fetchone()
+            if not sv:
+                return {'error': 'Вклад не найден'}
+            td = body.get('transaction_date', date.today().isoformat())
+
+            max_payout = get_accrued_interest_end_of_prev_month(cur, sid)
+            if max_payout <= 0:
+                return {'error': 'Нет начисленных процентов к выплате (по данным на конец предыдущего месяца)'}
+
+            interest = Decimal(str(safe_float(body['amount'], 'сумма'))) if body.get('amount') else max_payout
+            if interest > max_payout:
+                interest = max_payout
+
+            cur.execute("INSERT INTO savings_transactions (saving_id,transaction_date,amount,transaction_type,description) VALUES (%s,'%s',%s,'interest_payout','Выплата процентов')" % (sid, td, float(interest)))
+            cur.execute("UPDATE savings SET paid_interest=paid_interest+%s, updated_at=NOW() WHERE id=%s" % (float(interest), sid))
+            audit_log(cur, staff, 'interest_payout', 'saving', sid, '', 'Выплата %%: %s (макс: %s)' % (float(interest), float(max_payout)), ip)
+            conn.commit()
+            return {'success': True, 'amount': float(interest), 'max_payout': float(max_payout)}
+
+        elif action == 'daily_accrue':
+            today = date.today()
+            accrual_date = body.get('date', today.isoformat())
+            cur.execute("SELECT id, current_balance, rate, start_date FROM savings WHERE status='active'")
+            savings_rows = cur.fetchall()
+            accruals = []
+            for row in savings_rows:
+                s_id, s_bal, s_rate, s_start = row[0], Decimal(str(row[1])), Decimal(str(row[2])), str(row[3])
+                if s_bal <= 0:
+                    continue
+                if accrual_date <= s_start:
+                    continue
+                daily_amount = period_interest(s_bal, s_rate, 1, 365)
+                if daily_amount <= 0:
+                    continue
+                accruals.append((s_id, s_bal, s_rate, daily_amount))
+            count, total = insert_daily_accruals(cur, accrual_date, accruals)
+            if count > 0:
+                conn.commit()
+            return {'success': True, 'accrued_count': count, 'total_amount': float(total), 'date': accrual_date}
+
+        elif action == 'backfill_accrue':
+            """
+            Доначисление процентов по вкладу.
+            mode='add_missing' — добавляет только пропущенные дни.
+            mode='verify_fix' — проверяет все дни в периоде, исправляет неверную ставку/сумму и добавляет пропущенные.
+            """
+            sid = int(body['saving_id'])
+            date_from = body.get('date_from')
+            date_to = body.get('date_to', date.today().isoformat())
+            mode = body.get('mode', 'add_missing')
+            if not date_from:
+                cur.execute("SELECT start_date FROM savings WHERE id=%s" % sid)
+                sr = cur.fetchone()
+                if not sr:
+                    return {'error': 'Вклад не найден'}
+                date_from = str(sr[0])
+
+            cur.execute("SELECT id, current_balance, rate, start_date FROM savings WHERE id=%s AND status='active'" % sid)
+            sv = cur.fetchone()
+            if not sv:
+                return {'error': 'Вклад не найден или не активен'}
+
+            s_rate = Decimal(str(sv[2]))
+            s_start = str(sv[3])
+            cur.execute("SELECT effective_date, old_rate, new_rate FROM savings_rate_changes WHERE saving_id=%s ORDER BY effective_date" % sid)
+            rate_changes_rows = cur.fetchall()
+            rate_changes_list = [(date.fromisoformat(str(r[0])), Decimal(str(r[1])), Decimal(str(r[2]))) for r in rate_changes_rows]
+            original_rate = rate_changes_list[0][1] if rate_changes_list else s_rate
+
+            s_start_date = date.fromisoformat(s_start)
+            d = date.fromisoformat(date_from)
+            d_to = date.fromisoformat(date_to)
+            if d <= s_start_date:
+                d = s_start_date + timedelta(days=1)
+
+            cur.execute("SELECT id, accrual_date, balance, rate, daily_amount FROM savings_daily_accruals WHERE saving_id=%s ORDER BY accrual_date" % sid)
+            existing_rows = {str(r[1]): {'id': r[0], 'balance': Decimal(str(r[2])), 'rate': Decimal(str(r[3])), 'daily_amount': Decimal(str(r[4]))} for r in cur.fetchall()}
+
+            cur.execute("SELECT transaction_date, amount, transaction_type FROM savings_transactions WHERE saving_id=%s ORDER BY transaction_date, id" % sid)
+            tx_rows = cur.fetchall()
+            tx_by_date = {}
+            for tr in tx_rows:
+                td_str = str(tr[0])
+                if td_str not in tx_by_date:
+                    tx_by_date[td_str] = []
+                tx_by_date[td_str].append((to_kop(tr[1]), tr[2]))
+
+            cur.execute("SELECT amount FROM savings WHERE id=%s" % sid)
+            current_amount = to_kop(cur.fetchone()[0])
+
+            initial_amount = current_amount
+            for td_str in sorted(tx_by_date.keys()):
+                for amt, tt in tx_by_date[td_str]:
+                    if tt == 'deposit':
+                        initial_amount -= amt
+                    elif tt in ('withdrawal', 'partial_withdrawal'):
+                        initial_amount += amt
+            if initial_amount < 0:
+                initial_amount = 0
+
+            running_bal = initial_amount
+            for td_str in sorted(tx_by_date.keys()):
+                if td_str < d.isoformat():
+                    for amt, tt in tx_by_date[td_str]:
+                        if tt == 'deposit':
+                            running_bal += amt
+                        elif tt in ('withdrawal', 'partial_withdrawal'):
+                            running_bal -= amt
+
+            count_added = 0
+            count_fixed = 0
+            total_added = Decimal('0')
+            total_fixed_diff = Decimal('0')
+
+            while d <= d_to:
+                ds = d.isoformat()
+
+                effective_rate = original_rate
+                for rc_d, rc_old, rc_r in rate_changes_list:
+                    if rc_d <= d:
+                        effective_rate = rc_r
+
+                if running_bal > 0:
+                    correct_amount = kop_decimal(interest_kop(running_bal, to_rate(effective_rate), 1, 365))
+
+                    if ds not in existing_rows:
+                        if correct_amount > 0:
+                            cur.execute("INSERT INTO savings_daily_accruals (saving_id, accrual_date, balance, rate, daily_amount) VALUES (%s, '%s', %s, %s, %s)" % (sid, ds, running_bal / 100, float(effective_rate), float(correct_amount)))
+                            cur.execute("UPDATE savings SET accrued_interest=accrued_interest+%s, updated_at=NOW() WHERE id=%s" % (float(correct_amount), sid))
+                            count_added += 1
+                            total_added += correct_amount
+                    elif mode == 'verify_fix':
+                        ex = existing_rows[ds]
+                        old_amount = ex['daily_amount']
+                        old_rate_ex = ex['rate']
+                        if abs(old_amount - correct_amount) >= Decimal('0.01') or abs(old_rate_ex - effective_rate) >= Decimal('0.001'):
+                            diff = correct_amount - old_amount
+                            cur.execute("UPDATE savings_daily_accruals SET rate=%s, daily_amount=%s, balance=%s WHERE id=%s" % (float(effective_rate), float(correct_amount), running_bal / 100, ex['id']))
+                            cur.execute("UPDATE savings SET accrued_interest=accrued_interest+%s, updated_at=NOW() WHERE id=%s" % (float(diff), sid))
+                            count_fixed += 1
+                            total_fixed_diff += diff
+
+                if ds in tx_by_date:
+                    for amt, tt in tx_by_date[ds]:
+                        if tt == 'deposit':
+                            running_bal += amt
+                        elif tt == 'withdrawal':
+                            running_bal -= amt
+
+                d += timedelta(days=1)
+
+            desc_parts = []
+            if count_added > 0:
+                desc_parts.append('добавлено %s дн. на %s' % (count_added, float(total_added)))
+            if count_fixed > 0:
+                desc_parts.append('исправлено %s дн., корректировка %s' % (count_fixed, float(total_fixed_diff)))
+            if desc_parts:
+                desc = 'Начисление процентов за %s — %s: %s' % (fmt_date(date_from), fmt_date(date_to), '; '.join(desc_parts))
+                cur.execute("INSERT INTO savings_transactions (saving_id,transaction_date,amount,transaction_type,description) VALUES (%s,'%s',%s,'interest_accrual','%s')" % (sid, date_to, float(total_added + total_fixed_diff), esc(desc)))
+            audit_log(cur, staff, 'backfill_accrue', 'saving', sid, '', 'Период: %s — %s, mode: %s, добавлено: %s, исправлено: %s' % (date_from, date_to, mode, count_added, count_fixed), ip)
+            if count_added > 0 or count_fixed > 0:
+                refresh_accrual_totals(cur, sid)
+                conn.commit()
+            return {
+                'success': True,
+                'days_added': count_added,
+                'days_fixed': count_fixed,
+                'total_added': float(total_added),
+                'total_fixed_diff': float(total_fixed_diff),
+                'date_from': date_from,
+                'date_to': date_to,
+                'mode': mode,
+            }
+
+        elif action == 'reset_accruals':
+            sid = int(body['saving_id'])
+            date_to = body.get('date_to', date.today().isoformat())
+            cur.execute("SELECT id, rate, start_date FROM savings WHERE id=%s" % sid)
+            sv = cur.fetchone()
+            if not sv:
+                return {'error': 'Вклад не найден'}
+            s_rate = Decimal(str(sv[1]))
+            s_start = str(sv[2])
+            s_start_date = date.fromisoformat(s_start)
+            cur.execute("SELECT effective_date, old_rate, new_rate FROM savings_rate_changes WHERE saving_id=%s ORDER BY effective_date" % sid)
+            rate_changes_rows = cur.fetchall()
+            rate_changes_list = [(date.fromisoformat(str(r[0])), Decimal(str(r[1])), Decimal(str(r[2]))) for r in rate_changes_rows]
+            original_rate = rate_changes_list[0][1] if rate_changes_list else s_rate
+            cur.execute("SELECT transaction_date, amount, transaction_type FROM savings_transactions WHERE saving_id=%s ORDER BY transaction_date, id" % sid)
+            tx_rows = cur.fetchall()
+            tx_by_date = {}
+            for tr in tx_rows:
+                td_str = str(tr[0])
+                if td_str not in tx_by_date:
+                    tx_by_date[td_str] = []
+                tx_by_date[td_str].append((Decimal(str(tr[1])), tr[2]))
+            cur.execute("SELECT amount FROM savings WHERE id=%s" % sid)
+            current_amount = Decimal(str(cur.fetchone()[0]))
+            initial_amount = current_amount
+            for td_str in sorted(tx_by_date.keys()):
+                for amt, tt in tx_by_date[td_str]:
+                    if tt == 'deposit':
+                        initial_amount -= amt
+                    elif tt in ('withdrawal', 'partial_withdrawal'):
+                        initial_amount += amt
+            if initial_amount < 0:
+                initial_amount = Decimal('0')
+            cur.execute("DELETE FROM savings_daily_accruals WHERE saving_id=%s" % sid)
+            cur.execute("DELETE FROM savings_transactions WHERE saving_id=%s AND transaction_type='interest_accrual'" % sid)
+            running_bal = initial_amount
+            d = s_start_date + timedelta(days=1)
+            d_to = date.fromisoformat(date_to)
+            total_accrued = Decimal('0')
+            count = 0
+            while d <= d_to:
+                ds = d.isoformat()
+                effective_rate = original_rate
+                for rc_d, rc_old, rc_r in rate_changes_list:
+                    if rc_d <= d:
+                        effective_rate = rc_r
+                if running_bal > 0:
+                    daily = (running_bal * effective_rate / Decimal('100') / Decimal('365')).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+                    if daily > 0:
+                        cur.execute("INSERT INTO savings_daily_accruals (saving_id, accrual_date, balance, rate, daily_amount) VALUES (%s, '%s', %s, %s, %s)" % (sid, ds, float(running_bal), float(effective_rate), float(daily)))
+                        total_accrued += daily
+                        count += 1
+                if ds in tx_by_date:
+                    for amt, tt in tx_by_date[ds]:
+                        if tt == 'deposit':
+                            running_bal += amt
+                        elif tt in ('withdrawal', 'partial_withdrawal'):
+                            running_bal -= amt
+                d += timedelta(days=1)
+            cur.execute("UPDATE savings SET accrued_interest=%s, updated_at=NOW() WHERE id=%s" % (float(total_accrued), sid))
+            refresh_accrual_totals(cur, sid)
+            desc = 'Пересчёт начислений %s — %s: %s дн., итого %s' % (s_start, date_to, count, float(total_accrued))
+            cur.execute("INSERT INTO savings_transactions (saving_id,transaction_date,amount,transaction_type,description) VALUES (%s,'%s',%s,'interest_accrual','%s')" % (sid, date_to, float(total_accrued), esc(desc)))
+            audit_log(cur, staff, 'reset_accruals', 'saving', sid, '', desc, ip)
+            conn.commit()
+            return {'success': True, 'days': count, 'total_accrued': float(total_accrued)}
+
+        elif action == 'partial_withdrawal':
+            sid = int(body['saving_id'])
+            a = Decimal(str(safe_float(body['amount'], 'сумма')))
+            td = body.get('transaction_date', date.today().isoformat())
+            cur.execute("SELECT current_balance, amount, min_balance_pct FROM savings WHERE id=%s AND status='active'" % sid)
+            sv = cur.fetchone()
+            if not sv:
+                return {'error': 'Вклад не найден или не активен'}
+            bal = Decimal(str(sv[0]))
+            orig_amount = Decimal(str(sv[1]))
+            mbp = Decimal(str(sv[2]))
+            if mbp <= 0:
+                return {'error': 'По данному договору частичное изъятие не предусмотрено'}
+            min_bal = (orig_amount * mbp / Decimal('100')).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+            new_bal = bal - a
+            if new_bal < min_bal:
+                return {'error': 'Нельзя снять больше. Неснижаемый остаток: %s руб. (текущий баланс: %s руб.)' % (float(min_bal), float(bal))}
+            cur.execute("INSERT INTO savings_transactions (saving_id,transaction_date,amount,transaction_type,description) VALUES (%s,'%s',%s,'partial_withdrawal','Частичное изъятие')" % (sid, td, float(a)))
+            cur.execute("UPDATE savings SET current_balance=current_balance-%s, amount=amount-%s, updated_at=NOW() WHERE id=%s" % (float(a), float(a), sid))
+            cur.execute("SELECT amount, rate, term_months, start_date, payout_type FROM savings WHERE id=%s" % sid)
+            sv2 = cur.fetchone()
+            recalc_savings_schedule(cur, sid, float(sv2[0]), float(sv2[1]), int(sv2[2]), date.fromisoformat(str(sv2[3])), sv2[4])
+            audit_log(cur, staff, 'partial_withdrawal', 'saving', sid, '', 'Сумма: %s, остаток: %s' % (float(a), float(new_bal)), ip)
+            conn.commit()
+            return {'success': True, 'new_balance': float(new_bal), 'min_balance': float(min_bal)}
+
+        elif action == 'modify_term':
+            sid = int(body['saving_id'])
+            new_term = safe_int(body.get('new_term'), 'срок')
+            effective_date = body.get('effective_date', date.today().isoformat())
+            cur.execute("SELECT amount, rate, start_date, payout_type FROM savings WHERE id=%s AND status='active'" % sid)
+            sv = cur.fetchone()
+            if not sv:
+                return {'error': 'Вклад не найден или не активен'}
+            s_amount, s_rate, s_start, s_pt = float(sv[0]), float(sv[1]), date.fromisoformat(str(sv[2])), sv[3]
+            schedule = recalc_savings_schedule(cur, sid, s_amount, s_rate, new_term, s_start, s_pt)
+            new_end = add_months(s_start, new_term)
+            cur.execute("UPDATE savings SET term_months=%s, end_date='%s', updated_at=NOW() WHERE id=%s" % (new_term, new_end.isoformat(), sid))
+            cur.execute("INSERT INTO savings_transactions (saving_id,transaction_date,amount,transaction_type,description) VALUES (%s,'%s',0,'term_change','Изменение срока: %s мес. с %s, новая дата окончания: %s')" % (sid, effective_date, new_term, fmt_date(effective_date), fmt_date(new_end.isoformat())))
+            audit_log(cur, staff, 'modify_term', 'saving', sid, '', 'Новый срок: %s мес. с %s' % (new_term, effective_date), ip)
+            conn.commit()
+            return {'success': True, 'new_term': new_term, 'new_end_date': new_end.isoformat(), 'schedule': schedule}
+
+        elif action == 'recalc_schedule':
+            sid = int(body['saving_id'])
+            cur.execute("SELECT amount, rate, term_months, start_date, payout_type FROM savings WHERE id=%s AND status='active'" % sid)
+            sv = cur.fetchone()
+            if not sv:
+                return {'error': 'Вклад не найден или не активен'}
+            s_amount, s_rate, s_term = float(sv[0]), float(sv[1]), int(sv[2])
+            s_start, s_pt = date.fromisoformat(str(sv[3])), sv[4]
+            schedule = recalc_savings_schedule(cur, sid, s_amount, s_rate, s_term, s_start, s_pt)
+            new_end = add_months(s_start, s_term)
+            cur.execute("UPDATE savings SET end_date='%s', updated_at=NOW() WHERE id=%s" % (new_end.isoformat(), sid))
+            audit_log(cur, staff, 'recalc_schedule', 'saving', sid, '', 'Пересчёт графика', ip)
+            conn.commit()
+            return {'success': True, 'schedule': schedule, 'new_end_date': new_end.isoformat()}
+        
+        elif action == 'recalc_all_active':
+            cur.execute("SELECT id FROM savings WHERE status='active' ORDER BY id")
+            ids = [r[0] for r in cur.fetchall()]
+            chunk_size = int(body.get('chunk_size', 200))
+            job_id = start_batch_job(cur, conn, 'savings_recalc_all', len(ids), staff)
+            recalculated = 0
+            errors = []
+            try:
+                for pos in range(0, len(ids), chunk_size):
+                    inputs = load_savings_inputs(cur, ids[pos:pos + chunk_size])
+                    results = map_parallel(compute_savings_recalc, list(inputs.values()))
+                    end_dates = []
+                    for res in results:
+                        item = inputs[res['id']]
+                        if 'error' in res:
+                            errors.append({'contract_no': item['contract_no'], 'error': res['error']})
+                            continue
+                        cur.execute("SAVEPOINT recalc_saving")
+                        try:
+                            write_savings_schedule(cur, res['id'], res['schedule'])
+                            cur.execute("RELEASE SAVEPOINT recalc_saving")
+                        except Exception as e:
+                            cur.execute("ROLLBACK TO SAVEPOINT recalc_saving")
+                            errors.append({'contract_no': item['contract_no'], 'error': str(e)})
+                            continue
+                        end_dates.append("(%s, '%s'::date)" % (res['id'], add_months(item['start_date'], item['term']).isoformat()))
+                        audit_log(cur, staff, 'recalc_schedule', 'saving', res['id'], item['contract_no'], 'Массовый пересчёт графика', ip)
+                        recalculated += 1
+                    if end_dates:
+                        cur.execute("UPDATE savings s SET end_date=v.end_date, updated_at=NOW() FROM (VALUES %s) AS v(id, end_date) WHERE s.id=v.id" % ','.join(end_dates))
+                    update_batch_job(cur, job_id, recalculated + len(errors), len(errors))
+                    conn.commit()
+            except Exception as e:
+                conn.rollback()
+                update_batch_job(cur, job_id, recalculated + len(errors), len(errors), 'failed', {'error': str(e)})
+                conn.commit()
+                raise
+            result = {'success': True, 'job_id': job_id, 'recalculated': recalculated, 'total': len(ids), 'errors': errors}
+            update_batch_job(cur, job_id, recalculated + len(errors), len(errors), 'done', result)
+            conn.commit()
+            return result
+
+        elif action == 'update_saving':
+            sid = int(body['saving_id'])
+            cur.execute("SELECT id, contract_no, member_id, amount, rate, term_months, payout_type, start_date, min_balance_pct, org_id, status FROM savings WHERE id=%s" % sid)
+            sv = cur.fetchone()
+            if not sv:
+                return {'error': 'Договор не найден'}
+            mark_member_stats(cur, 'members', sv[2])
+            mark_member_stats(cur, 'savings', sid)
+            old_cn = sv[1]
+            old_amount = float(sv[3])
+            old_rate = float(sv[4])
+            old_term = int(sv[5])
+            old_pt = sv[6]
+            old_sd = date.fromisoformat(str(sv[7]))
+            old_mbp = float(sv[8]) if sv[8] else 0
+            old_org = sv[9]
+            old_status = sv[10]
+            cn = body.get('contract_no', old_cn).strip()
+            if cn != old_cn:
+                cur.execute("SELECT id FROM savings WHERE contract_no='%s' AND id!=%s" % (esc(cn), sid))
+                if cur.fetchone():
+                    return {'error': 'Договор с номером %s уже существует' % cn}
+            new_amount = safe_float(body['amount'], 'сумма') if 'amount' in body else old_amount
+            new_rate = safe_float(body['rate'], 'ставка') if 'rate' in body else old_rate
+            new_term = safe_int(body['term_months'], 'срок') if 'term_months' in body else old_term
+            new_pt = body.get('payout_type', old_pt)
+            new_sd = date.fromisoformat(body['start_date']) if 'start_date' in body else old_sd
+            new_mbp = safe_float(body.get('min_balance_pct', old_mbp), 'мин. остаток %')
+            new_org = body.get('org_id', old_org)
+            new_mid = int(body['member_id']) if 'member_id' in body else int(sv[2])
+            new_ed = add_months(new_sd, new_term)
+            cur.execute("UPDATE savings SET contract_no='%s', member_id=%s, amount=%s, rate=%s, term_months=%s, payout_type='%s', start_date='%s', end_date='%s', min_balance_pct=%s, org_id=%s, updated_at=NOW() WHERE id=%s" % (esc(cn), new_mid, new_amount, new_rate, new_term, new_pt, new_sd.isoformat(), new_ed.isoformat(), new_mbp, new_org if new_org else 'NULL', sid))
+            if old_status == 'active':
+                cur.execute("UPDATE savings SET current_balance=%s WHERE id=%s AND current_balance=%s" % (new_amount, sid, old_amount))
+            changes = []
+            if cn != old_cn:
+                changes.append('номер: %s→%s' % (old_cn, cn))
+            if new_amount != old_amount:
+                changes.append('сумма: %s→%s' % (fmt_money(old_amount), fmt_money(new_amount)))
+            if new_rate != old_rate:
+                changes.append('ставка: %s%%→%s%%' % (old_rate, new_rate))
+            if new_term != old_term:
+                changes.append('срок: %s→%s мес.' % (old_term, new_term))
+            if new_pt != old_pt:
+                changes.append('выплата: %s→%s' % (old_pt, new_pt))
+            if new_sd != old_sd:
+                changes.append('дата начала: %s→%s' % (old_sd.isoformat(), new_sd.isoformat()))
+            if new_mbp != old_mbp:
+                changes.append('несниж.остаток: %s%%→%s%%' % (old_mbp, new_mbp))
+            schedule = recalc_savings_schedule(cur, sid, new_amount, new_rate, new_term, new_sd, new_pt)
+            audit_log(cur, staff, 'update_saving', 'saving', sid, cn, 'Изменение договора: %s' % ', '.join(changes) if changes else 'Пересчёт графика', ip)
+            conn.commit()
+            return {'success': True, 'schedule': schedule, 'new_end_date': new_ed.isoformat()}
+
+        elif action == 'change_rate':
+            sid = int(body['saving_id'])
+            new_rate = safe_float(body.get('new_rate'), 'ставка')
+            effective_date = body.get('effective_date', date.today().isoformat())
+            reason = body.get('reason', '')
+            cur.execute("SELECT rate, amount, term_months, start_date, payout_type FROM savings WHERE id=%s AND status='active'" % sid)
+            sv = cur.fetchone()
+            if not sv:
+                return {'error': 'Вклад не найден или не активен'}
+            old_rate = float(sv[0])
+            if new_rate == old_rate:
+                return {'error': 'Новая ставка совпадает с текущей'}
+            created_by_id = staff.get('user_id') if staff else None
+            cur.execute("INSERT INTO savings_rate_changes (saving_id, effective_date, old_rate, new_rate, reason, created_by) VALUES (%s, '%s', %s, %s, '%s', %s)" % (sid, effective_date, old_rate, new_rate, esc(reason), created_by_id or 'NULL'))
+            cur.execute("UPDATE savings SET rate=%s, updated_at=NOW() WHERE id=%s" % (new_rate, sid))
+            s_amount, s_term = float(sv[1]), int(sv[2])
+            s_start, s_pt = date.fromisoformat(str(sv[3])), sv[4]
+            schedule = recalc_savings_schedule(cur, sid, s_amount, new_rate, s_term, s_start, s_pt)
+            cur.execute("INSERT INTO savings_transactions (saving_id,transaction_date,amount,transaction_type,description) VALUES (%s,'%s',0,'rate_change','Изменение ставки: %s%% → %s%% с %s. %s')" % (sid, effective_date, old_rate, new_rate, fmt_date(effective_date), esc(reason)))
+            audit_log(cur, staff, 'change_rate', 'saving', sid, '', 'Ставка: %s%% → %s%% с %s' % (old_rate, new_rate, effective_date), ip)
+            conn.commit()
+            return {'success': True, 'old_rate': old_rate, 'new_rate': new_rate, 'schedule': schedule}
+
+        elif action == 'batch_change_rate':
+            new_rate = safe_float(body.get('new_rate'), 'ставка')
+            effective_date = body.get('effective_date', date.today().isoformat())
+            eff_date = date.fromisoformat(effective_date)
+            reason = body.get('reason', '')
+            dry_run = bool(body.get('dry_run'))
+            where = ["status='active'", "rate <> %s" % new_rate]
+            if body.get('org_id'):
+                where.append("org_id=%s" % int(body['org_id']))
+            if body.get('rate') not in (None, ''):
+                where.append("rate=%s" % safe_float(body['rate'], 'текущая ставка'))
+            if body.get('term_months') not in (None, ''):
+                where.append("term_months=%s" % safe_int(body['term_months'], 'срок'))
+            if body.get('start_from'):
+                where.append("start_date >= '%s'" % date.fromisoformat(body['start_from']).isoformat())
+            if body.get('start_to'):
+                where.append("start_date <= '%s'" % date.fromisoformat(body['start_to']).isoformat())
+            cur.execute("SELECT id FROM savings WHERE %s ORDER BY id" % ' AND '.join(where))
+            ids = [r[0] for r in cur.fetchall()]
+            if not ids:
+                return {'success': True, 'total': 0, 'changed': 0, 'failed': 0, 'deposits': []}
+            ids_sql = ','.join(str(i) for i in ids)
+
+            inputs = load_savings_inputs(cur, ids)
+            cur.execute("SELECT saving_id, COALESCE(SUM(interest_amount), 0) FROM savings_schedule WHERE saving_id IN (%s) GROUP BY saving_id" % ids_sql)
+            old_interest = {r[0]: Decimal(str(r[1])) for r in cur.fetchall()}
+            cur.execute("SELECT saving_id, id, accrual_date, balance, daily_amount FROM savings_daily_accruals WHERE saving_id IN (%s) AND accrual_date >= '%s' ORDER BY saving_id, accrual_date" % (ids_sql, effective_date))
+            for r in cur.fetchall():
+                inputs[r[0]].setdefault('accruals', []).append((r[1], r[2], r[3], r[4]))
+            items = []
+            for sid in ids:
+                item = inputs[sid]
+                old_rate = item['rate']
+                item['old_rate'] = old_rate
+                item['rate_changes'] = sorted(item['rate_changes'] + [(eff_date, Decimal(str(old_rate)), Decimal(str(new_rate)))], key=lambda rc: rc[0])
+                item['rate'] = new_rate
+                items.append(item)
+            results = map_parallel(compute_savings_recalc, items)
+
+            deposits = []
+            ok_ids = []
+            for res in results:
+                item = inputs[res['id']]
+                if 'error' in res:
+                    deposits.append({'id': res['id'], 'contract_no': item['contract_no'], 'error': res['error']})
+                    continue
+                old_total = old_interest.get(res['id'], Decimal('0'))
+                new_total = schedule_interest_total(res['schedule'])
+                accrual_diff = sum(Decimal(str(f[3])) for f in res['accrual_fixes'])
+                deposits.append({'id': res['id'], 'contract_no': item['contract_no'], 'old_rate': item['old_rate'], 'new_rate': new_rate,
+                                 'old_interest': float(old_total), 'new_interest': float(new_total),
+                                 'interest_diff': float(new_total - old_total), 'accrual_diff': float(accrual_diff)})
+                ok_ids.append(res['id'])
+            if dry_run:
+                conn.rollback()
+                return {'success': True, 'dry_run': True, 'total': len(ids), 'changed': len(ok_ids), 'failed': len(ids) - len(ok_ids),
+                        'interest_diff': sum(d.get('interest_diff', 0) for d in deposits), 'deposits': deposits}
+
+            # Фиксация по частям с прогрессом в batch_jobs, как recalc_all_active: ошибка вклада откатывается до его savepoint,
+            # сбой части — до её начала; уже зафиксированные части остаются, повторный запуск их не выберет (rate <> new_rate)
+            created_by_id = staff.get('user_id') if staff else None
+            by_id = {d['id']: d for d in deposits}
+            chunk_size = int(body.get('chunk_size', 200))
+            job_id = start_batch_job(cur, conn, 'savings_batch_change_rate', len(ids), staff)
+            changed = 0
+            failed = len(ids) - len(ok_ids)
+            results = [res for res in results if 'error' not in res]
+            committed = (changed, failed)
+            try:
+                for pos in range(0, len(results), chunk_size):
+                    chunk = results[pos:pos + chunk_size]
+                    chunk_ids = [res['id'] for res in chunk]
+                    cur.execute("INSERT INTO savings_rate_changes (saving_id, effective_date, old_rate, new_rate, reason, created_by) VALUES %s RETURNING saving_id, id" % ','.join(
+                        "(%s, '%s', %s, %s, '%s', %s)" % (sid, effective_date, by_id[sid]['old_rate'], new_rate, esc(reason), created_by_id or 'NULL') for sid in chunk_ids))
+                    rc_ids = dict(cur.fetchall())
+                    cur.execute("INSERT INTO savings_transactions (saving_id, transaction_date, amount, transaction_type, description) VALUES %s RETURNING saving_id, id" % ','.join(
+                        "(%s, '%s', 0, 'rate_change', 'Изменение ставки: %s%% → %s%% с %s. %s')" % (sid, effective_date, by_id[sid]['old_rate'], new_rate, fmt_date(effective_date), esc(reason)) for sid in chunk_ids))
+                    tx_ids = dict(cur.fetchall())
+                    cur.execute("UPDATE savings SET rate=%s, updated_at=NOW() WHERE id IN (%s)" % (new_rate, ','.join(str(i) for i in chunk_ids)))
+                    for res in chunk:
+                        sid = res['id']
+                        cur.execute("SAVEPOINT batch_rate")
+                        try:
+                            write_savings_schedule(cur, sid, res['schedule'])
+                            if res['accrual_fixes']:
+                                cur.execute("""
+                                    UPDATE savings_daily_accruals da SET rate=v.rate, daily_amount=v.amount
+                                    FROM (VALUES %s) AS v(id, rate, amount) WHERE da.id=v.id
+                                """ % ','.join("(%s, %s, %s)" % (f[0], f[1], f[2]) for f in res['accrual_fixes']))
+                                diff = by_id[sid]['accrual_diff']
+                                cur.execute("UPDATE savings SET accrued_interest=accrued_interest+%s, accrual_total=accrual_total+%s WHERE id=%s" % (diff, diff, sid))
+                            audit_log(cur, staff, 'change_rate', 'saving', sid, by_id[sid]['contract_no'], 'Пакетная смена ставки: %s%% → %s%% с %s' % (by_id[sid]['old_rate'], new_rate, effective_date), ip)
+                            cur.execute("RELEASE SAVEPOINT batch_rate")
+                            changed += 1
+                        except Exception as e:
+                            cur.execute("ROLLBACK TO SAVEPOINT batch_rate")
+                            by_id[sid]['error'] = str(e)
+                            failed += 1
+                            cur.execute("DELETE FROM savings_rate_changes WHERE id=%s" % rc_ids[sid])
+                            cur.execute("DELETE FROM savings_transactions WHERE id=%s" % tx_ids[sid])
+                            cur.execute("UPDATE savings SET rate=%s WHERE id=%s" % (by_id[sid]['old_rate'], sid))
+                    update_batch_job(cur, job_id, changed + failed, failed)
+                    conn.commit()
+                    committed = (changed, failed)
+            except Exception as e:
+                conn.rollback()
+                changed, failed = committed
+                update_batch_job(cur, job_id, changed + failed, failed, 'failed', {'error': str(e), 'changed': changed})
+                conn.commit()
+                raise
+            result = {'success': True, 'job_id': job_id, 'total': len(ids), 'changed': changed, 'failed': failed,
+                      'interest_diff': sum(d.get('interest_diff', 0) for d in deposits if 'error' not in d), 'deposits': deposits}
+            update_batch_job(cur, job_id, changed + failed, failed, 'done', {k: v for k, v in result.items() if k != 'deposits'})
+            conn.commit()
+            return result
+
+        elif action == 'auto_accrue':
+            sid = int(body['saving_id'])
+            today = date.today()
+            cur.execute("SELECT id, period_no, period_end FROM savings_schedule WHERE saving_id=%s AND status='pending' AND period_end <= '%s' ORDER BY period_no" % (sid, today.isoformat()))
+            rows = cur.fetchall()
+            count = 0
+            for r in rows:
+                cur.execute("UPDATE savings_schedule SET status='accrued' WHERE id=%s" % r[0])
+                count += 1
+            if count > 0:
+                conn.commit()
+            return {'success': True, 'accrued_count': count}
+
+        elif action == 'update_transaction':
+            tid = int(body['transaction_id'])
+            cur.execute("SELECT saving_id, amount, transaction_type FROM savings_transactions WHERE id=%s" % tid)
+            old = cur.fetchone()
+            if not old:
+                return {'error': 'Операция не найдена'}
+            sid, old_amount, old_tt = old[0], Decimal(str(old[1])), old[2]
+
+            new_date = body.get('transaction_date')
+            new_amount = Decimal(str(body.get('amount', float(old_amount))))
+            new_desc = body.get('description', '')
+            delta = new_amount - old_amount
+
+            upd = "amount=%s" % float(new_amount)
+            if new_date:
+                upd += ", transaction_date='%s'" % new_date
+            if new_desc is not None:
+                upd += ", description='%s'" % esc(new_desc)
+            cur.execute("UPDATE savings_transactions SET %s WHERE id=%s" % (upd, tid))
+
+            if delta != 0:
+                if old_tt == 'deposit':
+                    cur.execute("UPDATE savings SET current_balance=current_balance+%s, amount=amount+%s, updated_at=NOW() WHERE id=%s" % (float(delta), float(delta), sid))
+                elif old_tt == 'withdrawal':
+                    cur.execute("UPDATE savings SET current_balance=current_balance-%s, updated_at=NOW() WHERE id=%s" % (float(delta), sid))
+                elif old_tt == 'interest_payout':
+                    cur.execute("UPDATE savings SET paid_interest=paid_interest+%s, accrued_interest=accrued_interest+%s, updated_at=NOW() WHERE id=%s" % (float(delta), float(delta), sid))
+            audit_log(cur, staff, 'update_transaction', 'saving', sid, '', 'Транзакция #%s: %s -> %s' % (tid, float(old_amount), float(new_amount)), ip)
+            conn.commit()
+            return {'success': True}
+
+        elif action == 'delete_transaction':
+            tid = int(body['transaction_id'])
+            cur.execute("SELECT saving_id, amount, transaction_type FROM savings_transactions WHERE id=%s" % tid)
+            old = cur.fetchone()
+            if not old:
+                return {'error': 'Операция не найдена'}
+            sid, old_amount, old_tt = old[0], Decimal(str(old[1])), old[2]
+            cur.execute("DELETE FROM savings_transactions WHERE id=%s" % tid)
+            if old_tt == 'deposit':
+                cur.execute("UPDATE savings SET current_balance=current_balance-%s, amount=amount-%s, updated_at=NOW() WHERE id=%s" % (float(old_amount), float(old_amount), sid))
+            elif old_tt == 'withdrawal':
+                cur.execute("UPDATE savings SET current_balance=current_balance+%s, updated_at=NOW() WHERE id=%s" % (float(old_amount), sid))
+            elif old_tt == 'interest_payout':
+                cur.execute("UPDATE savings SET paid_interest=paid_interest-%s, accrued_interest=accrued_interest-%s, updated_at=NOW() WHERE id=%s" % (float(old_amount), float(old_amount), sid))
+            elif old_tt == 'interest_accrual':
+                cur.execute("UPDATE savings SET accrued_interest=accrued_interest-%s, updated_at=NOW() WHERE id=%s" % (float(old_amount), sid))
+            audit_log(cur, staff, 'delete_transaction', 'saving', sid, '', 'Удалена: %s %s' % (old_tt, float(old_amount)), ip)
+            conn.commit()
+            return {'success': True}
+
+        elif action == 'delete_accrual':
+            accrual_id = int(body['accrual_id'])
+            cur.execute("SELECT saving_id, daily_amount FROM savings_daily_accruals WHERE id=%s" % accrual_id)
+            row = cur.fetchone()
+            if not row:
+                return {'error': 'Начисление не найдено'}
+            sid, daily_amt = row[0], Decimal(str(row[1]))
+            cur.execute("DELETE FROM savings_daily_accruals WHERE id=%s" % accrual_id)
+            cur.execute("UPDATE savings SET accrued_interest=GREATEST(0, accrued_interest-%s), updated_at=NOW() WHERE id=%s" % (float(daily_amt), sid))
+            refresh_accrual_totals(cur, sid)
+            audit_log(cur, staff, 'delete_accrual', 'saving', sid, '', 'Удалено начисление %s' % float(daily_amt), ip)
+            conn.commit()
+            return {'success': True}
+
+        elif action == 'clear_daily_accruals':
+            sid = int(body['saving_id'])
+            cur.execute("SELECT COALESCE(SUM(daily_amount),0) FROM savings_daily_accruals WHERE saving_id=%s" % sid)
+            total_accrued = Decimal(str(cur.fetchone()[0]))
+            cur.execute("DELETE FROM savings_daily_accruals WHERE saving_id=%s" % sid)
+            cur.execute("UPDATE savings SET accrued_interest=0, accrual_total=0, accrual_days=0, accrual_first_date=NULL, accrual_last_date=NULL, updated_at=NOW() WHERE id=%s" % sid)
+            audit_log(cur, staff, 'clear_daily_accruals', 'saving', sid, '', 'Удалены все начисления, сумма: %s' % float(total_accrued), ip)
+            conn.commit()
+            return {'success': True, 'cleared_amount': float(total_accrued)}
+
+        elif action == 'delete_contract':
+            sid = int(body['saving_id'])
+            cur.execute("SELECT contract_no, member_id FROM savings WHERE id=%s" % sid)
+            sr = cur.fetchone()
+            if not sr:
+                return {'error': 'Договор не найден'}
+            mark_member_stats(cur, 'members', sr[1])
+            cur.execute("DELETE FROM savings_transactions WHERE saving_id=%s" % sid)
+            cur.execute("DELETE FROM savings_schedule WHERE saving_id=%s" % sid)
+            cur.execute("DELETE FROM savings_rate_changes WHERE saving_id=%s" % sid)
+            cur.execute("DELETE FROM savings WHERE id=%s" % sid)
+            audit_log(cur, staff, 'delete_contract', 'saving', sid, sr[0], '', ip)
+            conn.commit()
+            return {'success': True}
+
+        elif action == 'delete_all_transactions':
+            sid = int(body['saving_id'])
+            cur.execute("SELECT amount FROM savings WHERE id=%s" % sid)
+            sr = cur.fetchone()
+            if not sr:
+                return {'error': 'Договор не найден'}
+            cur.execute("DELETE FROM savings_transactions WHERE saving_id=%s" % sid)
+            cur.execute("DELETE FROM savings_daily_accruals WHERE saving_id=%s" % sid)
+            cur.execute("DELETE FROM savings_rate_changes WHERE saving_id=%s" % sid)
+            cur.execute("UPDATE savings_schedule SET status='pending', paid_date=NULL, paid_amount=0 WHERE saving_id=%s" % sid)
+            orig = float(sr[0])
+            mark_member_stats(cur, 'savings', sid)
+            cur.execute("UPDATE savings SET current_balance=%s, accrued_interest=0, paid_interest=0, accrual_total=0, accrual_days=0, accrual_first_date=NULL, accrual_last_date=NULL, status='active', updated_at=NOW() WHERE id=%s" % (orig, sid))
+            audit_log(cur, staff, 'delete_all_transactions', 'saving', sid, '', '', ip)
+            conn.commit()
+            return {'success': True}
+
+        elif action == 'early_close':
+            sid = int(body['saving_id'])
+            cur.execute("SELECT amount, accrued_interest, paid_interest, current_balance FROM savings WHERE id=%s" % sid)
+            sv = cur.fetchone()
+            oa, paid, bal = Decimal(str(sv[0])), Decimal(str(sv[2])), Decimal(str(sv[3]))
+            ei = (oa * Decimal('0.001')).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+            overpaid = paid - ei
+            fa = bal - overpaid if overpaid > 0 else bal
+            mark_member_stats(cur, 'savings', sid)
+            cur.execute("UPDATE savings SET status='early_closed', current_balance=%s, accrued_interest=%s, updated_at=NOW() WHERE id=%s" % (float(fa), float(ei), sid))
+            cur.execute("INSERT INTO savings_transactions (saving_id,transaction_date,amount,transaction_type,description) VALUES (%s,'%s',%s,'early_close','Досрочное закрытие')" % (sid, date.today().isoformat(), float(fa)))
+            audit_log(cur, staff, 'early_close', 'saving', sid, '', 'Возврат: %s' % float(fa), ip)
+            conn.commit()
+            return {'success': True, 'final_amount': float(fa), 'early_interest': float(ei)}
@@ -0,0 +1,785 @@
+"""Графики займов и сбережений, распределение платежей и пересчёты — общие для займов, сбережений и сверки"""
+import json
+from datetime import date, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+import hashlib
+from money import RATE_SCALE, FractionalAmount, to_kop, to_rate, kop_decimal, interest_kop, period_interest, factor, mul_kop
+from core import add_months, esc, execute_prepared, last_day_of_month
+
+def calc_payment_dates(start_date, term):
+    dates = []
+    for i in range(1, term + 1):
+        if i == term:
+            dates.append(add_months(start_date, term))
+        else:
+            dates.append(last_day_of_month(add_months(start_date, i)))
+    return dates
+
+def calc_annuity_schedule(amount, rate, term, start_date):
+    """Аннуитетный график в целых копейках; сумма с долями копейки — через calc_annuity_schedule_decimal"""
+    monthly_rate = Decimal(str(rate)) / Decimal('100') / Decimal('12')
+    amt = Decimal(str(amount))
+    if monthly_rate > 0:
+        annuity = amt * monthly_rate * (1 + monthly_rate) ** term / ((1 + monthly_rate) ** term - 1)
+    else:
+        annuity = amt / term
+    annuity = annuity.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    try:
+        balance, annuity_k = to_kop(amt), to_kop(annuity)
+    except FractionalAmount:
+        return calc_annuity_schedule_decimal(amount, rate, term, start_date)
+    mr = factor(monthly_rate)
+    schedule = []
+    pay_dates = calc_payment_dates(start_date, term)
+    for i in range(1, term + 1):
+        interest = mul_kop(balance, mr)
+        if i == term:
+            principal = balance
+            payment = principal + interest
+        else:
+            principal = max(annuity_k - interest, 0)
+            payment = annuity_k
+        balance = max(balance - principal, 0)
+        schedule.append({
+            'payment_no': i, 'payment_date': pay_dates[i - 1].isoformat(),
+            'payment_amount': payment / 100, 'principal_amount': principal / 100,
+            'interest_amount': interest / 100, 'balance_after': balance / 100,
+        })
+    return schedule, annuity_k / 100
+
+def calc_annuity_schedule_decimal(amount, rate, term, start_date):
+    monthly_rate = Decimal(str(rate)) / Decimal('100') / Decimal('12')
+    amt = Decimal(str(amount))
+    if monthly_rate > 0:
+        annuity = amt * monthly_rate * (1 + monthly_rate) ** term / ((1 + monthly_rate) ** term - 1)
+    else:
+        annuity = amt / term
+    annuity = annuity.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    schedule = []
+    balance = amt
+    pay_dates = calc_payment_dates(start_date, term)
+    for i in range(1, term + 1):
+        payment_date = pay_dates[i - 1]
+        interest = (balance * monthly_rate).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        if i == term:
+            principal = balance
+            payment = principal + interest
+        else:
+            principal = annuity - interest
+            if principal < 0:
+                principal = Decimal('0')
+            payment = annuity
+        balance = balance - principal
+        if balance < 0:
+            balance = Decimal('0')
+        schedule.append({
+            'payment_no': i, 'payment_date': payment_date.isoformat(),
+            'payment_amount': float(payment), 'principal_amount': float(principal),
+            'interest_amount': float(interest), 'balance_after': float(balance),
+        })
+    return schedule, float(annuity)
+
+def calc_end_of_term_schedule(amount, rate, term, start_date):
+    try:
+        balance, r = to_kop(amount), to_rate(rate)
+    except FractionalAmount:
+        return calc_end_of_term_schedule_decimal(amount, rate, term, start_date)
+    schedule = []
+    pay_dates = calc_payment_dates(start_date, term)
+    for i in range(1, term + 1):
+        payment_date = pay_dates[i - 1]
+        prev_date = pay_dates[i - 2] if i > 1 else start_date
+        interest = interest_kop(balance, r, (payment_date - prev_date).days, 360)
+        if i == term:
+            principal = balance
+            balance = 0
+        else:
+            principal = 0
+        schedule.append({
+            'payment_no': i, 'payment_date': payment_date.isoformat(),
+            'payment_amount': (principal + interest) / 100, 'principal_amount': principal / 100,
+            'interest_amount': interest / 100, 'balance_after': balance / 100,
+        })
+    return schedule, schedule[0]['payment_amount'] if schedule else 0
+
+def calc_end_of_term_schedule_decimal(amount, rate, term, start_date):
+    amt = Decimal(str(amount))
+    schedule = []
+    balance = amt
+    pay_dates = calc_payment_dates(start_date, term)
+    for i in range(1, term + 1):
+        payment_date = pay_dates[i - 1]
+        prev_date = pay_dates[i - 2] if i > 1 else start_date
+        days_in_period = (payment_date - prev_date).days
+        interest = (balance * Decimal(str(rate)) / Decimal('100') * Decimal(str(days_in_period)) / Decimal('360')).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        if i == term:
+            principal = balance
+            payment = principal + interest
+            balance = Decimal('0')
+        else:
+            principal = Decimal('0')
+            payment = interest
+        schedule.append({
+            'payment_no': i, 'payment_date': payment_date.isoformat(),
+            'payment_amount': float(payment), 'principal_amount': float(principal),
+            'interest_amount': float(interest), 'balance_after': float(balance),
+        })
+    return schedule, float(schedule[0]['payment_amount']) if schedule else 0
+
+def build_savings_boundaries(start_date, term):
+    close_date = add_months(start_date, term)
+    boundaries = [start_date]
+    eom = last_day_of_month(start_date)
+    while eom < close_date:
+        if eom > start_date:
+            boundaries.append(eom)
+        eom = last_day_of_month(eom + timedelta(days=1))
+    if boundaries[-1] != close_date:
+        boundaries.append(close_date)
+    return boundaries, close_date
+
+def calc_savings_schedule(amount, rate, term, start_date, payout_type):
+    try:
+        amt, r = to_kop(amount), to_rate(rate)
+    except FractionalAmount:
+        return calc_savings_schedule_decimal(amount, rate, term, start_date, payout_type)
+    schedule = []
+    cumulative = 0
+    boundaries, close_date = build_savings_boundaries(start_date, term)
+    for i in range(len(boundaries) - 1):
+        period_start = boundaries[i]
+        period_end = boundaries[i + 1]
+        interest = interest_kop(amt, r, (period_end - period_start).days, 365)
+        cumulative += interest
+        schedule.append({
+            'period_no': i + 1, 'period_start': period_start.isoformat(),
+            'period_end': period_end.isoformat(), 'interest_amount': interest / 100,
+            'cumulative_interest': cumulative / 100,
+            'balance_after': (amt + cumulative if payout_type == 'end_of_term' else amt) / 100,
+        })
+    return schedule
+
+def calc_savings_schedule_decimal(amount, rate, term, start_date, payout_type):
+    amt = Decimal(str(amount))
+    schedule = []
+    cumulative = Decimal('0')
+    boundaries, close_date = build_savings_boundaries(start_date, term)
+    for i in range(len(boundaries) - 1):
+        period_start = boundaries[i]
+        period_end = boundaries[i + 1]
+        actual_days = (period_end - period_start).days
+        interest = (amt * Decimal(str(rate)) / Decimal('100') * Decimal(str(actual_days)) / Decimal('365')).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        cumulative += interest
+        balance_after = float(amt + cumulative) if payout_type == 'end_of_term' else float(amt)
+        schedule.append({
+            'period_no': i + 1, 'period_start': period_start.isoformat(),
+            'period_end': period_end.isoformat(), 'interest_amount': float(interest),
+            'cumulative_interest': float(cumulative), 'balance_after': balance_after,
+        })
+    return schedule
+
+def refresh_loan_overdue_status(cur, lid):
+    cur.execute("SELECT status FROM loans WHERE id=%s" % lid)
+    row = cur.fetchone()
+    if not row or row[0] == 'closed':
+        return
+    
+    cur.execute("""
+        SELECT COUNT(*) FROM loan_schedule
+        WHERE loan_id=%s AND status IN ('pending', 'overdue')
+          AND payment_date < CURRENT_DATE
+    """ % lid)
+    has_overdue = cur.fetchone()[0] > 0
+    
+    if has_overdue:
+        cur.execute("UPDATE loans SET status='overdue', updated_at=NOW() WHERE id=%s AND status='active'" % lid)
+        cur.execute("""
+            UPDATE loan_schedule SET status='overdue', overdue_days=(CURRENT_DATE - payment_date)
+            WHERE loan_id=%s AND status IN ('pending') AND payment_date < CURRENT_DATE
+        """ % lid)
+    else:
+        cur.execute("UPDATE loans SET status='active', updated_at=NOW() WHERE id=%s AND status='overdue'" % lid)
+        cur.execute("UPDATE loan_schedule SET overdue_days=0 WHERE loan_id=%s AND status='overdue'" % lid)
+        cur.execute("UPDATE loan_schedule SET status='pending' WHERE loan_id=%s AND status='overdue'" % lid)
+    
+    cur.execute("""
+        UPDATE loan_schedule SET overdue_days=(CURRENT_DATE - payment_date)
+        WHERE loan_id=%s AND status = 'partial' AND payment_date < CURRENT_DATE
+    """ % lid)
+
+def allocate_loan_payments(schedule_rows, payments, start=None, snapshots=None):
+    """Распределяет платежи по графику в памяти — та же логика, что применяет recalc_loan_schedule_statuses.
+    schedule_rows: [(id, payment_no, payment_date, principal, interest, penalty)];
+    payments: [(id, payment_date, amount, manual, principal_part, interest_part, penalty_part)] в порядке (дата, id).
+    start — (состояния строк, principal_paid) из снимка, с которого продолжить; в snapshots дописывается снимок после каждого платежа.
+    Возвращает (state, parts, principal_paid): state — {id строки: [paid_amount, paid_date, status, payment_id]},
+    parts — {id платежа: (principal, interest, penalty)} для платежей без ручного распределения.
+    Считается в целых копейках; суммы с долями копейки — через allocate_loan_payments_decimal."""
+    try:
+        rows = [(r[0], r[2], to_kop(r[3]), to_kop(r[4]), to_kop(r[5])) for r in sorted(schedule_rows, key=lambda r: (r[1], r[0]))]
+        pays = [(p[0], p[1], to_kop(p[2]), p[3], to_kop(p[4]) if p[3] else 0, to_kop(p[5]) if p[3] else 0, to_kop(p[6]) if p[3] else 0)
+                for p in payments]
+        state = {r[0]: [0, None, 'pending', None] for r in rows}
+        principal_paid = 0
+        if start:
+            for sid, st in start[0].items():
+                state[sid] = [to_kop(st[0])] + list(st[1:])
+            principal_paid = to_kop(start[1])
+    except FractionalAmount:
+        return allocate_loan_payments_decimal(schedule_rows, payments, start, snapshots)
+    parts = {}
+    # Состояния строк в Decimal для снимков: пересобираются только у строк, которых коснулся платёж
+    shown = None
+    if snapshots is not None:
+        shown = {sid: [kop_decimal(st[0])] + st[1:] for sid, st in state.items() if st[3] is not None}
+    for pay_id, pay_date, remaining, is_manual, pay_pp, pay_ip, pay_pnp in pays:
+        if is_manual:
+            remaining = pay_pp + pay_ip + pay_pnp
+        covered_one_future = False
+        for sid, sch_date, sp, si, spn in rows:
+            st = state[sid]
+            if st[2] not in ('pending', 'partial'):
+                continue
+            if remaining <= 0:
+                break
+            spa = st[0]
+            is_future = sch_date > pay_date
+            if is_future and covered_one_future:
+                break
+            if is_manual:
+                need_total = sp + si + spn - spa
+                if need_total <= 0:
+                    if is_future:
+                        covered_one_future = True
+                    continue
+                take_total = min(remaining, need_total)
+                remaining -= take_total
+                new_paid = spa + take_total
+            else:
+                already_i = min(spa, si)
+                already_pn = min(spa - si, spn) if spa > si else 0
+                already_pp = spa - already_i - already_pn if spa > already_i + already_pn else 0
+                need_i = si - already_i
+                need_pn = spn - already_pn
+                need_pp = sp - already_pp
+                need_total = need_i + need_pn + need_pp
+                if need_total <= 0:
+                    if is_future:
+                        covered_one_future = True
+                    continue
+                take_total = min(remaining, need_total)
+                item_i = min(take_total, need_i)
+                after_i = take_total - item_i
+                item_pn = min(after_i, need_pn)
+                item_pp = after_i - item_pn
+                remaining -= take_total
+                pay_ip += item_i
+                pay_pnp += item_pn
+                pay_pp += item_pp
+                new_paid = spa + item_i + item_pn + item_pp
+            st[0] = new_paid
+            st[1] = pay_date
+            st[2] = 'paid' if new_paid >= sp + si + spn else 'partial'
+            st[3] = pay_id
+            if shown is not None:
+                shown[sid] = [kop_decimal(new_paid), pay_date, st[2], pay_id]
+            if is_future:
+                covered_one_future = True
+        if not is_manual:
+            if remaining > 0:
+                pay_pp += remaining
+            parts[pay_id] = (kop_decimal(pay_pp), kop_decimal(pay_ip), kop_decimal(pay_pnp))
+        principal_paid += pay_pp
+        if shown is not None:
+            # списки в shown заменяются целиком, поэтому снимок может ссылаться на них без копирования
+            snapshots.append((pay_id, pay_date, kop_decimal(principal_paid), dict(shown)))
+    for st in state.values():
+        st[0] = kop_decimal(st[0])
+    return state, parts, kop_decimal(principal_paid)
+
+def allocate_loan_payments_decimal(schedule_rows, payments, start=None, snapshots=None):
+    """Исходное распределение на Decimal — для сумм с долями копейки"""
+    rows = sorted(schedule_rows, key=lambda r: (r[1], r[0]))
+    state = {r[0]: [Decimal('0'), None, 'pending', None] for r in rows}
+    parts = {}
+    principal_paid = Decimal('0')
+    if start:
+        for sid, st in start[0].items():
+            state[sid] = list(st)
+        principal_paid = start[1]
+    for pay_id, pay_date, amount, is_manual, manual_pp, manual_ip, manual_pnp in payments:
+        remaining = Decimal(str(amount))
+        if is_manual:
+            pay_pp, pay_ip, pay_pnp = Decimal(str(manual_pp)), Decimal(str(manual_ip)), Decimal(str(manual_pnp))
+            remaining = pay_pp + pay_ip + pay_pnp
+        else:
+            pay_pp = pay_ip = pay_pnp = Decimal('0')
+        covered_one_future = False
+        for sid, _, sch_date, sp, si, spn in rows:
+            st = state[sid]
+            if st[2] not in ('pending', 'partial'):
+                continue
+            if remaining <= Decimal('0.005'):
+                break
+            sp, si, spn = Decimal(str(sp)), Decimal(str(si)), Decimal(str(spn))
+            spa = st[0]
+            is_future = sch_date > pay_date
+            if is_future and covered_one_future:
+                break
+            if is_manual:
+                need_total = sp + si + spn - spa
+                if need_total <= Decimal('0.005'):
+                    if is_future:
+                        covered_one_future = True
+                    continue
+                take_total = min(remaining, need_total)
+                remaining -= take_total
+                new_paid = spa + take_total
+            else:
+                already_i = min(spa, si)
+                already_pn = min(spa - si, spn) if spa > si else Decimal('0')
+                already_pp = spa - already_i - already_pn if spa > already_i + already_pn else Decimal('0')
+                need_i = si - already_i
+                need_pn = spn - already_pn
+                need_pp = sp - already_pp
+                need_total = need_i + need_pn + need_pp
+                if need_total <= Decimal('0.005'):
+                    if is_future:
+                        covered_one_future = True
+                    continue
+                take_total = min(remaining, need_total)
+                item_i = min(take_total, need_i)
+                after_i = take_total - item_i
+                item_pn = min(after_i, need_pn)
+                item_pp = after_i - item_pn
+                remaining -= take_total
+                pay_ip += item_i
+                pay_pnp += item_pn
+                pay_pp += item_pp
+                new_paid = spa + item_i + item_pn + item_pp
+            st[0] = new_paid
+            st[1] = pay_date
+            st[2] = 'paid' if new_paid >= sp + si + spn else 'partial'
+            st[3] = pay_id
+            if is_future:
+                covered_one_future = True
+        if not is_manual:
+            if remaining > Decimal('0.005'):
+                pay_pp += remaining
+            parts[pay_id] = (pay_pp, pay_ip, pay_pnp)
+        principal_paid += pay_pp
+        if snapshots is not None:
+            snapshots.append((pay_id, pay_date, principal_paid, {sid: list(st) for sid, st in state.items() if st[3] is not None}))
+    return state, parts, principal_paid
+
+def expected_overdue_state(loan_status, schedule_rows, state, today):
+    """Статусы займа и строк графика, которые выставит refresh_loan_overdue_status после распределения"""
+    if loan_status == 'closed':
+        return loan_status, {sid: (st[2], None) for sid, st in state.items()}
+    dates = {r[0]: r[2] for r in schedule_rows}
+    has_overdue = any(st[2] == 'pending' and dates[sid] < today for sid, st in state.items())
+    if has_overdue and loan_status == 'active':
+        loan_status = 'overdue'
+    elif not has_overdue and loan_status == 'overdue':
+        loan_status = 'active'
+    rows = {}
+    for sid, st in state.items():
+        late = (today - dates[sid]).days if dates[sid] < today else None
+        if st[2] == 'pending' and late is not None:
+            rows[sid] = ('overdue', late)
+        elif st[2] == 'partial' and late is not None:
+            rows[sid] = ('partial', late)
+        else:
+            rows[sid] = (st[2], None)
+    return loan_status, rows
+
+def loan_schedule_hash(schedule_rows):
+    """Отпечаток графика: снимки годятся, только пока строки и их суммы не менялись"""
+    key = '|'.join('%s:%s:%s:%s:%s:%s' % r for r in sorted(schedule_rows))
+    return hashlib.md5(key.encode()).hexdigest()
+
+def drop_loan_snapshots(cur, lid, since=None):
+    """Удаляет снимки займа, начиная с позиции since = (дата, id платежа); без since — все"""
+    if since:
+        cur.execute("DELETE FROM loan_balance_snapshots WHERE loan_id=%s AND (payment_date, payment_id) >= ('%s'::date, %s)" % (lid, since[0], since[1]))
+    else:
+        cur.execute("DELETE FROM loan_balance_snapshots WHERE loan_id=%s" % lid)
+
+def recalc_loan_schedule_statuses(cur, lid, since=None):
+    """Перераспределяет платежи по графику. since = (дата, id) самого раннего изменённого платежа:
+    пересчёт продолжается с ближайшего более раннего снимка, иначе — с начала"""
+    execute_prepared(cur, 'loan_schedule_rows', lid)
+    schedule_rows = cur.fetchall()
+    schedule_hash = loan_schedule_hash(schedule_rows)
+    start = None
+    snap = None
+    if since:
+        drop_loan_snapshots(cur, lid, since)
+        execute_prepared(cur, 'loan_last_snapshot', lid)
+        snap = cur.fetchone()
+    if snap and snap[4] == schedule_hash:
+        start = ({int(sid): [Decimal(str(st[0])), date.fromisoformat(st[1]) if st[1] else None, st[2], st[3]] for sid, st in snap[3].items()},
+                 Decimal(str(snap[2])))
+        execute_prepared(cur, 'loan_payment_rows_after', lid, snap[0], snap[1])
+    else:
+        drop_loan_snapshots(cur, lid)
+        execute_prepared(cur, 'loan_payment_rows', lid)
+    payments = cur.fetchall()
+    snapshots = []
+    state, parts, principal_paid = allocate_loan_payments(schedule_rows, payments, start, snapshots)
+    # строки, закрытые до снимка, не меняются
+    changed = [(sid, st) for sid, st in state.items() if not start or start[0].get(sid, [None, None, 'pending'])[2] != 'paid']
+    if changed:
+        cur.execute("""
+            UPDATE loan_schedule ls SET paid_amount=v.paid_amount, paid_date=v.paid_date, status=v.status, payment_id=v.payment_id
+            FROM (VALUES %s) AS v(id, paid_amount, paid_date, status, payment_id) WHERE ls.id=v.id
+        """ % ','.join("(%s, %s, %s::date, '%s', %s::integer)" % (
+            sid, float(st[0]), ("'%s'" % st[1]) if st[1] else 'NULL', st[2], st[3] or 'NULL') for sid, st in changed))
+    if parts:
+        cur.execute("""
+            UPDATE loan_payments lp SET principal_part=v.pp, interest_part=v.ip, penalty_part=v.pnp
+            FROM (VALUES %s) AS v(id, pp, ip, pnp) WHERE lp.id=v.id
+        """ % ','.join("(%s, %s, %s, %s)" % (pid, float(p[0]), float(p[1]), float(p[2])) for pid, p in parts.items()))
+    if snapshots:
+        cur.execute("INSERT INTO loan_balance_snapshots (loan_id, payment_id, payment_date, principal_paid, row_states, schedule_hash) VALUES %s ON CONFLICT (loan_id, payment_id) DO UPDATE SET payment_date=EXCLUDED.payment_date, principal_paid=EXCLUDED.principal_paid, row_states=EXCLUDED.row_states, schedule_hash=EXCLUDED.schedule_hash, created_at=NOW()" % ','.join(
+            "(%s, %s, '%s', %s, '%s', '%s')" % (lid, pid, pdate, float(pp), esc(json.dumps({str(sid): [str(st[0]), st[1].isoformat() if st[1] else None, st[2], st[3]] for sid, st in rs.items()})), schedule_hash)
+            for pid, pdate, pp, rs in snapshots))
+    cur.execute("SELECT amount FROM loans WHERE id=%s" % lid)
+    real_balance = max(Decimal(str(cur.fetchone()[0])) - principal_paid, Decimal('0'))
+    cur.execute("UPDATE loans SET balance=%s, updated_at=NOW() WHERE id=%s" % (float(real_balance), lid))
+
+    refresh_loan_overdue_status(cur, lid)
+
+def load_loan_inputs(cur, ids, today):
+    """Загружает займы, графики и платежи пачкой из трёх запросов — вход для reconcile_loan"""
+    id_list = ','.join(str(i) for i in ids)
+    cur.execute("SELECT id, contract_no, amount, balance, status FROM loans WHERE id IN (%s)" % id_list)
+    inputs = {}
+    for lid, contract_no, amount, balance, status in cur.fetchall():
+        inputs[lid] = {'id': lid, 'contract_no': contract_no, 'amount': amount, 'balance': balance, 'status': status,
+                       'today': today, 'schedule': [], 'actual_rows': [], 'payments': []}
+    cur.execute("""
+        SELECT loan_id, id, payment_no, payment_date, principal_amount, interest_amount, penalty_amount, paid_amount, paid_date, status, payment_id
+        FROM loan_schedule WHERE loan_id IN (%s) ORDER BY loan_id, payment_no, id
+    """ % id_list)
+    for r in cur.fetchall():
+        inputs[r[0]]['schedule'].append((r[1], r[2], r[3], r[4], r[5], r[6]))
+        inputs[r[0]]['actual_rows'].append((r[1], r[7], r[8], r[9], r[10]))
+    cur.execute("""
+        SELECT loan_id, id, payment_date, amount, manual_distribution, principal_part, interest_part, penalty_part
+        FROM loan_payments WHERE loan_id IN (%s) ORDER BY loan_id, payment_date, id
+    """ % id_list)
+    for r in cur.fetchall():
+        inputs[r[0]]['payments'].append((r[1], r[2], r[3], bool(r[4]), r[5], r[6], r[7]))
+    return inputs
+
+def reconcile_loan(item):
+    """Сверяет сохранённое состояние займа с повторным распределением платежей. Выполняется в процессе пула"""
+    try:
+        state, parts, principal_paid = allocate_loan_payments(item['schedule'], item['payments'])
+        exp_balance = max(Decimal(str(item['amount'])) - principal_paid, Decimal('0'))
+        exp_status, exp_rows = expected_overdue_state(item['status'], item['schedule'], state, item['today'])
+        issues = []
+        row_fixes = []
+        for sid, cur_paid, cur_paid_date, cur_status, cur_payment_id in item['actual_rows']:
+            st = state[sid]
+            exp_st, overdue_days = exp_rows[sid]
+            diffs = {}
+            if Decimal(str(cur_paid or 0)) != st[0]:
+                diffs['paid_amount'] = (float(cur_paid or 0), float(st[0]))
+            if cur_status != exp_st:
+                diffs['status'] = (cur_status, exp_st)
+            if (cur_payment_id or None) != st[3]:
+                diffs['payment_id'] = (cur_payment_id, st[3])
+            if (cur_paid_date or None) != st[1]:
+                diffs['paid_date'] = (str(cur_paid_date) if cur_paid_date else None, str(st[1]) if st[1] else None)
+            if diffs:
+                issues.append({'schedule_id': sid, 'diffs': diffs})
+                row_fixes.append((sid, float(st[0]), st[1].isoformat() if st[1] else None, exp_st, st[3], overdue_days))
+        part_fixes = []
+        for pid, _, _, is_manual, pp, ip, pnp in item['payments']:
+            if not is_manual and pid in parts:
+                exp = parts[pid]
+                if (Decimal(str(pp)), Decimal(str(ip)), Decimal(str(pnp))) != exp:
+                    issues.append({'payment_id': pid, 'diffs': {'parts': ([float(pp), float(ip), float(pnp)], [float(x) for x in exp])}})
+                    part_fixes.append((pid, float(exp[0]), float(exp[1]), float(exp[2])))
+        loan_fix = None
+        if Decimal(str(item['balance'])) != exp_balance or item['status'] != exp_status:
+            issues.append({'loan': True, 'diffs': {'balance': (float(item['balance']), float(exp_balance)), 'status': (item['status'], exp_status)}})
+            loan_fix = (float(exp_balance), exp_status)
+        return {'id': item['id'], 'issues': issues, 'row_fixes': row_fixes, 'part_fixes': part_fixes, 'loan_fix': loan_fix}
+    except Exception as e:
+        return {'id': item['id'], 'error': str(e)}
+
+def calc_savings_schedule_with_transactions(initial_amount, rate, term, start_date, payout_type, transactions, rate_changes=None):
+    """График вклада с учётом операций и смен ставки в целых копейках; суммы с долями копейки — через Decimal-вариант"""
+    try:
+        rc_list = []
+        for rc in rate_changes or []:
+            rc_date = date.fromisoformat(str(rc[0])) if not isinstance(rc[0], date) else rc[0]
+            rc_list.append((rc_date, to_rate(rc[2] if len(rc) >= 3 else rc[1])))
+        rc_list.sort(key=lambda x: x[0])
+        base_rate = to_rate(rate_changes[0][1] if rate_changes and len(rate_changes[0]) >= 3 else rate)
+        bal_changes = [(start_date, to_kop(initial_amount))]
+        for tx in transactions:
+            tx_date = date.fromisoformat(str(tx[0])) if not isinstance(tx[0], date) else tx[0]
+            if tx[2] == 'deposit':
+                bal_changes.append((tx_date, to_kop(tx[1])))
+            elif tx[2] in ('withdrawal', 'partial_withdrawal'):
+                bal_changes.append((tx_date, -to_kop(tx[1])))
+    except FractionalAmount:
+        return calc_savings_schedule_with_transactions_decimal(initial_amount, rate, term, start_date, payout_type, transactions, rate_changes)
+    bal_changes.sort(key=lambda x: x[0])
+
+    def get_rate_on_date(d):
+        r = base_rate
+        for rc_d, rc_r in rc_list:
+            if rc_d <= d:
+                r = rc_r
+        return r
+
+    schedule = []
+    cumulative = 0
+    boundaries, close_date = build_savings_boundaries(start_date, term)
+    for i in range(len(boundaries) - 1):
+        period_start = boundaries[i]
+        period_end = boundaries[i + 1]
+        current_bal = sum(ba for bd, ba in bal_changes if bd <= period_start)
+        interest = 0
+        split_dates = {period_start}
+        split_dates.update(bd for bd, _ in bal_changes if period_start < bd <= period_end)
+        split_dates.update(rc_d for rc_d, _ in rc_list if period_start < rc_d <= period_end)
+        split_dates = sorted(split_dates)
+        for j, ss in enumerate(split_dates):
+            se = split_dates[j + 1] if j + 1 < len(split_dates) else period_end
+            days = (se - ss).days
+            if days > 0 and current_bal > 0:
+                interest += interest_kop(current_bal, get_rate_on_date(ss), days, 365)
+            if j + 1 < len(split_dates):
+                current_bal += sum(ba for bd, ba in bal_changes if bd == se)
+        cumulative += interest
+        final_bal = sum(ba for bd, ba in bal_changes if bd <= period_end)
+        schedule.append({
+            'period_no': i + 1, 'period_start': period_start.isoformat(),
+            'period_end': period_end.isoformat(), 'interest_amount': interest / 100,
+            'cumulative_interest': cumulative / 100,
+            'balance_after': (final_bal + cumulative if payout_type == 'end_of_term' else final_bal) / 100,
+            'rate': get_rate_on_date(period_end) / RATE_SCALE,
+        })
+    return schedule
+
+def calc_savings_schedule_with_transactions_decimal(initial_amount, rate, term, start_date, payout_type, transactions, rate_changes=None):
+    rc_list = []
+    if rate_changes:
+        for rc in rate_changes:
+            rc_date = date.fromisoformat(str(rc[0])) if not isinstance(rc[0], date) else rc[0]
+            if len(rc) >= 3:
+                rc_list.append((rc_date, Decimal(str(rc[2]))))
+            else:
+                rc_list.append((rc_date, Decimal(str(rc[1]))))
+        rc_list.sort(key=lambda x: x[0])
+    if rate_changes and len(rate_changes) > 0 and len(rate_changes[0]) >= 3:
+        base_rate = Decimal(str(rate_changes[0][1]))
+    else:
+        base_rate = Decimal(str(rate))
+    schedule = []
+    cumulative = Decimal('0')
+    bal_changes = []
+    bal_changes.append((start_date, Decimal(str(initial_amount))))
+    for tx in transactions:
+        tx_date = date.fromisoformat(str(tx[0])) if not isinstance(tx[0], date) else tx[0]
+        tx_amt = Decimal(str(tx[1]))
+        tx_type = tx[2]
+        if tx_type == 'deposit':
+            bal_changes.append((tx_date, tx_amt))
+        elif tx_type in ('withdrawal', 'partial_withdrawal'):
+            bal_changes.append((tx_date, -tx_amt))
+    bal_changes.sort(key=lambda x: x[0])
+
+    def get_rate_on_date(d):
+        r = base_rate
+        for rc_d, rc_r in rc_list:
+            if rc_d <= d:
+                r = rc_r
+        return r
+
+    boundaries, close_date = build_savings_boundaries(start_date, term)
+    for i in range(len(boundaries) - 1):
+        period_start = boundaries[i]
+        period_end = boundaries[i + 1]
+        running_bal = Decimal('0')
+        for bd, ba in bal_changes:
+            if bd <= period_start:
+                running_bal += ba
+        interest = Decimal('0')
+        split_dates = set()
+        split_dates.add(period_start)
+        for bd, ba in bal_changes:
+            if period_start < bd <= period_end:
+                split_dates.add(bd)
+        for rc_d, _ in rc_list:
+            if period_start < rc_d <= period_end:
+                split_dates.add(rc_d)
+        split_dates = sorted(split_dates)
+        current_bal = running_bal
+        for j, ss in enumerate(split_dates):
+            se = split_dates[j + 1] if j + 1 < len(split_dates) else period_end
+            days = (se - ss).days
+            if j == len(split_dates) - 1:
+                days = (period_end - ss).days
+            r = get_rate_on_date(ss)
+            if days > 0 and current_bal > 0:
+                day_interest = (current_bal * r / Decimal('100') * Decimal(str(days)) / Decimal('365')).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+                interest += day_interest
+            if j + 1 < len(split_dates):
+                for bd, ba in bal_changes:
+                    if bd == split_dates[j + 1]:
+                        current_bal += ba
+        cumulative += interest
+        final_bal = Decimal('0')
+        for bd, ba in bal_changes:
+            if bd <= period_end:
+                final_bal += ba
+        current_rate = float(get_rate_on_date(period_end))
+        balance_after = float(final_bal + cumulative) if payout_type == 'end_of_term' else float(final_bal)
+        schedule.append({
+            'period_no': i + 1, 'period_start': period_start.isoformat(),
+            'period_end': period_end.isoformat(), 'interest_amount': float(interest),
+            'cumulative_interest': float(cumulative), 'balance_after': balance_after,
+            'rate': current_rate,
+        })
+    return schedule
+
+def savings_initial_amount(amount, transactions):
+    initial_amount = float(amount)
+    for tx in transactions:
+        tx_type = tx[2]
+        tx_amt = float(tx[1])
+        if tx_type == 'deposit':
+            initial_amount -= tx_amt
+        elif tx_type in ('withdrawal', 'partial_withdrawal'):
+            initial_amount += tx_amt
+    if initial_amount < 0:
+        initial_amount = 0
+    return initial_amount
+
+def write_savings_schedule(cur, sid, schedule):
+    """Записывает рассчитанный график: оплаченные периоды обновляются, остальные пересоздаются пакетно"""
+    cur.execute("DELETE FROM savings_schedule WHERE saving_id=%s AND status IN ('pending','accrued')" % sid)
+    cur.execute("SELECT period_no, id FROM savings_schedule WHERE saving_id=%s AND status='paid'" % sid)
+    paid_ids = dict(cur.fetchall())
+    today = date.today().isoformat()
+    updates = []
+    inserts = []
+    for item in schedule:
+        if item['period_no'] in paid_ids:
+            updates.append("(%s, '%s'::date, '%s'::date, %s, %s, %s)" % (
+                paid_ids[item['period_no']], item['period_start'], item['period_end'], item['interest_amount'], item['cumulative_interest'], item['balance_after']))
+            continue
+        new_status = 'accrued' if item['period_end'] <= today else 'pending'
+        inserts.append("(%s,%s,'%s','%s',%s,%s,%s,'%s')" % (
+            sid, item['period_no'], item['period_start'], item['period_end'], item['interest_amount'], item['cumulative_interest'], item['balance_after'], new_status))
+    if updates:
+        cur.execute("""
+            UPDATE savings_schedule ss SET period_start=v.ps, period_end=v.pe, interest_amount=v.ia, cumulative_interest=v.ci, balance_after=v.ba
+            FROM (VALUES %s) AS v(id, ps, pe, ia, ci, ba) WHERE ss.id=v.id
+        """ % ','.join(updates))
+    if inserts:
+        cur.execute("INSERT INTO savings_schedule (saving_id,period_no,period_start,period_end,interest_amount,cumulative_interest,balance_after,status) VALUES %s" % ','.join(inserts))
+
+def recalc_savings_schedule(cur, sid, amount, rate, term, start_date, payout_type):
+    cur.execute("SELECT transaction_date, amount, transaction_type FROM savings_transactions WHERE saving_id=%s AND transaction_type IN ('deposit','withdrawal','partial_withdrawal') ORDER BY transaction_date, id" % sid)
+    transactions = cur.fetchall()
+    cur.execute("SELECT amount FROM savings WHERE id=%s" % sid)
+    initial_amount = savings_initial_amount(cur.fetchone()[0], transactions)
+    cur.execute("SELECT effective_date, old_rate, new_rate FROM savings_rate_changes WHERE saving_id=%s ORDER BY effective_date" % sid)
+    rate_changes = cur.fetchall()
+    schedule = calc_savings_schedule_with_transactions(initial_amount, rate, term, start_date, payout_type, transactions, rate_changes)
+    write_savings_schedule(cur, sid, schedule)
+    return schedule
+
+def load_savings_inputs(cur, ids):
+    """Загружает вклады с операциями и сменами ставок тремя запросами на весь набор — вход для пакетного пересчёта"""
+    if not ids:
+        return {}
+    ids_sql = ','.join(str(int(i)) for i in ids)
+    cur.execute("SELECT id, contract_no, amount, rate, term_months, start_date, payout_type FROM savings WHERE id IN (%s)" % ids_sql)
+    inputs = {}
+    for r in cur.fetchall():
+        inputs[r[0]] = {'id': r[0], 'contract_no': r[1], 'amount': r[2], 'rate': float(r[3]), 'term': int(r[4]),
+                        'start_date': r[5], 'payout_type': r[6], 'transactions': [], 'rate_changes': []}
+    cur.execute("SELECT saving_id, transaction_date, amount, transaction_type FROM savings_transactions WHERE saving_id IN (%s) AND transaction_type IN ('deposit','withdrawal','partial_withdrawal') ORDER BY saving_id, transaction_date, id" % ids_sql)
+    for r in cur.fetchall():
+        inputs[r[0]]['transactions'].append((r[1], r[2], r[3]))
+    cur.execute("SELECT saving_id, effective_date, old_rate, new_rate FROM savings_rate_changes WHERE saving_id IN (%s) ORDER BY saving_id, effective_date" % ids_sql)
+    for r in cur.fetchall():
+        inputs[r[0]]['rate_changes'].append((r[1], r[2], r[3]))
+    for item in inputs.values():
+        item['initial_amount'] = savings_initial_amount(item['amount'], item['transactions'])
+    return inputs
+
+def compute_savings_recalc(item):
+    """Считает график вклада и, если переданы начисления, исправленные суммы дневных начислений. Выполняется в процессе пула"""
+    try:
+        schedule = calc_savings_schedule_with_transactions(item['initial_amount'], item['rate'], item['term'], item['start_date'],
+                                                           item['payout_type'], item['transactions'], item['rate_changes'])
+        accrual_fixes = []
+        if item.get('accruals'):
+            rc_list = sorted((rc[0], Decimal(str(rc[2]))) for rc in item['rate_changes'])
+            for aid, a_date, a_bal, a_amount in item['accruals']:
+                a_rate = Decimal(str(item['rate']))
+                for rc_d, rc_r in rc_list:
+                    if rc_d <= a_date:
+                        a_rate = rc_r
+                new_amount = period_interest(a_bal, a_rate, 1, 365)
+                old_amount = Decimal(str(a_amount))
+                if new_amount != old_amount:
+                    accrual_fixes.append((aid, float(a_rate), float(new_amount), float(new_amount - old_amount)))
+        return {'id': item['id'], 'schedule': schedule, 'accrual_fixes': accrual_fixes}
+    except Exception as e:
+        return {'id': item['id'], 'error': str(e)}
+
+def schedule_interest_total(schedule):
+    return sum(Decimal(str(item['interest_amount'])) for item in schedule)
+
+ACCRUAL_TOTALS_ADD = "accrual_total=accrual_total+%s, accrual_days=accrual_days+1, accrual_first_date=LEAST(accrual_first_date, '%s'::date), accrual_last_date=GREATEST(accrual_last_date, '%s'::date)"
+
+def insert_daily_accruals(cur, accrual_date, rows):
+    """Пишет дневные начисления [(saving_id, balance, rate, daily_amount)] одним запросом: вклады, уже начисленные за дату,
+    пропускаются, итоги вклада растут там же. Возвращает (кол-во начислений, сумма)"""
+    if not rows:
+        return 0, Decimal('0')
+    cur.execute("""
+        WITH v(saving_id, balance, rate, daily_amount) AS (VALUES %s),
+        ins AS (
+            INSERT INTO savings_daily_accruals (saving_id, accrual_date, balance, rate, daily_amount)
+            SELECT v.saving_id, '%s', v.balance, v.rate, v.daily_amount FROM v
+            WHERE NOT EXISTS (SELECT 1 FROM savings_daily_accruals a WHERE a.saving_id=v.saving_id AND a.accrual_date='%s')
+            RETURNING saving_id, daily_amount
+        )
+        UPDATE savings SET accrued_interest=accrued_interest+ins.daily_amount, %s, updated_at=NOW()
+        FROM ins WHERE savings.id=ins.saving_id
+        RETURNING ins.daily_amount
+    """ % (','.join("(%d, %s::numeric, %s::numeric, %s::numeric)" % r for r in rows), accrual_date, accrual_date,
+           ACCRUAL_TOTALS_ADD % ('ins.daily_amount', accrual_date, accrual_date)))
+    amounts = [Decimal(str(r[0])) for r in cur.fetchall()]
+    return len(amounts), sum(amounts, Decimal('0'))
+
+def refresh_accrual_totals(cur, sid):
+    """Пересчитывает агрегаты начислений вклада (сумма, первая/последняя дата, кол-во дней) после правки истории"""
+    cur.execute("""
+        UPDATE savings s SET accrual_total=a.total, accrual_days=a.cnt, accrual_first_date=a.first_date, accrual_last_date=a.last_date
+        FROM (SELECT COALESCE(SUM(daily_amount), 0) AS total, COUNT(*) AS cnt, MIN(accrual_date) AS first_date, MAX(accrual_date) AS last_date
+              FROM savings_daily_accruals WHERE saving_id=%s) a
+        WHERE s.id=%s
+    """ % (sid, sid))
+
+def get_accrued_interest_end_of_prev_month(cur, sid):
+    first_of_month = date.today().replace(day=1)
+    cur.execute("""
+        SELECT s.accrual_total - COALESCE((SELECT SUM(daily_amount) FROM savings_daily_accruals WHERE saving_id=s.id AND accrual_date >= '%s'), 0), s.paid_interest
+        FROM savings s WHERE s.id=%s
+    """ % (first_of_month.isoformat(), sid))
+    row = cur.fetchone()
+    available = Decimal(str(row[0])) - Decimal(str(row[1]))
+    return max(available, Decimal('0'))
@@ -0,0 +1,134 @@
+"""Паевые счета"""
+from datetime import date
+from decimal import Decimal
+from core import audit_log, esc, mark_member_stats, next_number, query_one, query_rows, safe_float
+
+def handle_shares(method, params, body, cur, conn, staff=None, ip=''):
+    if method == 'GET':
+        action = params.get('action', 'list')
+        if action == 'detail':
+            acc = query_one(cur, "SELECT * FROM share_accounts WHERE id=%s" % params['id'])
+            if not acc: return None
+            cur.execute("SELECT CASE WHEN m.member_type='FL' THEN CONCAT(m.last_name,' ',m.first_name,' ',m.middle_name) ELSE m.company_name END FROM members m WHERE m.id=%s" % acc['member_id'])
+            nr = cur.fetchone()
+            acc['member_name'] = nr[0] if nr else ''
+            if acc.get('org_id'):
+                org_row = query_one(cur, "SELECT name, short_name FROM organizations WHERE id=%s" % acc['org_id'])
+                acc['org_name'] = org_row['name'] if org_row else ''
+                acc['org_short_name'] = org_row['short_name'] if org_row else ''
+            acc['transactions'] = query_rows(cur, "SELECT * FROM share_transactions WHERE account_id=%s ORDER BY transaction_date DESC" % params['id'])
+            return acc
+        else:
+            return query_rows(cur, """
+                SELECT sa.id, sa.account_no, sa.balance, sa.total_in, sa.total_out, sa.status, sa.created_at, sa.updated_at,
+                       sa.org_id,
+                       CASE WHEN m.member_type='FL' THEN CONCAT(m.last_name,' ',m.first_name,' ',m.middle_name)
+                            ELSE m.company_name END as member_name, m.id as member_id,
+                       o.name as org_name, o.short_name as org_short_name
+                FROM share_accounts sa JOIN members m ON m.id=sa.member_id
+                LEFT JOIN organizations o ON o.id=sa.org_id
+                ORDER BY sa.created_at DESC
+            """)
+
+    elif method == 'POST':
+        action = body.get('action', 'create')
+        mark_member_stats(cur, 'share_accounts', body.get('account_id'))
+        if action == 'create':
+            mid = int(body['member_id'])
+            mark_member_stats(cur, 'members', mid)
+            a = safe_float(body.get('amount', 0), 'сумма')
+            org_id = body.get('org_id')
+            ano = 'ПС-%06d' % next_number(cur, 'share_account')
+            cur.execute("INSERT INTO share_accounts (account_no,member_id,balance,total_in,org_id) VALUES ('%s',%s,%s,%s,%s) RETURNING id, account_no" % (ano, mid, a, a, org_id if org_id else 'NULL'))
+            result = cur.fetchone()
+            if a > 0:
+                cur.execute("INSERT INTO share_transactions (account_id,transaction_date,amount,transaction_type,description) VALUES (%s,'%s',%s,'in','Первоначальный паевой взнос')" % (result[0], date.today().isoformat(), a))
+            audit_log(cur, staff, 'create', 'share', result[0], ano, 'Сумма: %s' % a, ip)
+            conn.commit()
+            return {'id': result[0], 'account_no': result[1]}
+        elif action == 'transaction':
+            aid = int(body['account_id'])
+            a = safe_float(body['amount'], 'сумма')
+            tt = body['transaction_type']
+            td = body.get('transaction_date', date.today().isoformat())
+            d = body.get('description', '')
+            if tt == 'in':
+                cur.execute("UPDATE share_accounts SET balance=balance+%s, total_in=total_in+%s, updated_at=NOW() WHERE id=%s" % (a, a, aid))
+            else:
+                cur.execute("SELECT balance FROM share_accounts WHERE id=%s" % aid)
+                if float(cur.fetchone()[0]) < a:
+                    return {'error': 'Недостаточно средств'}
+                cur.execute("UPDATE share_accounts SET balance=balance-%s, total_out=total_out+%s, updated_at=NOW() WHERE id=%s" % (a, a, aid))
+            cur.execute("INSERT INTO share_transactions (account_id,transaction_date,amount,transaction_type,description) VALUES (%s,'%s',%s,'%s','%s')" % (aid, td, a, tt, esc(d)))
+            tt_label = 'Внесение' if tt == 'in' else 'Выплата'
+            audit_log(cur, staff, 'transaction', 'share', aid, '', '%s: %s' % (tt_label, a), ip)
+            conn.commit()
+            return {'success': True}
+
+        elif action == 'update_transaction':
+            tid = int(body['transaction_id'])
+            cur.execute("SELECT account_id, amount, transaction_type FROM share_transactions WHERE id=%s" % tid)
+            old = cur.fetchone()
+            if not old:
+                return {'error': 'Операция не найдена'}
+            aid, old_amount, old_tt = old[0], Decimal(str(old[1])), old[2]
+            mark_member_stats(cur, 'share_accounts', aid)
+            new_amount = Decimal(str(body.get('amount', float(old_amount))))
+            new_date = body.get('transaction_date')
+            new_desc = body.get('description', '')
+            delta = new_amount - old_amount
+            upd = "amount=%s" % float(new_amount)
+            if new_date:
+                upd += ", transaction_date='%s'" % new_date
+            if new_desc is not None:
+                upd += ", description='%s'" % esc(new_desc)
+            cur.execute("UPDATE share_transactions SET %s WHERE id=%s" % (upd, tid))
+            if delta != 0:
+                if old_tt == 'in':
+                    cur.execute("UPDATE share_accounts SET balance=balance+%s, total_in=total_in+%s, updated_at=NOW() WHERE id=%s" % (float(delta), float(delta), aid))
+                else:
+                    cur.execute("UPDATE share_accounts SET balance=balance-%s, total_out=total_out+%s, updated_at=NOW() WHERE id=%s" % (float(delta), float(delta), aid))
+            audit_log(cur, staff, 'update_transaction', 'share', aid, '', 'Транзакция #%s: %s -> %s' % (tid, float(old_amount), float(new_amount)), ip)
+            conn.commit()
+            return {'success': True}
+
+        elif action == 'delete_transaction':
+            tid = int(body['transaction_id'])
+            cur.execute("SELECT account_id, amount, transaction_type FROM share_transactions WHERE id=%s" % tid)
+            old = cur.fetchone()
+            if not old:
+                return {'error': 'Операция не найдена'}
+            aid, old_amount, old_tt = old[0], Decimal(str(old[1])), old[2]
+            mark_member_stats(cur, 'share_accounts', aid)
+            cur.execute("DELETE FROM share_transactions WHERE id=%s" % tid)
+            if old_tt == 'in':
+                cur.execute("UPDATE share_accounts SET balance=balance-%s, total_in=total_in-%s, updated_at=NOW() WHERE id=%s" % (float(old_amount), float(old_amount), aid))
+            else:
+                cur.execute("UPDATE share_accounts SET balance=balance+%s, total_out=total_out-%s, updated_at=NOW() WHERE id=%s" % (float(old_amount), float(old_amount), aid))
+            audit_log(cur, staff, 'delete_transaction', 'share', aid, '', 'Удалена: %s %s' % (old_tt, float(old_amount)), ip)
+            conn.commit()
+            return {'success': True}
+
+        elif action == 'delete_account':
+            aid = int(body['account_id'])
+            cur.execute("SELECT account_no, member_id FROM share_accounts WHERE id=%s" % aid)
+            ar = cur.fetchone()
+            if not ar:
+                return {'error': 'Счёт не найден'}
+            mark_member_stats(cur, 'members', ar[1])
+            cur.execute("DELETE FROM share_transactions WHERE account_id=%s" % aid)
+            cur.execute("DELETE FROM share_accounts WHERE id=%s" % aid)
+            audit_log(cur, staff, 'delete_account', 'share', aid, ar[0], '', ip)
+            conn.commit()
+            return {'success': True}
+
+        elif action == 'delete_all_transactions':
+            aid = int(body['account_id'])
+            cur.execute("SELECT id FROM share_accounts WHERE id=%s" % aid)
+            if not cur.fetchone():
+                return {'error': 'Счёт не найден'}
+            cur.execute("DELETE FROM share_transactions WHERE account_id=%s" % aid)
+            cur.execute("UPDATE share_accounts SET balance=0, total_in=0, total_out=0, updated_at=NOW() WHERE id=%s" % aid)
+            audit_log(cur, staff, 'delete_all_transactions', 'share', aid, '', '', ip)
+            conn.commit()
+            return {'success': True}
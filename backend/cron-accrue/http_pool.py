@@ -0,0 +1,100 @@
+"""Пул keep-alive HTTP(S)-соединений для исходящих запросов к API мессенджеров, SMS и DaData.
+Файл одинаковый в backend/api и backend/cron-accrue."""
+import http.client
+import json
+import threading
+import time
+import urllib.error
+import urllib.parse
+from io import BytesIO
+
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+MAX_RETRY_SLEEP = 30
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+METRICS = {'requests': 0, 'connections_opened': 0, 'connections_reused': 0, 'reconnects': 0, 'retries': 0, 'rate_limited': 0}
+
+# Простаивающие соединения по (схема, хост, порт); живут между вызовами тёплого контейнера
+_idle = {}
+_lock = threading.Lock()
+
+# Ошибки, которыми заканчивается запрос в соединение, закрытое сервером по keep-alive таймауту
+STALE_ERRORS = (http.client.RemoteDisconnected, http.client.CannotSendRequest, BrokenPipeError, ConnectionResetError)
+
+
+def _checkout(key, timeout):
+    with _lock:
+        conns = _idle.get(key)
+        conn = conns.pop() if conns else None
+        METRICS['connections_reused' if conn else 'connections_opened'] += 1
+    if conn:
+        if conn.sock:
+            conn.sock.settimeout(timeout)
+        return conn, True
+    scheme, host, port = key
+    cls = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+    return cls(host, port, timeout=timeout), False
+
+
+def _checkin(key, conn):
+    with _lock:
+        _idle.setdefault(key, []).append(conn)
+
+
+def _retry_after(resp, body):
+    """Пауза из ответа 429: parameters.retry_after у Telegram или заголовок Retry-After"""
+    try:
+        return float(json.loads(body.decode('utf-8'))['parameters']['retry_after'])
+    except Exception:
+        pass
+    try:
+        return float(resp.getheader('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+def request(url, data=None, headers=None, method=None, timeout=10):
+    """Выполняет запрос через пул и возвращает тело ответа (bytes).
+    На не-2xx бросает urllib.error.HTTPError, как urllib.request.urlopen. 429 и 5xx повторяются с паузой."""
+    parts = urllib.parse.urlsplit(url)
+    key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+    path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+    method = method or ('POST' if data is not None else 'GET')
+    hdrs = dict(headers or {})
+    METRICS['requests'] += 1
+    attempt = 0
+    while True:
+        conn, reused = _checkout(key, timeout)
+        try:
+            conn.request(method, path, body=data, headers=hdrs)
+            resp = conn.getresponse()
+            body = resp.read()
+        except STALE_ERRORS:
+            conn.close()
+            if reused:
+                METRICS['reconnects'] += 1
+                continue
+            raise
+        except Exception:
+            conn.close()
+            raise
+        if resp.will_close:
+            conn.close()
+        else:
+            _checkin(key, conn)
+        if 200 <= resp.status < 300:
+            return body
+        if resp.status in RETRY_STATUSES and attempt < MAX_RETRIES:
+            delay = None
+            if resp.status == 429:
+                METRICS['rate_limited'] += 1
+                delay = _retry_after(resp, body)
+            if delay is None:
+                delay = BACKOFF_BASE * (2 ** attempt)
+            if delay <= MAX_RETRY_SLEEP:
+                attempt += 1
+                METRICS['retries'] += 1
+                time.sleep(delay)
+                continue
+        raise urllib.error.HTTPError(url, resp.status, resp.reason, resp.msg, BytesIO(body))
@@ -1,13 +1,90 @@
 import json
 import os
 import psycopg2
-import urllib.request
-import urllib.parse
+import psycopg2.extensions
+import http_pool
+import outbox
+from money import to_kop, period_interest, factor, mul_kop
 from datetime import date, timedelta
-from decimal import Decimal, ROUND_HALF_UP
+from decimal import Decimal
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """Курсор, который считает выполненные запросы в connection.statements — для бюджетов SQL по этапам крона"""
+    def execute(self, query, vars=None):
+        self.connection.statements += 1
+        return super().execute(query, vars)
+
+
+class CronConnection(psycopg2.extensions.connection):
+    """Соединение, запоминающее имена подготовленных на сервере запросов и считающее выполненные запросы"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.statements = 0
+        self.cursor_factory = CountingCursor
+
 
 def get_conn():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+    return psycopg2.connect(os.environ['DATABASE_URL'], connection_factory=CronConnection)
+
+
+# Горячие запросы крона: готовятся один раз на соединение (PREPARE) и выполняются через EXECUTE с параметрами
+PREPARED = {}
+# Получатели напоминаний — один запрос на тип: строка графика или вклад × активные клиенты пайщика × подписки канала
+for _ch, _table, _addr, _active in (('push', 'push_subscriptions', 'id', "r.user_agent != 'unsubscribed' AND r.user_agent != 'expired'"),
+                                    ('telegram', 'telegram_subscribers', 'chat_id', 'r.active=true'),
+                                    ('max', 'max_subscribers', 'chat_id', 'r.active=true')):
+    for _kind, _types, _cols, _from, _owner, _where in (
+            ('loan', 'date, text', 'ls.id, ls.loan_id, ls.payment_amount, l.contract_no', 'loan_schedule ls JOIN loans l ON l.id = ls.loan_id', 'l',
+             'ls.payment_date = $1 AND ls.status = $2 AND COALESCE(ls.paid_amount, 0) < ls.payment_amount'),
+            ('savings', 'date', 's.id, s.contract_no, s.current_balance', 'savings s', 's', "s.status = 'active' AND s.end_date = $1")):
+        _opt_out = ''
+        if _ch == 'max':
+            _opt_out = (" AND NOT EXISTS (SELECT 1 FROM notification_settings ns WHERE ns.user_id = u.id AND ns.channel = 'max' "
+                        "AND ns.setting_key = '%s_reminders' AND ns.setting_value = 'false')" % _kind)
+        PREPARED['%s_reminder_recipients_%s' % (_kind, _ch)] = (_types, """
+            SELECT %s, u.id, array_agg(r.%s ORDER BY r.id)
+            FROM %s
+            JOIN users u ON u.member_id = %s.member_id AND u.role = 'client' AND u.status = 'active'
+            JOIN %s r ON r.user_id = u.id AND %s
+            WHERE %s%s
+            GROUP BY %s, u.id
+        """ % (_cols, _addr, _from, _owner, _table, _active, _where, _opt_out, _cols))
+
+
+def execute_prepared(cur, name, *args):
+    conn = cur.connection
+    if name not in conn.prepared:
+        arg_types, sql = PREPARED[name]
+        cur.execute("PREPARE %s (%s) AS %s" % (name, arg_types, sql))
+        conn.prepared.add(name)
+    cur.execute("EXECUTE %s (%s)" % (name, ', '.join(['%s'] * len(args))), args)
+
+
+# Потолок SQL-запросов на этап крона; не зависит от числа вкладов, займов и строк графика.
+# Рассылки и очередь исходящих идут пачками и в бюджет не входят. Превышение только попадает в результат (over_budget),
+# соблюдение проверяет tests/test_statement_budgets.py
+CRON_STATEMENT_BUDGETS = {
+    'accrue': 2,
+    'overdue': 5,
+    'penalties': 2,
+    'aging': 2,
+    'audit_partitions': 16,
+}
+
+# Секции audit_log создаются на текущий и два следующих месяца
+AUDIT_PARTITION_MONTHS = 3
+
+
+def stage_statements(conn, stats, stage, started):
+    """Записывает число запросов этапа и сверяет его с бюджетом"""
+    n = conn.statements - started
+    stats[stage] = n
+    budget = CRON_STATEMENT_BUDGETS.get(stage)
+    if budget is not None and n > budget:
+        stats.setdefault('over_budget', []).append(stage)
+    return conn.statements
+
 
 def handler(event, context):
     """Ежедневный крон: начисление процентов на вклады + пометка просроченных займов. Вызывается по расписанию в 00:05."""
@@ -24,12 +101,17 @@ def handler(event, context):
     cur = conn.cursor()
 
     try:
+        if body.get('action') in ('drain_outbox', 'drain_bot_outbox'):
+            result = drain_outbox(cur, conn)
+            return {'statusCode': 200, 'headers': headers, 'body': json.dumps(dict(result, success=True, http=http_pool.METRICS))}
+
         accrual_date = body.get('date', date.today().isoformat())
+        stats = {}
+        mark = conn.statements
 
         cur.execute("SELECT id, current_balance, rate, start_date FROM savings WHERE status='active'")
         savings_rows = cur.fetchall()
-        count = 0
-        total = Decimal('0')
+        accruals = []
         skipped = 0
 
         for row in savings_rows:
@@ -40,29 +122,36 @@ def handler(event, context):
             if accrual_date <= s_start:
                 skipped += 1
                 continue
-            daily_amount = (s_bal * s_rate / Decimal('100') / Decimal('365')).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+            daily_amount = period_interest(s_bal, s_rate, 1, 365)
             if daily_amount <= 0:
                 skipped += 1
                 continue
-            cur.execute("SELECT id FROM savings_daily_accruals WHERE saving_id=%s AND accrual_date='%s'" % (s_id, accrual_date))
-            if cur.fetchone():
-                skipped += 1
-                continue
-            cur.execute("INSERT INTO savings_daily_accruals (saving_id, accrual_date, balance, rate, daily_amount) VALUES (%s, '%s', %s, %s, %s)" % (s_id, accrual_date, float(s_bal), float(s_rate), float(daily_amount)))
-            cur.execute("UPDATE savings SET accrued_interest=accrued_interest+%s, updated_at=NOW() WHERE id=%s" % (float(daily_amount), s_id))
-            count += 1
-            total += daily_amount
+            accruals.append((s_id, s_bal, s_rate, daily_amount))
+        count, total = accrue_savings(cur, accrual_date, accruals)
+        skipped += len(accruals) - count
+        mark = stage_statements(conn, stats, 'accrue', mark)
 
         overdue_result = check_overdue_loans(cur, accrual_date)
+        mark = stage_statements(conn, stats, 'overdue', mark)
         penalty_result = accrue_penalties(cur, accrual_date)
-        push_result = send_payment_reminders(cur, conn, accrual_date)
-        savings_push_result = send_savings_reminders(cur, conn, accrual_date)
-        tg_result = send_telegram_payment_reminders(cur, conn, accrual_date)
-        tg_savings_result = send_telegram_savings_reminders(cur, conn, accrual_date)
-        max_result = send_max_payment_reminders(cur, conn, accrual_date)
-        max_savings_result = send_max_savings_reminders(cur, conn, accrual_date)
+        mark = stage_statements(conn, stats, 'penalties', mark)
+        aging_result = snapshot_arrears_aging(cur, accrual_date)
+        mark = stage_statements(conn, stats, 'aging', mark)
+        ledger = load_reminder_ledger(cur, accrual_date)
+        push_result = send_payment_reminders(cur, conn, accrual_date, ledger)
+        savings_push_result = send_savings_reminders(cur, conn, accrual_date, ledger)
+        tg_result = send_telegram_payment_reminders(cur, conn, accrual_date, ledger)
+        tg_savings_result = send_telegram_savings_reminders(cur, conn, accrual_date, ledger)
+        max_result = send_max_payment_reminders(cur, conn, accrual_date, ledger)
+        max_savings_result = send_max_savings_reminders(cur, conn, accrual_date, ledger)
+        flush_reminder_ledger(cur, ledger)
+        mark = stage_statements(conn, stats, 'reminders', mark)
+        audit_partitions = ensure_audit_partitions(cur, accrual_date)
+        mark = stage_statements(conn, stats, 'audit_partitions', mark)
 
         conn.commit()
+        outbox = drain_outbox(cur, conn)
+        stage_statements(conn, stats, 'outbox', mark)
 
         result = {
             'success': True,
@@ -72,12 +161,17 @@ def handler(event, context):
             'total_accrued': float(total),
             'overdue': overdue_result,
             'penalties': penalty_result,
+            'aging': aging_result,
             'push_reminders': push_result,
             'savings_push_reminders': savings_push_result,
             'telegram_reminders': tg_result,
             'telegram_savings_reminders': tg_savings_result,
             'max_reminders': max_result,
-            'max_savings_reminders': max_savings_result
+            'max_savings_reminders': max_savings_result,
+            'audit_partitions': audit_partitions,
+            'outbox': outbox,
+            'statements': stats,
+            'http': http_pool.METRICS
         }
         return {'statusCode': 200, 'headers': headers, 'body': json.dumps(result)}
 
@@ -89,51 +183,125 @@ def handler(event, context):
         conn.close()
 
 
+def accrue_savings(cur, accrual_date, rows):
+    """Пишет дневные начисления [(saving_id, balance, rate, daily_amount)] одним запросом: вклады, уже начисленные за дату,
+    пропускаются, итоги вклада растут там же. Возвращает (кол-во начислений, сумма)"""
+    if not rows:
+        return 0, Decimal('0')
+    cur.execute("""
+        WITH v(saving_id, balance, rate, daily_amount) AS (VALUES %s),
+        ins AS (
+            INSERT INTO savings_daily_accruals (saving_id, accrual_date, balance, rate, daily_amount)
+            SELECT v.saving_id, '%s', v.balance, v.rate, v.daily_amount FROM v
+            WHERE NOT EXISTS (SELECT 1 FROM savings_daily_accruals a WHERE a.saving_id=v.saving_id AND a.accrual_date='%s')
+            RETURNING saving_id, daily_amount
+        )
+        UPDATE savings SET accrued_interest=accrued_interest+ins.daily_amount, accrual_total=accrual_total+ins.daily_amount,
+            accrual_days=accrual_days+1, accrual_first_date=LEAST(accrual_first_date, '%s'::date),
+            accrual_last_date=GREATEST(accrual_last_date, '%s'::date), updated_at=NOW()
+        FROM ins WHERE savings.id=ins.saving_id
+        RETURNING ins.daily_amount
+    """ % (','.join("(%d, %s::numeric, %s::numeric, %s::numeric)" % r for r in rows), accrual_date, accrual_date, accrual_date, accrual_date))
+    amounts = [Decimal(str(r[0])) for r in cur.fetchall()]
+    return len(amounts), sum(amounts, Decimal('0'))
+
+
+def ensure_audit_partitions(cur, check_date):
+    """Создаёт месячные секции audit_log на AUDIT_PARTITION_MONTHS месяцев вперёд, начиная с текущего.
+    Секция создаётся отдельной таблицей, строки её месяца переносятся в неё из audit_log_default, затем она подключается
+    через ATTACH PARTITION: CREATE ... PARTITION OF падает, пока такие строки лежат в секции по умолчанию.
+    Ошибки по месяцам возвращаются в errors, остальные месяцы создаются"""
+    month = date.fromisoformat(check_date).replace(day=1)
+    months = {}
+    for _ in range(AUDIT_PARTITION_MONTHS):
+        next_month = (month + timedelta(days=32)).replace(day=1)
+        months['audit_log_%s' % month.strftime('%Y%m')] = (month, next_month)
+        month = next_month
+    cur.execute("SELECT name FROM unnest(ARRAY[%s]) AS name WHERE to_regclass(name) IS NULL ORDER BY name" % ','.join("'%s'" % n for n in months))
+    created = []
+    moved = 0
+    errors = []
+    for name, in cur.fetchall():
+        month, next_month = months[name]
+        cur.execute("SAVEPOINT audit_partition")
+        try:
+            cur.execute("CREATE TABLE %s (LIKE audit_log INCLUDING DEFAULTS INCLUDING CONSTRAINTS)" % name)
+            cur.execute("""
+                WITH moved AS (DELETE FROM audit_log_default WHERE created_at >= '%s' AND created_at < '%s' RETURNING *)
+                INSERT INTO %s SELECT * FROM moved
+            """ % (month.isoformat(), next_month.isoformat(), name))
+            rows = cur.rowcount
+            cur.execute("ALTER TABLE audit_log ATTACH PARTITION %s FOR VALUES FROM ('%s') TO ('%s')" % (name, month.isoformat(), next_month.isoformat()))
+            cur.execute("RELEASE SAVEPOINT audit_partition")
+            created.append(name)
+            moved += rows
+        except Exception as e:
+            cur.execute("ROLLBACK TO SAVEPOINT audit_partition")
+            errors.append('%s: %s' % (name, str(e)))
+    return {'created': created, 'moved': moved, 'errors': errors}
+
+
+# Счётчики пайщика (как в backend/api/core.py): %s — условие на m.id
+MEMBER_STATS_UPSERT = """
+    INSERT INTO member_stats (member_id, active_loans, overdue_loans, active_savings, share_balance, total_debt, updated_at)
+    SELECT m.id, l.active_loans, l.overdue_loans, s.active_savings, sa.share_balance, l.total_debt, NOW()
+    FROM members m
+    CROSS JOIN LATERAL (SELECT COUNT(*) AS active_loans, COUNT(*) FILTER (WHERE status = 'overdue') AS overdue_loans, COALESCE(SUM(balance), 0) AS total_debt
+                        FROM loans WHERE member_id = m.id AND status != 'closed') l
+    CROSS JOIN LATERAL (SELECT COUNT(*) AS active_savings FROM savings WHERE member_id = m.id AND status = 'active') s
+    CROSS JOIN LATERAL (SELECT COALESCE(SUM(balance), 0) AS share_balance FROM share_accounts WHERE member_id = m.id AND status = 'active') sa
+    WHERE %s
+    ON CONFLICT (member_id) DO UPDATE SET active_loans=EXCLUDED.active_loans, overdue_loans=EXCLUDED.overdue_loans, active_savings=EXCLUDED.active_savings,
+        share_balance=EXCLUDED.share_balance, total_debt=EXCLUDED.total_debt, updated_at=EXCLUDED.updated_at
+"""
+
+
 def check_overdue_loans(cur, check_date):
+    """Помечает просроченные строки графика и их займы, возвращает в active займы без просрочки — по запросу на шаг, без цикла по займам.
+    Счётчики member_stats затронутых пайщиков пересчитываются здесь же"""
     cur.execute("""
-        SELECT DISTINCT ls.loan_id
-        FROM loan_schedule ls
-        JOIN loans l ON l.id = ls.loan_id
-        WHERE l.status = 'active'
+        UPDATE loan_schedule ls
+        SET status='overdue',
+            overdue_days = (DATE '%s' - ls.payment_date)
+        FROM loans l
+        WHERE l.id = ls.loan_id
+          AND l.status = 'active'
           AND ls.status = 'pending'
           AND ls.payment_date < '%s'
           AND COALESCE(ls.paid_amount, 0) < ls.payment_amount
-    """ % check_date)
-    overdue_loan_ids = [r[0] for r in cur.fetchall()]
+        RETURNING ls.loan_id
+    """ % (check_date, check_date))
+    overdue_loan_ids = sorted({r[0] for r in cur.fetchall()})
 
     marked_overdue = 0
-    for loan_id in overdue_loan_ids:
-        cur.execute("UPDATE loans SET status='overdue', updated_at=NOW() WHERE id=%s AND status='active'" % loan_id)
-        if cur.rowcount > 0:
-            marked_overdue += 1
-
-        cur.execute("""
-            UPDATE loan_schedule
-            SET status='overdue',
-                overdue_days = (DATE '%s' - payment_date)
-            WHERE loan_id=%s AND status='pending' AND payment_date < '%s'
-              AND COALESCE(paid_amount, 0) < payment_amount
-        """ % (check_date, loan_id, check_date))
+    if overdue_loan_ids:
+        cur.execute("UPDATE loans SET status='overdue', updated_at=NOW() WHERE id IN (%s) AND status='active'" % ','.join(str(i) for i in overdue_loan_ids))
+        marked_overdue = cur.rowcount
 
     cur.execute("""
-        SELECT DISTINCT l.id
-        FROM loans l
-        WHERE l.status = 'overdue'
-          AND NOT EXISTS (
-              SELECT 1 FROM loan_schedule ls
-              WHERE ls.loan_id = l.id
-                AND ls.status IN ('pending', 'overdue')
-                AND ls.payment_date < '%s'
-                AND COALESCE(ls.paid_amount, 0) < ls.payment_amount
-          )
+        WITH r AS (
+            UPDATE loans l SET status='active', updated_at=NOW()
+            WHERE l.status = 'overdue'
+              AND NOT EXISTS (
+                  SELECT 1 FROM loan_schedule ls
+                  WHERE ls.loan_id = l.id
+                    AND ls.status IN ('pending', 'overdue')
+                    AND ls.payment_date < '%s'
+                    AND COALESCE(ls.paid_amount, 0) < ls.payment_amount
+              )
+            RETURNING l.id
+        ), s AS (
+            UPDATE loan_schedule SET status='pending', overdue_days=0
+            WHERE loan_id IN (SELECT id FROM r) AND status='overdue'
+        )
+        SELECT id FROM r
     """ % check_date)
     restored_ids = [r[0] for r in cur.fetchall()]
-    restored = 0
-    for loan_id in restored_ids:
-        cur.execute("UPDATE loans SET status='active', updated_at=NOW() WHERE id=%s AND status='overdue'" % loan_id)
-        if cur.rowcount > 0:
-            restored += 1
-        cur.execute("UPDATE loan_schedule SET status='pending', overdue_days=0 WHERE loan_id=%s AND status='overdue'" % loan_id)
+    restored = len(restored_ids)
+
+    changed_ids = overdue_loan_ids + restored_ids
+    if changed_ids:
+        cur.execute(MEMBER_STATS_UPSERT % ("m.id IN (SELECT member_id FROM loans WHERE id IN (%s))" % ','.join(str(i) for i in changed_ids)))
 
     return {
         'checked_date': check_date,
@@ -143,7 +311,35 @@ def check_overdue_loans(cur, check_date):
     }
 
 
-PENALTY_DAILY_RATE = Decimal('0.000547')
+def snapshot_arrears_aging(cur, check_date):
+    """Снимок просрочки портфеля на дату: займы по корзинам дней просрочки (по самому старому неоплаченному платежу) и организациям.
+    Пересчёт за ту же дату заменяет снимок."""
+    cur.execute("DELETE FROM arrears_aging_snapshots WHERE snapshot_date = '%s'" % check_date)
+    cur.execute("""
+        INSERT INTO arrears_aging_snapshots (snapshot_date, org_id, bucket, loans_count, balance, overdue_amount)
+        SELECT DATE '%s', org_id, bucket, COUNT(*), SUM(balance), SUM(overdue_amount)
+        FROM (
+            SELECT COALESCE(l.org_id, 0) AS org_id, COALESCE(l.balance, 0) AS balance, COALESCE(a.overdue_amount, 0) AS overdue_amount,
+                CASE WHEN a.dpd IS NULL THEN 'current'
+                     WHEN a.dpd <= 30 THEN '1_30'
+                     WHEN a.dpd <= 60 THEN '31_60'
+                     WHEN a.dpd <= 90 THEN '61_90'
+                     ELSE '90_plus' END AS bucket
+            FROM loans l
+            LEFT JOIN (
+                SELECT loan_id, DATE '%s' - MIN(payment_date) AS dpd, SUM(payment_amount - COALESCE(paid_amount, 0)) AS overdue_amount
+                FROM loan_schedule
+                WHERE payment_date < DATE '%s' AND status <> 'paid' AND COALESCE(paid_amount, 0) < payment_amount
+                GROUP BY loan_id
+            ) a ON a.loan_id = l.id
+            WHERE l.status IN ('active', 'overdue')
+        ) t
+        GROUP BY org_id, bucket
+    """ % (check_date, check_date, check_date))
+    return {'date': check_date, 'rows': cur.rowcount}
+
+
+PENALTY_DAILY_RATE = factor('0.000547')
 
 def accrue_penalties(cur, check_date):
     cur.execute("""
@@ -156,34 +352,65 @@ def accrue_penalties(cur, check_date):
     """ % check_date)
     rows = cur.fetchall()
 
-    total_penalty = Decimal('0')
-    updated = 0
+    total_penalty = 0
+    updates = []
 
     for row in rows:
         ls_id, loan_id, principal, paid, current_penalty = row
-        principal = Decimal(str(principal))
-        paid = Decimal(str(paid))
-        current_penalty = Decimal(str(current_penalty)) if current_penalty else Decimal('0')
+        principal = to_kop(principal)
+        paid = to_kop(paid)
+        current_penalty = to_kop(current_penalty) if current_penalty else 0
 
         overdue_principal = principal - min(paid, principal)
         if overdue_principal <= 0:
             continue
 
-        daily_penalty = (overdue_principal * PENALTY_DAILY_RATE).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        daily_penalty = mul_kop(overdue_principal, PENALTY_DAILY_RATE)
         if daily_penalty <= 0:
             continue
 
         new_penalty = current_penalty + daily_penalty
-        cur.execute("UPDATE loan_schedule SET penalty_amount=%s WHERE id=%s" % (float(new_penalty), ls_id))
+        updates.append('(%s, %s::numeric)' % (ls_id, new_penalty / 100))
         total_penalty += daily_penalty
-        updated += 1
+
+    if updates:
+        cur.execute("UPDATE loan_schedule ls SET penalty_amount=v.penalty_amount FROM (VALUES %s) AS v(id, penalty_amount) WHERE ls.id=v.id" % ','.join(updates))
 
     return {
-        'schedules_penalized': updated,
-        'total_daily_penalty': float(total_penalty)
+        'schedules_penalized': len(updates),
+        'total_daily_penalty': total_penalty / 100
     }
 
 
+def load_reminder_ledger(cur, check_date):
+    """Ключи уже поставленных напоминаний с датой от check_date — одним запросом на весь прогон.
+    Ключ: (канал, 'schedule'|'saving', id строки графика или вклада, user_id, тип напоминания, дата платежа/окончания)"""
+    cur.execute("SELECT channel, ref_kind, ref_id, user_id, reminder_type, reminder_date FROM reminder_ledger WHERE reminder_date >= '%s'" % check_date)
+    return {'seen': {(r[0], r[1], r[2], r[3], r[4], r[5].isoformat()) for r in cur.fetchall()}, 'new': []}
+
+
+def reminder_claim(ledger, key, loan_id=None):
+    """False, если напоминание с таким ключом уже ставилось; иначе запоминает ключ для flush_reminder_ledger"""
+    if key in ledger['seen']:
+        return False
+    ledger['seen'].add(key)
+    ledger['new'].append(key + (loan_id,))
+    return True
+
+
+def flush_reminder_ledger(cur, ledger, chunk=1000):
+    """Записывает новые ключи в reminder_ledger пачками INSERT ... ON CONFLICT DO NOTHING"""
+    rows = ledger['new']
+    for i in range(0, len(rows), chunk):
+        cur.execute("""
+            INSERT INTO reminder_ledger (channel, ref_kind, ref_id, user_id, reminder_type, reminder_date, loan_id)
+            VALUES %s ON CONFLICT DO NOTHING
+        """ % ','.join("('%s', '%s', %d, %d, '%s', '%s', %s)" % (ch, kind, ref_id, user_id, rtype, rdate, loan_id if loan_id else 'NULL')
+                       for ch, kind, ref_id, user_id, rtype, rdate, loan_id in rows[i:i + chunk]))
+    ledger['new'] = []
+    return len(rows)
+
+
 def get_push_settings(cur):
     try:
         cur.execute("SELECT key, value FROM push_settings")
@@ -192,7 +419,7 @@ def get_push_settings(cur):
         return {'enabled': 'true', 'reminder_days': '3,1,0', 'overdue_notify': 'true', 'remind_time': '09:00'}
 
 
-def send_payment_reminders(cur, conn, check_date):
+def send_payment_reminders(cur, conn, check_date, ledger):
     settings = get_push_settings(cur)
 
     if settings.get('enabled', 'true') != 'true':
@@ -200,15 +427,9 @@ def send_payment_reminders(cur, conn, check_date):
 
     vapid_private = os.environ.get('VAPID_PRIVATE_KEY', '')
     vapid_public = os.environ.get('VAPID_PUBLIC_KEY', '')
-    vapid_email = os.environ.get('VAPID_EMAIL', 'mailto:admin@example.com')
     if not vapid_private or not vapid_public:
         return {'skipped': True, 'reason': 'VAPID keys not configured'}
 
-    try:
-        from pywebpush import webpush
-    except ImportError:
-        return {'skipped': True, 'reason': 'pywebpush not installed'}
-
     today_str = check_date if isinstance(check_date, str) else check_date.isoformat()
     today_date = date.fromisoformat(today_str) if isinstance(check_date, str) else check_date
 
@@ -255,78 +476,23 @@ def send_payment_reminders(cur, conn, check_date):
              tpl_overdue_title,
              tpl_overdue_body))
 
-    sent_total = 0
-    failed_total = 0
-    errors = []
+    outbox = []
 
     for rtype, target_date, sched_status, title_tpl, body_tpl in reminders:
-        cur.execute("""
-            SELECT ls.id, ls.loan_id, ls.payment_amount, l.contract_no, l.member_id
-            FROM loan_schedule ls
-            JOIN loans l ON l.id = ls.loan_id
-            WHERE ls.payment_date = '%s'
-              AND ls.status = '%s'
-              AND COALESCE(ls.paid_amount, 0) < ls.payment_amount
-        """ % (target_date, sched_status))
-        schedules = cur.fetchall()
-
-        for ls_id, loan_id, pay_amount, contract_no, member_id in schedules:
-            cur.execute("""
-                SELECT u.id FROM users u
-                WHERE u.member_id = %d AND u.role = 'client' AND u.status = 'active'
-            """ % member_id)
-            user_rows = cur.fetchall()
-
-            for (user_id,) in user_rows:
-                cur.execute("""
-                    SELECT id FROM push_auto_log
-                    WHERE loan_id=%d AND schedule_id=%d AND user_id=%d AND reminder_type='%s'
-                """ % (loan_id, ls_id, user_id, rtype))
-                if cur.fetchone():
-                    continue
-
-                cur.execute("""
-                    SELECT id, endpoint, p256dh, auth FROM push_subscriptions
-                    WHERE user_id=%d AND user_agent != 'unsubscribed' AND user_agent != 'expired'
-                """ % user_id)
-                subs = cur.fetchall()
-                if not subs:
-                    continue
-
-                amount_str = '{:,.2f}'.format(float(pay_amount)).replace(',', ' ')
-                title = title_tpl.format(contract_no=contract_no, amount=amount_str)
-                body_text = body_tpl.format(contract_no=contract_no, amount=amount_str)
-                payload = json.dumps({'title': title, 'body': body_text, 'url': '/'})
-
-                sub_sent = False
-                for sub_id, endpoint, p256dh, auth_key in subs:
-                    try:
-                        webpush(
-                            subscription_info={'endpoint': endpoint, 'keys': {'p256dh': p256dh, 'auth': auth_key}},
-                            data=payload,
-                            vapid_private_key=vapid_private,
-                            vapid_claims={'sub': vapid_email}
-                        )
-                        sent_total += 1
-                        sub_sent = True
-                    except Exception as e:
-                        failed_total += 1
-                        err = str(e)[:200]
-                        errors.append(err)
-                        if '410' in err or '404' in err:
-                            cur.execute("UPDATE push_subscriptions SET user_agent='expired' WHERE id=%d" % sub_id)
-
-                if sub_sent:
-                    cur.execute("""
-                        INSERT INTO push_auto_log (loan_id, schedule_id, user_id, reminder_type)
-                        VALUES (%d, %d, %d, '%s')
-                        ON CONFLICT DO NOTHING
-                    """ % (loan_id, ls_id, user_id, rtype))
-
-    return {'sent': sent_total, 'failed': failed_total, 'errors': errors[:5]}
-
-
-def send_savings_reminders(cur, conn, check_date):
+        execute_prepared(cur, 'loan_reminder_recipients_push', target_date, sched_status)
+        for ls_id, loan_id, pay_amount, contract_no, user_id, sub_ids in cur.fetchall():
+            if not reminder_claim(ledger, ('push', 'schedule', ls_id, user_id, rtype, target_date), loan_id):
+                continue
+            amount_str = '{:,.2f}'.format(float(pay_amount)).replace(',', ' ')
+            title = title_tpl.format(contract_no=contract_no, amount=amount_str)
+            body_text = body_tpl.format(contract_no=contract_no, amount=amount_str)
+            payload = {'title': title, 'body': body_text, 'url': '/'}
+            outbox.extend(('push', sub_id, user_id, payload) for sub_id in sub_ids)
+
+    return {'queued': enqueue_outbox(cur, outbox)}
+
+
+def send_savings_reminders(cur, conn, check_date, ledger):
     settings = get_push_settings(cur)
 
     if settings.get('savings_enabled', 'true') != 'true':
@@ -334,15 +500,9 @@ def send_savings_reminders(cur, conn, check_date):
 
     vapid_private = os.environ.get('VAPID_PRIVATE_KEY', '')
     vapid_public = os.environ.get('VAPID_PUBLIC_KEY', '')
-    vapid_email = os.environ.get('VAPID_EMAIL', 'mailto:admin@example.com')
     if not vapid_private or not vapid_public:
         return {'skipped': True, 'reason': 'VAPID keys not configured'}
 
-    try:
-        from pywebpush import webpush
-    except ImportError:
-        return {'skipped': True, 'reason': 'pywebpush not installed'}
-
     today_str = check_date if isinstance(check_date, str) else check_date.isoformat()
     today_date = date.fromisoformat(today_str) if isinstance(check_date, str) else check_date
 
@@ -360,9 +520,7 @@ def send_savings_reminders(cur, conn, check_date):
     tpl_savings_days_title = settings.get('tpl_savings_days_title', 'Окончание договора сбережений через {days} дн.')
     tpl_savings_days_body = settings.get('tpl_savings_days_body', 'Через {days} дн. истекает срок договора сбережений {contract_no}. Сумма: {amount} руб.')
 
-    sent_total = 0
-    failed_total = 0
-    errors = []
+    outbox = []
 
     for days in reminder_days:
         target_date = (today_date + timedelta(days=days)).isoformat()
@@ -379,68 +537,17 @@ def send_savings_reminders(cur, conn, check_date):
             title = tpl_savings_days_title.format(days=days)
             body_tpl = tpl_savings_days_body.format(contract_no='{contract_no}', amount='{amount}', days=days)
 
-        cur.execute("""
-            SELECT s.id, s.contract_no, s.current_balance, s.member_id
-            FROM savings s
-            WHERE s.status = 'active'
-              AND s.end_date = '%s'
-        """ % target_date)
-        savings_rows = cur.fetchall()
+        execute_prepared(cur, 'savings_reminder_recipients_push', target_date)
+        for s_id, contract_no, balance, user_id, sub_ids in cur.fetchall():
+            if not reminder_claim(ledger, ('push', 'saving', s_id, user_id, rtype, target_date)):
+                continue
+            amount_str = '{:,.2f}'.format(float(balance)).replace(',', ' ')
+            body_text = body_tpl.format(contract_no=contract_no, amount=amount_str)
+            title_text = title.format(contract_no=contract_no, amount=amount_str)
+            payload = {'title': title_text, 'body': body_text, 'url': '/'}
+            outbox.extend(('push', sub_id, user_id, payload) for sub_id in sub_ids)
 
-        for s_id, contract_no, balance, member_id in savings_rows:
-            cur.execute("""
-                SELECT u.id FROM users u
-                WHERE u.member_id = %d AND u.role = 'client' AND u.status = 'active'
-            """ % member_id)
-            user_rows = cur.fetchall()
-
-            for (user_id,) in user_rows:
-                cur.execute("""
-                    SELECT id FROM push_auto_log
-                    WHERE loan_id=%d AND schedule_id=0 AND user_id=%d AND reminder_type='%s'
-                """ % (s_id, user_id, rtype))
-                if cur.fetchone():
-                    continue
-
-                cur.execute("""
-                    SELECT id, endpoint, p256dh, auth FROM push_subscriptions
-                    WHERE user_id=%d AND user_agent != 'unsubscribed' AND user_agent != 'expired'
-                """ % user_id)
-                subs = cur.fetchall()
-                if not subs:
-                    continue
-
-                amount_str = '{:,.2f}'.format(float(balance)).replace(',', ' ')
-                body_text = body_tpl.format(contract_no=contract_no, amount=amount_str)
-                title_text = title.format(contract_no=contract_no, amount=amount_str)
-                payload = json.dumps({'title': title_text, 'body': body_text, 'url': '/'})
-
-                sub_sent = False
-                for sub_id, endpoint, p256dh, auth_key in subs:
-                    try:
-                        webpush(
-                            subscription_info={'endpoint': endpoint, 'keys': {'p256dh': p256dh, 'auth': auth_key}},
-                            data=payload,
-                            vapid_private_key=vapid_private,
-                            vapid_claims={'sub': vapid_email}
-                        )
-                        sent_total += 1
-                        sub_sent = True
-                    except Exception as e:
-                        failed_total += 1
-                        err = str(e)[:200]
-                        errors.append(err)
-                        if '410' in err or '404' in err:
-                            cur.execute("UPDATE push_subscriptions SET user_agent='expired' WHERE id=%d" % sub_id)
-
-                if sub_sent:
-                    cur.execute("""
-                        INSERT INTO push_auto_log (loan_id, schedule_id, user_id, reminder_type)
-                        VALUES (%d, 0, %d, '%s')
-                        ON CONFLICT DO NOTHING
-                    """ % (s_id, user_id, rtype))
-
-    return {'sent': sent_total, 'failed': failed_total, 'errors': errors[:5]}
+    return {'queued': enqueue_outbox(cur, outbox)}
 
 
 def get_telegram_settings(cur):
@@ -465,20 +572,26 @@ def get_bot_token(cur):
     return token
 
 
-def send_tg_message(bot_token, chat_id, text):
-    url = 'https://api.telegram.org/bot%s/sendMessage' % bot_token
-    data = json.dumps({'chat_id': chat_id, 'text': text, 'parse_mode': 'HTML'}).encode('utf-8')
-    req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
-    resp = urllib.request.urlopen(req, timeout=10)
-    resp.read()
+def enqueue_outbox(cur, rows, source='reminder'):
+    """Ставит сообщения в notification_outbox одним INSERT. rows — (channel, recipient, user_id, payload)"""
+    if not rows:
+        return 0
+    values = ','.join("('%s', '%s', %s, '%s'::jsonb, '%s')" % (
+        channel, str(recipient).replace("'", "''"), int(user_id) if user_id else 'NULL',
+        json.dumps(payload, ensure_ascii=False).replace("'", "''"), source) for channel, recipient, user_id, payload in rows)
+    cur.execute("INSERT INTO notification_outbox (channel, recipient, user_id, payload, source) VALUES %s" % values)
+    return len(rows)
 
 
-def send_max_message(bot_token, chat_id, text):
-    url = 'https://botapi.max.ru/messages?access_token=%s&chat_id=%s' % (urllib.parse.quote(bot_token), chat_id)
-    data = json.dumps({'text': text, 'format': 'html'}).encode('utf-8')
-    req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
-    resp = urllib.request.urlopen(req, timeout=10)
-    resp.read()
+def drain_outbox(cur, conn):
+    """Разбирает notification_outbox (outbox.drain) и чистит старые обработанные обновления ботов и отправленные сообщения"""
+    totals = outbox.drain(cur, conn, get_bot_token(cur), get_max_bot_token())
+    cur.execute("DELETE FROM bot_updates WHERE received_at < NOW() - INTERVAL '7 days'")
+    cur.execute("DELETE FROM notification_outbox WHERE status='sent' AND sent_at < NOW() - INTERVAL '30 days'")
+    cur.execute("SELECT COUNT(*) FROM notification_outbox WHERE status='pending'")
+    totals['pending'] = cur.fetchone()[0]
+    conn.commit()
+    return dict(totals, errors=totals['errors'][:5])
 
 
 def get_max_bot_token():
@@ -494,7 +607,7 @@ def get_max_settings(cur):
         return {}
 
 
-def send_max_payment_reminders(cur, conn, check_date):
+def send_max_payment_reminders(cur, conn, check_date, ledger):
     settings = get_max_settings(cur)
 
     if settings.get('enabled', 'false') != 'true':
@@ -538,76 +651,21 @@ def send_max_payment_reminders(cur, conn, check_date):
         reminders.append(('max_overdue_1d', today_str, 'overdue',
             tpl_overdue))
 
-    sent_total = 0
-    failed_total = 0
-    errors = []
+    outbox = []
 
     for rtype, target_date, sched_status, body_tpl in reminders:
-        cur.execute("""
-            SELECT ls.id, ls.loan_id, ls.payment_amount, l.contract_no, l.member_id
-            FROM loan_schedule ls
-            JOIN loans l ON l.id = ls.loan_id
-            WHERE ls.payment_date = '%s'
-              AND ls.status = '%s'
-              AND COALESCE(ls.paid_amount, 0) < ls.payment_amount
-        """ % (target_date, sched_status))
-        schedules = cur.fetchall()
-
-        for ls_id, loan_id, pay_amount, contract_no, member_id in schedules:
-            cur.execute("""
-                SELECT u.id FROM users u
-                WHERE u.member_id = %d AND u.role = 'client' AND u.status = 'active'
-            """ % member_id)
-            user_rows = cur.fetchall()
-
-            for (user_id,) in user_rows:
-                cur.execute("""
-                    SELECT ns.setting_value FROM notification_settings ns
-                    WHERE ns.user_id=%d AND ns.channel='max' AND ns.setting_key='loan_reminders'
-                """ % user_id)
-                ns_row = cur.fetchone()
-                if ns_row and ns_row[0] == 'false':
-                    continue
-
-                cur.execute("""
-                    SELECT id FROM max_auto_log
-                    WHERE loan_id=%d AND schedule_id=%d AND user_id=%d AND reminder_type='%s'
-                """ % (loan_id, ls_id, user_id, rtype))
-                if cur.fetchone():
-                    continue
-
-                cur.execute("""
-                    SELECT chat_id FROM max_subscribers
-                    WHERE user_id=%d AND active=true
-                """ % user_id)
-                max_subs = cur.fetchall()
-                if not max_subs:
-                    continue
-
-                amount_str = '{:,.2f}'.format(float(pay_amount)).replace(',', ' ')
-                text = body_tpl.format(contract_no=contract_no, amount=amount_str)
-
-                sub_sent = False
-                for (chat_id,) in max_subs:
-                    try:
-                        send_max_message(bot_token, chat_id, text)
-                        sent_total += 1
-                        sub_sent = True
-                    except Exception as e:
-                        failed_total += 1
-                        errors.append(str(e)[:200])
-
-                if sub_sent:
-                    cur.execute("""
-                        INSERT INTO max_auto_log (loan_id, schedule_id, user_id, reminder_type)
-                        VALUES (%d, %d, %d, '%s')
-                        ON CONFLICT DO NOTHING
-                    """ % (loan_id, ls_id, user_id, rtype))
-
-    return {'sent': sent_total, 'failed': failed_total, 'errors': errors[:5]}
-
-
-def send_max_savings_reminders(cur, conn, check_date):
+        execute_prepared(cur, 'loan_reminder_recipients_max', target_date, sched_status)
+        for ls_id, loan_id, pay_amount, contract_no, user_id, chat_ids in cur.fetchall():
+            if not reminder_claim(ledger, ('max', 'schedule', ls_id, user_id, rtype, target_date), loan_id):
+                continue
+            amount_str = '{:,.2f}'.format(float(pay_amount)).replace(',', ' ')
+            text = body_tpl.format(contract_no=contract_no, amount=amount_str)
+            outbox.extend(('max', chat_id, user_id, {'text': text}) for chat_id in chat_ids)
+
+    return {'queued': enqueue_outbox(cur, outbox)}
+
+
+def send_max_savings_reminders(cur, conn, check_date, ledger):
     settings = get_max_settings(cur)
 
     if settings.get('savings_enabled', 'false') != 'true':
@@ -631,9 +689,7 @@ def send_max_savings_reminders(cur, conn, check_date):
     tpl_savings_tomorrow = settings.get('tpl_savings_tomorrow', 'Завтра истекает срок договора сбережений <b>{contract_no}</b>.\nСумма: <b>{amount}</b> руб.')
     tpl_savings_days = settings.get('tpl_savings_days', 'Через <b>{days} дн.</b> истекает срок договора сбережений <b>{contract_no}</b>.\nСумма: <b>{amount}</b> руб.')
 
-    sent_total = 0
-    failed_total = 0
-    errors = []
+    outbox = []
 
     for days in reminder_days:
         target_date = (today_date + timedelta(days=days)).isoformat()
@@ -647,69 +703,18 @@ def send_max_savings_reminders(cur, conn, check_date):
             rtype = 'max_savings_end_%dd' % days
             body_tpl = tpl_savings_days.format(contract_no='{contract_no}', amount='{amount}', days=days)
 
-        cur.execute("""
-            SELECT s.id, s.contract_no, s.current_balance, s.member_id
-            FROM savings s
-            WHERE s.status = 'active'
-              AND s.end_date = '%s'
-        """ % target_date)
-        savings_rows = cur.fetchall()
+        execute_prepared(cur, 'savings_reminder_recipients_max', target_date)
+        for s_id, contract_no, balance, user_id, chat_ids in cur.fetchall():
+            if not reminder_claim(ledger, ('max', 'saving', s_id, user_id, rtype, target_date)):
+                continue
+            amount_str = '{:,.2f}'.format(float(balance)).replace(',', ' ')
+            text = body_tpl.format(contract_no=contract_no, amount=amount_str)
+            outbox.extend(('max', chat_id, user_id, {'text': text}) for chat_id in chat_ids)
 
-        for s_id, contract_no, balance, member_id in savings_rows:
-            cur.execute("""
-                SELECT u.id FROM users u
-                WHERE u.member_id = %d AND u.role = 'client' AND u.status = 'active'
-            """ % member_id)
-            user_rows = cur.fetchall()
-
-            for (user_id,) in user_rows:
-                cur.execute("""
-                    SELECT ns.setting_value FROM notification_settings ns
-                    WHERE ns.user_id=%d AND ns.channel='max' AND ns.setting_key='savings_reminders'
-                """ % user_id)
-                ns_row = cur.fetchone()
-                if ns_row and ns_row[0] == 'false':
-                    continue
-
-                cur.execute("""
-                    SELECT id FROM max_auto_log
-                    WHERE loan_id=%d AND schedule_id=0 AND user_id=%d AND reminder_type='%s'
-                """ % (s_id, user_id, rtype))
-                if cur.fetchone():
-                    continue
-
-                cur.execute("""
-                    SELECT chat_id FROM max_subscribers
-                    WHERE user_id=%d AND active=true
-                """ % user_id)
-                max_subs = cur.fetchall()
-                if not max_subs:
-                    continue
-
-                amount_str = '{:,.2f}'.format(float(balance)).replace(',', ' ')
-                text = body_tpl.format(contract_no=contract_no, amount=amount_str)
-
-                sub_sent = False
-                for (chat_id,) in max_subs:
-                    try:
-                        send_max_message(bot_token, chat_id, text)
-                        sent_total += 1
-                        sub_sent = True
-                    except Exception as e:
-                        failed_total += 1
-                        errors.append(str(e)[:200])
-
-                if sub_sent:
-                    cur.execute("""
-                        INSERT INTO max_auto_log (loan_id, schedule_id, user_id, reminder_type)
-                        VALUES (%d, 0, %d, '%s')
-                        ON CONFLICT DO NOTHING
-                    """ % (s_id, user_id, rtype))
-
-    return {'sent': sent_total, 'failed': failed_total, 'errors': errors[:5]}
-
-
-def send_telegram_payment_reminders(cur, conn, check_date):
+    return {'queued': enqueue_outbox(cur, outbox)}
+
+
+def send_telegram_payment_reminders(cur, conn, check_date, ledger):
     settings = get_telegram_settings(cur)
 
     if settings.get('enabled', 'false') != 'true':
@@ -753,68 +758,21 @@ def send_telegram_payment_reminders(cur, conn, check_date):
         reminders.append(('tg_overdue_1d', today_str, 'overdue',
             tpl_overdue))
 
-    sent_total = 0
-    failed_total = 0
-    errors = []
+    outbox = []
 
     for rtype, target_date, sched_status, body_tpl in reminders:
-        cur.execute("""
-            SELECT ls.id, ls.loan_id, ls.payment_amount, l.contract_no, l.member_id
-            FROM loan_schedule ls
-            JOIN loans l ON l.id = ls.loan_id
-            WHERE ls.payment_date = '%s'
-              AND ls.status = '%s'
-              AND COALESCE(ls.paid_amount, 0) < ls.payment_amount
-        """ % (target_date, sched_status))
-        schedules = cur.fetchall()
-
-        for ls_id, loan_id, pay_amount, contract_no, member_id in schedules:
-            cur.execute("""
-                SELECT u.id FROM users u
-                WHERE u.member_id = %d AND u.role = 'client' AND u.status = 'active'
-            """ % member_id)
-            user_rows = cur.fetchall()
-
-            for (user_id,) in user_rows:
-                cur.execute("""
-                    SELECT id FROM telegram_auto_log
-                    WHERE loan_id=%d AND schedule_id=%d AND user_id=%d AND reminder_type='%s'
-                """ % (loan_id, ls_id, user_id, rtype))
-                if cur.fetchone():
-                    continue
-
-                cur.execute("""
-                    SELECT chat_id FROM telegram_subscribers
-                    WHERE user_id=%d AND active=true
-                """ % user_id)
-                tg_subs = cur.fetchall()
-                if not tg_subs:
-                    continue
-
-                amount_str = '{:,.2f}'.format(float(pay_amount)).replace(',', ' ')
-                text = body_tpl.format(contract_no=contract_no, amount=amount_str)
-
-                sub_sent = False
-                for (chat_id,) in tg_subs:
-                    try:
-                        send_tg_message(bot_token, chat_id, text)
-                        sent_total += 1
-                        sub_sent = True
-                    except Exception as e:
-                        failed_total += 1
-                        errors.append(str(e)[:200])
-
-                if sub_sent:
-                    cur.execute("""
-                        INSERT INTO telegram_auto_log (loan_id, schedule_id, user_id, reminder_type)
-                        VALUES (%d, %d, %d, '%s')
-                        ON CONFLICT DO NOTHING
-                    """ % (loan_id, ls_id, user_id, rtype))
-
-    return {'sent': sent_total, 'failed': failed_total, 'errors': errors[:5]}
-
-
-def send_telegram_savings_reminders(cur, conn, check_date):
+        execute_prepared(cur, 'loan_reminder_recipients_telegram', target_date, sched_status)
+        for ls_id, loan_id, pay_amount, contract_no, user_id, chat_ids in cur.fetchall():
+            if not reminder_claim(ledger, ('telegram', 'schedule', ls_id, user_id, rtype, target_date), loan_id):
+                continue
+            amount_str = '{:,.2f}'.format(float(pay_amount)).replace(',', ' ')
+            text = body_tpl.format(contract_no=contract_no, amount=amount_str)
+            outbox.extend(('telegram', chat_id, user_id, {'text': text}) for chat_id in chat_ids)
+
+    return {'queued': enqueue_outbox(cur, outbox)}
+
+
+def send_telegram_savings_reminders(cur, conn, check_date, ledger):
     settings = get_telegram_settings(cur)
 
     if settings.get('savings_enabled', 'false') != 'true':
@@ -838,9 +796,7 @@ def send_telegram_savings_reminders(cur, conn, check_date):
     tpl_savings_tomorrow = settings.get('tpl_savings_tomorrow', 'Завтра истекает срок договора сбережений <b>{contract_no}</b>.\nСумма: <b>{amount}</b> руб.')
     tpl_savings_days = settings.get('tpl_savings_days', 'Через <b>{days} дн.</b> истекает срок договора сбережений <b>{contract_no}</b>.\nСумма: <b>{amount}</b> руб.')
 
-    sent_total = 0
-    failed_total = 0
-    errors = []
+    outbox = []
 
     for days in reminder_days:
         target_date = (today_date + timedelta(days=days)).isoformat()
@@ -854,55 +810,12 @@ def send_telegram_savings_reminders(cur, conn, check_date):
             rtype = 'tg_savings_end_%dd' % days
             body_tpl = tpl_savings_days.format(contract_no='{contract_no}', amount='{amount}', days=days)
 
-        cur.execute("""
-            SELECT s.id, s.contract_no, s.current_balance, s.member_id
-            FROM savings s
-            WHERE s.status = 'active'
-              AND s.end_date = '%s'
-        """ % target_date)
-        savings_rows = cur.fetchall()
+        execute_prepared(cur, 'savings_reminder_recipients_telegram', target_date)
+        for s_id, contract_no, balance, user_id, chat_ids in cur.fetchall():
+            if not reminder_claim(ledger, ('telegram', 'saving', s_id, user_id, rtype, target_date)):
+                continue
+            amount_str = '{:,.2f}'.format(float(balance)).replace(',', ' ')
+            text = body_tpl.format(contract_no=contract_no, amount=amount_str)
+            outbox.extend(('telegram', chat_id, user_id, {'text': text}) for chat_id in chat_ids)
 
-        for s_id, contract_no, balance, member_id in savings_rows:
-            cur.execute("""
-                SELECT u.id FROM users u
-                WHERE u.member_id = %d AND u.role = 'client' AND u.status = 'active'
-            """ % member_id)
-            user_rows = cur.fetchall()
-
-            for (user_id,) in user_rows:
-                cur.execute("""
-                    SELECT id FROM telegram_auto_log
-                    WHERE loan_id=%d AND schedule_id=0 AND user_id=%d AND reminder_type='%s'
-                """ % (s_id, user_id, rtype))
-                if cur.fetchone():
-                    continue
-
-                cur.execute("""
-                    SELECT chat_id FROM telegram_subscribers
-                    WHERE user_id=%d AND active=true
-                """ % user_id)
-                tg_subs = cur.fetchall()
-                if not tg_subs:
-                    continue
-
-                amount_str = '{:,.2f}'.format(float(balance)).replace(',', ' ')
-                text = body_tpl.format(contract_no=contract_no, amount=amount_str)
-
-                sub_sent = False
-                for (chat_id,) in tg_subs:
-                    try:
-                        send_tg_message(bot_token, chat_id, text)
-                        sent_total += 1
-                        sub_sent = True
-                    except Exception as e:
-                        failed_total += 1
-                        errors.append(str(e)[:200])
-
-                if sub_sent:
-                    cur.execute("""
-                        INSERT INTO telegram_auto_log (loan_id, schedule_id, user_id, reminder_type)
-                        VALUES (%d, 0, %d, '%s')
-                        ON CONFLICT DO NOTHING
-                    """ % (s_id, user_id, rtype))
-
-    return {'sent': sent_total, 'failed': failed_total, 'errors': errors[:5]}
\ No newline at end of file
+    return {'queued': enqueue_outbox(cur, outbox)}
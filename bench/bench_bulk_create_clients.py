@@ -0,0 +1,121 @@
+"""Массовое создание учётных записей клиентов (POST entity=users, action=bulk_create_clients) на N пайщиках без учётных записей:
+один запрос на множестве против прежнего цикла по пайщикам (SELECT логина и INSERT на каждого), взятого из истории.
+Телефоны в разных записях (+7, 8, десять цифр), у каждого двадцатого телефона нет, каждые два из пятидесяти совпадают.
+Каждый режим — на свежей копии заполненной базы. Запуск: TEST_DATABASE_URL=... python bench/bench_bulk_create_clients.py [пайщиков]"""
+import json
+import os
+import sys
+import time
+
+import psycopg2
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests'))
+
+import erpdb  # noqa: E402
+
+BASE_DB = 'erp_bench_bulk_clients'
+RUN_DB = 'erp_bench_bulk_clients_run'
+
+
+def old_bulk_create_clients(body, cur, conn, staff):
+    from core import audit_log, esc, hash_password
+
+    default_password = body.get('password', '123456')
+    pw_hash = hash_password(default_password)
+    cur.execute("SELECT m.id, m.member_no, m.phone, CASE WHEN m.member_type='FL' THEN CONCAT(m.last_name,' ',m.first_name) ELSE m.company_name END as name FROM members m WHERE m.status='active' AND NOT EXISTS (SELECT 1 FROM users u WHERE u.member_id=m.id AND u.role='client')")
+    rows = cur.fetchall()
+    created = 0
+    skipped = 0
+    skipped_reasons = []
+    for r in rows:
+        mid, mno, mphone, mname = r[0], r[1], r[2] or '', r[3] or 'Клиент'
+        phone_digits = ''.join(c for c in mphone if c.isdigit())
+        if len(phone_digits) == 11 and phone_digits[0] in ('7', '8'):
+            phone_digits = '7' + phone_digits[1:]
+        elif len(phone_digits) == 10:
+            phone_digits = '7' + phone_digits
+        if len(phone_digits) < 11:
+            skipped += 1
+            if len(skipped_reasons) < 5:
+                skipped_reasons.append('%s — нет телефона' % (mno or str(mid)))
+            continue
+        login = phone_digits
+        cur.execute("SELECT id FROM users WHERE login='%s'" % esc(login))
+        if cur.fetchone():
+            login = login + '_' + str(mid)
+        cur.execute("INSERT INTO users (login, name, email, phone, role, password_hash, member_id) VALUES ('%s','%s','','%s','client','%s',%s)" % (esc(login), esc(mname), esc(phone_digits), pw_hash, mid))
+        created += 1
+    if created > 0:
+        audit_log(cur, staff, 'bulk_create_clients', 'user', None, '', 'Создано: %s, пропущено: %s' % (created, skipped), '')
+        conn.commit()
+    return {'success': True, 'created': created, 'skipped': skipped, 'skipped_reasons': skipped_reasons, 'password': default_password}
+
+
+def seed(cur, count):
+    cur.execute("""
+        INSERT INTO members (member_no, member_type, last_name, first_name, inn, phone, status)
+        SELECT 'П-' || lpad(g::text, 6, '0'), 'FL', 'Пайщиков' || g, 'Иван', lpad(g::text, 12, '0'),
+               CASE WHEN g %% 20 = 0 THEN ''
+                    WHEN g %% 3 = 0 THEN '+7 (9' || lpad((p / 10000000)::text, 2, '0') || ') ' || lpad((p %% 10000000)::text, 7, '0')
+                    WHEN g %% 3 = 1 THEN '8 9' || lpad((p / 10000000)::text, 2, '0') || ' ' || lpad((p %% 10000000)::text, 7, '0')
+                    ELSE '9' || lpad(p::text, 9, '0') END,
+               'active'
+        FROM (SELECT g, CASE WHEN g %% 50 = 1 THEN g + 1 ELSE g END * 7919 %% 1000000000 AS p FROM generate_series(1, %s) g) t
+    """ % count)
+
+
+def timed(old):
+    erpdb.use_database(erpdb.create_database(RUN_DB, template=BASE_DB))
+    with pytest.MonkeyPatch.context() as mp:
+        if old:
+            import staff
+
+            new = staff.handle_users
+
+            def handle_users(method, params, body, staff_row, cur, conn):
+                if method == 'POST' and body.get('action') == 'bulk_create_clients':
+                    return old_bulk_create_clients(body, cur, conn, staff_row)
+                return new(method, params, body, staff_row, cur, conn)
+            mp.setattr(staff, 'handle_users', handle_users)
+        event = {'httpMethod': 'POST', 'queryStringParameters': {'entity': 'users'}, 'headers': {'X-Auth-Token': erpdb.STAFF_TOKEN},
+                 'body': json.dumps({'action': 'bulk_create_clients', 'password': 'secret1'})}
+        t = time.perf_counter()
+        resp = erpdb.api().handler(event, None)
+        ms = (time.perf_counter() - t) * 1000
+    assert resp['statusCode'] < 300, resp['body']
+    conn = psycopg2.connect(erpdb.db_dsn(RUN_DB))
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(DISTINCT login), COUNT(DISTINCT phone), COUNT(*) FILTER (WHERE login LIKE '%\\_%') FROM users WHERE role='client'")
+    logins = cur.fetchone()
+    conn.close()
+    erpdb.drop_database(RUN_DB)
+    return ms, json.loads(resp['body']), logins
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    erpdb.build_template()
+    dsn = erpdb.create_database(BASE_DB)
+    try:
+        conn = psycopg2.connect(dsn)
+        cur = conn.cursor()
+        erpdb.add_staff(cur)
+        seed(cur, count)
+        conn.commit()
+        conn.close()
+        print('пайщиков: %s' % count)
+        results = {}
+        for old in (True, False):
+            ms, res, logins = timed(old)
+            results[old] = (res['created'], res['skipped'], logins)
+            print('%-16s %8.0f ms: создано %s, пропущено %s; логинов %s, телефонов %s, логинов с id пайщика %s' % (
+                'цикл по пайщикам' if old else 'один запрос', ms, res['created'], res['skipped'], *logins))
+        assert results[True] == results[False]
+    finally:
+        for name in (RUN_DB, BASE_DB, erpdb.TEMPLATE_DB):
+            erpdb.drop_database(name)
+
+
+if __name__ == '__main__':
+    main()
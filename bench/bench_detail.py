@@ -0,0 +1,164 @@
+"""Карточки займа и вклада (action=detail): JSON, собранный в БД (query_json), против прежней сборки в Python
+(query_one/query_rows, serialize каждого значения и json.dumps в handler). Прежний код взят из истории до перевода на query_json.
+Вклад открыт несколько лет назад: дневные начисления за каждый день (backfill_accrue), ежемесячные пополнения; займ — с платежами.
+Замеряется handler api целиком, режимы чередуются, выводится медиана и минимум.
+Запуск: TEST_DATABASE_URL=... python bench/bench_detail.py [лет] [прогонов]"""
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import date
+
+import psycopg2
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests'))
+
+import erpdb  # noqa: E402
+
+BENCH_DB = 'erp_bench_detail'
+MEMBER_NAME_SQL = "SELECT CASE WHEN m.member_type='FL' THEN CONCAT(m.last_name,' ',m.first_name,' ',m.middle_name) ELSE m.company_name END FROM members m WHERE m.id=%s"
+
+
+def old_loan_detail(cur, lid):
+    from core import query_one, query_rows
+
+    loan = query_one(cur, "SELECT * FROM loans WHERE id = %s" % lid)
+    if not loan:
+        return None
+    cur.execute(MEMBER_NAME_SQL % loan['member_id'])
+    nr = cur.fetchone()
+    loan['member_name'] = nr[0] if nr else ''
+    if loan.get('org_id'):
+        org_row = query_one(cur, "SELECT name, short_name FROM organizations WHERE id=%s" % loan['org_id'])
+        loan['org_name'] = org_row['name'] if org_row else ''
+        loan['org_short_name'] = org_row['short_name'] if org_row else ''
+    loan['schedule'] = query_rows(cur, "SELECT * FROM loan_schedule WHERE loan_id=%s ORDER BY payment_no" % lid)
+    loan['payments'] = query_rows(cur, "SELECT * FROM loan_payments WHERE loan_id=%s ORDER BY payment_date" % lid)
+    return loan
+
+
+def old_saving_detail(cur, sid):
+    from core import query_one, query_rows
+    from schedules import get_accrued_interest_end_of_prev_month
+
+    s = query_one(cur, "SELECT * FROM savings WHERE id=%s" % sid)
+    if not s:
+        return None
+    cur.execute(MEMBER_NAME_SQL % s['member_id'])
+    nr = cur.fetchone()
+    s['member_name'] = nr[0] if nr else ''
+    if s.get('org_id'):
+        org_row = query_one(cur, "SELECT name, short_name FROM organizations WHERE id=%s" % s['org_id'])
+        s['org_name'] = org_row['name'] if org_row else ''
+        s['org_short_name'] = org_row['short_name'] if org_row else ''
+    cur.execute("UPDATE savings_schedule SET status='accrued' WHERE saving_id=%s AND status='pending' AND period_end <= '%s'" % (sid, date.today().isoformat()))
+    s['schedule'] = query_rows(cur, "SELECT * FROM savings_schedule WHERE saving_id=%s ORDER BY period_no" % sid)
+    s['transactions'] = query_rows(cur, "SELECT * FROM savings_transactions WHERE saving_id=%s ORDER BY transaction_date" % sid)
+    s['daily_accruals'] = query_rows(cur, "SELECT id, accrual_date, balance, rate, daily_amount, created_at FROM savings_daily_accruals WHERE saving_id=%s ORDER BY accrual_date" % sid)
+    s['rate_changes'] = query_rows(cur, "SELECT id, effective_date, old_rate, new_rate, reason, created_at FROM savings_rate_changes WHERE saving_id=%s ORDER BY effective_date" % sid)
+    cur.execute("SELECT COALESCE(SUM(daily_amount), 0) FROM savings_daily_accruals WHERE saving_id=%s" % sid)
+    s['total_daily_accrued'] = float(cur.fetchone()[0])
+    s['max_payout'] = float(get_accrued_interest_end_of_prev_month(cur, sid))
+    cur.execute("SELECT MIN(accrual_date), MAX(accrual_date), COUNT(*) FROM savings_daily_accruals WHERE saving_id=%s" % sid)
+    accrual_info = cur.fetchone()
+    s['accrual_first_date'] = str(accrual_info[0]) if accrual_info[0] else None
+    s['accrual_last_date'] = str(accrual_info[1]) if accrual_info[1] else None
+    s['accrual_days_count'] = accrual_info[2] or 0
+    return s
+
+
+def use_old_detail(mp):
+    """Подменяет ветку detail в handle_loans/handle_savings прежним кодом; остальные действия не трогает"""
+    import loans
+    import savings
+
+    for mod, name, old in ((loans, 'handle_loans', old_loan_detail), (savings, 'handle_savings', old_saving_detail)):
+        def handle(method, params, body, cur, conn, staff=None, ip='', _new=getattr(mod, name), _old=old):
+            if method == 'GET' and params.get('action') == 'detail':
+                return _old(cur, int(params['id']))
+            return _new(method, params, body, cur, conn, staff, ip)
+        mp.setattr(mod, name, handle)
+
+
+def seed(dsn, years):
+    """Пайщик с вкладом на years лет назад (дневные начисления за каждый день, пополнение каждый месяц) и займом с платежами"""
+    from core import add_months
+
+    today = date.today()
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    erpdb.add_staff(cur)
+    mid = erpdb.add_member(cur, 1)
+    conn.commit()
+    conn.close()
+    months = 12 * years
+    start = add_months(today, -months)
+    status, saving, _ = erpdb.call_api('POST', 'savings', body={
+        'action': 'create', 'member_id': mid, 'amount': 500000, 'rate': 12.5, 'term_months': months + 12,
+        'start_date': start.isoformat(), 'payout_type': 'end_of_term'})
+    assert status < 300, saving
+    for k in range(1, months):
+        status, res, _ = erpdb.call_api('POST', 'savings', body={
+            'action': 'transaction', 'saving_id': saving['id'], 'amount': 5000, 'transaction_type': 'deposit',
+            'transaction_date': add_months(start, k).isoformat()})
+        assert status < 300, res
+    status, res, _ = erpdb.call_api('POST', 'savings', body={'action': 'backfill_accrue', 'saving_id': saving['id'], 'mode': 'verify_fix'})
+    assert status < 300, res
+
+    status, loan, _ = erpdb.call_api('POST', 'loans', body={
+        'action': 'create', 'contract_no': 'З-1', 'member_id': mid, 'amount': 3000000, 'rate': 16,
+        'term_months': months + 12, 'start_date': start.isoformat()})
+    assert status < 300, loan
+    for item in loan['schedule'][:months]:
+        status, res, _ = erpdb.call_api('POST', 'loans', body={
+            'action': 'payment', 'loan_id': loan['id'], 'payment_date': item['payment_date'], 'amount': item['payment_amount']})
+        assert status < 300, res
+    return loan['id'], saving['id']
+
+
+def timed(old, entity, eid):
+    """Время handler от события до тела ответа; разбор тела в замер не входит"""
+    event = {'httpMethod': 'GET', 'queryStringParameters': {'entity': entity, 'action': 'detail', 'id': eid},
+             'headers': {'X-Auth-Token': erpdb.STAFF_TOKEN}}
+    with pytest.MonkeyPatch.context() as mp:
+        if old:
+            use_old_detail(mp)
+        t = time.perf_counter()
+        resp = erpdb.api().handler(event, None)
+        ms = (time.perf_counter() - t) * 1000
+    assert resp['statusCode'] == 200, resp['body']
+    return ms, json.loads(resp['body'])
+
+
+def main():
+    years = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 15
+    erpdb.build_template()
+    dsn = erpdb.create_database(BENCH_DB)
+    erpdb.use_database(dsn)
+    try:
+        loan_id, saving_id = seed(dsn, years)
+        for entity, eid, lists in (('loans', loan_id, ('schedule', 'payments')),
+                                   ('savings', saving_id, ('schedule', 'transactions', 'daily_accruals'))):
+            times = {True: [], False: []}
+            bodies = {}
+            for _ in range(rounds):
+                for old in (True, False):
+                    ms, bodies[old] = timed(old, entity, eid)
+                    times[old].append(ms)
+            # одинаковая форма ответа: те же ключи и столько же строк в списках
+            assert set(bodies[True]) == set(bodies[False])
+            sizes = {key: len(bodies[False][key]) for key in lists}
+            assert sizes == {key: len(bodies[True][key]) for key in lists}
+            print('%s detail %s, ответ %s КБ' % (entity, sizes, len(json.dumps(bodies[False])) // 1024))
+            print('    Python + json.dumps: медиана %6.1f мин %6.1f ms   query_json: медиана %6.1f мин %6.1f ms' % (
+                statistics.median(times[True]), min(times[True]), statistics.median(times[False]), min(times[False])))
+    finally:
+        erpdb.drop_database(BENCH_DB)
+        erpdb.drop_database(erpdb.TEMPLATE_DB)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Прогноз денежного потока (GET entity=reports, action=forecast) на синтетическом портфеле: займы на 36 месяцев
+с аннуитетным графиком, начатые в разные месяцы последних трёх лет, и вклады на 12 месяцев, три организации.
+Замеряется handler api целиком (запросы, NumPy, JSON) и elapsed_ms из ответа; выводится медиана и максимум.
+Запуск: TEST_DATABASE_URL=... python bench/bench_forecast.py [займов] [прогонов]"""
+import json
+import os
+import statistics
+import sys
+import time
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests'))
+
+import erpdb  # noqa: E402
+
+BENCH_DB = 'erp_bench_forecast'
+CASES = [
+    ('месяцы, 12', {'months': 12}),
+    ('месяцы, 60, сценарий', {'months': 60, 'default_rate': 5, 'prepay_rate': 15}),
+    ('недели, 12', {'months': 12, 'group': 'week'}),
+    ('месяцы, 36, by_org', {'months': 36, 'by_org': '1', 'default_rate': 5, 'prepay_rate': 15}),
+    ('недели, 60, by_org', {'months': 60, 'group': 'week', 'by_org': '1'}),
+]
+
+
+def seed(cur, loans):
+    cur.execute("INSERT INTO organizations (name) SELECT 'КПК ' || g FROM generate_series(1, 3) g RETURNING id")
+    orgs = [r[0] for r in cur.fetchall()]
+    member_id = erpdb.add_member(cur, 1)
+    cur.execute("""
+        INSERT INTO loans (contract_no, member_id, amount, rate, term_months, schedule_type, start_date, end_date, balance, status, org_id)
+        SELECT 'З-' || g, %(member)s, 100000 + g %% 50 * 10000, 18, 36, 'annuity',
+               CURRENT_DATE - (g %% 1080), CURRENT_DATE - (g %% 1080) + 1095, 100000, 'active', (%(orgs)s)[1 + g %% 3]
+        FROM generate_series(1, %(loans)s) g
+    """, {'member': member_id, 'orgs': orgs, 'loans': loans})
+    # график без оплат: просроченные строки остаются в прогнозе с датой «сегодня»
+    cur.execute("""
+        INSERT INTO loan_schedule (loan_id, payment_no, payment_date, payment_amount, principal_amount, interest_amount, balance_after, status)
+        SELECT l.id, n, l.start_date + n * 30, l.amount / 36 + l.amount * 0.015, l.amount / 36, l.amount * 0.015 * (37 - n) / 36,
+               l.amount * (36 - n) / 36, CASE WHEN l.start_date + n * 30 < CURRENT_DATE - 90 THEN 'paid' ELSE 'pending' END
+        FROM loans l CROSS JOIN generate_series(1, 36) n
+    """)
+    cur.execute("""
+        INSERT INTO savings (contract_no, member_id, amount, rate, term_months, payout_type, start_date, end_date, current_balance, status, org_id)
+        SELECT 'С-' || g, %(member)s, 50000 + g %% 20 * 5000, 12, 12, CASE WHEN g %% 2 = 0 THEN 'monthly' ELSE 'end_of_term' END,
+               CURRENT_DATE - (g %% 360), CURRENT_DATE - (g %% 360) + 365, 50000 + g %% 20 * 5000, 'active', (%(orgs)s)[1 + g %% 3]
+        FROM generate_series(1, %(savings)s) g
+    """, {'member': member_id, 'orgs': orgs, 'savings': loans // 2})
+    cur.execute("""
+        INSERT INTO savings_schedule (saving_id, period_no, period_start, period_end, interest_amount, cumulative_interest, balance_after, status)
+        SELECT s.id, n, s.start_date + (n - 1) * 30, s.start_date + n * 30, s.amount * 0.01, s.amount * 0.01 * n, s.amount,
+               CASE WHEN s.start_date + n * 30 < CURRENT_DATE THEN 'paid' ELSE 'pending' END
+        FROM savings s CROSS JOIN generate_series(1, 12) n
+    """)
+    cur.execute("ANALYZE")
+
+
+def timed(params):
+    event = {'httpMethod': 'GET', 'queryStringParameters': dict(params, entity='reports', action='forecast'),
+             'headers': {'X-Auth-Token': erpdb.STAFF_TOKEN}}
+    t = time.perf_counter()
+    resp = erpdb.api().handler(event, None)
+    ms = (time.perf_counter() - t) * 1000
+    assert resp['statusCode'] == 200, resp['body']
+    return ms, json.loads(resp['body'])
+
+
+def main():
+    loans = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 7
+    erpdb.build_template()
+    dsn = erpdb.create_database(BENCH_DB)
+    erpdb.use_database(dsn)
+    try:
+        conn = psycopg2.connect(dsn)
+        cur = conn.cursor()
+        erpdb.add_staff(cur)
+        seed(cur, loans)
+        conn.commit()
+        conn.close()
+        timed(CASES[0][1])  # импорт NumPy и модуля отчётов
+        for title, params in CASES:
+            samples = [timed({k: str(v) for k, v in params.items()}) for _ in range(rounds)]
+            total = [ms for ms, _ in samples]
+            inner = [res['elapsed_ms'] for _, res in samples]
+            res = samples[-1][1]
+            print('%-22s строк %s, корзин %3s: handler медиана %6.0f макс %6.0f ms, расчёт (elapsed_ms) медиана %6.0f ms' % (
+                title, res['rows'], len(res['buckets']), statistics.median(total), max(total), statistics.median(inner)))
+    finally:
+        erpdb.drop_database(BENCH_DB)
+        erpdb.drop_database(erpdb.TEMPLATE_DB)
+
+
+if __name__ == '__main__':
+    main()
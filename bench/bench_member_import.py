@@ -0,0 +1,78 @@
+"""Импорт пайщиков (POST entity=members, action=import) из сгенерированного CSV: время проверки (dry_run) и загрузки
+через handler api целиком, отдельно — разбор файла members.read_import_rows и пик памяти разбора (tracemalloc).
+Каждый десятый пайщик — организация, каждая сотая строка с ошибкой (неверный ИНН).
+Запуск: TEST_DATABASE_URL=... python bench/bench_member_import.py [строк]"""
+import base64
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests'))
+
+import erpdb  # noqa: E402
+
+BENCH_DB = 'erp_bench_member_import'
+HEADER = 'Тип;Фамилия;Имя;Отчество;Наименование компании;ИНН;Телефон;Дата рождения;Серия паспорта;Номер паспорта;Адрес регистрации'
+
+
+def csv_file(count):
+    lines = [HEADER]
+    for i in range(1, count + 1):
+        inn = '%012d' % (770000000000 + i) if i % 100 else '%d' % i
+        if i % 10:
+            lines.append('ФЛ;Иванов%d;Пётр;Сергеевич;;%s;+7 900 %07d;%02d.%02d.19%02d;%04d;%06d;г. Москва, ул. Ленина, д. %d' % (
+                i, inn, i, 1 + i % 28, 1 + i % 12, 50 + i % 50, i % 10000, i % 1000000, i % 200))
+        else:
+            lines.append('ЮЛ;;;;ООО «Ромашка-%d»;%s;+7 495 %07d;;;;г. Москва, ул. Тверская, д. %d' % (i, inn[2:], i, i % 200))
+    return ('\r\n'.join(lines) + '\r\n').encode('cp1251')
+
+
+def timed_import(data, dry_run):
+    event = {'httpMethod': 'POST', 'queryStringParameters': {'entity': 'members'}, 'headers': {'X-Auth-Token': erpdb.STAFF_TOKEN},
+             'body': json.dumps({'action': 'import', 'file': base64.b64encode(data).decode(), 'filename': 'members.csv', 'dry_run': dry_run})}
+    t = time.perf_counter()
+    resp = erpdb.api().handler(event, None)
+    ms = (time.perf_counter() - t) * 1000
+    assert resp['statusCode'] < 300, resp['body']
+    return ms, json.loads(resp['body'])
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    erpdb.build_template()
+    dsn = erpdb.create_database(BENCH_DB)
+    erpdb.use_database(dsn)
+    try:
+        conn = psycopg2.connect(dsn)
+        erpdb.add_staff(conn.cursor())
+        conn.commit()
+        conn.close()
+        data = csv_file(count)
+        print('строк: %s, файл %.1f МБ (base64 %.1f МБ)' % (count, len(data) / 2 ** 20, len(data) * 4 / 3 / 2 ** 20))
+
+        from members import read_import_rows
+        t = time.perf_counter()
+        parsed = sum(1 for _ in read_import_rows(data, 'csv'))
+        parse_ms = (time.perf_counter() - t) * 1000
+        tracemalloc.start()
+        for _ in read_import_rows(data, 'csv'):
+            pass
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print('разбор CSV: %s строк, %.0f ms, пик памяти %.1f МБ' % (parsed, parse_ms, peak / 2 ** 20))
+
+        for dry_run in (True, False):
+            ms, res = timed_import(data, dry_run)
+            print('%-10s %7.0f ms: всего %s, загружено %s, ошибок %s' % (
+                'dry_run' if dry_run else 'загрузка', ms, res['total'], res['imported'], res['error_count']))
+    finally:
+        erpdb.drop_database(BENCH_DB)
+        erpdb.drop_database(erpdb.TEMPLATE_DB)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""Копейки против Decimal: распределение платежей, графики займов и вкладов.
+Сравниваются быстрые функции schedules.py и сохранённые *_decimal на одних и тех же входах, лучшее из REPEAT прогонов.
+Запуск: python bench/bench_money.py (база не нужна)"""
+import os
+import random
+import sys
+import timeit
+from datetime import date, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend', 'api'))
+
+import schedules  # noqa: E402
+
+REPEAT = 9
+SD = date(2024, 1, 15)
+
+
+def make_loans(count=400, term=36):
+    r = random.Random(7)
+    loans = []
+    for _ in range(count):
+        rows = [(i, i + 1, SD + timedelta(days=30 * (i + 1)), Decimal(r.randint(100000, 900000)) / 100, Decimal(r.randint(1000, 90000)) / 100, Decimal('0'))
+                for i in range(term)]
+        pays = sorted([(k, SD + timedelta(days=30 * k + r.randint(-5, 5)), Decimal(r.randint(5000, 12000)), False, None, None, None) for k in range(1, term + 1)],
+                      key=lambda p: (p[1], p[0]))
+        loans.append((rows, pays))
+    return loans
+
+
+def best(fn):
+    return min(timeit.repeat(fn, number=1, repeat=REPEAT)) * 1000
+
+
+def main():
+    loans = make_loans()
+    txs = [(SD + timedelta(days=40 * k), Decimal('10000.00'), 'deposit') for k in range(8)]
+    rcs = [(SD + timedelta(days=200), Decimal('12.5'), Decimal('13.25'))]
+    cases = [
+        ('allocate_loan_payments, 400 займов × 36 платежей, со снимками', 'allocate_loan_payments',
+         lambda fn: [fn(rows, pays, None, []) for rows, pays in loans]),
+        ('calc_annuity_schedule × 1000, 60 мес.', 'calc_annuity_schedule',
+         lambda fn: [fn(1234567.89, 17.5, 60, SD) for _ in range(1000)]),
+        ('calc_savings_schedule_with_transactions × 500, 36 мес.', 'calc_savings_schedule_with_transactions',
+         lambda fn: [fn(500000.0, 12.5, 36, SD, 'end_of_term', txs, rcs) for _ in range(500)]),
+    ]
+    for title, name, run in cases:
+        fast, dec = getattr(schedules, name), getattr(schedules, name + '_decimal')
+        assert run(fast) == run(dec)
+        print('%-62s decimal %7.1f ms   копейки %7.1f ms' % (title, best(lambda: run(dec)), best(lambda: run(fast))))
+
+
+if __name__ == '__main__':
+    main()
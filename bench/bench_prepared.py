@@ -0,0 +1,93 @@
+"""PREPARE/EXECUTE против обычных запросов с параметрами: прогон крона и оплата займа (loans, action=payment).
+«До» — execute_prepared в api и кроне подменяется выполнением того же SQL из PREPARED без PREPARE.
+Заполненная база (erpdb.seed_portfolio) клонируется на каждый прогон, режимы чередуются, выводится медиана и минимум.
+Запуск: TEST_DATABASE_URL=... python bench/bench_prepared.py [масштаб] [прогонов]"""
+import importlib
+import os
+import re
+import statistics
+import sys
+import time
+from datetime import date
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests'))
+
+import erpdb  # noqa: E402
+
+BASE_DB = 'erp_bench_prepared'
+RUN_DB = 'erp_bench_prepared_run'
+PAYMENTS = 20
+
+
+def execute_inline(registry):
+    def execute(cur, name, *args):
+        sql = registry[name][1].replace('%', '%%')
+        cur.execute(re.sub(r'\$(\d+)', r'%(p\1)s', sql), {'p%d' % i: a for i, a in enumerate(args, 1)})
+    return execute
+
+
+def set_mode(mp, prepared):
+    """prepared=False: все модули, взявшие execute_prepared из core, и крон получают выполнение без PREPARE"""
+    import core
+    for name in ('cabinet', 'loans', 'schedules'):
+        importlib.import_module(name)
+    if prepared:
+        return
+    original = core.execute_prepared
+    for mod in list(sys.modules.values()):
+        if getattr(mod, 'execute_prepared', None) is original:
+            mp.setattr(mod, 'execute_prepared', execute_inline(core.PREPARED))
+    cron = erpdb.cron()
+    mp.setattr(cron, 'execute_prepared', execute_inline(cron.PREPARED))
+
+
+def run_cron():
+    status, res = erpdb.call_cron({'date': date.today().isoformat()})
+    assert status == 200 and res['outbox']['failed'] == 0, res
+    return res
+
+
+def run_payments(loan):
+    for _ in range(PAYMENTS):
+        status, res, _ = erpdb.call_api('POST', 'loans', body={
+            'action': 'payment', 'loan_id': loan['id'], 'payment_date': date.today().isoformat(), 'amount': 100})
+        assert status < 300, res
+
+
+def timed(prepared, fn, *args):
+    erpdb.use_database(erpdb.create_database(RUN_DB, template=BASE_DB))
+    with pytest.MonkeyPatch.context() as mp:
+        erpdb.cron_offline(mp)
+        set_mode(mp, prepared)
+        t = time.perf_counter()
+        fn(*args)
+        return (time.perf_counter() - t) * 1000
+
+
+def main():
+    scale = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 7
+    erpdb.build_template()
+    dsn = erpdb.create_database(BASE_DB)
+    erpdb.use_database(dsn)
+    seeded = erpdb.seed_portfolio(dsn, scale)
+    print('масштаб %s: %s' % (scale, seeded['volume']))
+    cases = [('крон, полный прогон', run_cron, ()),
+             ('loans payment × %s' % PAYMENTS, run_payments, (seeded['loan'],))]
+    try:
+        for title, fn, args in cases:
+            times = {False: [], True: []}
+            for _ in range(rounds):
+                for prepared in (False, True):
+                    times[prepared].append(timed(prepared, fn, *args))
+            print('%-28s без PREPARE: медиана %7.1f мин %7.1f ms   PREPARE/EXECUTE: медиана %7.1f мин %7.1f ms' % (
+                title, statistics.median(times[False]), min(times[False]), statistics.median(times[True]), min(times[True])))
+    finally:
+        for name in (RUN_DB, BASE_DB, erpdb.TEMPLATE_DB):
+            erpdb.drop_database(name)
+
+
+if __name__ == '__main__':
+    main()
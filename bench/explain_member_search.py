@@ -0,0 +1,123 @@
+"""Планы поиска пайщиков (GET entity=members, action=search) на 100 000 пайщиков: EXPLAIN (ANALYZE, BUFFERS) запросов,
+которые выполняет members.search_members (подстрока и, при недоборе, нечёткое совпадение), с триграммными индексами V0051
+и без них (индексы удаляются в транзакции и возвращаются откатом).
+Статистика собирается заново перед каждым запросом: план не должен зависеть от выборки ANALYZE.
+Пайщики синтетические: ФИО из частых фамилий, имён и отчеств, каждый десятый — организация; ИНН, телефон и паспорт у всех.
+Запуск: TEST_DATABASE_URL=... python bench/explain_member_search.py [пайщиков]"""
+import os
+import re
+import sys
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests'))
+
+import erpdb  # noqa: E402
+
+BENCH_DB = 'erp_bench_member_search'
+SEARCH_INDEXES = ('idx_members_search_name', 'idx_members_search_ids')
+QUERIES = [
+    'иванов',           # начало фамилии, частое
+    'иваноф',           # опечатка: только нечёткое совпадение слова
+    'ромашка',          # организация
+    'сергеевич',        # отчество: совпадает у каждого тридцатого
+    '7701',             # цифры ИНН или телефона
+    'п-054321',         # точный номер пайщика
+    'шварценеггер',     # нет совпадений
+    'алекс',            # начало многих имён и отчеств
+    'вич',              # три символа внутри почти каждого отчества
+    'ан',               # короче триграммы: только начало слова
+]
+
+LAST = ['Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров', 'Соколов', 'Михайлов', 'Новиков', 'Фёдоров',
+        'Морозов', 'Волков', 'Алексеев', 'Лебедев', 'Семёнов', 'Егоров', 'Павлов', 'Козлов', 'Степанов', 'Николаев',
+        'Орлов', 'Андреев', 'Макаров', 'Никитин', 'Захаров', 'Зайцев', 'Соловьёв', 'Борисов', 'Яковлев', 'Григорьев',
+        'Романов', 'Воробьёв', 'Сергеев', 'Кузьмин', 'Фролов', 'Александров', 'Дмитриев', 'Королёв', 'Гусев', 'Киселёв']
+FIRST = ['Александр', 'Сергей', 'Дмитрий', 'Андрей', 'Алексей', 'Максим', 'Евгений', 'Иван', 'Михаил', 'Артём',
+         'Николай', 'Владимир', 'Павел', 'Роман', 'Игорь', 'Олег', 'Виктор', 'Юрий', 'Денис', 'Антон',
+         'Илья', 'Кирилл', 'Константин', 'Тимур', 'Вадим', 'Григорий', 'Фёдор', 'Борис', 'Степан', 'Глеб']
+MIDDLE = ['Александрович', 'Сергеевич', 'Дмитриевич', 'Андреевич', 'Алексеевич', 'Максимович', 'Евгеньевич', 'Иванович',
+          'Михайлович', 'Николаевич', 'Владимирович', 'Павлович', 'Романович', 'Игоревич', 'Олегович', 'Викторович',
+          'Юрьевич', 'Денисович', 'Антонович', 'Ильич', 'Кириллович', 'Константинович', 'Тимурович', 'Вадимович',
+          'Григорьевич', 'Фёдорович', 'Борисович', 'Степанович', 'Глебович', 'Петрович']
+COMPANY = ['Ромашка', 'Вектор', 'Альфа', 'Горизонт', 'Меридиан', 'Север', 'Урожай', 'Стройресурс', 'Техноком', 'Импульс']
+
+
+def seed(cur, count):
+    def arr(words):
+        return 'ARRAY[%s]' % ', '.join("'%s'" % w for w in words)
+    cur.execute("""
+        INSERT INTO members (member_no, member_type, last_name, first_name, middle_name, company_name, inn, phone,
+                             passport_series, passport_number, status)
+        SELECT 'П-' || lpad(g::text, 6, '0'),
+               CASE WHEN g %% 10 = 0 THEN 'UL' ELSE 'FL' END,
+               CASE WHEN g %% 10 <> 0 THEN (%(last)s)[1 + g %% %(nl)s] END,
+               CASE WHEN g %% 10 <> 0 THEN (%(first)s)[1 + (g / 7) %% %(nf)s] END,
+               CASE WHEN g %% 10 <> 0 THEN (%(middle)s)[1 + (g / 11) %% %(nm)s] END,
+               CASE WHEN g %% 10 = 0 THEN 'ООО «' || (%(company)s)[1 + (g / 10) %% %(nc)s] || '-' || g || '»' END,
+               lpad(((g::bigint * 104729 + 7700000000) %% 1000000000000)::text, 12, '0'),
+               '+7 (9' || lpad(((g * 7907) %% 100)::text, 2, '0') || ') ' || lpad(((g::bigint * 15485863) %% 10000000)::text, 7, '0'),
+               lpad(((g * 31) %% 10000)::text, 4, '0'),
+               lpad(((g::bigint * 7919) %% 1000000)::text, 6, '0'),
+               'active'
+        FROM generate_series(1, %(count)s) g
+    """ % {'last': arr(LAST), 'nl': len(LAST), 'first': arr(FIRST), 'nf': len(FIRST), 'middle': arr(MIDDLE), 'nm': len(MIDDLE),
+           'company': arr(COMPANY), 'nc': len(COMPANY), 'count': count})
+    cur.execute("ANALYZE members")
+
+
+class RecordingCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        self.queries.append(query)
+        return super().execute(query, vars)
+
+
+def search_sql(conn, q):
+    """Запросы, которые выполняет search_members для q, и число найденных"""
+    from members import search_members
+
+    cur = conn.cursor(cursor_factory=RecordingCursor)
+    cur.queries = []
+    rows = search_members(cur, {'q': q, 'limit': '10'})
+    return cur.queries, len(rows)
+
+
+def explain(cur, sql):
+    cur.execute(sql)  # прогрев кэша
+    cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql)
+    return [r[0] for r in cur.fetchall()]
+
+
+def execution_ms(plan):
+    return float(re.search(r'Execution Time: ([\d.]+)', plan[-1]).group(1))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    erpdb.build_template()
+    dsn = erpdb.create_database(BENCH_DB)
+    conn = psycopg2.connect(dsn)
+    try:
+        cur = conn.cursor()
+        seed(cur, count)
+        conn.commit()
+        print('пайщиков: %s' % count)
+        for q in QUERIES:
+            cur.execute("ANALYZE members")
+            queries, found = search_sql(conn, q)
+            with_indexes = [explain(cur, sql) for sql in queries]
+            cur.execute("DROP INDEX %s" % ', '.join(SEARCH_INDEXES))
+            without = [explain(cur, sql) for sql in queries]
+            conn.rollback()
+            print('\n== q=%r, найдено %s, запросов %s: с индексами %.1f ms, без индексов %.1f ms' % (
+                q, found, len(queries), sum(map(execution_ms, with_indexes)), sum(map(execution_ms, without))))
+            for plan in with_indexes:
+                print('\n'.join(plan))
+    finally:
+        conn.close()
+        erpdb.drop_database(BENCH_DB)
+        erpdb.drop_database(erpdb.TEMPLATE_DB)
+
+
+if __name__ == '__main__':
+    main()
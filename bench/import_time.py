@@ -0,0 +1,76 @@
+"""Холодный старт функции api: время import index и первого импорта модуля сущности (entity_module) в свежем процессе.
+«До» — backend/api из коммита перед появлением core.py (единый index.py), «после» — рабочее дерево.
+Каждый прогон — отдельный процесс на свежей копии каталога: без __pycache__ (как после деплоя) и после compileall.
+Нужны зависимости функции (psycopg2). Запуск: python bench/import_time.py [прогонов]"""
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+from io import BytesIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_DIR = os.path.join(ROOT, 'backend', 'api')
+
+PROBE = """
+import sys, time
+t = time.perf_counter()
+import index
+t_index = time.perf_counter() - t
+entity = sys.argv[1]
+t = time.perf_counter()
+if entity != '-':
+    index.entity_module(entity)
+print(t_index * 1000, (time.perf_counter() - t) * 1000)
+"""
+
+
+def before_tree(dest):
+    """backend/api на родителе коммита, добавившего core.py"""
+    added = subprocess.check_output(['git', 'log', '--diff-filter=A', '--format=%H', '--', 'backend/api/core.py'], cwd=ROOT, text=True).split()[-1]
+    archive = subprocess.check_output(['git', 'archive', added + '^', 'backend/api'], cwd=ROOT)
+    with tarfile.open(fileobj=BytesIO(archive)) as tar:
+        tar.extractall(dest)
+    return os.path.join(dest, 'backend', 'api')
+
+
+def probe(src, entity, compiled):
+    """(мс на import index, мс на первый entity_module) в новом процессе на свежей копии src"""
+    with tempfile.TemporaryDirectory() as tmp:
+        work = os.path.join(tmp, 'api')
+        shutil.copytree(src, work, ignore=shutil.ignore_patterns('__pycache__'))
+        if compiled:
+            subprocess.check_call([sys.executable, '-m', 'compileall', '-q', work])
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [work, os.environ.get('PYTHONPATH')])))
+        # -B не даёт процессу записать __pycache__, уже скомпилированные файлы читаются
+        out = subprocess.check_output([sys.executable, '-B', '-c', PROBE, entity], cwd=work, env=env, text=True)
+        return tuple(float(x) for x in out.split())
+
+
+def median_ms(src, entity, compiled, runs):
+    samples = [probe(src, entity, compiled) for _ in range(runs)]
+    return statistics.median(s[0] for s in samples), statistics.median(s[1] for s in samples)
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 7
+    with open(os.path.join(API_DIR, 'index.py'), encoding='utf-8') as f:
+        entities = sorted(set(re.findall(r"entity_module\('(\w+)'\)", f.read())))
+    with tempfile.TemporaryDirectory() as tmp:
+        old_dir = before_tree(tmp)
+        for compiled in (False, True):
+            print('== %s' % ('после compileall' if compiled else 'без __pycache__'))
+            old_index, _ = median_ms(old_dir, '-', compiled, runs)
+            new_index, _ = median_ms(API_DIR, '-', compiled, runs)
+            print('import index: до %6.1f ms, после %6.1f ms' % (old_index, new_index))
+            for entity in entities:
+                index_ms, entity_ms = median_ms(API_DIR, entity, compiled, runs)
+                print('  первый запрос к %-14s index %5.1f + модуль %5.1f = %6.1f ms (до: %6.1f ms)' % (
+                    entity, index_ms, entity_ms, index_ms + entity_ms, old_index))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,13 @@
+ALTER TABLE savings ADD COLUMN IF NOT EXISTS accrual_total NUMERIC NOT NULL DEFAULT 0;
+ALTER TABLE savings ADD COLUMN IF NOT EXISTS accrual_days INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE savings ADD COLUMN IF NOT EXISTS accrual_first_date DATE NULL;
+ALTER TABLE savings ADD COLUMN IF NOT EXISTS accrual_last_date DATE NULL;
+
+UPDATE savings s SET accrual_total = a.total, accrual_days = a.cnt, accrual_first_date = a.first_date, accrual_last_date = a.last_date
+FROM (
+    SELECT saving_id, SUM(daily_amount) AS total, COUNT(*) AS cnt, MIN(accrual_date) AS first_date, MAX(accrual_date) AS last_date
+    FROM savings_daily_accruals GROUP BY saving_id
+) a
+WHERE s.id = a.saving_id;
+
+CREATE INDEX IF NOT EXISTS idx_loan_schedule_open ON loan_schedule(loan_id, payment_no) INCLUDE (payment_date) WHERE status IN ('pending', 'overdue');
@@ -0,0 +1,47 @@
+-- Журнал аудита секционируется по месяцам: старые месяцы отключаются без перезаписи таблицы
+-- ALTER TABLE audit_log DETACH PARTITION audit_log_YYYYMM;
+-- Секции на текущий и следующий месяц создаёт ежедневный крон (ensure_audit_partitions).
+
+ALTER TABLE audit_log RENAME TO audit_log_old;
+ALTER TABLE audit_log_old RENAME CONSTRAINT audit_log_pkey TO audit_log_old_pkey;
+
+CREATE TABLE audit_log (
+    id INTEGER NOT NULL DEFAULT nextval('audit_log_id_seq'),
+    user_id INTEGER,
+    user_name VARCHAR(255),
+    user_role VARCHAR(50),
+    action VARCHAR(50) NOT NULL,
+    entity VARCHAR(50) NOT NULL,
+    entity_id INTEGER,
+    entity_label VARCHAR(255),
+    details TEXT,
+    ip VARCHAR(45),
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (created_at, id)
+) PARTITION BY RANGE (created_at);
+
+CREATE TABLE audit_log_default PARTITION OF audit_log DEFAULT;
+
+DO $$
+DECLARE
+    m DATE;
+    last_m DATE := (date_trunc('month', NOW()) + INTERVAL '1 month')::date;
+BEGIN
+    m := COALESCE((SELECT date_trunc('month', MIN(created_at))::date FROM audit_log_old), date_trunc('month', NOW())::date);
+    WHILE m <= last_m LOOP
+        EXECUTE format('CREATE TABLE IF NOT EXISTS audit_log_%s PARTITION OF audit_log FOR VALUES FROM (%L) TO (%L)',
+                       to_char(m, 'YYYYMM'), m, (m + INTERVAL '1 month')::date);
+        m := (m + INTERVAL '1 month')::date;
+    END LOOP;
+END $$;
+
+INSERT INTO audit_log (id, user_id, user_name, user_role, action, entity, entity_id, entity_label, details, ip, created_at)
+SELECT id, user_id, user_name, user_role, action, entity, entity_id, entity_label, details, ip, created_at FROM audit_log_old;
+
+ALTER SEQUENCE audit_log_id_seq OWNED BY audit_log.id;
+DROP TABLE audit_log_old;
+
+CREATE INDEX idx_audit_log_entity ON audit_log(entity, entity_id);
+CREATE INDEX idx_audit_log_user ON audit_log(user_id);
+CREATE INDEX idx_audit_log_entity_keyset ON audit_log(entity, created_at DESC, id DESC);
+CREATE INDEX idx_audit_log_action_keyset ON audit_log(action, created_at DESC, id DESC);
@@ -0,0 +1,23 @@
+CREATE TABLE IF NOT EXISTS number_counters (
+    scheme VARCHAR(50) NOT NULL,
+    scope_id INTEGER NOT NULL DEFAULT 0,
+    last_value BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (scheme, scope_id)
+);
+
+INSERT INTO number_counters (scheme, scope_id, last_value)
+SELECT 'member', 0, GREATEST(
+    COALESCE((SELECT MAX(id) FROM members), 0),
+    COALESCE((SELECT MAX(CAST(SUBSTRING(member_no FROM '[0-9]+$') AS BIGINT)) FROM members WHERE member_no ~ '[0-9]+$'), 0))
+ON CONFLICT (scheme, scope_id) DO NOTHING;
+
+INSERT INTO number_counters (scheme, scope_id, last_value)
+SELECT 'saving_contract', 0, COALESCE((SELECT MAX(CAST(SUBSTRING(contract_no FROM '^[0-9]+') AS BIGINT)) FROM savings WHERE contract_no ~ '^[0-9]+'), 0)
+ON CONFLICT (scheme, scope_id) DO NOTHING;
+
+INSERT INTO number_counters (scheme, scope_id, last_value)
+SELECT 'share_account', 0, GREATEST(
+    COALESCE((SELECT MAX(id) FROM share_accounts), 0),
+    COALESCE((SELECT MAX(CAST(SUBSTRING(account_no FROM '[0-9]+$') AS BIGINT)) FROM share_accounts WHERE account_no ~ '[0-9]+$'), 0))
+ON CONFLICT (scheme, scope_id) DO NOTHING;
@@ -0,0 +1,15 @@
+CREATE TABLE IF NOT EXISTS batch_jobs (
+    id SERIAL PRIMARY KEY,
+    kind VARCHAR(50) NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'running',
+    total INTEGER NOT NULL DEFAULT 0,
+    processed INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    result JSONB NULL,
+    started_by INTEGER NULL,
+    started_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    finished_at TIMESTAMP NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_batch_jobs_kind ON batch_jobs(kind, started_at DESC);
@@ -0,0 +1 @@
+ALTER TABLE client_sessions ADD COLUMN IF NOT EXISTS last_write_at TIMESTAMP NULL;
@@ -0,0 +1,12 @@
+CREATE TABLE IF NOT EXISTS loan_balance_snapshots (
+    loan_id INTEGER NOT NULL REFERENCES loans(id),
+    payment_id INTEGER NOT NULL,
+    payment_date DATE NOT NULL,
+    principal_paid NUMERIC(15,2) NOT NULL DEFAULT 0,
+    row_states JSONB NOT NULL DEFAULT '{}',
+    schedule_hash VARCHAR(32) NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (loan_id, payment_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_loan_balance_snapshots_pos ON loan_balance_snapshots(loan_id, payment_date DESC, payment_id DESC);
@@ -0,0 +1,8 @@
+CREATE TABLE IF NOT EXISTS dadata_cache (
+    cache_key VARCHAR(600) PRIMARY KEY,
+    response JSONB NOT NULL,
+    expires_at TIMESTAMP NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_dadata_cache_expires ON dadata_cache(expires_at);
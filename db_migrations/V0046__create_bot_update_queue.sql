@@ -0,0 +1,23 @@
+CREATE TABLE IF NOT EXISTS bot_updates (
+    platform VARCHAR(20) NOT NULL,
+    update_key VARCHAR(200) NOT NULL,
+    payload JSONB NULL,
+    received_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (platform, update_key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_bot_updates_received ON bot_updates(received_at);
+
+CREATE TABLE IF NOT EXISTS bot_replies (
+    id SERIAL PRIMARY KEY,
+    platform VARCHAR(20) NOT NULL,
+    chat_id BIGINT NOT NULL,
+    text TEXT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    sent_at TIMESTAMP NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_bot_replies_pending ON bot_replies(id) WHERE status = 'pending';
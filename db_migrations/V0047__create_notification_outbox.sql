@@ -0,0 +1,24 @@
+CREATE TABLE IF NOT EXISTS notification_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    channel VARCHAR(20) NOT NULL,
+    recipient VARCHAR(500) NOT NULL,
+    user_id INTEGER NULL,
+    payload JSONB NOT NULL,
+    source VARCHAR(30) NOT NULL,
+    source_id INTEGER NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    last_error TEXT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    sent_at TIMESTAMP NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_notification_outbox_due ON notification_outbox(next_attempt_at, id) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_notification_outbox_source ON notification_outbox(source, source_id);
+
+INSERT INTO notification_outbox (channel, recipient, payload, source, attempts, last_error, created_at)
+SELECT platform, chat_id::text, jsonb_build_object('text', text), 'bot_reply', attempts, last_error, created_at
+FROM bot_replies WHERE status = 'pending';
+
+DROP TABLE IF EXISTS bot_replies;
@@ -0,0 +1,51 @@
+CREATE TABLE IF NOT EXISTS reminder_ledger (
+    reminder_date DATE NOT NULL,
+    channel VARCHAR(20) NOT NULL,
+    ref_kind VARCHAR(10) NOT NULL,
+    ref_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    reminder_type VARCHAR(30) NOT NULL,
+    loan_id INTEGER NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (reminder_date, channel, ref_kind, ref_id, user_id, reminder_type)
+);
+
+INSERT INTO reminder_ledger (reminder_date, channel, ref_kind, ref_id, user_id, reminder_type, loan_id, created_at)
+SELECT ls.payment_date, 'push', 'schedule', a.schedule_id, a.user_id, a.reminder_type, a.loan_id, COALESCE(a.sent_at, NOW())
+FROM push_auto_log a JOIN loan_schedule ls ON ls.id = a.schedule_id
+WHERE a.schedule_id <> 0
+ON CONFLICT DO NOTHING;
+
+INSERT INTO reminder_ledger (reminder_date, channel, ref_kind, ref_id, user_id, reminder_type, created_at)
+SELECT s.end_date, 'push', 'saving', a.loan_id, a.user_id, a.reminder_type, COALESCE(a.sent_at, NOW())
+FROM push_auto_log a JOIN savings s ON s.id = a.loan_id
+WHERE a.schedule_id = 0 AND s.end_date IS NOT NULL
+ON CONFLICT DO NOTHING;
+
+INSERT INTO reminder_ledger (reminder_date, channel, ref_kind, ref_id, user_id, reminder_type, loan_id, created_at)
+SELECT ls.payment_date, 'telegram', 'schedule', a.schedule_id, a.user_id, a.reminder_type, a.loan_id, COALESCE(a.sent_at, NOW())
+FROM telegram_auto_log a JOIN loan_schedule ls ON ls.id = a.schedule_id
+WHERE a.schedule_id <> 0
+ON CONFLICT DO NOTHING;
+
+INSERT INTO reminder_ledger (reminder_date, channel, ref_kind, ref_id, user_id, reminder_type, created_at)
+SELECT s.end_date, 'telegram', 'saving', a.loan_id, a.user_id, a.reminder_type, COALESCE(a.sent_at, NOW())
+FROM telegram_auto_log a JOIN savings s ON s.id = a.loan_id
+WHERE a.schedule_id = 0 AND s.end_date IS NOT NULL
+ON CONFLICT DO NOTHING;
+
+INSERT INTO reminder_ledger (reminder_date, channel, ref_kind, ref_id, user_id, reminder_type, loan_id, created_at)
+SELECT ls.payment_date, 'max', 'schedule', a.schedule_id, a.user_id, a.reminder_type, a.loan_id, COALESCE(a.sent_at, NOW())
+FROM max_auto_log a JOIN loan_schedule ls ON ls.id = a.schedule_id
+WHERE a.schedule_id <> 0
+ON CONFLICT DO NOTHING;
+
+INSERT INTO reminder_ledger (reminder_date, channel, ref_kind, ref_id, user_id, reminder_type, created_at)
+SELECT s.end_date, 'max', 'saving', a.loan_id, a.user_id, a.reminder_type, COALESCE(a.sent_at, NOW())
+FROM max_auto_log a JOIN savings s ON s.id = a.loan_id
+WHERE a.schedule_id = 0 AND s.end_date IS NOT NULL
+ON CONFLICT DO NOTHING;
+
+DROP TABLE IF EXISTS push_auto_log;
+DROP TABLE IF EXISTS telegram_auto_log;
+DROP TABLE IF EXISTS max_auto_log;
@@ -0,0 +1,10 @@
+CREATE TABLE IF NOT EXISTS arrears_aging_snapshots (
+    snapshot_date DATE NOT NULL,
+    org_id INTEGER NOT NULL DEFAULT 0,
+    bucket VARCHAR(10) NOT NULL,
+    loans_count INTEGER NOT NULL DEFAULT 0,
+    balance NUMERIC(15,2) NOT NULL DEFAULT 0,
+    overdue_amount NUMERIC(15,2) NOT NULL DEFAULT 0,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (snapshot_date, org_id, bucket)
+);
@@ -0,0 +1,20 @@
+-- Счётчики пайщика для списков и выгрузки: пересчитываются при commit записи по займам, сбережениям и паевым счетам
+-- и кроном при смене статусов просрочки. Полный пересчёт — POST entity=members, action=rebuild_stats.
+CREATE TABLE IF NOT EXISTS member_stats (
+    member_id INTEGER PRIMARY KEY REFERENCES members(id) ON DELETE CASCADE,
+    active_loans INTEGER NOT NULL DEFAULT 0,
+    overdue_loans INTEGER NOT NULL DEFAULT 0,
+    active_savings INTEGER NOT NULL DEFAULT 0,
+    share_balance NUMERIC(15,2) NOT NULL DEFAULT 0,
+    total_debt NUMERIC(15,2) NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+INSERT INTO member_stats (member_id, active_loans, overdue_loans, active_savings, share_balance, total_debt)
+SELECT m.id, l.active_loans, l.overdue_loans, s.active_savings, sa.share_balance, l.total_debt
+FROM members m
+CROSS JOIN LATERAL (SELECT COUNT(*) AS active_loans, COUNT(*) FILTER (WHERE status = 'overdue') AS overdue_loans, COALESCE(SUM(balance), 0) AS total_debt
+                    FROM loans WHERE member_id = m.id AND status != 'closed') l
+CROSS JOIN LATERAL (SELECT COUNT(*) AS active_savings FROM savings WHERE member_id = m.id AND status = 'active') s
+CROSS JOIN LATERAL (SELECT COALESCE(SUM(balance), 0) AS share_balance FROM share_accounts WHERE member_id = m.id AND status = 'active') sa
+ON CONFLICT (member_id) DO NOTHING;
@@ -0,0 +1,15 @@
+-- Поиск пайщиков (GET entity=members, action=search): триграммные GIN-индексы по выражениям из backend/api/members.py.
+-- Выражения в запросе должны совпадать с индексными, иначе планировщик индекс не возьмёт.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- ФИО и наименование организации в нижнем регистре
+CREATE INDEX IF NOT EXISTS idx_members_search_name ON members USING gin (
+    lower(COALESCE(last_name, '') || ' ' || COALESCE(first_name, '') || ' ' || COALESCE(middle_name, '') || ' ' || COALESCE(company_name, '')) gin_trgm_ops
+);
+
+-- Цифры номера пайщика, ИНН, телефона и паспорта; поля разделены пробелом, чтобы совпадение не шло через границу
+CREATE INDEX IF NOT EXISTS idx_members_search_ids ON members USING gin (
+    (regexp_replace(COALESCE(member_no, ''), '\D', '', 'g') || ' ' || COALESCE(inn, '') || ' ' ||
+     regexp_replace(COALESCE(phone, ''), '\D', '', 'g') || ' ' ||
+     regexp_replace(COALESCE(passport_series, '') || COALESCE(passport_number, ''), '\D', '', 'g')) gin_trgm_ops
+);
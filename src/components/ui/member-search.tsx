@@ -1,7 +1,7 @@
 import { useState, useRef, useEffect } from "react";
 import { Input } from "@/components/ui/input";
 import Icon from "@/components/ui/icon";
-import { Member } from "@/lib/api";
+import { Member, api } from "@/lib/api";
 
 interface MemberSearchProps {
   members: Member[];
@@ -13,9 +13,24 @@ interface MemberSearchProps {
 const MemberSearch = ({ members, value, onChange, placeholder = "Начните вводить ФИО или номер..." }: MemberSearchProps) => {
   const [query, setQuery] = useState("");
   const [open, setOpen] = useState(false);
+  const [found, setFound] = useState<Member[] | null>(null);
+  const [picked, setPicked] = useState<Member | null>(null);
   const ref = useRef<HTMLDivElement>(null);
 
-  const selected = members.find(m => String(m.id) === value);
+  const selected = members.find(m => String(m.id) === value) || (picked && String(picked.id) === value ? picked : undefined);
+
+  useEffect(() => {
+    const q = query.trim();
+    if (q.length < 2) {
+      setFound(null);
+      return;
+    }
+    let cancelled = false;
+    const timer = setTimeout(() => {
+      api.members.search(q, 10).then(rows => { if (!cancelled) setFound(rows); }).catch(() => { if (!cancelled) setFound(null); });
+    }, 200);
+    return () => { cancelled = true; clearTimeout(timer); };
+  }, [query]);
 
   useEffect(() => {
     if (selected) setQuery("");
@@ -30,7 +45,7 @@ const MemberSearch = ({ members, value, onChange, placeholder = "Начните
   }, []);
 
   const filtered = query.length > 0
-    ? members.filter(m =>
+    ? found ?? members.filter(m =>
         m.name.toLowerCase().includes(query.toLowerCase()) ||
         m.member_no.toLowerCase().includes(query.toLowerCase()) ||
         m.inn?.toLowerCase().includes(query.toLowerCase()) ||
@@ -76,7 +91,7 @@ const MemberSearch = ({ members, value, onChange, placeholder = "Начните
                 key={m.id}
                 type="button"
                 className="w-full flex items-center gap-2 px-3 py-2 text-left hover:bg-accent transition-colors"
-                onClick={() => { onChange(String(m.id), m.name); setOpen(false); setQuery(""); }}
+                onClick={() => { setPicked(m); onChange(String(m.id), m.name); setOpen(false); setQuery(""); }}
               >
                 <Icon name={m.member_type === "FL" ? "User" : "Building2"} size={14} className="text-muted-foreground shrink-0" />
                 <div className="flex-1 min-w-0">
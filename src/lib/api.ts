@@ -37,9 +37,13 @@ export const api = {
   members: {
     list: () => request<Member[]>("GET", { entity: "members" }),
     get: (id: number) => request<MemberDetail>("GET", { entity: "members", id }),
+    search: (q: string, limit = 10) => request<Member[]>("GET", { entity: "members", action: "search", q, limit }),
     create: (data: Partial<MemberDetail>) => request<{ id: number; member_no: string }>("POST", undefined, { entity: "members", ...data }),
     update: (data: Partial<MemberDetail>) => request<{ success: boolean }>("PUT", { entity: "members" }, { entity: "members", ...data }),
     delete: (memberId: number) => request<{ success: boolean }>("DELETE", { entity: "members", id: memberId }),
+    import: (file: string, filename: string, dryRun?: boolean) =>
+      request<MemberImportResult>("POST", undefined, { entity: "members", action: "import", file, filename, dry_run: dryRun }),
+    rebuildStats: () => request<{ success: boolean; rebuilt: number }>("POST", undefined, { entity: "members", action: "rebuild_stats" }),
   },
 
   loans: {
@@ -54,6 +58,11 @@ export const api = {
       request<PaymentResult>("POST", undefined, { entity: "loans", action: "payment", ...data }),
     earlyRepayment: (data: { loan_id: number; amount: number; repayment_type: string; payment_date: string }) =>
       request<unknown>("POST", undefined, { entity: "loans", action: "early_repayment", ...data }),
+    simulateRepayment: (loanId: number, amounts: number[], dates?: string[], strategies?: string[], schedules = true) =>
+      request<RepaymentSimulation>("GET", {
+        entity: "loans", action: "simulate_repayment", id: loanId, amounts: amounts.join(","),
+        dates: dates?.join(","), strategies: strategies?.join(","), schedules: schedules ? undefined : "0",
+      }),
     modify: (data: { loan_id: number; new_rate?: number; new_term?: number; new_amount?: number; effective_date?: string }) =>
       request<{ success: boolean; new_schedule: ScheduleItem[]; monthly_payment: number; new_balance: number }>("POST", undefined, { entity: "loans", action: "modify", ...data }),
     updateLoan: (data: { loan_id: number; contract_no?: string; member_id?: number; amount?: number; rate?: number; term_months?: number; schedule_type?: string; start_date?: string; org_id?: number | null }) =>
@@ -76,6 +85,8 @@ export const api = {
       request<{ success: boolean }>("POST", undefined, { entity: "loans", action: "recalc_statuses", loan_id: loanId }),
     reconciliationReport: (loanId: number) =>
       request<ReconciliationReport>("GET", { entity: "loans", action: "reconciliation_report", id: loanId }),
+    reconcileAll: (apply = false) =>
+      request<PortfolioReconcileResult>("POST", undefined, { entity: "loans", action: "reconcile_all", apply }),
   },
 
   savings: {
@@ -115,8 +126,24 @@ export const api = {
       request<{ success: boolean }>("POST", undefined, { entity: "savings", action: "delete_accrual", accrual_id: accrualId }),
     clearDailyAccruals: (savingId: number) =>
       request<{ success: boolean; cleared_amount: number }>("POST", undefined, { entity: "savings", action: "clear_daily_accruals", saving_id: savingId }),
+    batchChangeRate: (data: { new_rate: number; effective_date?: string; reason?: string; org_id?: number; rate?: number; term_months?: number; start_from?: string; start_to?: string; dry_run?: boolean }) =>
+      request<BatchRateChangeResult>("POST", undefined, { entity: "savings", action: "batch_change_rate", ...data }),
     recalcAllActive: () =>
-      request<{ success: boolean; recalculated: number; total: number; errors: { contract_no: string; error: string }[] }>("POST", undefined, { entity: "savings", action: "recalc_all_active" }),
+      request<{ success: boolean; job_id: number; recalculated: number; total: number; errors: { contract_no: string; error: string }[] }>("POST", undefined, { entity: "savings", action: "recalc_all_active" }),
+  },
+
+  reports: {
+    forecast: (params?: { months?: number; group?: "month" | "week"; org_id?: number; by_org?: boolean; default_rate?: number; prepay_rate?: number }) =>
+      request<CashFlowForecast>("GET", { entity: "reports", action: "forecast", ...params }),
+    aging: (params?: { date?: string; org_id?: number }) =>
+      request<ArrearsAging>("GET", { entity: "reports", action: "aging", ...params }),
+    agingHistory: (params?: { date_from?: string; date_to?: string; org_id?: number }) =>
+      request<{ date_from: string; date_to: string; items: (ArrearsAgingSummary & { date: string })[] }>("GET", { entity: "reports", action: "aging_history", ...params }),
+  },
+
+  jobs: {
+    get: (id: number) => request<BatchJob>("GET", { entity: "jobs", id }),
+    list: (kind?: string) => request<BatchJob[]>("GET", { entity: "jobs", ...(kind ? { kind } : {}) }),
   },
 
   shares: {
@@ -231,7 +258,7 @@ export const api = {
   },
 
   audit: {
-    list: (params?: { limit?: number; offset?: number; filter_entity?: string; filter_action?: string }) =>
+    list: (params?: { limit?: number; offset?: number; cursor?: string; filter_entity?: string; filter_action?: string }) =>
       request<AuditListResult>("GET", { entity: "audit", ...params }),
   },
 
@@ -253,7 +280,7 @@ export const api = {
     messages: (limit?: number, offset?: number) =>
       request<{ items: PushMessage[]; total: number }>("GET", { entity: "push", action: "messages", limit, offset }),
     send: (data: { title: string; body: string; url?: string; target?: string; target_user_ids?: number[] }) =>
-      request<{ success: boolean; message_id: number; sent: number; failed: number }>("POST", undefined, { entity: "push", action: "send", ...data }),
+      request<{ success: boolean; message_id: number; queued: number }>("POST", undefined, { entity: "push", action: "send", ...data }),
     messageLog: (id: number) => request<PushMessageLogEntry[]>("GET", { entity: "push", action: "message_log", id }),
     myMessages: (token: string) => request<PushClientMessage[]>("POST", undefined, { entity: "push", action: "my_messages", token }),
     getSettings: () => request<PushSettings>("GET", { entity: "push", action: "get_settings" }),
@@ -266,9 +293,9 @@ export const api = {
       request<{ success: boolean }>("POST", undefined, { entity: "notifications", action: "save_channel", channel, enabled, settings }),
     telegramSubscribers: () => request<TelegramSubscriber[]>("GET", { entity: "notifications", action: "telegram_subscribers" }),
     sendTelegram: (data: { title?: string; body: string; target?: string; target_user_ids?: number[] }) =>
-      request<{ success: boolean; notification_id: number; sent: number; failed: number }>("POST", undefined, { entity: "notifications", action: "send_telegram", ...data }),
+      request<{ success: boolean; notification_id: number; queued: number }>("POST", undefined, { entity: "notifications", action: "send_telegram", ...data }),
     sendEmail: (data: { title: string; body: string; target?: string; target_user_ids?: number[] }) =>
-      request<{ success: boolean; notification_id: number; sent: number; failed: number }>("POST", undefined, { entity: "notifications", action: "send_email", ...data }),
+      request<{ success: boolean; notification_id: number; queued: number }>("POST", undefined, { entity: "notifications", action: "send_email", ...data }),
     history: (channel?: string, limit?: number, offset?: number) =>
       request<{ items: NotificationHistoryItem[]; total: number }>("GET", { entity: "notifications", action: "history", channel, limit, offset }),
     historyLog: (id: number) => request<NotificationLogEntry[]>("GET", { entity: "notifications", action: "history_log", id }),
@@ -282,7 +309,7 @@ export const api = {
     saveTelegramSettings: (settings: Record<string, string>) => request<{ success: boolean }>("POST", undefined, { entity: "notifications", action: "save_telegram_settings", settings }),
     maxSubscribers: () => request<TelegramSubscriber[]>("GET", { entity: "notifications", action: "max_subscribers" }),
     sendMax: (data: { title?: string; body: string; target?: string; target_user_ids?: number[] }) =>
-      request<{ success: boolean; notification_id: number; sent: number; failed: number }>("POST", undefined, { entity: "notifications", action: "send_max", ...data }),
+      request<{ success: boolean; notification_id: number; queued: number }>("POST", undefined, { entity: "notifications", action: "send_max", ...data }),
     testMax: (chat_id: string) => request<{ success: boolean }>("POST", undefined, { entity: "notifications", action: "test_max", chat_id }),
     setMaxWebhook: (webhookUrl?: string) => request<{ success: boolean; webhook_url: string }>("POST", undefined, { entity: "notifications", action: "set_max_webhook", webhook_url: webhookUrl }),
     deleteMaxWebhook: () => request<{ success: boolean }>("POST", undefined, { entity: "notifications", action: "delete_max_webhook" }),
@@ -395,6 +422,9 @@ export interface Member {
   created_at: string;
   active_loans: number;
   active_savings: number;
+  overdue_loans: number;
+  share_balance: number;
+  total_debt: number;
 }
 
 export interface MemberDetail {
@@ -511,6 +541,32 @@ export interface PaymentResult {
   options?: Record<string, OverpayOption>;
 }
 
+export interface RepaymentScenario {
+  amount: number;
+  payment_date: string;
+  strategy: "reduce_term" | "reduce_payment";
+  closes_loan: boolean;
+  new_balance: number;
+  new_term: number;
+  new_monthly: number;
+  end_date: string;
+  total_interest: number;
+  total_payments: number;
+  interest_saved: number;
+  schedule?: ScheduleItem[];
+}
+
+export interface RepaymentSimulation {
+  loan_id: number;
+  balance: number;
+  rate: number;
+  schedule_type: string;
+  monthly_payment: number;
+  remaining_periods: number;
+  remaining_interest: number;
+  scenarios: RepaymentScenario[];
+}
+
 export interface Saving {
   id: number;
   contract_no: string;
@@ -756,6 +812,105 @@ export interface ReconciliationReport {
   };
 }
 
+export interface BatchJob {
+  id: number;
+  kind: string;
+  status: "running" | "done" | "failed";
+  total: number;
+  processed: number;
+  failed: number;
+  result?: Record<string, unknown> | null;
+  started_by: number | null;
+  started_at: string;
+  updated_at: string;
+  finished_at: string | null;
+}
+
+export interface PortfolioReconcileResult {
+  success: boolean;
+  job_id: number;
+  applied: boolean;
+  total: number;
+  with_discrepancies: number;
+  repaired: number;
+  errors: { contract_no: string; error: string }[];
+  discrepancies: {
+    loan_id: number;
+    contract_no: string;
+    issues: { schedule_id?: number; payment_id?: number; loan?: boolean; diffs: Record<string, [unknown, unknown]> }[];
+  }[];
+}
+
+export interface CashFlowBucket {
+  period: string;
+  principal: number;
+  interest: number;
+  prepayments: number;
+  interest_payouts: number;
+  maturities: number;
+  inflow: number;
+  outflow: number;
+  net: number;
+  cumulative_net: number;
+}
+
+export interface CashFlowForecast {
+  group: "month" | "week";
+  months: number;
+  start: string;
+  end: string;
+  scenario: { default_rate: number; prepay_rate: number };
+  buckets: CashFlowBucket[];
+  totals: Omit<CashFlowBucket, "period" | "cumulative_net">;
+  rows: { loan_schedule: number; savings_schedule: number; savings: number };
+  by_org?: { org_id: number | null; name: string | null; buckets: CashFlowBucket[] }[];
+  elapsed_ms: number;
+}
+
+export interface ArrearsAgingSummary {
+  buckets: { bucket: "current" | "1_30" | "31_60" | "61_90" | "90_plus"; loans: number; balance: number; overdue: number }[];
+  loans: number;
+  total_balance: number;
+  total_overdue: number;
+  par30: number;
+  par90: number;
+}
+
+export interface ArrearsAging extends ArrearsAgingSummary {
+  date: string | null;
+  by_org: (ArrearsAgingSummary & { org_id: number | null; name: string | null })[];
+}
+
+export interface BatchRateChangeResult {
+  success: boolean;
+  dry_run?: boolean;
+  total: number;
+  changed: number;
+  failed: number;
+  interest_diff?: number;
+  deposits: {
+    id: number;
+    contract_no: string;
+    old_rate?: number;
+    new_rate?: number;
+    old_interest?: number;
+    new_interest?: number;
+    interest_diff?: number;
+    accrual_diff?: number;
+    error?: string;
+  }[];
+}
+
+export interface MemberImportResult {
+  success: boolean;
+  dry_run?: boolean;
+  total: number;
+  imported: number;
+  valid?: number;
+  error_count: number;
+  errors: { row: number; errors: string[] }[];
+}
+
 export interface AuditLogEntry {
   id: number;
   user_id: number | null;
@@ -773,6 +928,8 @@ export interface AuditLogEntry {
 export interface AuditListResult {
   items: AuditLogEntry[];
   total: number;
+  total_estimated?: boolean;
+  next_cursor: string | null;
 }
 
 export interface OrgSettings {
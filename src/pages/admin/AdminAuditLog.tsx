@@ -34,13 +34,16 @@ const AdminAuditLog = () => {
   const [items, setItems] = useState<AuditLogEntry[]>([]);
   const [total, setTotal] = useState(0);
   const [page, setPage] = useState(0);
+  const [cursors, setCursors] = useState<(string | undefined)[]>([undefined]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [filterEntity, setFilterEntity] = useState(ALL);
   const [filterAction, setFilterAction] = useState(ALL);
   const [loading, setLoading] = useState(false);
 
-  const load = useCallback((p: number, entity: string, action: string) => {
+  const load = useCallback((p: number, entity: string, action: string, cursor?: string) => {
     setLoading(true);
-    const params: Record<string, string | number> = { limit: PAGE_SIZE, offset: p * PAGE_SIZE };
+    const params: Record<string, string | number> = { limit: PAGE_SIZE };
+    if (cursor) params.cursor = cursor;
     const e = toFilter(entity);
     const a = toFilter(action);
     if (e) params.filter_entity = e;
@@ -49,6 +52,12 @@ const AdminAuditLog = () => {
       .then((res) => {
         setItems(res.items);
         setTotal(res.total);
+        setNextCursor(res.next_cursor);
+        setCursors((prev) => {
+          const next = prev.slice(0, p + 1);
+          next[p] = cursor;
+          return next;
+        });
         setPage(p);
       })
       .catch(() => {})
@@ -60,9 +69,9 @@ const AdminAuditLog = () => {
   }, []);
 
   const handleApply = () => load(0, filterEntity, filterAction);
-  const handlePrev = () => load(page - 1, filterEntity, filterAction);
-  const handleNext = () => load(page + 1, filterEntity, filterAction);
-  const totalPages = Math.ceil(total / PAGE_SIZE);
+  const handlePrev = () => load(page - 1, filterEntity, filterAction, cursors[page - 1]);
+  const handleNext = () => nextCursor && load(page + 1, filterEntity, filterAction, nextCursor);
+  const totalPages = Math.max(Math.ceil(total / PAGE_SIZE), page + (nextCursor ? 2 : 1));
 
   return (
     <>
@@ -103,11 +112,11 @@ const AdminAuditLog = () => {
 
       <DataTable columns={auditColumns} data={items} loading={loading} />
 
-      {totalPages > 1 && (
+      {(page > 0 || nextCursor) && (
         <div className="flex justify-center gap-2 mt-4">
           <Button size="sm" onClick={handlePrev} disabled={page === 0}>Назад</Button>
-          <span className="text-sm py-2">Стр. {page + 1} из {totalPages}</span>
-          <Button size="sm" onClick={handleNext} disabled={(page + 1) * PAGE_SIZE >= total}>Вперёд</Button>
+          <span className="text-sm py-2">Стр. {page + 1} из ~{totalPages}</span>
+          <Button size="sm" onClick={handleNext} disabled={!nextCursor}>Вперёд</Button>
         </div>
       )}
     </>
@@ -93,7 +93,7 @@ const AdminEmailTab = () => {
         body: form.body.trim(),
         target: form.target,
       });
-      toast({ title: `Отправлено: ${res.sent}, ошибок: ${res.failed}` });
+      toast({ title: `Поставлено в очередь: ${res.queued}` });
       setForm({ title: "", body: "", target: "all" });
       loadData();
     } catch (e) {
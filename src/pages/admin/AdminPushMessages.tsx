@@ -86,7 +86,7 @@ const AdminPushMessages = () => {
         target: form.target,
         target_user_ids: form.target === "selected" ? selectedUsers : undefined,
       });
-      toast({ title: `Отправлено: ${res.sent}, ошибок: ${res.failed}` });
+      toast({ title: `Поставлено в очередь: ${res.queued}` });
       setShowSend(false);
       setForm({ title: "", body: "", url: "", target: "all" });
       setSelectedUsers([]);
@@ -133,7 +133,7 @@ const AdminTelegramTab = () => {
         target: form.target,
         target_user_ids: form.target === "selected" ? selectedUsers : undefined,
       });
-      toast({ title: `Отправлено: ${res.sent}, ошибок: ${res.failed}` });
+      toast({ title: `Поставлено в очередь: ${res.queued}` });
       setForm({ title: "", body: "", target: "all" });
       setSelectedUsers([]);
       loadData();
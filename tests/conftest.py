@@ -0,0 +1,34 @@
+"""Тесты backend/api и backend/cron-accrue. Тестам с базой нужен локальный PostgreSQL с pg_trgm:
+TEST_DATABASE_URL=postgresql://postgres@localhost:5432/postgres python -m pytest -q tests
+Без TEST_DATABASE_URL такие тесты пропускаются."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import erpdb  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def pg_template():
+    if not erpdb.admin_dsn():
+        pytest.skip('TEST_DATABASE_URL не задан')
+    erpdb.build_template()
+    yield erpdb.TEMPLATE_DB
+    erpdb.drop_database(erpdb.TEMPLATE_DB)
+
+
+@pytest.fixture(scope='session')
+def make_db(pg_template):
+    """Фабрика баз из шаблона с миграциями: make_db(имя) -> DSN. Базы удаляются в конце сессии"""
+    created = []
+
+    def make(name):
+        created.append(name)
+        return erpdb.create_database(name)
+
+    yield make
+    for name in created:
+        erpdb.drop_database(name)
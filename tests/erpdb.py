@@ -0,0 +1,221 @@
+"""Тестовая база ERP на локальном PostgreSQL: создание из db_migrations, вызов обработчиков api и крона.
+Общий код для tests/ и скриптов bench/. Адрес сервера — TEST_DATABASE_URL (пользователь с правом CREATE DATABASE)."""
+import importlib.util
+import json
+import os
+import sys
+import types
+from datetime import date, timedelta
+
+import psycopg2
+import psycopg2.extensions
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_DIR = os.path.join(ROOT, 'backend', 'api')
+CRON_DIR = os.path.join(ROOT, 'backend', 'cron-accrue')
+MIGRATIONS_DIR = os.path.join(ROOT, 'db_migrations')
+# Часть миграций обращается к схеме по имени, поэтому таблицы создаются в ней же
+SCHEMA = 't_p25513958_client_erp_developme'
+TEMPLATE_DB = 'erp_test_template'
+
+STAFF_TOKEN = 'test-staff-token'
+CLIENT_TOKEN = 'test-client-token'
+
+if API_DIR not in sys.path:
+    sys.path.insert(0, API_DIR)
+if CRON_DIR not in sys.path:
+    sys.path.append(CRON_DIR)
+
+
+def admin_dsn():
+    return os.environ.get('TEST_DATABASE_URL', '')
+
+
+def db_dsn(name):
+    return psycopg2.extensions.make_dsn(admin_dsn(), dbname=name, options='-c search_path=%s,public' % SCHEMA)
+
+
+def _admin_exec(*statements):
+    conn = psycopg2.connect(admin_dsn())
+    conn.autocommit = True
+    try:
+        cur = conn.cursor()
+        for sql in statements:
+            cur.execute(sql)
+    finally:
+        conn.close()
+
+
+def build_template():
+    """Пересоздаёт шаблонную базу и применяет к ней все миграции по порядку"""
+    _admin_exec('DROP DATABASE IF EXISTS %s' % TEMPLATE_DB, 'CREATE DATABASE %s' % TEMPLATE_DB)
+    conn = psycopg2.connect(db_dsn(TEMPLATE_DB))
+    conn.autocommit = True
+    try:
+        cur = conn.cursor()
+        cur.execute('CREATE SCHEMA %s' % SCHEMA)
+        for name in sorted(os.listdir(MIGRATIONS_DIR)):
+            if name.endswith('.sql'):
+                with open(os.path.join(MIGRATIONS_DIR, name), encoding='utf-8') as f:
+                    cur.execute(f.read())
+    finally:
+        conn.close()
+
+
+def create_database(name, template=TEMPLATE_DB):
+    """Новая база из шаблона (по умолчанию — с миграциями); возвращает DSN с search_path на схему приложения"""
+    _admin_exec('DROP DATABASE IF EXISTS %s' % name, 'CREATE DATABASE %s TEMPLATE %s' % (name, template))
+    return db_dsn(name)
+
+
+def drop_database(name):
+    _admin_exec('DROP DATABASE IF EXISTS %s WITH (FORCE)' % name)
+
+
+def use_database(dsn):
+    """Направляет get_conn() api и крона на тестовую базу"""
+    os.environ['DATABASE_URL'] = dsn
+    os.environ.pop('DATABASE_READ_URL', None)
+
+
+def api():
+    import index
+    return index
+
+
+_cron = {}
+
+
+def cron():
+    """Модуль backend/cron-accrue/index.py; в sys.modules имя index занято api, поэтому грузится под cron_index"""
+    if 'mod' not in _cron:
+        spec = importlib.util.spec_from_file_location('cron_index', os.path.join(CRON_DIR, 'index.py'))
+        mod = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(mod)
+        _cron['mod'] = mod
+    return _cron['mod']
+
+
+def call_api(method, entity, params=None, body=None, token=STAFF_TOKEN):
+    """Вызов обработчика api как из облачной функции; возвращает (код, тело, число SQL-запросов)"""
+    params = dict(params or {}, entity=entity)
+    event = {'httpMethod': method, 'queryStringParameters': params, 'headers': {'X-Auth-Token': token} if token else {}}
+    if body is not None:
+        event['body'] = json.dumps(body)
+    resp = api().handler(event, None)
+    return resp['statusCode'], json.loads(resp['body']), int(resp['headers'].get('X-Sql-Count', 0))
+
+
+def call_cron(body):
+    resp = cron().handler({'httpMethod': 'POST', 'body': json.dumps(body)}, None)
+    return resp['statusCode'], json.loads(resp['body'])
+
+
+def add_staff(cur, token=STAFF_TOKEN):
+    cur.execute("INSERT INTO users (name, login, role) VALUES ('Тест Админ', 'test_admin', 'admin') RETURNING id")
+    uid = cur.fetchone()[0]
+    cur.execute("INSERT INTO client_sessions (user_id, token, expires_at) VALUES (%s, %s, NOW() + INTERVAL '1 day')", (uid, token))
+    return uid
+
+
+def add_member(cur, no, last_name='Тестов'):
+    cur.execute("""
+        INSERT INTO members (member_no, member_type, last_name, first_name, middle_name, inn, phone)
+        VALUES (%s, 'FL', %s, 'Иван', 'Петрович', %s, %s) RETURNING id
+    """, ('П-%06d' % no, last_name, '%012d' % no, '+7900%07d' % no))
+    return cur.fetchone()[0]
+
+
+def add_client(cur, member_id, token=None):
+    """Клиент личного кабинета пайщика; с token — ещё и сессия"""
+    cur.execute("INSERT INTO users (member_id, name, role) VALUES (%s, 'Клиент', 'client') RETURNING id", (member_id,))
+    uid = cur.fetchone()[0]
+    if token:
+        cur.execute("INSERT INTO client_sessions (user_id, token, expires_at) VALUES (%s, %s, NOW() + INTERVAL '1 day')", (uid, token))
+    return uid
+
+
+def add_subscriptions(cur, user_id, n):
+    """Подписки клиента во всех каналах рассылок: push, Telegram и MAX"""
+    for i in range(n):
+        cur.execute("INSERT INTO push_subscriptions (user_id, endpoint, p256dh, auth, user_agent) VALUES (%s, %s, 'p256dh', 'auth', 'test')",
+                    (user_id, 'https://push.invalid/%s/%s' % (user_id, i)))
+        cur.execute("INSERT INTO telegram_subscribers (user_id, chat_id) VALUES (%s, %s)", (user_id, user_id * 1000 + i))
+        cur.execute("INSERT INTO max_subscribers (user_id, chat_id) VALUES (%s, %s)", (user_id, user_id * 1000 + i))
+
+
+def _fake_send(url, data=None, headers=None, method=None, timeout=10):
+    return b'{"ok": true}'
+
+
+def cron_offline(mp):
+    """Каналы рассылок (outbox в кроне и api) включены, но в сеть не ходят: мессенджеры и push сразу отвечают успехом.
+    mp — pytest.MonkeyPatch, всё откатывается вместе с ним"""
+    cron_mod = cron()
+    for name in ('VAPID_PRIVATE_KEY', 'VAPID_PUBLIC_KEY', 'TELEGRAM_BOT_TOKEN', 'MAX_BOT_TOKEN'):
+        mp.setenv(name, 'test')
+    mp.setattr(cron_mod.http_pool, 'request', _fake_send)
+    mp.setitem(sys.modules, 'pywebpush', types.SimpleNamespace(webpush=lambda **kw: None))
+    mp.setattr(cron_mod.outbox, 'OUTBOX_RATE', dict.fromkeys(('telegram', 'max', 'email', 'push'), 100000))
+
+
+def seed_portfolio(dsn, n):
+    """Заполняет базу в масштабе n: займ на 12n месяцев с 3n платежами, вклад с 3n пополнениями, 5n подписчиков"""
+    from core import add_months
+
+    today = date.today()
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    add_staff(cur)
+    borrower = add_member(cur, 1)
+    add_client(cur, borrower, token=CLIENT_TOKEN)
+    subscribers = []
+    for i in range(5 * n):
+        mid = add_member(cur, 100 + i, 'Подписчиков')
+        add_subscriptions(cur, add_client(cur, mid), 1)
+        subscribers.append(mid)
+    for table in ('telegram_settings', 'max_settings'):
+        cur.execute("UPDATE %s SET value='true' WHERE key IN ('enabled', 'savings_enabled')" % table)
+    conn.commit()
+
+    status, loan, _ = call_api('POST', 'loans', body={
+        'action': 'create', 'contract_no': 'З-1', 'member_id': borrower, 'amount': 500000, 'rate': 18,
+        'term_months': 12 * n, 'start_date': add_months(today, -6 * n).isoformat()})
+    assert status < 300, loan
+    for item in loan['schedule'][:3 * n]:
+        status, res, _ = call_api('POST', 'loans', body={
+            'action': 'payment', 'loan_id': loan['id'], 'payment_date': item['payment_date'], 'amount': item['payment_amount']})
+        assert status < 300, res
+
+    saving_start = add_months(today, -3 * n)
+    status, saving, _ = call_api('POST', 'savings', body={
+        'action': 'create', 'member_id': borrower, 'amount': 100000, 'rate': 12, 'term_months': 12 * n,
+        'start_date': saving_start.isoformat(), 'payout_type': 'monthly'})
+    assert status < 300, saving
+    for i in range(3 * n):
+        status, res, _ = call_api('POST', 'savings', body={
+            'action': 'transaction', 'saving_id': saving['id'], 'amount': 1000, 'transaction_type': 'deposit',
+            'transaction_date': (saving_start + timedelta(days=i + 1)).isoformat()})
+        assert status < 300, res
+
+    # займы и вклады подписчиков с платежом через 3 дня и окончанием через 7 — под напоминания крона
+    for i, mid in enumerate(subscribers):
+        status, sl, _ = call_api('POST', 'loans', body={
+            'action': 'create', 'contract_no': 'З-П-%s' % i, 'member_id': mid, 'amount': 10000, 'rate': 18,
+            'term_months': 3, 'start_date': today.isoformat()})
+        assert status < 300, sl
+        status, ss, _ = call_api('POST', 'savings', body={
+            'action': 'create', 'member_id': mid, 'amount': 10000, 'rate': 12, 'term_months': 12,
+            'start_date': add_months(today, -11).isoformat()})
+        assert status < 300, ss
+        cur.execute("UPDATE loan_schedule SET payment_date=%s WHERE loan_id=%s AND payment_no=1", (today + timedelta(days=3), sl['id']))
+        cur.execute("UPDATE savings SET end_date=%s WHERE id=%s", (today + timedelta(days=7), ss['id']))
+    conn.commit()
+
+    cur.execute("""
+        SELECT (SELECT COUNT(*) FROM loan_schedule WHERE loan_id=%s), (SELECT COUNT(*) FROM loan_payments),
+               (SELECT COUNT(*) FROM savings_transactions WHERE transaction_type='deposit'), (SELECT COUNT(*) FROM telegram_subscribers)
+    """, (loan['id'],))
+    volume = dict(zip(('schedule_rows', 'payments', 'deposits', 'subscribers'), cur.fetchone()))
+    conn.close()
+    return {'loan': loan, 'saving': saving, 'volume': volume}
@@ -0,0 +1,78 @@
+"""Месячные секции audit_log в ежедневном кроне (ensure_audit_partitions): записи месяца без секции лежат
+в audit_log_default; крон создаёт секцию отдельно, переносит в неё эти записи и подключает через ATTACH PARTITION."""
+import psycopg2
+import pytest
+
+import erpdb
+
+
+@pytest.fixture
+def dsn(make_db):
+    dsn = make_db('erp_test_audit_partitions')
+    erpdb.use_database(dsn)
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    # до появления секций: две записи за февраль 2031 и одна за май уходят в секцию по умолчанию
+    for created_at in ('2031-02-01 00:00:00', '2031-02-28 23:59:59', '2031-05-10 12:00:00'):
+        cur.execute("INSERT INTO audit_log (action, entity, created_at) VALUES ('update', 'loan', %s)", (created_at,))
+    conn.commit()
+    conn.close()
+    return dsn
+
+
+def partitions(dsn):
+    """{секция: число записей} для секций 2031 года и секции по умолчанию; секции текущих месяцев создала миграция"""
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    cur.execute("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = 'audit_log'::regclass ORDER BY 1")
+    result = {}
+    for name, in cur.fetchall():
+        if not name.startswith(('audit_log_2031', 'audit_log_default')):
+            continue
+        cur.execute("SELECT COUNT(*) FROM %s" % name)
+        result[name] = cur.fetchone()[0]
+    conn.close()
+    return result
+
+
+def test_rows_in_default_moved_to_new_partition(dsn, monkeypatch):
+    erpdb.cron_offline(monkeypatch)
+    status, res = erpdb.call_cron({'date': '2031-02-15'})
+    assert status == 200, res
+    assert res['audit_partitions'] == {'created': ['audit_log_203102', 'audit_log_203103', 'audit_log_203104'], 'moved': 2, 'errors': []}
+    assert partitions(dsn) == {'audit_log_203102': 2, 'audit_log_203103': 0, 'audit_log_203104': 0, 'audit_log_default': 1}
+
+    # новые записи месяца идут в подключённую секцию, повторный запуск ничего не создаёт
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    cur.execute("INSERT INTO audit_log (action, entity, created_at) VALUES ('update', 'loan', '2031-03-05')")
+    conn.commit()
+    conn.close()
+    status, res = erpdb.call_cron({'date': '2031-02-16'})
+    assert status == 200 and res['audit_partitions'] == {'created': [], 'moved': 0, 'errors': []}, res
+    assert partitions(dsn)['audit_log_203103'] == 1
+
+    # май: запись из секции по умолчанию переезжает, когда до месяца доходит очередь
+    status, res = erpdb.call_cron({'date': '2031-03-01'})
+    assert status == 200 and res['audit_partitions'] == {'created': ['audit_log_203105'], 'moved': 1, 'errors': []}, res
+    assert partitions(dsn)['audit_log_default'] == 0
+
+
+def test_partition_error_reported_others_created(dsn, monkeypatch):
+    erpdb.cron_offline(monkeypatch)
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    # перенос февральских записей из секции по умолчанию падает
+    cur.execute("""
+        CREATE FUNCTION audit_default_locked() RETURNS trigger AS $$
+        BEGIN RAISE EXCEPTION 'audit_log_default locked'; END $$ LANGUAGE plpgsql;
+        CREATE TRIGGER audit_default_locked BEFORE DELETE ON audit_log_default FOR EACH ROW EXECUTE FUNCTION audit_default_locked();
+    """)
+    conn.commit()
+    conn.close()
+    status, res = erpdb.call_cron({'date': '2031-02-15'})
+    assert status == 200, res
+    parts = res['audit_partitions']
+    assert parts['created'] == ['audit_log_203103', 'audit_log_203104'] and parts['moved'] == 0
+    assert len(parts['errors']) == 1 and parts['errors'][0].startswith('audit_log_203102: audit_log_default locked')
+    assert partitions(dsn) == {'audit_log_203103': 0, 'audit_log_203104': 0, 'audit_log_default': 3}
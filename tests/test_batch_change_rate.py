@@ -0,0 +1,98 @@
+"""Пакетная смена ставки вкладов (POST entity=savings, action=batch_change_rate): фиксация по частям с прогрессом в batch_jobs.
+Ошибка одного вклада откатывает только его, сбой части оставляет уже зафиксированные части."""
+import itertools
+
+import psycopg2
+import pytest
+
+import erpdb
+
+DEPOSITS = 5
+OLD_RATE = 10
+DB_SEQ = itertools.count(1)
+
+
+@pytest.fixture
+def dsn(make_db):
+    # своя база на тест: тесты меняют ставки всех вкладов
+    dsn = make_db('erp_test_batch_rate_%d' % next(DB_SEQ))
+    erpdb.use_database(dsn)
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    erpdb.add_staff(cur)
+    mid = erpdb.add_member(cur, 1)
+    conn.commit()
+    conn.close()
+    for _ in range(DEPOSITS):
+        status, res, _ = erpdb.call_api('POST', 'savings', body={
+            'action': 'create', 'member_id': mid, 'amount': 100000, 'rate': OLD_RATE, 'term_months': 12, 'start_date': '2026-01-15'})
+        assert status < 300, res
+    return dsn
+
+
+def fail_on(monkeypatch, name, should_fail):
+    """Функция модуля savings бросает ошибку БД (деление на ноль в транзакции), когда should_fail(аргументы)"""
+    import savings
+
+    original = getattr(savings, name)
+
+    def wrapper(cur, *args):
+        if should_fail(*args):
+            cur.execute("SELECT 1/0")
+        return original(cur, *args)
+
+    monkeypatch.setattr(savings, name, wrapper)
+
+
+def state(dsn):
+    """{id вклада: (ставка, смен ставки, операций rate_change)} и последнее задание batch_jobs"""
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT s.id, s.rate,
+               (SELECT COUNT(*) FROM savings_rate_changes rc WHERE rc.saving_id=s.id),
+               (SELECT COUNT(*) FROM savings_transactions t WHERE t.saving_id=s.id AND t.transaction_type='rate_change')
+        FROM savings s ORDER BY s.id
+    """)
+    deposits = {r[0]: (float(r[1]), r[2], r[3]) for r in cur.fetchall()}
+    cur.execute("SELECT status, total, processed, failed FROM batch_jobs WHERE kind='savings_batch_change_rate' ORDER BY id DESC LIMIT 1")
+    job = cur.fetchone()
+    conn.close()
+    return deposits, job
+
+
+def change_rate(**body):
+    return erpdb.call_api('POST', 'savings', body=dict(body, action='batch_change_rate', new_rate=12, effective_date='2026-03-01', reason='Решение правления'))
+
+
+def test_failed_deposit_rolled_back_others_committed(dsn, monkeypatch):
+    ids = sorted(state(dsn)[0])
+    bad = ids[2]
+    fail_on(monkeypatch, 'write_savings_schedule', lambda sid, schedule: sid == bad)
+    status, res, _ = change_rate(chunk_size=2)
+    assert status < 300, res
+    assert (res['total'], res['changed'], res['failed']) == (DEPOSITS, DEPOSITS - 1, 1)
+    assert 'division by zero' in next(d for d in res['deposits'] if d['id'] == bad)['error']
+
+    deposits, job = state(dsn)
+    assert deposits[bad] == (OLD_RATE, 0, 0)
+    assert all(deposits[sid] == (12, 1, 1) for sid in ids if sid != bad)
+    assert job == ('done', DEPOSITS, DEPOSITS, 1)
+
+    # повторный запуск берёт только вклад со старой ставкой
+    monkeypatch.undo()
+    status, res, _ = change_rate()
+    assert status < 300 and (res['total'], res['changed']) == (1, 1), res
+    assert state(dsn)[0][bad] == (12, 1, 1)
+
+
+def test_failed_chunk_keeps_committed_chunks(dsn, monkeypatch):
+    ids = sorted(state(dsn)[0])
+    # ошибка вне savepoint вклада: сбой записи прогресса после третьего вклада (вторая часть по 2)
+    fail_on(monkeypatch, 'update_batch_job', lambda job_id, processed, failed, *rest: processed == 4 and not rest)
+    status, res, _ = change_rate(chunk_size=2)
+    assert status == 500, res
+
+    deposits, job = state(dsn)
+    assert [deposits[sid] for sid in ids] == [(12, 1, 1)] * 2 + [(OLD_RATE, 0, 0)] * 3
+    assert job == ('failed', DEPOSITS, 2, 0)
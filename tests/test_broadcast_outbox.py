@@ -0,0 +1,120 @@
+"""Рассылки сотрудников (Telegram, MAX, Web Push) через notification_outbox: запрос рассылки сам отправляет её после commit
+(notifications.drain_broadcast, не дольше BROADCAST_INLINE_SECONDS), недоотправленное и ошибки дошлёт крон (action=drain_outbox).
+Отправка подменена: мессенджеры и push в сеть не ходят."""
+import json
+import urllib.error
+
+import psycopg2
+import pytest
+
+import erpdb
+
+CLIENTS = 3
+
+
+@pytest.fixture(scope='module')
+def dsn(make_db):
+    dsn = make_db('erp_test_broadcast_outbox')
+    erpdb.use_database(dsn)
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    erpdb.add_staff(cur)
+    for no in range(1, CLIENTS + 1):
+        erpdb.add_subscriptions(cur, erpdb.add_client(cur, erpdb.add_member(cur, no)), 1)
+    cur.execute("UPDATE notification_channels SET settings='{\"bot_token\": \"test\"}'::jsonb WHERE channel='telegram'")
+    conn.commit()
+    conn.close()
+    return dsn
+
+
+@pytest.fixture
+def sender(monkeypatch):
+    """Отправка без сети; chat_id из sender['fail'] отвечают 502. Возвращает словарь с отправленными chat_id"""
+    import http_pool
+
+    state = {'sent': [], 'fail': set()}
+
+    def request(url, data=None, headers=None, method=None, timeout=10):
+        chat_id = int(url.split('chat_id=')[1]) if 'chat_id=' in url else int(json.loads(data)['chat_id'])
+        if chat_id in state['fail']:
+            raise urllib.error.HTTPError(url, 502, 'Bad Gateway', {}, None)
+        state['sent'].append(chat_id)
+        return b'{"ok": true}'
+
+    erpdb.cron_offline(monkeypatch)
+    monkeypatch.setattr(http_pool, 'request', request)
+    return state
+
+
+def outbox_status(dsn, source, source_id):
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    cur.execute("SELECT status, COUNT(*) FROM notification_outbox WHERE source=%s AND source_id=%s GROUP BY status", (source, source_id))
+    counts = dict(cur.fetchall())
+    table = 'push_messages' if source == 'push_message' else 'notification_history'
+    cur.execute("SELECT status, sent_count, failed_count FROM %s WHERE id=%%s" % table, (source_id,))
+    row = cur.fetchone()
+    conn.close()
+    return counts, row
+
+
+def send(action, **body):
+    status, res, _ = erpdb.call_api('POST', 'notifications', body=dict(body, action=action, title='Новости', body='Собрание в пятницу'))
+    assert status < 300, res
+    return res
+
+
+@pytest.mark.parametrize('action', ['send_telegram', 'send_max'])
+def test_broadcast_sent_by_request(dsn, sender, action):
+    res = send(action)
+    assert res['queued'] == res['sent'] == CLIENTS
+    assert len(sender['sent']) == CLIENTS
+    counts, history = outbox_status(dsn, 'notification', res['notification_id'])
+    assert counts == {'sent': CLIENTS}
+    assert history == ('sent', CLIENTS, 0)
+
+
+def test_push_broadcast_sent_by_request(dsn, sender):
+    status, res, _ = erpdb.call_api('POST', 'push', body={'action': 'send', 'title': 'Новости', 'body': 'Собрание в пятницу'})
+    assert status < 300, res
+    assert res['queued'] == res['sent'] == CLIENTS
+    counts, message = outbox_status(dsn, 'push_message', res['message_id'])
+    assert counts == {'sent': CLIENTS}
+    assert message == ('sent', CLIENTS, 0)
+
+
+def test_failed_message_left_for_cron(dsn, sender):
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    cur.execute("SELECT MIN(chat_id) FROM telegram_subscribers")
+    sender['fail'].add(cur.fetchone()[0])
+    conn.close()
+    res = send('send_telegram')
+    assert (res['queued'], res['sent']) == (CLIENTS, CLIENTS - 1)
+    counts, history = outbox_status(dsn, 'notification', res['notification_id'])
+    # 502 — временная ошибка: сообщение ждёт повтора, рассылка не закрыта
+    assert counts == {'sent': CLIENTS - 1, 'pending': 1}
+    assert history == ('sending', CLIENTS - 1, 0)
+
+    sender['fail'].clear()
+    conn = psycopg2.connect(dsn)
+    conn.cursor().execute("UPDATE notification_outbox SET next_attempt_at=NOW() WHERE status='pending'")
+    conn.commit()
+    conn.close()
+    status, drained = erpdb.call_cron({'action': 'drain_outbox'})
+    assert status == 200 and drained['sent'] == 1 and drained['pending'] == 0, drained
+    counts, history = outbox_status(dsn, 'notification', res['notification_id'])
+    assert counts == {'sent': CLIENTS}
+    assert history == ('sent', CLIENTS, 0)
+
+
+def test_inline_drain_bounded_by_time(dsn, sender, monkeypatch):
+    import notifications
+
+    monkeypatch.setattr(notifications, 'BROADCAST_INLINE_SECONDS', 0)
+    res = send('send_max')
+    assert (res['queued'], res['sent']) == (CLIENTS, 0)
+    assert outbox_status(dsn, 'notification', res['notification_id'])[0] == {'pending': CLIENTS}
+    status, drained = erpdb.call_cron({'action': 'drain_outbox'})
+    assert status == 200 and drained['sent'] == CLIENTS, drained
+    assert outbox_status(dsn, 'notification', res['notification_id']) == ({'sent': CLIENTS}, ('sent', CLIENTS, 0))
@@ -0,0 +1,75 @@
+"""Массовое создание учётных записей клиентов (POST entity=users, action=bulk_create_clients): телефоны пайщиков
+нормализуются к 7XXXXXXXXXX, логин — телефон; при совпадении телефона или занятом логине к логину добавляется id пайщика.
+Пайщики без телефона пропускаются и попадают в отчёт."""
+import psycopg2
+import pytest
+
+import erpdb
+
+# (номер, фамилия, телефон, статус); три телефона совпадают после нормализации
+MEMBERS = [
+    (1, 'Алексеев', '+7 (900) 111-22-33', 'active'),
+    (2, 'Борисов', '8 900 111 22 33', 'active'),
+    (3, 'Васильев', '9001112233', 'active'),
+    (4, 'Григорьев', '+7 900 555-66-77', 'active'),
+    (5, 'Дмитриев', '', 'active'),
+    (6, 'Егоров', '12-34-5', 'active'),
+    (7, 'Жуков', '+7 900 999-00-00', 'closed'),
+    (8, 'Зайцев', '+7 900 888-00-00', 'active'),
+]
+
+
+@pytest.fixture(scope='module')
+def dsn(make_db):
+    dsn = make_db('erp_test_bulk_create_clients')
+    erpdb.use_database(dsn)
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    erpdb.add_staff(cur)
+    ids = {}
+    for no, last_name, phone, status in MEMBERS:
+        cur.execute("INSERT INTO members (member_no, member_type, last_name, first_name, inn, phone, status) VALUES (%s, 'FL', %s, 'Иван', %s, %s, %s) RETURNING id",
+                    ('П-%06d' % no, last_name, '%012d' % no, phone, status))
+        ids[no] = cur.fetchone()[0]
+    # логин 79005556677 уже занят сотрудником, у пайщика 8 уже есть учётная запись
+    cur.execute("INSERT INTO users (login, name, role) VALUES ('79005556677', 'Менеджер', 'manager')")
+    erpdb.add_client(cur, ids[8])
+    conn.commit()
+    conn.close()
+    return dsn, ids
+
+
+def clients(dsn):
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    cur.execute("SELECT member_id, login, phone, name FROM users WHERE role='client' ORDER BY member_id")
+    rows = {r[0]: r[1:] for r in cur.fetchall()}
+    conn.close()
+    return rows
+
+
+def test_colliding_phones_and_skipped_report(dsn):
+    dsn, ids = dsn
+    status, res, _ = erpdb.call_api('POST', 'users', body={'action': 'bulk_create_clients', 'password': 'secret1'})
+    assert status < 300, res
+    assert (res['created'], res['skipped']) == (4, 2)
+    assert res['skipped_reasons'] == ['П-000005 — нет телефона', 'П-000006 — нет телефона']
+
+    rows = clients(dsn)
+    assert set(rows) == {ids[1], ids[2], ids[3], ids[4], ids[8]}
+    # первый по id получает телефон как логин, остальные — с id пайщика; телефон у всех нормализован
+    assert rows[ids[1]] == ('79001112233', '79001112233', 'Алексеев Иван')
+    assert rows[ids[2]][:2] == ('79001112233_%s' % ids[2], '79001112233')
+    assert rows[ids[3]][:2] == ('79001112233_%s' % ids[3], '79001112233')
+    assert rows[ids[4]][:2] == ('79005556677_%s' % ids[4], '79005556677')
+
+    # повторный запуск: у всех с телефоном уже есть учётная запись
+    status, res, _ = erpdb.call_api('POST', 'users', body={'action': 'bulk_create_clients', 'password': 'secret1'})
+    assert status < 300, res
+    assert (res['created'], res['skipped']) == (0, 2)
+    assert clients(dsn) == rows
+
+
+def test_short_password_rejected(dsn):
+    status, res, _ = erpdb.call_api('POST', 'users', body={'action': 'bulk_create_clients', 'password': '123'})
+    assert status == 400 and 'Пароль' in res['error']
@@ -0,0 +1,177 @@
+"""Прогноз денежного потока (GET entity=reports, action=forecast) против прямого расчёта на Python по строкам графиков:
+корзины по месяцам и неделям, сценарий default_rate/prepay_rate, разбивка by_org. Портфель — займы и вклады двух
+организаций и без организации, с частично оплаченной строкой графика и вкладами с выплатой ежемесячно и в конце срока."""
+from datetime import date, timedelta
+
+import psycopg2
+import pytest
+
+import erpdb
+
+FLOWS = ('principal', 'interest', 'prepayments', 'interest_payouts', 'maturities', 'inflow', 'outflow', 'net')
+
+
+@pytest.fixture(scope='module')
+def dsn(make_db):
+    from core import add_months
+
+    dsn = make_db('erp_test_cash_flow_forecast')
+    erpdb.use_database(dsn)
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    erpdb.add_staff(cur)
+    mid = erpdb.add_member(cur, 1)
+    orgs = []
+    for name in ('КПК «Север»', 'КПК «Юг»'):
+        cur.execute("INSERT INTO organizations (name) VALUES (%s) RETURNING id", (name,))
+        orgs.append(cur.fetchone()[0])
+    conn.commit()
+    conn.close()
+
+    today = date.today()
+    loans = [('З-1', orgs[0], 300000, 24, -5), ('З-2', orgs[1], 120000, 12, 0), ('З-3', None, 60000, 6, -2)]
+    for contract_no, org_id, amount, term, shift in loans:
+        status, loan, _ = erpdb.call_api('POST', 'loans', body={
+            'action': 'create', 'contract_no': contract_no, 'member_id': mid, 'amount': amount, 'rate': 18, 'term_months': term,
+            'start_date': add_months(today, shift).isoformat(), 'org_id': org_id})
+        assert status < 300, loan
+        if contract_no == 'З-1':
+            # три платежа по графику и половина четвёртого: строка partial
+            for item in loan['schedule'][:4]:
+                amount = item['payment_amount'] if item['payment_no'] < 4 else round(item['payment_amount'] / 2, 2)
+                status, res, _ = erpdb.call_api('POST', 'loans', body={
+                    'action': 'payment', 'loan_id': loan['id'], 'payment_date': item['payment_date'], 'amount': amount})
+                assert status < 300, res
+            conn = psycopg2.connect(dsn)
+            cur = conn.cursor()
+            cur.execute("SELECT status FROM loan_schedule WHERE loan_id=%s AND payment_no=4", (loan['id'],))
+            assert cur.fetchone()[0] == 'partial'
+            conn.close()
+    savings = [(orgs[0], 'monthly', 12, -3), (orgs[1], 'end_of_term', 6, -1), (None, 'end_of_term', 24, -2)]
+    for org_id, payout_type, term, shift in savings:
+        status, res, _ = erpdb.call_api('POST', 'savings', body={
+            'action': 'create', 'member_id': mid, 'amount': 100000, 'rate': 12, 'term_months': term,
+            'start_date': add_months(today, shift).isoformat(), 'payout_type': payout_type, 'org_id': org_id})
+        assert status < 300, res
+    return dsn
+
+
+def reference(dsn, months, group, default_rate=0, prepay_rate=0, org_id=None):
+    """Тот же прогноз построчным проходом на Python: {org_id: [{поток: сумма} по корзинам]}, корзины — [начало периода]"""
+    today = date.today()
+    month0 = today.year * 12 + today.month - 1
+    horizon = date((month0 + months) // 12, (month0 + months) % 12 + 1, 1)
+    if group == 'month':
+        starts = [date((month0 + i) // 12, (month0 + i) % 12 + 1, 1) for i in range(months)]
+    else:
+        week0 = today - timedelta(days=today.weekday())
+        starts = [week0 + timedelta(weeks=i) for i in range(((horizon - week0).days + 6) // 7)]
+
+    def bucket(d):
+        d = max(d, today)
+        if group == 'month':
+            return d.year * 12 + d.month - 1 - month0
+        return (d - starts[0]).days // 7
+
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT ls.loan_id, ls.payment_date, ls.principal_amount, ls.interest_amount, COALESCE(ls.paid_amount, 0), ls.balance_after,
+               ls.status, l.status, l.org_id
+        FROM loan_schedule ls JOIN loans l ON l.id = ls.loan_id ORDER BY ls.loan_id, ls.payment_date, ls.payment_no
+    """)
+    loan_rows = cur.fetchall()
+    cur.execute("""
+        SELECT s.id, s.status, s.payout_type, s.end_date, s.current_balance, s.org_id, ss.period_end, ss.interest_amount, ss.status
+        FROM savings s JOIN savings_schedule ss ON ss.saving_id = s.id ORDER BY s.id, ss.period_no
+    """)
+    saving_rows = cur.fetchall()
+    conn.close()
+
+    table = {}
+
+    def add(org, d, flow, amount):
+        if org_id and org != org_id:
+            return
+        cells = table.setdefault(org or 0, [dict.fromkeys(FLOWS, 0.0) for _ in starts])
+        cells[bucket(d)][flow] += amount
+
+    prev = {}
+    for loan_id, pay_date, principal, interest, paid, balance_after, row_status, loan_status, org in loan_rows:
+        if loan_status not in ('active', 'overdue') or row_status not in ('pending', 'partial', 'overdue') or pay_date >= horizon:
+            continue
+        principal, interest, paid, balance_after = float(principal), float(interest), float(paid), float(balance_after)
+        years = max((pay_date - today).days, 0) / 365.0
+        alive = (1 - default_rate) ** years
+        unprepaid = (1 - prepay_rate) ** years
+        add(org, pay_date, 'principal', max(principal - max(paid - interest, 0), 0) * unprepaid * alive)
+        add(org, pay_date, 'interest', max(interest - paid, 0) * unprepaid * alive)
+        add(org, pay_date, 'prepayments', (balance_after + principal) * (prev.get(loan_id, 1.0) - unprepaid) * alive)
+        prev[loan_id] = unprepaid
+    matured = set()
+    for sid, status, payout_type, end_date, balance, org, period_end, interest, row_status in saving_rows:
+        if status != 'active':
+            continue
+        if end_date < horizon and sid not in matured:
+            matured.add(sid)
+            add(org, end_date, 'maturities', float(balance))
+        pay_date = period_end if payout_type == 'monthly' else end_date
+        if row_status == 'pending' and pay_date < horizon:
+            add(org, pay_date, 'interest_payouts', float(interest))
+    for cells in table.values():
+        for c in cells:
+            c['inflow'] = c['principal'] + c['interest'] + c['prepayments']
+            c['outflow'] = c['interest_payouts'] + c['maturities']
+            c['net'] = c['inflow'] - c['outflow']
+    return [s.isoformat() for s in starts], table
+
+
+def forecast(**params):
+    status, res, _ = erpdb.call_api('GET', 'reports', dict({'action': 'forecast'}, **{k: str(v) for k, v in params.items()}))
+    assert status == 200, res
+    return res
+
+
+def assert_buckets(buckets, starts, cells):
+    assert [b['period'] for b in buckets] == starts
+    cumulative = 0.0
+    for b, c in zip(buckets, cells):
+        for flow in FLOWS:
+            assert b[flow] == pytest.approx(c[flow], abs=0.011), (b['period'], flow)
+        cumulative += c['net']
+        assert b['cumulative_net'] == pytest.approx(cumulative, abs=0.011 * len(buckets))
+
+
+def total(table):
+    """Сумма таблиц организаций по корзинам"""
+    cells = list(table.values())
+    return [{flow: sum(org[i][flow] for org in cells) for flow in FLOWS} for i in range(len(cells[0]))]
+
+
+@pytest.mark.parametrize('group', ['month', 'week'])
+@pytest.mark.parametrize('default_rate, prepay_rate', [(0, 0), (5, 0), (0, 20), (7.5, 15)])
+def test_forecast_matches_python(dsn, group, default_rate, prepay_rate):
+    res = forecast(months=12, group=group, default_rate=default_rate, prepay_rate=prepay_rate, by_org='1')
+    starts, table = reference(dsn, 12, group, default_rate / 100, prepay_rate / 100)
+    cells = total(table)
+    assert_buckets(res['buckets'], starts, cells)
+    for flow in FLOWS:
+        assert res['totals'][flow] == pytest.approx(sum(c[flow] for c in cells), abs=0.011)
+    assert len(table) == 3 and sorted(o['org_id'] or 0 for o in res['by_org']) == sorted(table)
+    for org in res['by_org']:
+        assert_buckets(org['buckets'], starts, table[org['org_id'] or 0])
+    # досрочные погашения появляются только при prepay_rate
+    assert res['totals']['prepayments'] > 0 if prepay_rate else res['totals']['prepayments'] == 0
+
+
+def test_forecast_single_org(dsn):
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    cur.execute("SELECT org_id FROM loans WHERE contract_no='З-1'")
+    org_id = cur.fetchone()[0]
+    conn.close()
+    res = forecast(months=24, group='month', org_id=org_id, default_rate=3, prepay_rate=10)
+    starts, table = reference(dsn, 24, 'month', 0.03, 0.10, org_id=org_id)
+    assert list(table) == [org_id]
+    assert_buckets(res['buckets'], starts, table[org_id])
+    assert 'by_org' not in res
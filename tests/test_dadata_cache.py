@@ -0,0 +1,113 @@
+"""Кэш и склейка запросов подсказок DaData (backend/api/dadata.py) против локальной заглушки на http.server:
+сколько запросов доходит до DaData при одновременных одинаковых запросах, после истечения TTL и после вытеснения LRU."""
+import json
+import threading
+import time
+import types
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import dadata
+
+UPSTREAM_DELAY = 0.2
+
+
+class StubDadata(BaseHTTPRequestHandler):
+    """Отвечает как suggest-API DaData; считает запросы по (тип подсказки, query)"""
+    hits = Counter()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        action = self.path.rsplit('/', 1)[-1]
+        self.hits[(action, body['query'])] += 1
+        time.sleep(UPSTREAM_DELAY)
+        status = 400 if body['query'] == 'ошибка' else 200
+        data = json.dumps({'suggestions': [{'value': body['query'], 'action': action}]}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def stub_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubDadata)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:%s/suggest/' % server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def upstream(stub_url, monkeypatch):
+    monkeypatch.setenv('DADATA_API_KEY', 'test')
+    monkeypatch.setattr(dadata, 'DADATA_URLS', {action: stub_url + action for action in dadata.DADATA_URLS})
+    monkeypatch.setattr(dadata, 'DADATA_CACHE_TABLE', False)
+    dadata._dadata_cache.clear()
+    StubDadata.hits.clear()
+    yield StubDadata.hits
+    dadata._dadata_cache.clear()
+
+
+def suggest(query, action='party'):
+    return dadata.handle_dadata({'action': action, 'query': query})
+
+
+def test_concurrent_identical_queries_coalesce(upstream):
+    threads_count = 20
+    barrier = threading.Barrier(threads_count)
+    results = []
+
+    def run(i):
+        barrier.wait()
+        # регистр и пробелы не меняют ключ кэша
+        results.append(suggest('Ромашка ООО' if i % 2 else '  ромашка   ооо '))
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(threads_count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sum(upstream.values()) == 1
+    assert len(results) == threads_count and all(r == results[0] and r['suggestions'] for r in results)
+    suggest('ромашка ооо')
+    assert sum(upstream.values()) == 1
+
+
+def test_ttl_expiry_refetches(upstream, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(dadata, 'time', types.SimpleNamespace(monotonic=lambda: clock[0]))
+    suggest('Москва', 'address')
+    suggest('Москва', 'address')
+    assert upstream[('address', 'Москва')] == 1
+    clock[0] += dadata.DADATA_CACHE_TTL - 1
+    suggest('Москва', 'address')
+    assert upstream[('address', 'Москва')] == 1
+    clock[0] += 2
+    suggest('Москва', 'address')
+    assert upstream[('address', 'Москва')] == 2
+
+
+def test_lru_eviction(upstream, monkeypatch):
+    monkeypatch.setattr(dadata, 'DADATA_CACHE_SIZE', 3)
+    for q in ('a', 'b', 'c'):
+        suggest(q)
+    suggest('a')  # a — самый свежий, первым вытесняется b
+    suggest('d')
+    assert list(k.split(':')[1] for k in dadata._dadata_cache) == ['c', 'a', 'd']
+    suggest('a')
+    suggest('b')
+    assert upstream == Counter({('party', 'a'): 1, ('party', 'b'): 2, ('party', 'c'): 1, ('party', 'd'): 1})
+
+
+def test_errors_are_not_cached(upstream):
+    assert '_error' in suggest('ошибка')
+    assert '_error' in suggest('ошибка')
+    assert upstream[('party', 'ошибка')] == 2
@@ -0,0 +1,110 @@
+"""Импорт пайщиков из CSV (POST entity=members, action=import): проверка строк с номерами в отчёте, повторы ИНН в файле
+и в базе, номера пайщиков одним блоком из number_counters, кодировки UTF-8/Windows-1251 и файл больше окна определения кодировки."""
+import base64
+
+import psycopg2
+import pytest
+
+import erpdb
+
+EXISTING_INN = '500100000001'
+
+
+@pytest.fixture(scope='module')
+def dsn(make_db):
+    dsn = make_db('erp_test_member_import')
+    erpdb.use_database(dsn)
+    conn = psycopg2.connect(dsn)
+    erpdb.add_staff(conn.cursor())
+    conn.commit()
+    conn.close()
+    status, member, _ = erpdb.call_api('POST', 'members', body={'member_type': 'FL', 'last_name': 'Егоров', 'first_name': 'Иван', 'inn': EXISTING_INN})
+    assert status < 300, member
+    return dsn
+
+
+def run_import(text, encoding='utf-8', **body):
+    data = base64.b64encode(text.encode(encoding)).decode()
+    status, res, statements = erpdb.call_api('POST', 'members', body=dict(body, action='import', file=data, filename='members.csv'))
+    assert status < 300, res
+    return res, statements
+
+
+def member_numbers(dsn, inns):
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    cur.execute("SELECT inn, member_no FROM members WHERE inn = ANY(%s)", (list(inns),))
+    numbers = dict(cur.fetchall())
+    conn.close()
+    return numbers
+
+
+def test_rows_checked_and_numbered_in_bulk(dsn):
+    lines = [
+        'Тип;Фамилия;Имя;ИНН;Дата рождения;Наименование компании',
+        'ФЛ;Алексеев;Павел;770100000011;01.02.1980;',
+        'ЮЛ;;;7701000012;;ООО «Ромашка»',
+        'ФЛ;Борисов;Глеб;770100000011;;',
+        'ФЛ;Васильев;;770100000013;;',
+        'ФЛ;Григорьев;Олег;12345;;',
+        'ФЛ;Дмитриев;Илья;770100000014;31.02.1990;',
+        '',
+        'ФЛ;Егоров;Иван;%s;;' % EXISTING_INN,
+        'ФЛ;Жуков;Роман;770100000015;;',
+    ]
+    text = '\r\n'.join(lines) + '\r\n'
+    dry, _ = run_import(text, encoding='cp1251', dry_run=True)
+    assert (dry['dry_run'], dry['imported'], dry['valid'], dry['error_count']) == (True, 0, 3, 5)
+
+    res, _ = run_import(text, encoding='cp1251')
+    assert (res['total'], res['imported'], res['error_count']) == (8, 3, 5)
+    errors = {e['row']: ' '.join(e['errors']) for e in res['errors']}
+    assert sorted(errors) == [4, 5, 6, 7, 9]
+    assert 'уже встречается в строке 2' in errors[4]
+    assert 'фамилия и имя' in errors[5]
+    assert '10 или 12 цифр' in errors[6]
+    assert 'некорректная дата' in errors[7]
+    assert 'уже существует (П-000001)' in errors[9]
+
+    # номера — один блок из счётчика в порядке строк файла; следующий пайщик получает номер после блока
+    assert member_numbers(dsn, ['770100000011', '7701000012', '770100000015']) == {
+        '770100000011': 'П-000002', '7701000012': 'П-000003', '770100000015': 'П-000004'}
+    status, member, _ = erpdb.call_api('POST', 'members', body={'member_type': 'FL', 'last_name': 'Зайцев', 'first_name': 'Олег', 'inn': '770100000016'})
+    assert status < 300, member
+    assert member_numbers(dsn, ['770100000016']) == {'770100000016': 'П-000005'}
+
+
+def utf8_file(prefix, count):
+    """CSV с BOM и разделителем «,»: кириллица, запятая и кавычки внутри поля в кавычках"""
+    rows = ['\ufeffФамилия,Имя,ИНН,Место рождения']
+    rows += ['Щукин%s,Ёжик,%s%010d,"г. Москва, ул. Щорса ""%s"""' % (i, prefix, i, i) for i in range(count)]
+    return '\n'.join(rows)
+
+
+def test_large_utf8_file_streamed(dsn):
+    import members
+
+    count = 2000
+    text = utf8_file('77', count)
+    # больше окна определения кодировки: строки и многобайтные символы на границах чтения потока
+    assert len(text.encode('utf-8')) > 2 * members.IMPORT_SNIFF_BYTES
+    small, small_statements = run_import(utf8_file('78', 10))
+    assert small['imported'] == 10
+    res, statements = run_import(text)
+    assert (res['imported'], res['error_count']) == (count, 0)
+    # число запросов не зависит от числа строк
+    assert statements == small_statements
+
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    cur.execute("SELECT birth_place FROM members WHERE inn=%s", ('77%010d' % (count - 1),))
+    assert cur.fetchone()[0] == 'г. Москва, ул. Щорса "%s"' % (count - 1)
+    cur.execute("SELECT MAX(member_no) FROM members")
+    assert cur.fetchone()[0] == 'П-%06d' % (5 + 10 + count)
+    conn.close()
+
+
+def test_header_without_inn_rejected(dsn):
+    data = base64.b64encode('Фамилия;Имя\nИванов;Иван\n'.encode('utf-8')).decode()
+    status, res, _ = erpdb.call_api('POST', 'members', body={'action': 'import', 'file': data})
+    assert status == 400 and 'ИНН' in res['error']
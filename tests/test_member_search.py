@@ -0,0 +1,52 @@
+"""Поиск пайщиков (members.search_members): подстрока, реквизиты, нечёткое совпадение на недобор и короткие запросы."""
+import psycopg2
+import pytest
+
+import erpdb
+
+
+@pytest.fixture(scope='module')
+def dsn(make_db):
+    dsn = make_db('erp_test_member_search')
+    erpdb.use_database(dsn)
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    erpdb.add_staff(cur)
+    for no, (last, first, inn) in enumerate([('Иванов', 'Пётр', '770100000001'), ('Иванова', 'Анна', '770100000002'),
+                                              ('Петров', 'Иван', '500100000003'), ('Сидоров', 'Антон', '500100000004')], 1):
+        cur.execute("INSERT INTO members (member_no, member_type, last_name, first_name, middle_name, inn, status) "
+                    "VALUES (%s, 'FL', %s, %s, '', %s, 'active')", ('П-%06d' % no, last, first, inn))
+    conn.commit()
+    conn.close()
+    return dsn
+
+
+def search(q, limit=10):
+    status, rows, statements = erpdb.call_api('GET', 'members', {'action': 'search', 'q': q, 'limit': limit})
+    assert status == 200, rows
+    return [r['name'].split()[0] for r in rows], statements
+
+
+def test_substring_ranks_word_start_first(dsn):
+    names, _ = search('иван')
+    # начало слова (Иванов, Иванова, Петров Иван) раньше совпадений только по похожести
+    assert set(names[:3]) == {'Иванов', 'Иванова', 'Петров'}
+
+
+def test_fuzzy_fills_shortfall_only(dsn):
+    names, statements = search('иваноф')
+    assert names[:2] in (['Иванов', 'Иванова'], ['Иванова', 'Иванов'])
+    full, full_statements = search('иванов', limit=2)
+    # подстрока набрала лимит — нечёткий запрос не выполняется
+    assert len(full) == 2 and full_statements == statements - 1
+
+
+def test_exact_inn_first(dsn):
+    names, _ = search('770100000002')
+    assert names[0] == 'Иванова'
+
+
+def test_short_query_matches_word_starts(dsn):
+    names, _ = search('ан')
+    # «Анна», «Антон»; «Иванова» содержит «ан» только внутри слова
+    assert names == ['Иванова', 'Сидоров']
@@ -0,0 +1,188 @@
+"""Расчёты в целых копейках (money.py) совпадают с прежними расчётами в Decimal до последнего знака.
+Эталон — сохранённые функции *_decimal из schedules.py и исходные формулы Decimal для доначисления и пени.
+Случайные входы с фиксированным зерном; MONEY_CASES задаёт число случаев."""
+import os
+import random
+from datetime import date, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+
+import psycopg2
+import pytest
+
+import erpdb
+import schedules
+from money import FractionalAmount, factor, interest_kop, kop_decimal, mul_kop, period_interest, to_kop, to_rate
+
+CASES = int(os.environ.get('MONEY_CASES', '300'))
+CENT = Decimal('0.01')
+
+
+def rng(case):
+    return random.Random('money-%s' % case)
+
+
+def money(r, hi=2000000):
+    return Decimal(r.randint(0, hi * 100)) / 100
+
+
+def rate(r):
+    """Ставки с точностью до сотых и до тысячных процента, как в NUMERIC(6,3)"""
+    return float(Decimal(r.randint(0, 6000)) / 100) if r.random() < 0.8 else float(Decimal(r.randint(0, 60000)) / 1000)
+
+
+def fractional(r, value):
+    """Сумма с долями копейки — уходит в FractionalAmount и считается через *_decimal"""
+    return float(value) + r.choice((0.001, 0.005, 0.0049))
+
+
+def loan_rows(r, sd, term):
+    return [(1000 + i, i + 1, sd + timedelta(days=30 * (i + 1)), money(r, 50000), money(r, 5000),
+             money(r, 500) if r.random() < 0.3 else Decimal('0')) for i in range(term)]
+
+
+def loan_payments(r, sd, term, frac=False):
+    pays = []
+    for k in range(r.randint(0, term + 3)):
+        manual = r.random() < 0.15
+        amount = money(r, 60000)
+        if frac and k == 0:
+            amount += Decimal('0.005')
+        pays.append((5000 + k, sd + timedelta(days=r.randint(0, 30 * term + 60)), amount, manual,
+                     money(r, 20000) if manual else None, money(r, 3000) if manual else None, money(r, 100) if manual else None))
+    pays.sort(key=lambda p: (p[1], p[0]))
+    return pays
+
+
+@pytest.mark.parametrize('case', range(CASES))
+def test_loan_schedules_match_decimal(case):
+    r = rng(case)
+    amount = float(money(r)) or 1000.0
+    rt, term, sd = rate(r), r.randint(1, 60), date(2020, 1, 1) + timedelta(days=r.randint(0, 2000))
+    assert schedules.calc_annuity_schedule(amount, rt, term, sd) == schedules.calc_annuity_schedule_decimal(amount, rt, term, sd)
+    assert schedules.calc_end_of_term_schedule(amount, rt, term, sd) == schedules.calc_end_of_term_schedule_decimal(amount, rt, term, sd)
+    frac = fractional(r, amount)
+    assert schedules.calc_annuity_schedule(frac, rt, term, sd) == schedules.calc_annuity_schedule_decimal(frac, rt, term, sd)
+
+
+@pytest.mark.parametrize('case', range(CASES))
+def test_savings_schedules_match_decimal(case):
+    r = rng(case)
+    amount = float(money(r)) or 1000.0
+    rt, term, sd = rate(r), r.randint(1, 60), date(2020, 1, 1) + timedelta(days=r.randint(0, 2000))
+    pt = r.choice(('monthly', 'end_of_term'))
+    assert schedules.calc_savings_schedule(amount, rt, term, sd, pt) == schedules.calc_savings_schedule_decimal(amount, rt, term, sd, pt)
+    txs = sorted((sd + timedelta(days=r.randint(1, term * 30)), money(r, 200000), r.choice(('deposit', 'withdrawal', 'partial_withdrawal')))
+                 for _ in range(r.randint(0, 6)))
+    rcs = sorted((sd + timedelta(days=r.randint(1, term * 30)), Decimal(str(rt)), Decimal(r.randint(0, 30000)) / 1000)
+                 for _ in range(r.randint(0, 3)))
+    for initial in (amount, fractional(r, amount)):
+        assert (schedules.calc_savings_schedule_with_transactions(initial, rt, term, sd, pt, txs, rcs) ==
+                schedules.calc_savings_schedule_with_transactions_decimal(initial, rt, term, sd, pt, txs, rcs))
+
+
+@pytest.mark.parametrize('case', range(CASES))
+def test_payment_allocation_matches_decimal(case):
+    r = rng(case)
+    term, sd = r.randint(1, 48), date(2020, 1, 1) + timedelta(days=r.randint(0, 2000))
+    rows = loan_rows(r, sd, term)
+    for frac in (False, True):
+        pays = loan_payments(r, sd, term, frac)
+        snaps, snaps_dec = [], []
+        assert schedules.allocate_loan_payments(rows, pays, None, snaps) == schedules.allocate_loan_payments_decimal(rows, pays, None, snaps_dec)
+        assert snaps == snaps_dec
+        if pays:
+            # продолжение со снимка, как после загрузки loan_balance_snapshots
+            cut = r.randint(0, len(pays) - 1)
+            start = ({sid: list(st) for sid, st in snaps_dec[cut][3].items()}, snaps_dec[cut][2])
+            resumed, resumed_dec = [], []
+            assert (schedules.allocate_loan_payments(rows, pays[cut + 1:], start, resumed) ==
+                    schedules.allocate_loan_payments_decimal(rows, pays[cut + 1:], start, resumed_dec))
+            assert resumed == resumed_dec
+
+
+def test_whole_kopecks_take_kopeck_path(monkeypatch):
+    """Иначе сравнения выше сравнивали бы *_decimal сам с собой"""
+    def fail(*args, **kwargs):
+        raise AssertionError('fallback to Decimal')
+    for name in ('calc_annuity_schedule_decimal', 'calc_end_of_term_schedule_decimal', 'calc_savings_schedule_decimal',
+                 'calc_savings_schedule_with_transactions_decimal', 'allocate_loan_payments_decimal'):
+        monkeypatch.setattr(schedules, name, fail)
+    sd = date(2024, 1, 15)
+    schedules.calc_annuity_schedule(100000.0, 17.5, 12, sd)
+    schedules.calc_end_of_term_schedule(100000.0, 17.5, 12, sd)
+    schedules.calc_savings_schedule(100000.0, 12.125, 12, sd, 'monthly')
+    schedules.calc_savings_schedule_with_transactions(100000.0, 12.125, 12, sd, 'end_of_term', [(sd + timedelta(days=40), Decimal('5000.00'), 'deposit')])
+    r = rng('path')
+    rows = loan_rows(r, sd, 12)
+    schedules.allocate_loan_payments(rows, loan_payments(r, sd, 12), None, [])
+
+
+def test_fractional_inputs_fall_back():
+    with pytest.raises(FractionalAmount):
+        to_kop(Decimal('10.005'))
+    with pytest.raises(FractionalAmount):
+        to_rate(Decimal('12.0005'))
+    balance, rt = Decimal('1234.565'), Decimal('12.5')
+    assert period_interest(balance, rt, 1, 365) == (balance * rt / Decimal('100') / Decimal('365')).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def test_daily_interest_matches_decimal():
+    """Дневные проценты backfill_accrue, daily_accrue и крона против исходной формулы Decimal"""
+    r = rng('interest')
+    for _ in range(CASES * 100):
+        balance = money(r, 10000000)
+        rt = Decimal(r.randint(0, 60000)) / 1000
+        expected = (balance * rt / Decimal('100') / Decimal('365')).quantize(CENT, rounding=ROUND_HALF_UP)
+        assert kop_decimal(interest_kop(to_kop(balance), to_rate(rt), 1, 365)) == expected
+        assert period_interest(balance, rt, 1, 365) == expected
+
+
+def test_penalty_matches_decimal():
+    """Дневная пеня accrue_penalties крона против (долг × 0.000547).quantize"""
+    rate_factor = erpdb.cron().PENALTY_DAILY_RATE
+    assert rate_factor == factor('0.000547')
+    r = rng('penalty')
+    for _ in range(CASES * 100):
+        principal = money(r, 10000000)
+        expected = (principal * Decimal('0.000547')).quantize(CENT, rounding=ROUND_HALF_UP)
+        assert kop_decimal(mul_kop(to_kop(principal), rate_factor)) == expected
+
+
+def test_backfill_accrue_matches_decimal(make_db):
+    """Доначисление по вкладу с пополнениями и сменой ставки: каждая дневная строка равна расчёту в Decimal"""
+    erpdb.use_database(make_db('erp_test_money'))
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor()
+    erpdb.add_staff(cur)
+    mid = erpdb.add_member(cur, 1)
+    conn.commit()
+    sd = date.today() - timedelta(days=120)
+    status, saving, _ = erpdb.call_api('POST', 'savings', body={
+        'action': 'create', 'member_id': mid, 'amount': 123456.78, 'rate': 13.375, 'term_months': 12, 'start_date': sd.isoformat()})
+    assert status < 300, saving
+    r = rng('backfill')
+    for k in range(6):
+        erpdb.call_api('POST', 'savings', body={
+            'action': 'transaction', 'saving_id': saving['id'], 'amount': float(money(r, 50000)), 'transaction_type': 'deposit',
+            'transaction_date': (sd + timedelta(days=15 * (k + 1))).isoformat()})
+    cur.execute("INSERT INTO savings_rate_changes (saving_id, effective_date, old_rate, new_rate) VALUES (%s, %s, 13.375, 11.125)",
+                (saving['id'], sd + timedelta(days=60)))
+    conn.commit()
+    status, res, _ = erpdb.call_api('POST', 'savings', body={'action': 'backfill_accrue', 'saving_id': saving['id'], 'mode': 'verify_fix'})
+    assert status < 300 and res['days_added'] > 0, res
+
+    cur.execute("SELECT transaction_date, amount FROM savings_transactions WHERE saving_id=%s AND transaction_type='deposit' ORDER BY transaction_date, id", (saving['id'],))
+    deposits = {}
+    for td, amt in cur.fetchall():
+        deposits[td] = deposits.get(td, Decimal('0')) + amt
+    cur.execute("SELECT accrual_date, rate, daily_amount FROM savings_daily_accruals WHERE saving_id=%s ORDER BY accrual_date", (saving['id'],))
+    accruals = cur.fetchall()
+    conn.close()
+    # депозит дня X входит в остаток со следующего дня, ставка меняется с effective_date
+    expected, balance, d = [], Decimal('123456.78'), sd + timedelta(days=1)
+    while d <= date.today():
+        rt = Decimal('11.125') if d >= sd + timedelta(days=60) else Decimal('13.375')
+        expected.append((d, rt, (balance * rt / Decimal('100') / Decimal('365')).quantize(CENT, rounding=ROUND_HALF_UP)))
+        balance += deposits.get(d, Decimal('0'))
+        d += timedelta(days=1)
+    assert accruals == expected
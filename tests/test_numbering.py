@@ -0,0 +1,95 @@
+"""Номера пайщиков, договоров сбережений и паевых счетов из number_counters (core.next_number)
+при одновременном создании из многих потоков: без повторов и без пропусков."""
+import re
+import threading
+
+import psycopg2
+import pytest
+
+import erpdb
+
+THREADS = 16
+PER_THREAD = 12
+
+
+def number(value, pattern):
+    return int(re.search(pattern, value).group(1))
+
+
+def assert_dense(numbers, last_value):
+    assert len(numbers) == len(set(numbers)), 'повторы номеров'
+    assert sorted(numbers) == list(range(1, last_value + 1)), 'пропуски номеров'
+
+
+@pytest.fixture(scope='module')
+def dsn(make_db):
+    dsn = make_db('erp_test_numbering')
+    erpdb.use_database(dsn)
+    conn = psycopg2.connect(dsn)
+    erpdb.add_staff(conn.cursor())
+    conn.commit()
+    conn.close()
+    return dsn
+
+
+def worker(dsn, k, member_id, barrier, errors):
+    from core import next_number
+
+    try:
+        barrier.wait()
+        for i in range(PER_THREAD):
+            kind = (k + i) % 5
+            if kind == 0:
+                status, res, _ = erpdb.call_api('POST', 'members', body={'member_type': 'FL', 'last_name': 'Потоков', 'inn': '%06d%06d' % (k, i)})
+            elif kind == 1:
+                status, res, _ = erpdb.call_api('POST', 'savings', body={
+                    'action': 'create', 'member_id': member_id, 'amount': 1000, 'rate': 10, 'term_months': 6})
+            elif kind == 2:
+                status, res, _ = erpdb.call_api('POST', 'shares', body={'action': 'create', 'member_id': member_id, 'amount': 0})
+            else:
+                # как импорт: блок номеров за один вызов; kind 4 откатывается и номера должны вернуться в счётчик
+                conn = psycopg2.connect(dsn)
+                cur = conn.cursor()
+                count = 1 + (k + i) % 3
+                last = next_number(cur, 'member', count=count)
+                if kind == 4:
+                    conn.rollback()
+                else:
+                    for n in range(last - count + 1, last + 1):
+                        cur.execute("INSERT INTO members (member_no, member_type, inn) VALUES (%s, 'FL', %s)", ('П-%06d' % n, 'imp%s' % n))
+                    conn.commit()
+                conn.close()
+                continue
+            assert status < 300, res
+    except Exception as e:
+        errors.append(e)
+
+
+def test_concurrent_numbers_unique_and_dense(dsn):
+    status, member, _ = erpdb.call_api('POST', 'members', body={'member_type': 'FL', 'last_name': 'Вкладчиков', 'inn': '1'})
+    assert status < 300, member
+    barrier = threading.Barrier(THREADS)
+    errors = []
+    threads = [threading.Thread(target=worker, args=(dsn, k, member['id'], barrier, errors)) for k in range(THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors, errors
+
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    cur.execute("SELECT scheme, last_value FROM number_counters WHERE scope_id=0")
+    counters = dict(cur.fetchall())
+    cur.execute("SELECT member_no FROM members")
+    assert_dense([number(r[0], r'(\d+)$') for r in cur.fetchall()], counters['member'])
+    cur.execute("SELECT contract_no FROM savings")
+    savings = [number(r[0], r'^(\d+)-') for r in cur.fetchall()]
+    assert_dense(savings, counters['saving_contract'])
+    cur.execute("SELECT account_no FROM share_accounts")
+    shares = [number(r[0], r'(\d+)$') for r in cur.fetchall()]
+    assert_dense(shares, counters['share_account'])
+    conn.close()
+    kinds = [(k + i) % 5 for k in range(THREADS) for i in range(PER_THREAD)]
+    assert len(savings) == kinds.count(1)
+    assert len(shares) == kinds.count(2)
@@ -0,0 +1,47 @@
+"""Карточка вклада (GET entity=savings, action=detail): max_payout — начисленное до начала текущего месяца за вычетом
+выплаченного; текущий месяц берётся по дате приложения, а не по CURRENT_DATE сервера БД."""
+from datetime import date
+
+import psycopg2
+import pytest
+
+import erpdb
+
+
+class FixedDate(date):
+    @classmethod
+    def today(cls):
+        return cls(2031, 3, 10)
+
+
+@pytest.fixture
+def saving_id(make_db):
+    dsn = make_db('erp_test_saving_detail')
+    erpdb.use_database(dsn)
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    erpdb.add_staff(cur)
+    mid = erpdb.add_member(cur, 1)
+    conn.commit()
+    status, res, _ = erpdb.call_api('POST', 'savings', body={
+        'action': 'create', 'member_id': mid, 'amount': 100000, 'rate': 12, 'term_months': 12, 'start_date': '2031-01-15'})
+    assert status < 300, res
+    # два дня февраля и один день марта по 10, выплачено 5
+    cur.execute("""
+        INSERT INTO savings_daily_accruals (saving_id, accrual_date, balance, rate, daily_amount)
+        SELECT %s, d, 100000, 12, 10 FROM unnest(ARRAY['2031-02-27', '2031-02-28', '2031-03-01']::date[]) d
+    """, (res['id'],))
+    cur.execute("UPDATE savings SET accrual_total=30, paid_interest=5 WHERE id=%s", (res['id'],))
+    conn.commit()
+    conn.close()
+    return res['id']
+
+
+def test_max_payout_uses_application_date(saving_id, monkeypatch):
+    import savings
+
+    monkeypatch.setattr(savings, 'date', FixedDate)
+    status, res, _ = erpdb.call_api('GET', 'savings', {'action': 'detail', 'id': saving_id})
+    assert status == 200, res
+    assert float(res['max_payout']) == 15
+    assert float(res['total_daily_accrued']) == 30
@@ -0,0 +1,81 @@
+"""Число SQL-запросов на действие не зависит от объёма данных: одни и те же запросы гоняются по базам
+двух размеров, где растут строки графика, платежи, пополнения вкладов и подписчики рассылок.
+Счётчик — CountingCursor соединения (заголовок X-Sql-Count api и statements в результате крона)."""
+from datetime import date, timedelta
+
+import pytest
+
+import erpdb
+
+SIZES = {'small': 1, 'large': 4}
+TODAY = date.today()
+
+
+def measure(dsn, n):
+    """Счётчики запросов всех проверяемых действий api и этапов крона на базе масштаба n"""
+    erpdb.use_database(dsn)
+    seeded = erpdb.seed_portfolio(dsn, n)
+    loan, saving = seeded['loan'], seeded['saving']
+    counts = {}
+
+    def api(key, method, entity, params=None, body=None, token=erpdb.STAFF_TOKEN):
+        status, res, statements = erpdb.call_api(method, entity, params, body, token)
+        assert status < 300, (key, res)
+        counts[key] = statements
+
+    api(('loans', 'detail'), 'GET', 'loans', {'action': 'detail', 'id': loan['id']})
+    api(('loans', 'recalc_statuses'), 'POST', 'loans', body={'action': 'recalc_statuses', 'loan_id': loan['id']})
+    api(('loans', 'payment'), 'POST', 'loans', body={
+        'action': 'payment', 'loan_id': loan['id'], 'payment_date': TODAY.isoformat(), 'amount': loan['monthly_payment']})
+    api(('savings', 'detail'), 'GET', 'savings', {'action': 'detail', 'id': saving['id']})
+    api(('savings', 'recalc_schedule'), 'POST', 'savings', body={'action': 'recalc_schedule', 'saving_id': saving['id']})
+    api(('dashboard', None), 'GET', 'dashboard')
+    api(('cabinet', 'overview'), 'GET', 'cabinet', {'action': 'overview'}, token=erpdb.CLIENT_TOKEN)
+    api(('cron', 'daily_accrue'), 'POST', 'cron', body={'action': 'daily_accrue', 'date': (TODAY - timedelta(days=1)).isoformat()})
+
+    with pytest.MonkeyPatch.context() as mp:
+        erpdb.cron_offline(mp)
+        # очередь разбирается пачками по OUTBOX_BATCH: одна пачка на весь прогон, чтобы этап сравнивался по запросам на пачку
+        mp.setattr(erpdb.cron().outbox, 'OUTBOX_BATCH', 10000)
+        status, res = erpdb.call_cron({'date': TODAY.isoformat()})
+    assert status == 200, res
+    for key in ('push_reminders', 'savings_push_reminders', 'telegram_reminders', 'telegram_savings_reminders', 'max_reminders', 'max_savings_reminders'):
+        assert res[key].get('queued'), (key, res[key])
+    assert res['outbox']['sent'] > 0 and res['outbox']['failed'] == 0, res['outbox']
+    for stage, statements in res['statements'].items():
+        counts[('cron-accrue', stage)] = statements
+    return seeded['volume'], counts
+
+
+@pytest.fixture(scope='module')
+def measured(make_db):
+    return {size: measure(make_db('erp_test_budget_%s' % size), n) for size, n in SIZES.items()}
+
+
+def test_data_grows_between_sizes(measured):
+    small, large = measured['small'][0], measured['large'][0]
+    for key in ('schedule_rows', 'payments', 'deposits', 'subscribers'):
+        assert large[key] > small[key], key
+
+
+API_ACTIONS = [('loans', 'payment'), ('loans', 'detail'), ('loans', 'recalc_statuses'), ('savings', 'detail'),
+               ('savings', 'recalc_schedule'), ('dashboard', None), ('cabinet', 'overview'), ('cron', 'daily_accrue')]
+
+
+@pytest.mark.parametrize('key', API_ACTIONS, ids=lambda k: '%s.%s' % k)
+def test_api_statements_flat(measured, key):
+    small, large = measured['small'][1][key], measured['large'][1][key]
+    assert small == large
+    assert large <= erpdb.api().STATEMENT_BUDGETS[key]
+
+
+CRON_STAGES = ['accrue', 'overdue', 'penalties', 'aging', 'reminders', 'audit_partitions', 'outbox']
+
+
+@pytest.mark.parametrize('stage', CRON_STAGES)
+def test_cron_stage_statements_flat(measured, stage):
+    small, large = measured['small'][1][('cron-accrue', stage)], measured['large'][1][('cron-accrue', stage)]
+    assert small == large
+    budget = erpdb.cron().CRON_STATEMENT_BUDGETS.get(stage)
+    if budget is not None:
+        assert large <= budget